@@ -1,18 +1,27 @@
 import os
-import orjson
 import shutil
 import redis
 from flask import (
     Flask,
+    g,
     jsonify,
     request,
-    after_this_request,
-    Response,
     Blueprint,
     make_response,
+    send_file,
 )
 from flask_cors import CORS
 import uuid
+import cache_access
+import cache_policy
+import http_cache
+import json_provider
+import memory_usage
+import metrics
+import profiling
+import tracing
+from exports import EXPORT_GZIP, COLUMNAR_FORMATS, parse_beads, parse_samples
+from http_cache import http_cached
 from process import (
     gene_names_list,
     cell_lines_list,
@@ -42,11 +51,31 @@ from process import (
     get_gse_chrid_options,
     get_gse_distance_matrix,
     download_gse_csv,
+    region_bundle,
+    record_region_visit,
+    region_cache_stats,
+    prefold_stats,
+    l1_cache_stats,
+    disk_cache_stats,
+    export_cache_stats,
+    redis_cache_stats,
+    slow_query_stats,
+    inspect_redis_cache,
+    purge_redis_cache,
+    enforce_redis_cache_budgets,
 )
 
 
 app = Flask(__name__)
+# Lets a front proxy (Apache, lighttpd) send download files itself, the WSGI server's sendfile is used otherwise
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
 CORS(app)
+json_provider.init_app(app)
+http_cache.init_app(app)
+cache_access.init_app(app)
+metrics.init_app(app)
+tracing.init_app(app)
+memory_usage.init_app(app)
 
 # Cookie configuration
 USER_ID_COOKIE = "chrom_polymer_user_id"
@@ -81,41 +110,48 @@ REDIS_DB = int(os.getenv("REDIS_DB", 0))
 
 # Create a Redis connection pool
 redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
-redis_client = redis.Redis(connection_pool=redis_pool)
+redis_client = tracing.TracedRedis(connection_pool=redis_pool)
+profiling.init_app(app, redis_client)
 
 
 api = Blueprint("api", __name__, url_prefix="/api")
 
 
 @api.route("/getGeneNameList", methods=["GET"])
+@http_cached(public=True)
 def get_GeneNameList():
     return jsonify(gene_names_list())
 
 
 @api.route("/getCellLines", methods=["GET"])
+@http_cached(public=True)
 def get_CellLinesList():
     return jsonify(cell_lines_list())
 
 
 @api.route("/getChromosomesList", methods=["POST"])
+@http_cached()
 def get_ChromosomesList():
     cell_line = request.json["cell_line"]
     return jsonify(chromosomes_list(cell_line))
 
 
 @api.route("/getChromosomeSize", methods=["POST"])
+@http_cached()
 def get_ChromosomeSize():
     chromosome_name = request.json["chromosome_name"]
     return jsonify(chromosome_size(chromosome_name))
 
 
 @api.route("/getChromosomeSizeByGeneName", methods=["POST"])
+@http_cached()
 def get_ChromosomeSizeByGeneName():
     gene_name = request.json["gene_name"]
     return jsonify(chromosome_size_by_gene_name(gene_name))
 
 
 @api.route("/getChromosomeOriginalValidSequence", methods=["POST"])
+@http_cached()
 def get_ChromosomeOriginalValidSequences():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -123,6 +159,7 @@ def get_ChromosomeOriginalValidSequences():
 
 
 @api.route("/getChromosMergedValidSequence", methods=["POST"])
+@http_cached()
 def get_ChromosMergedValidSequences():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -130,6 +167,7 @@ def get_ChromosMergedValidSequences():
 
 
 @api.route("/getChromosData", methods=["POST"])
+@http_cached()
 def get_ChromosData():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -138,6 +176,7 @@ def get_ChromosData():
 
 
 @api.route("/getChromosValidIBPData", methods=["POST"])
+@http_cached()
 def get_ChromosValidIBPData():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -145,7 +184,175 @@ def get_ChromosValidIBPData():
     return jsonify(chromosome_valid_ibp_data(cell_line, chromosome_name, sequences))
 
 
+@api.route("/getRegionBundle", methods=["POST"])
+@http_cached()
+def get_RegionBundle():
+    cell_line = request.json["cell_line"]
+    chromosome_name = request.json["chromosome_name"]
+    sequences = request.json["sequences"]
+    facets = request.json.get("facets")
+    result = region_bundle(cell_line, chromosome_name, sequences, facets)
+    if result["errors"]:
+        # A facet failed, the next request must retry it rather than revalidate the partial bundle
+        g.http_cache_no_store = True
+    status = 500 if result["errors"] and not result["data"] else 200
+    return jsonify(result), status
+
+
+@api.route("/getRegionCacheStats", methods=["GET"])
+def get_RegionCacheStats():
+    return jsonify(region_cache_stats())
+
+
+@api.route("/getPrefoldStats", methods=["GET"])
+def get_PrefoldStats():
+    return jsonify(prefold_stats())
+
+
+@api.route("/getL1CacheStats", methods=["GET"])
+def get_L1CacheStats():
+    return jsonify(l1_cache_stats())
+
+
+@api.route("/getDiskCacheStats", methods=["GET"])
+def get_DiskCacheStats():
+    return jsonify(disk_cache_stats())
+
+
+@api.route("/getExportCacheStats", methods=["GET"])
+def get_ExportCacheStats():
+    return jsonify(export_cache_stats())
+
+
+@api.route("/getRedisRoundTripStats", methods=["GET"])
+def get_RedisRoundTripStats():
+    return jsonify(cache_access.round_trip_stats())
+
+
+@api.route("/getRedisCacheStats", methods=["GET"])
+def get_RedisCacheStats():
+    return jsonify(redis_cache_stats())
+
+
+def monitoring_forbidden():
+    """Statement texts, plans and memory peaks are for operators, only METRICS_ALLOWED_NETWORKS may read them like /metrics"""
+    if metrics.is_allowed(request.remote_addr):
+        return None
+    return jsonify({"error": "Forbidden"}), 403
+
+
+@api.route("/getSlowQueryStats", methods=["GET"])
+def get_SlowQueryStats():
+    forbidden = monitoring_forbidden()
+    if forbidden:
+        return forbidden
+    return jsonify(slow_query_stats(request.args.get("limit", 100, type=int)))
+
+
+@api.route("/getMemoryStats", methods=["GET"])
+def get_MemoryStats():
+    forbidden = monitoring_forbidden()
+    if forbidden:
+        return forbidden
+    return jsonify(memory_usage.stats())
+
+
+def cache_admin_forbidden():
+    """The admin routes list and delete keys, only CACHE_ADMIN_ALLOWED_NETWORKS may call them"""
+    if metrics.is_allowed(request.remote_addr, cache_policy.CACHE_ADMIN_ALLOWED_NETWORKS):
+        return None
+    return jsonify({"error": "Forbidden"}), 403
+
+
+@api.route("/getRedisCacheKeys", methods=["GET"])
+def get_RedisCacheKeys():
+    forbidden = cache_admin_forbidden()
+    if forbidden:
+        return forbidden
+    family = request.args.get("family")
+    match = request.args.get("match", "*")
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify(inspect_redis_cache(family, match, limit))
+
+
+@api.route("/purgeRedisCache", methods=["POST"])
+def purge_RedisCache():
+    forbidden = cache_admin_forbidden()
+    if forbidden:
+        return forbidden
+    body = request.get_json(silent=True) or {}
+    try:
+        removed = purge_redis_cache(body.get("family"), body.get("match"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"removed": removed})
+
+
+@api.route("/enforceRedisCacheBudgets", methods=["POST"])
+def enforce_RedisCacheBudgets():
+    forbidden = cache_admin_forbidden()
+    if forbidden:
+        return forbidden
+    evicted = enforce_redis_cache_budgets()
+    return jsonify({family: {"keys": keys, "bytes": nbytes} for family, (keys, nbytes) in evicted.items()})
+
+
+def profiling_forbidden():
+    """Profiles hold request parameters and code paths, only PROFILING_ALLOWED_NETWORKS may list or arm them"""
+    if metrics.is_allowed(request.remote_addr, profiling.PROFILING_ALLOWED_NETWORKS):
+        return None
+    return jsonify({"error": "Forbidden"}), 403
+
+
+@api.route("/getProfiles", methods=["GET"])
+def get_Profiles():
+    forbidden = profiling_forbidden()
+    if forbidden:
+        return forbidden
+    profiles = profiling.list_profiles()
+    endpoint = request.args.get("endpoint")
+    if endpoint:
+        profiles = [profile for profile in profiles if profile["endpoint"] == endpoint]
+    return jsonify({"arming": profiling.arming.status(), "profiles": profiles})
+
+
+@api.route("/downloadProfile", methods=["GET"])
+def download_Profile():
+    forbidden = profiling_forbidden()
+    if forbidden:
+        return forbidden
+    path = profiling.profile_path(request.args.get("file", ""))
+    if path is None:
+        return jsonify({"error": "Unknown profile"}), 404
+    mimetype = "application/json" if path.endswith(".json") else "application/octet-stream"
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(path))
+
+
+@api.route("/setProfiling", methods=["POST"])
+def set_Profiling():
+    """Arms profiling of an endpoint ("*" for all) in every worker, or disarms it with {"endpoint": null}"""
+    forbidden = profiling_forbidden()
+    if forbidden:
+        return forbidden
+    body = request.get_json(silent=True) or {}
+    if not body.get("endpoint"):
+        profiling.arming.disarm()
+        return jsonify({"arming": None})
+    try:
+        arming = profiling.arming.arm(
+            body["endpoint"],
+            body.get("mode", "sample"),
+            float(body.get("rate", 1.0)),
+            int(body.get("count", 10)),
+            float(body.get("duration", 600)),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"arming": arming})
+
+
 @api.route("/getExistChromosome3DData", methods=["POST"])
+@http_cached()
 def get_ExistChromosome3DData():
     cell_line = request.json["cell_line"]
     sample_id = request.json["sample_id"]
@@ -153,13 +360,19 @@ def get_ExistChromosome3DData():
     chromosome_name = request.json.get(
         "chromosome_name", "chr8"
     )  # Default to chr8 for backward compatibility
-    payload = orjson.dumps(
-        exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name)
-    )
-    return Response(payload, content_type="application/json")
+    return jsonify(exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name))
+
+
+def record_3d_visit(params):
+    record_region_visit(params["cell_line"], params["chromosome_name"], params["sequences"], "http")
+
+
+def record_region_access(params):
+    record_region_visit(params["cell_line"], params["chromosome_name"], params["sequences"])
 
 
 @api.route("/getChromosome3DData", methods=["POST"])
+@http_cached(on_skip=record_3d_visit)
 def get_Chromosome3DData():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -169,12 +382,14 @@ def get_Chromosome3DData():
 
 
 @api.route("/getComparisonCellLineList", methods=["POST"])
+@http_cached()
 def get_ComparisonCellLineList():
     cell_line = request.json["cell_line"]
     return jsonify(comparison_cell_line_list(cell_line))
 
 
 @api.route("/getGeneList", methods=["POST"])
+@http_cached()
 def get_GeneList():
     chromosome_name = request.json["chromosome_name"]
     sequences = request.json["sequences"]
@@ -182,6 +397,7 @@ def get_GeneList():
 
 
 @api.route("/getepigeneticTrackData", methods=["POST"])
+@http_cached()
 def get_epigeneticTrackData():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -190,12 +406,14 @@ def get_epigeneticTrackData():
 
 
 @api.route("/geneNamesListSearch", methods=["POST"])
+@http_cached()
 def geneNamesListSearch():
     search = request.json["search"]
     return jsonify(gene_names_list_search(search))
 
 
 @api.route("/getBeadDistribution", methods=["POST"])
+@http_cached(on_skip=record_region_access)
 def get_BeadDistribution():
     cell_line = request.json["cell_line"]
     chromosome_name = request.json["chromosome_name"]
@@ -205,6 +423,7 @@ def get_BeadDistribution():
 
 
 @api.route("/getExistBeadDistribution", methods=["POST"])
+@http_cached()
 def get_ExistBeadDistribution():
     cell_line = request.json["cell_line"]
     indices = request.json["indices"]
@@ -220,6 +439,7 @@ def get_ExistBeadDistribution():
 
 
 @api.route("/getBeadDistributionPValues", methods=["POST"])
+@http_cached()
 def get_BeadDistributionPValues():
     groups = request.json
     return jsonify(bead_distribution_pvalues(groups))
@@ -253,52 +473,76 @@ def clearFoldingInputFolderInputContent():
     return jsonify({"status": "cleared"})
 
 
-@api.route("/downloadFullChromosome3DDistanceData", methods=["POST"])
-def downloadFullChromosome3DDistanceData():
-    cell_line = request.json["cell_line"]
-    chromosome_name = request.json["chromosome_name"]
-    sequences = request.json["sequences"]
-    is_example = request.json["is_example"]
-    file_path, npz_file = download_full_chromosome_3D_distance_data(
-        cell_line, chromosome_name, sequences, is_example
+def download_request(default_format):
+    """
+    Parameters of a 3D download: the JSON body of a POST, or the query string of a GET / HEAD
+    (cell_line, chromosome_name, start, end, is_example, format, samples, beads), which can be resumed
+    with Range. samples ("0-199,250" or a list of ids) and beads ("first-last" or [first, last]) are
+    optional sub-selections, raises ValueError if they are malformed.
+    """
+    if request.method == "POST":
+        body = request.json
+        return (
+            body["cell_line"],
+            body["chromosome_name"],
+            body["sequences"],
+            body["is_example"],
+            body.get("format", default_format),
+            parse_samples(body.get("samples")),
+            parse_beads(body.get("beads")),
+        )
+
+    args = request.args
+    sequences = {"start": args.get("start", type=int), "end": args.get("end", type=int)}
+    is_example = args.get("is_example", "false").lower() in ("1", "true")
+    return (
+        args["cell_line"],
+        args["chromosome_name"],
+        sequences,
+        is_example,
+        args.get("format", default_format),
+        parse_samples(args.get("samples")),
+        parse_beads(args.get("beads")),
     )
 
-    if not is_example:
-
-        @after_this_request
-        def remove_file(response):
-            try:
-                os.remove(file_path)
-                app.logger.info("Deleted temporary npz file: %s", file_path)
-            except Exception as error:
-                app.logger.error("Failed to delete npz file: %s", error)
-            return response
 
-    return npz_file
+@api.route("/downloadFullChromosome3DDistanceData", methods=["GET", "POST"])
+def downloadFullChromosome3DDistanceData():
+    try:
+        cell_line, chromosome_name, sequences, is_example, export_format, samples, beads = download_request("npz")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if export_format != "npz" and export_format not in COLUMNAR_FORMATS:
+        return jsonify({"error": f"Unsupported format: {export_format}"}), 400
+    response = download_full_chromosome_3D_distance_data(
+        cell_line, chromosome_name, sequences, is_example, export_format, samples=samples, beads=beads
+    )
+    if response is None:
+        return jsonify({"error": "No distance data for this selection"}), 404
+    return response
 
 
-@api.route("/downloadFullChromosome3DPositionData", methods=["POST"])
+@api.route("/downloadFullChromosome3DPositionData", methods=["GET", "POST"])
 def downloadFullChromosome3DPositionData():
-    cell_line = request.json["cell_line"]
-    chromosome_name = request.json["chromosome_name"]
-    sequences = request.json["sequences"]
-    is_example = request.json["is_example"]
-    file_path, csv_file = download_full_chromosome_3D_position_data(
-        cell_line, chromosome_name, sequences, is_example
+    try:
+        cell_line, chromosome_name, sequences, is_example, export_format, samples, beads = download_request("csv")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if export_format != "csv" and export_format not in COLUMNAR_FORMATS:
+        return jsonify({"error": f"Unsupported format: {export_format}"}), 400
+    response = download_full_chromosome_3D_position_data(
+        cell_line,
+        chromosome_name,
+        sequences,
+        is_example,
+        gzip=EXPORT_GZIP and "gzip" in request.accept_encodings,
+        export_format=export_format,
+        samples=samples,
+        beads=beads,
     )
-
-    if not is_example:
-
-        @after_this_request
-        def remove_file(response):
-            try:
-                os.remove(file_path)
-                app.logger.info("Deleted temporary csv file: %s", file_path)
-            except Exception as error:
-                app.logger.error("Failed to delete csv file: %s", error)
-            return response
-
-    return csv_file
+    if response is None:
+        return jsonify({"error": "No position data for this selection"}), 404
+    return response
 
 
 @api.route("/getTourStatus", methods=["GET"])
@@ -327,9 +571,10 @@ def set_tour_seen():
     """Mark the tour as seen for this user (first time only)"""
     user_id = get_or_create_user_id()
 
-    # Store tour seen status in Redis (expires in 1 year)
+    # Store tour seen status in Redis (the tour cache family, expires in 1 year)
     # This gets set the moment the tour is shown, not when completed
-    redis_client.setex(f"tour_seen:{user_id}", 60 * 60 * 24 * 365, "true")
+    key = f"tour_seen:{user_id}"
+    redis_client.setex(key, cache_policy.write_ttl(key, len("true")), "true")
 
     response = make_response(jsonify({"status": "success", "user_id": user_id}))
     response = set_user_cookie(response, user_id)
@@ -338,12 +583,14 @@ def set_tour_seen():
 
 
 @api.route("/getBintuCellClusters", methods=["GET"])
+@http_cached(public=True)
 def get_bintu_cell_clusters_api():
     """Get available Bintu cell clusters for the selector"""
     return jsonify(get_bintu_cell_clusters())
 
 
 @api.route("/getBintuDistanceMatrix", methods=["POST"])
+@http_cached()
 def get_bintu_distance_matrix_api():
     """Get Bintu distance matrix for a specific cell ID"""
     cell_line = request.json["cell_line"]
@@ -384,6 +631,7 @@ def download_bintu_csv_api():
 
 # GSE-related endpoints
 @api.route("/getGseCellLineOptions", methods=["GET"])
+@http_cached(public=True)
 def get_gse_cell_line_options_api():
     """Get list of available GSE cell lines"""
     try:
@@ -393,6 +641,7 @@ def get_gse_cell_line_options_api():
 
 
 @api.route("/getGseCellIdOptions", methods=["POST"])
+@http_cached()
 def get_gse_cell_id_options_api():
     """Get list of available GSE cell ID options for a given cell line and resolution"""
     try:
@@ -408,6 +657,7 @@ def get_gse_cell_id_options_api():
 
 
 @api.route("/getGseChrIdOptions", methods=["POST"])
+@http_cached()
 def get_gse_chrid_options_api():
     """Get list of available GSE chromosome ID options for a given cell line and cell ID"""
     try:
@@ -423,6 +673,7 @@ def get_gse_chrid_options_api():
 
 
 @api.route("/getGseDistanceMatrix", methods=["POST"])
+@http_cached()
 def get_gse_distance_matrix_api():
     """Get GSE distance matrix for given parameters"""
     try:
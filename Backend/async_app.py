@@ -0,0 +1,429 @@
+"""
+Asyncio variant of the /api blueprint.
+
+Serve with an ASGI server, e.g.
+    hypercorn async_app:asgi_app --bind 0.0.0.0:5002
+
+JSON endpoints are served by Quart on top of async_process (AsyncConnectionPool + redis.asyncio).
+File download routes are dispatched to the synchronous Flask app through a WSGI bridge, so both
+variants share one implementation of the export code.
+"""
+import os
+from quart import Quart, Blueprint, jsonify, request, Response, make_response
+from quart_cors import cors
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from app import (
+    app as flask_app,
+    USER_ID_COOKIE,
+    COOKIE_MAX_AGE,
+)
+import async_process
+import json_provider
+import metrics
+import tracing
+from process import region_cache_stats, prefold_stats, l1_cache_stats, disk_cache_stats, export_cache_stats, redis_cache_stats, slow_query_stats
+from async_process import (
+    async_redis_client,
+    gene_names_list,
+    cell_lines_list,
+    chromosome_size,
+    chromosomes_list,
+    chromosome_original_valid_sequences,
+    chromosome_merged_valid_sequences,
+    chromosome_data,
+    chromosome_3D_data,
+    comparison_cell_line_list,
+    gene_list,
+    gene_names_list_search,
+    chromosome_size_by_gene_name,
+    chromosome_valid_ibp_data,
+    epigenetic_track_data,
+    bead_distribution,
+    exist_bead_distribution,
+    exist_chromosome_3D_data,
+    bead_distribution_pvalues,
+    get_bintu_cell_clusters,
+    get_bintu_distance_matrix,
+    get_gse_cell_line_options,
+    get_gse_cell_id_options,
+    get_gse_chrid_options,
+    get_gse_distance_matrix,
+    region_bundle,
+)
+import uuid
+
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+json_provider.init_app(app)
+metrics.init_app(app, request, Response)
+tracing.init_app(app, request)
+
+# Routes that stream files from disk or Postgres stay on the synchronous implementation
+WSGI_FALLBACK_PATHS = {
+    "/api/clearFoldingInputFolderInputContent",
+    "/api/downloadFullChromosome3DDistanceData",
+    "/api/downloadFullChromosome3DPositionData",
+    "/api/downloadBintuCSV",
+    "/api/downloadGseCSV",
+}
+
+# Upper bound for request bodies forwarded to the Flask app
+WSGI_MAX_BODY_SIZE = int(os.getenv("WSGI_MAX_BODY_SIZE", 2**20))
+
+
+@app.before_serving
+async def startup():
+    await async_process.open_pools()
+
+
+@app.after_serving
+async def shutdown():
+    await async_process.close_pools()
+
+
+def get_or_create_user_id():
+    """Get user ID from cookie or create a new one"""
+    user_id = request.cookies.get(USER_ID_COOKIE)
+    if not user_id:
+        user_id = str(uuid.uuid4())
+    return user_id
+
+
+def set_user_cookie(response, user_id):
+    """Set user ID cookie on response"""
+    response.set_cookie(
+        USER_ID_COOKIE,
+        user_id,
+        max_age=COOKIE_MAX_AGE,
+        httponly=True,
+        secure=True,
+        samesite="Lax",
+    )
+    return response
+
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+@api.route("/getGeneNameList", methods=["GET"])
+async def get_GeneNameList():
+    return jsonify(await gene_names_list())
+
+
+@api.route("/getCellLines", methods=["GET"])
+async def get_CellLinesList():
+    return jsonify(await cell_lines_list())
+
+
+@api.route("/getChromosomesList", methods=["POST"])
+async def get_ChromosomesList():
+    body = await request.get_json()
+    return jsonify(await chromosomes_list(body["cell_line"]))
+
+
+@api.route("/getChromosomeSize", methods=["POST"])
+async def get_ChromosomeSize():
+    body = await request.get_json()
+    return jsonify(await chromosome_size(body["chromosome_name"]))
+
+
+@api.route("/getChromosomeSizeByGeneName", methods=["POST"])
+async def get_ChromosomeSizeByGeneName():
+    body = await request.get_json()
+    return jsonify(await chromosome_size_by_gene_name(body["gene_name"]))
+
+
+@api.route("/getChromosomeOriginalValidSequence", methods=["POST"])
+async def get_ChromosomeOriginalValidSequences():
+    body = await request.get_json()
+    return jsonify(await chromosome_original_valid_sequences(body["cell_line"], body["chromosome_name"]))
+
+
+@api.route("/getChromosMergedValidSequence", methods=["POST"])
+async def get_ChromosMergedValidSequences():
+    body = await request.get_json()
+    return jsonify(await chromosome_merged_valid_sequences(body["cell_line"], body["chromosome_name"]))
+
+
+@api.route("/getChromosData", methods=["POST"])
+async def get_ChromosData():
+    body = await request.get_json()
+    return jsonify(await chromosome_data(body["cell_line"], body["chromosome_name"], body["sequences"]))
+
+
+@api.route("/getChromosValidIBPData", methods=["POST"])
+async def get_ChromosValidIBPData():
+    body = await request.get_json()
+    return jsonify(await chromosome_valid_ibp_data(body["cell_line"], body["chromosome_name"], body["sequences"]))
+
+
+@api.route("/getRegionBundle", methods=["POST"])
+async def get_RegionBundle():
+    body = await request.get_json()
+    result = await region_bundle(body["cell_line"], body["chromosome_name"], body["sequences"], body.get("facets"))
+    status = 500 if result["errors"] and not result["data"] else 200
+    return jsonify(result), status
+
+
+@api.route("/getRegionCacheStats", methods=["GET"])
+async def get_RegionCacheStats():
+    return jsonify(region_cache_stats())
+
+
+@api.route("/getPrefoldStats", methods=["GET"])
+async def get_PrefoldStats():
+    return jsonify(await async_process.run_blocking(prefold_stats))
+
+
+@api.route("/getL1CacheStats", methods=["GET"])
+async def get_L1CacheStats():
+    return jsonify(l1_cache_stats())
+
+
+@api.route("/getDiskCacheStats", methods=["GET"])
+async def get_DiskCacheStats():
+    return jsonify(disk_cache_stats())
+
+
+@api.route("/getExportCacheStats", methods=["GET"])
+async def get_ExportCacheStats():
+    return jsonify(export_cache_stats())
+
+
+@api.route("/getRedisCacheStats", methods=["GET"])
+async def get_RedisCacheStats():
+    return jsonify(redis_cache_stats())
+
+
+@api.route("/getSlowQueryStats", methods=["GET"])
+async def get_SlowQueryStats():
+    # Statement texts and plans hold query literals, served to METRICS_ALLOWED_NETWORKS like /metrics
+    if not metrics.is_allowed(request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(slow_query_stats(request.args.get("limit", 100, type=int)))
+
+
+@api.route("/getExistChromosome3DData", methods=["POST"])
+async def get_ExistChromosome3DData():
+    body = await request.get_json()
+    chromosome_name = body.get("chromosome_name", "chr8")  # Default to chr8 for backward compatibility
+    data = await exist_chromosome_3D_data(body["cell_line"], body["sample_id"], body["sequences"], chromosome_name)
+    payload = await async_process.run_blocking(json_provider.dumps, data)
+    return Response(payload, content_type="application/json")
+
+
+@api.route("/getChromosome3DData", methods=["POST"])
+async def get_Chromosome3DData():
+    body = await request.get_json()
+    data = await chromosome_3D_data(body["cell_line"], body["chromosome_name"], body["sequences"], body["sample_id"])
+    payload = await async_process.run_blocking(json_provider.dumps, data)
+    return Response(payload, content_type="application/json")
+
+
+@api.route("/getComparisonCellLineList", methods=["POST"])
+async def get_ComparisonCellLineList():
+    body = await request.get_json()
+    return jsonify(await comparison_cell_line_list(body["cell_line"]))
+
+
+@api.route("/getGeneList", methods=["POST"])
+async def get_GeneList():
+    body = await request.get_json()
+    return jsonify(await gene_list(body["chromosome_name"], body["sequences"]))
+
+
+@api.route("/getepigeneticTrackData", methods=["POST"])
+async def get_epigeneticTrackData():
+    body = await request.get_json()
+    return jsonify(await epigenetic_track_data(body["cell_line"], body["chromosome_name"], body["sequences"]))
+
+
+@api.route("/geneNamesListSearch", methods=["POST"])
+async def geneNamesListSearch():
+    body = await request.get_json()
+    return jsonify(await gene_names_list_search(body["search"]))
+
+
+@api.route("/getBeadDistribution", methods=["POST"])
+async def get_BeadDistribution():
+    body = await request.get_json()
+    return jsonify(
+        await bead_distribution(body["cell_line"], body["chromosome_name"], body["sequences"], body["indices"])
+    )
+
+
+@api.route("/getExistBeadDistribution", methods=["POST"])
+async def get_ExistBeadDistribution():
+    body = await request.get_json()
+    chromosome_name = body.get("chromosome_name", "chr8")  # Default to chr8 for backward compatibility
+    sequences = body.get("sequences", {"start": 127300000, "end": 128300000})  # Default for backward compatibility
+    return jsonify(await exist_bead_distribution(body["cell_line"], body["indices"], chromosome_name, sequences))
+
+
+@api.route("/getBeadDistributionPValues", methods=["POST"])
+async def get_BeadDistributionPValues():
+    groups = await request.get_json()
+    return jsonify(await bead_distribution_pvalues(groups))
+
+
+@api.route("/getExample3DProgress", methods=["GET"])
+async def get_Example3DProgress():
+    cell_line = request.args["cell_line"]
+    chromosome_name = request.args["chromosome_name"]
+    start = request.args["start"]
+    end = request.args["end"]
+    sample_id = request.args["sample_id"]
+    is_exist = request.args["is_exist"]
+
+    if is_exist == "true":
+        key = f"{cell_line}:chr8:127300000:128300000:exist_{sample_id}_progress"
+    else:
+        key = f"{cell_line}:{chromosome_name}:{start}:{end}:{sample_id}_progress"
+
+    val = await async_redis_client.get(key)
+    return jsonify(percent=int(val) if val is not None else 0)
+
+
+@api.route("/getTourStatus", methods=["GET"])
+async def get_tour_status():
+    """Get whether the user has seen the tour before"""
+    user_id = get_or_create_user_id()
+    tour_seen = await async_redis_client.get(f"tour_seen:{user_id}")
+
+    response_data = {
+        "tour_seen": tour_seen is not None and tour_seen.decode() == "true",
+        "user_id": user_id,
+        "is_new_user": tour_seen is None,
+    }
+
+    response = await make_response(jsonify(response_data))
+    return set_user_cookie(response, user_id)
+
+
+@api.route("/setTourSeen", methods=["POST"])
+async def set_tour_seen():
+    """Mark the tour as seen for this user (first time only)"""
+    user_id = get_or_create_user_id()
+    await async_process.cache_setex(f"tour_seen:{user_id}", "true")
+
+    response = await make_response(jsonify({"status": "success", "user_id": user_id}))
+    return set_user_cookie(response, user_id)
+
+
+@api.route("/getBintuCellClusters", methods=["GET"])
+async def get_bintu_cell_clusters_api():
+    """Get available Bintu cell clusters for the selector"""
+    return jsonify(await get_bintu_cell_clusters())
+
+
+@api.route("/getBintuDistanceMatrix", methods=["POST"])
+async def get_bintu_distance_matrix_api():
+    """Get Bintu distance matrix for a specific cell ID"""
+    body = await request.get_json()
+    result = await get_bintu_distance_matrix(
+        body["cell_line"], body["chrid"], body["start_value"], body["end_value"], body["cell_id"]
+    )
+    if result is None:
+        return jsonify({"error": "No data found for the specified cell ID"}), 404
+
+    return jsonify(result)
+
+
+@api.route("/getGseCellLineOptions", methods=["GET"])
+async def get_gse_cell_line_options_api():
+    """Get list of available GSE cell lines"""
+    try:
+        return jsonify(await get_gse_cell_line_options())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/getGseCellIdOptions", methods=["POST"])
+async def get_gse_cell_id_options_api():
+    """Get list of available GSE cell ID options for a given cell line and resolution"""
+    try:
+        data = await request.get_json()
+        if not data or 'cell_line' not in data:
+            return jsonify({"error": "cell_line parameter is required"}), 400
+
+        return jsonify(await get_gse_cell_id_options(data['cell_line'], data.get('resolution')))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/getGseChrIdOptions", methods=["POST"])
+async def get_gse_chrid_options_api():
+    """Get list of available GSE chromosome ID options for a given cell line and cell ID"""
+    try:
+        data = await request.get_json()
+        if not data or 'cell_line' not in data or 'cell_id' not in data:
+            return jsonify({"error": "cell_line and cell_id parameters are required"}), 400
+
+        return jsonify(await get_gse_chrid_options(data['cell_line'], data['cell_id']))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/getGseDistanceMatrix", methods=["POST"])
+async def get_gse_distance_matrix_api():
+    """Get GSE distance matrix for given parameters"""
+    try:
+        data = await request.get_json()
+        required_params = ['cell_line', 'cell_id', 'chrid', 'resolution']
+
+        if not data or not all(param in data for param in required_params):
+            return jsonify({"error": f"Missing required parameters: {required_params}"}), 400
+
+        start_value = data.get('start_value')
+        end_value = data.get('end_value')
+        if start_value is not None:
+            start_value = int(start_value)
+        if end_value is not None:
+            end_value = int(end_value)
+
+        result = await get_gse_distance_matrix(
+            data['cell_line'], data['cell_id'], data['chrid'], data['resolution'], start_value, end_value
+        )
+        if result is None:
+            return jsonify({"error": "No GSE data found for the specified parameters"}), 404
+
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+app.register_blueprint(api)
+
+
+@app.route("/")
+async def index():
+    return "Hello, World!"
+
+
+class WSGIFallbackDispatcher:
+    """Send the listed HTTP paths to a WSGI app, everything else to the ASGI app"""
+
+    def __init__(self, asgi_app, wsgi_app, paths):
+        self.asgi_app = asgi_app
+        self.wsgi_app = AsyncioWSGIMiddleware(wsgi_app, max_body_size=WSGI_MAX_BODY_SIZE)
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            return await self.wsgi_app(scope, receive, send)
+        return await self.asgi_app(scope, receive, send)
+
+
+asgi_app = WSGIFallbackDispatcher(app, flask_app, WSGI_FALLBACK_PATHS)
+
+
+if __name__ == "__main__":
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{os.getenv('ASYNC_APP_PORT', 5002)}"]
+    asyncio.run(serve(asgi_app, config))
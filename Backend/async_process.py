@@ -0,0 +1,860 @@
+import os
+import json
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import combinations
+import numpy as np
+import orjson
+import redis.asyncio as aioredis
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from scipy.spatial.distance import squareform
+from dotenv import load_dotenv
+from cell_line_labels import label_mapping
+from l1_cache import value_nbytes
+from region_cache import slice_columns
+import cache_policy
+import metrics
+import slow_queries
+import tracing
+import process
+from process import (
+    make_redis_cache_key,
+    region_cache,
+    contact_rows_query,
+    contact_records,
+    valid_ibps,
+    sort_chromosomes,
+    merge_intervals,
+    aggregate_epigenetic_tracks,
+    REGION_BUNDLE_FACETS,
+    region_bundle_tasks,
+    finish_region_bundle,
+    decode_calc_distance_row,
+    collect_bead_distances,
+    build_bintu_distance_matrix,
+    build_gse_distance_matrix,
+)
+
+
+load_dotenv()
+
+
+# postgres database connection settings
+DB_NAME = os.getenv("DB_NAME")
+DB_HOST = os.getenv("DB_HOST")
+DB_USERNAME = os.getenv("DB_USERNAME")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_PORT = os.getenv("DB_PORT")
+
+# redis connection settings
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB   = int(os.getenv("REDIS_DB", 0))
+
+# Requests wait for a free connection instead of being rejected (max_waiting=0 means unbounded queue)
+ASYNC_DB_POOL_MIN_SIZE = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", 5))
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", 50))
+ASYNC_DB_POOL_MAX_WAITING = int(os.getenv("ASYNC_DB_POOL_MAX_WAITING", 0))
+ASYNC_REDIS_MAX_CONNECTIONS = int(os.getenv("ASYNC_REDIS_MAX_CONNECTIONS", 200))
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", os.cpu_count() or 4))
+# Concurrent sBIF folds, each runs for minutes and blocks its thread throughout
+ASYNC_FOLD_WORKERS = int(os.getenv("ASYNC_FOLD_WORKERS", 2))
+
+# The pool is opened by the ASGI app on startup, once an event loop is running
+async_conn_pool = AsyncConnectionPool(
+    conninfo=f"host={DB_HOST} port={DB_PORT} dbname={DB_NAME} user={DB_USERNAME} password={DB_PASSWORD}",
+    min_size=ASYNC_DB_POOL_MIN_SIZE,
+    max_size=ASYNC_DB_POOL_MAX_SIZE,
+    max_waiting=ASYNC_DB_POOL_MAX_WAITING,
+    open=False,
+    configure=slow_queries.configure_async_connection,
+)
+metrics.register_pool("async", async_conn_pool)
+
+async_redis_pool = aioredis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    max_connections=ASYNC_REDIS_MAX_CONNECTIONS,
+)
+async_redis_client = tracing.TracedAsyncRedis(connection_pool=async_redis_pool)
+
+# NumPy/SciPy decoding, JSON (de)serialization and the blocking sBIF/feather paths run here,
+# so they never stall the event loop
+executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="async-offload")
+
+# Regions that still have to be folded queue here, so they never take the threads of the short work above
+fold_executor = ThreadPoolExecutor(max_workers=ASYNC_FOLD_WORKERS, thread_name_prefix="async-fold")
+
+
+"""
+Open the async connection pool, called once the event loop is running
+"""
+async def open_pools():
+    await async_conn_pool.open()
+
+
+"""
+Close the async connection pools and the offload executors
+"""
+async def close_pools():
+    await async_conn_pool.close()
+    await async_redis_client.aclose()
+    executor.shutdown(wait=False)
+    fold_executor.shutdown(wait=False)
+
+
+"""
+Run a function in one of the executors, in a copy of the caller's context
+"""
+async def run_in(pool, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # The copied context keeps the spans of the offloaded work in the request's trace
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(pool, partial(context.run, func, *args, **kwargs))
+
+
+"""
+Run a blocking or CPU heavy function in the offload executor
+"""
+async def run_blocking(func, *args, **kwargs):
+    return await run_in(executor, func, *args, **kwargs)
+
+
+"""
+Run a function that may fold a region with sBIF in the fold executor
+"""
+async def run_fold(func, *args, **kwargs):
+    return await run_in(fold_executor, func, *args, **kwargs)
+
+
+"""
+Check out a connection from the async connection pool.
+"""
+@asynccontextmanager
+async def db_conn():
+    async with async_conn_pool.connection() as conn:
+        yield conn
+
+
+"""
+Execute a query and return every row as a dict
+"""
+async def fetch_all(query, params=None):
+    async with db_conn() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+"""
+SETEX with the TTL of the key's cache family, a payload above the family's item size is not cached
+"""
+async def cache_setex(key, value):
+    ttl = cache_policy.write_ttl(key, cache_policy.payload_nbytes(value))
+    if ttl is not None:
+        await async_redis_client.setex(key, ttl, value)
+
+
+"""
+Read keys from Redis in one pipeline, promoting the hits into the L1 cache with their remaining TTL
+like CacheSession.get_many. decoders[i] turns the Redis bytes of keys[i] into the value kept in L1.
+Returns the values in key order, None for a miss.
+"""
+async def redis_get_many(keys, decoders):
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = await pipe.execute()
+
+    values, refreshes = [], []
+    for key, decoder, blob, pttl in zip(keys, decoders, replies[::2], replies[1::2]):
+        metrics.count_redis_lookup(key, blob is not None)
+        cache_policy.count_lookup(key, blob is not None)
+        if blob is None:
+            values.append(None)
+            continue
+        # Sliding families get their expiry pushed out
+        ttl = cache_policy.refresh_ttl(key, pttl)
+        if ttl is not None:
+            refreshes.append((key, ttl))
+            pttl = ttl * 1000
+        value = decoder(blob)
+        process.l1_cache.set(key, value, value_nbytes(value, len(blob)), ttl=pttl / 1000 if pttl > 0 else None)
+        values.append(value)
+
+    if refreshes:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            for key, ttl in refreshes:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+    return values
+
+
+"""
+Write decoded values through the cache tiers like CacheSession.set: the JSON bytes go to Redis in one
+pipeline unless they are above the item size of the key's family, the values to the L1 and disk caches.
+items are (key, value, JSON bytes).
+"""
+async def cache_set_many(items):
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for key, value, blob in items:
+            ttl = cache_policy.write_ttl(key, len(blob))
+            if ttl is not None:
+                pipe.setex(key, ttl, blob)
+            process.l1_cache.set(key, value, value_nbytes(value, len(blob)), ttl=ttl)
+            process.disk_cache.put(key, value)
+        await pipe.execute()
+
+
+"""
+Execute a query and return the first row as a dict
+"""
+async def fetch_one(query, params=None):
+    async with db_conn() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchone()
+
+
+"""
+Return the list of genes
+"""
+async def gene_names_list():
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT symbol
+        FROM gene
+    """
+    )
+    return [{"value": row["symbol"], "label": row["symbol"]} for row in rows]
+
+
+"""
+Return the gene name list in searching specific letters
+"""
+async def gene_names_list_search(search):
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT symbol
+        FROM gene
+        WHERE symbol ILIKE %s
+    """,
+        (f"%{search}%",),
+    )
+    return [{"value": row["symbol"], "label": row["symbol"]} for row in rows]
+
+
+"""
+Returns the list of cell line
+"""
+async def cell_lines_list():
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT cell_line
+        FROM valid_regions
+    """
+    )
+    return [
+        {
+            "value": row["cell_line"],
+            "label": label_mapping.get(row["cell_line"], "Unknown"),
+        }
+        for row in rows
+    ]
+
+
+"""
+Returns the list of chromosomes in the cell line
+"""
+async def chromosomes_list(cell_line):
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT chrid
+        FROM valid_regions
+        WHERE cell_line = %s
+    """,
+        (cell_line,),
+    )
+    return sort_chromosomes([row["chrid"] for row in rows])
+
+
+"""
+Return the chromosome size in the given chromosome name
+"""
+async def chromosome_size(chromosome_name):
+    row = await fetch_one(
+        """
+        SELECT size
+        FROM chromosome
+        WHERE chrid = %s
+    """,
+        (chromosome_name,),
+    )
+    return row["size"]
+
+
+"""
+Returns the all valid original sequences of the chromosome data in the given cell line, chromosome name
+"""
+async def chromosome_original_valid_sequences(cell_line, chromosome_name):
+    rows = await fetch_all(
+        """
+        SELECT start_value, end_value
+        FROM valid_regions
+        WHERE cell_line = %s
+        AND chrid = %s
+        ORDER BY start_value
+    """,
+        (cell_line, chromosome_name),
+    )
+    return [{"start": row["start_value"], "end": row["end_value"]} for row in rows]
+
+
+"""
+Returns the all valid merged sequences of the chromosome data in the given cell line, chromosome name
+"""
+async def chromosome_merged_valid_sequences(cell_line, chromosome_name):
+    rows = await fetch_all(
+        """
+        SELECT start_value, end_value
+        FROM valid_regions
+        WHERE cell_line = %s
+        AND chrid = %s
+        ORDER BY start_value
+    """,
+        (cell_line, chromosome_name),
+    )
+    return merge_intervals(rows)
+
+
+"""
+Return the chromosome size in the given gene name
+"""
+async def chromosome_size_by_gene_name(gene_name):
+    return await fetch_one(
+        """
+            SELECT chromosome, orientation, start_location, end_location
+            FROM gene
+            WHERE symbol = %s
+            AND CAST(chromosome AS integer) >= %s
+            AND CAST(chromosome AS integer) <= %s
+        """,
+        (gene_name, '1', '22'),
+    )
+
+
+"""
+Returns the (ibp, jbp, fq, fdr, rawc) Hi-C contacts with both ends in [start, end], except the exclude range
+"""
+async def fetch_contact_rows(cell_line, chromosome_name, start, end, exclude=None):
+    query, params = contact_rows_query(cell_line, chromosome_name, start, end, exclude)
+    async with db_conn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+"""
+Return the Hi-C contact columns of [start, end] out of the process-wide region cache and pass them to finish.
+The lookup runs on the event loop and a miss is fetched on the async pool, only the slicing, merging
+and finish run in the executor.
+"""
+async def region_contacts(cell_line, chromosome_name, sequences, finish):
+    start, end = sequences["start"], sequences["end"]
+    covering, miss = region_cache.plan(cell_line, chromosome_name, start, end)
+    if miss is None:
+        return await run_blocking(lambda: finish(slice_columns(covering, start, end)))
+
+    fetch_start, fetch_end, exclude, _, _ = miss
+    rows = await fetch_contact_rows(cell_line, chromosome_name, fetch_start, fetch_end, exclude)
+    return await run_blocking(
+        lambda: finish(region_cache.complete(cell_line, chromosome_name, start, end, miss, rows))
+    )
+
+
+"""
+Returns the existing chromosome data in the given cell line, chromosome name, start, end
+"""
+async def chromosome_data(cell_line, chromosome_name, sequences):
+    return await region_contacts(
+        cell_line, chromosome_name, sequences, partial(contact_records, cell_line, chromosome_name)
+    )
+
+
+"""
+Returns the existing chromosome data in the given cell line, chromosome name, start, end
+"""
+async def chromosome_valid_ibp_data(cell_line, chromosome_name, sequences):
+    return await region_contacts(cell_line, chromosome_name, sequences, valid_ibps)
+
+
+"""
+Returns the existing 3D chromosome data of the example regions, the feather reads run in the executor
+"""
+async def exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name="chr8"):
+    return await run_blocking(process.exist_chromosome_3D_data, cell_line, sample_id, sequences, chromosome_name)
+
+
+"""
+Returns the 3D chromosome data in the given cell line, chromosome name, start, end.
+Redis and database paths are served natively and write through the same L1, Redis and disk tiers
+as the synchronous implementation, a region that still has to be folded by sBIF is handed over to
+it in the fold executor.
+"""
+async def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
+    start, end = sequences["start"], sequences["end"]
+
+    progress_key = make_redis_cache_key(cell_line, chromosome_name, start, end, f"{sample_id}_progress")
+    position_key = make_redis_cache_key(cell_line, chromosome_name, start, end, f"3d_{sample_id}_position_data")
+    if sample_id == 0:
+        sample_distance_key = make_redis_cache_key(cell_line, chromosome_name, start, end, "best_corr_data")
+    else:
+        sample_distance_key = make_redis_cache_key(cell_line, chromosome_name, start, end, f"{sample_id}_distance_vector")
+    avg_key = make_redis_cache_key(cell_line, chromosome_name, start, end, "avg_distance_data")
+    fq_key = make_redis_cache_key(cell_line, chromosome_name, start, end, "fq_data")
+    best_corr_key = make_redis_cache_key(cell_line, chromosome_name, start, end, "best_corr_data")
+    best_sample_id_key = make_redis_cache_key(cell_line, chromosome_name, start, end, "best_sample_id")
+    process.region_access_log.touch(cell_line, chromosome_name, sequences)
+
+    # Hot regions are served from the process-wide L1 cache, only the final progress the frontend polls is written
+    l1_values = [process.l1_cache.get(key) for key in (position_key, sample_distance_key, avg_key, fq_key)]
+    if all(value is not None for value in l1_values):
+        await cache_setex(progress_key, 99)
+        process.region_request_log.record(cell_line, chromosome_name, sequences, "l1")
+        position_data, sample_distance_vector, avg_distance_matrix, fq_data = l1_values
+        return {
+            "position_data": position_data,
+            "avg_distance_data": avg_distance_matrix,
+            "fq_data": fq_data,
+            "sample_distance_vector": sample_distance_vector
+        }
+
+    await cache_setex(progress_key, 0)
+
+    # The cached JSON goes into the response as it is
+    redis_values = await redis_get_many((position_key, sample_distance_key, avg_key, fq_key), [orjson.Fragment] * 4)
+    if all(value is not None for value in redis_values):
+        position_data, sample_distance_vector, avg_distance_matrix, fq_data = redis_values
+        await cache_setex(progress_key, 99)
+        process.region_request_log.record(cell_line, chromosome_name, sequences, "redis")
+        return {
+            "position_data": position_data,
+            "avg_distance_data": avg_distance_matrix,
+            "fq_data": fq_data,
+            "sample_distance_vector": sample_distance_vector
+        }
+
+    # Disk copies survive Redis flushes and restarts, the mmap reads run in the executor. Hits are
+    # promoted to L1 only, like in the synchronous implementation
+    def read_disk():
+        values = []
+        for key in (position_key, sample_distance_key, avg_key, fq_key):
+            value, nbytes = process.disk_cache.get(key)
+            if value is not None:
+                process.l1_cache.set(key, value, nbytes)
+            values.append(value)
+        return values
+
+    disk_values = await run_blocking(read_disk)
+    if all(value is not None for value in disk_values):
+        await cache_setex(progress_key, 99)
+        process.region_request_log.record(cell_line, chromosome_name, sequences, "disk")
+        position_data, sample_distance_vector, avg_distance_matrix, fq_data = disk_values
+        return {
+            "position_data": position_data,
+            "avg_distance_data": avg_distance_matrix,
+            "fq_data": fq_data,
+            "sample_distance_vector": sample_distance_vector
+        }
+
+    exists_row = await fetch_one(
+        """
+        SELECT
+            EXISTS(
+                SELECT 1 FROM position
+                WHERE chrid     = %s
+                AND cell_line   = %s
+                AND start_value = %s
+                AND end_value   = %s
+            ) AS position_exists,
+            EXISTS(
+                SELECT 1 FROM distance
+                WHERE cell_line = %s
+                AND chrid       = %s
+                AND start_value = %s
+                AND end_value   = %s
+            ) AS distance_exists;
+    """,
+        (chromosome_name, cell_line, start, end, cell_line, chromosome_name, start, end),
+    )
+    await cache_setex(progress_key, 5)
+
+    if not (exists_row["position_exists"] and exists_row["distance_exists"]):
+        return await run_fold(process.chromosome_3D_data, cell_line, chromosome_name, sequences, sample_id)
+
+    process.region_request_log.record(cell_line, chromosome_name, sequences, "database")
+
+    async def get_avg_fq_best_corr_data():
+        cached = await redis_get_many(
+            (avg_key, fq_key, best_corr_key, best_sample_id_key),
+            [orjson.Fragment, orjson.Fragment, orjson.Fragment, int],
+        )
+        if all(value is not None for value in cached):
+            return tuple(cached)
+
+        row = await fetch_one(
+            """
+                SELECT avg_distance_vector, fq_distance_vector, best_vector, best_sample_id
+                FROM calc_distance
+                WHERE chrid = %s
+                    AND cell_line = %s
+                    AND start_value = %s
+                    AND end_value = %s
+            """,
+            (chromosome_name, cell_line, start, end),
+        )
+
+        def decode():
+            matrices = decode_calc_distance_row(row)
+            return matrices, [orjson.dumps(mat, option=orjson.OPT_SERIALIZE_NUMPY) for mat in matrices]
+
+        (avg_data, fq_data, best_corr_data), (avg_json, fq_json, best_corr_json) = await run_blocking(decode)
+        best_sample_id = row["best_sample_id"]
+
+        await cache_set_many([
+            (avg_key, avg_data, avg_json),
+            (fq_key, fq_data, fq_json),
+            (best_corr_key, best_corr_data, best_corr_json),
+            (best_sample_id_key, best_sample_id, str(best_sample_id).encode("utf-8")),
+        ])
+
+        return avg_data, fq_data, best_corr_data, best_sample_id
+
+    async def get_distance_vector_by_sample(sid):
+        row = await fetch_one(
+            """
+                SELECT distance_vector
+                FROM distance
+                WHERE cell_line = %s
+                    AND chrid = %s
+                    AND start_value = %s
+                    AND end_value = %s
+                    AND sampleid = %s
+            """,
+            (cell_line, chromosome_name, start, end, sid),
+        )
+
+        def decode():
+            full_mat = squareform(np.frombuffer(row["distance_vector"], dtype=np.float32))
+            return full_mat, orjson.dumps(full_mat, option=orjson.OPT_SERIALIZE_NUMPY)
+
+        full_mat, data_json = await run_blocking(decode)
+        await cache_set_many([(sample_distance_key, full_mat, data_json)])
+        return full_mat
+
+    async def get_position_data(sid):
+        data = await fetch_all(
+            """
+                SELECT *
+                FROM position
+                WHERE chrid = %s
+                AND cell_line = %s
+                AND start_value = %s
+                AND end_value = %s
+                AND sampleid = %s
+                ORDER BY pid
+            """,
+            (chromosome_name, cell_line, start, end, sid),
+        )
+        position_json = (await run_blocking(json.dumps, data, ensure_ascii=False, default=str)).encode("utf-8")
+        position_data = orjson.Fragment(position_json)
+        await cache_set_many([(position_key, position_data, position_json)])
+        return position_data
+
+    avg_distance_matrix, fq_data, sample_distance_vector, best_sample_id = await get_avg_fq_best_corr_data()
+
+    if sample_id != 0:
+        sample_distance_vector, position_data = await asyncio.gather(
+            get_distance_vector_by_sample(sample_id),
+            get_position_data(sample_id),
+        )
+    else:
+        position_data = await get_position_data(best_sample_id)
+
+    await cache_setex(progress_key, 99)
+    return {
+        "position_data": position_data,
+        "avg_distance_data": avg_distance_matrix,
+        "fq_data": fq_data,
+        "sample_distance_vector": sample_distance_vector
+    }
+
+
+"""
+Returns currently existing other cell line list in given chromosome name and sequences
+"""
+async def comparison_cell_line_list(cell_line):
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT cell_line
+        FROM valid_regions
+    """
+    )
+    return [
+        {
+            "value": row["cell_line"],
+            "label": label_mapping.get(row["cell_line"], "Unknown"),
+        }
+        for row in rows
+        if row["cell_line"] != cell_line
+    ]
+
+
+"""
+Return the gene list in the given chromosome_name and sequence
+"""
+async def gene_list(chromosome_name, sequences):
+    return await fetch_all(
+        """
+        SELECT *
+        FROM gene
+        WHERE chromosome = %s
+        AND (
+            (start_location BETWEEN %s AND %s)
+            OR (end_location BETWEEN %s AND %s)
+            OR (start_location <= %s AND end_location >= %s)
+        )
+    """,
+        (
+            chromosome_name,
+            sequences["start"],
+            sequences["end"],
+            sequences["start"],
+            sequences["end"],
+            sequences["start"],
+            sequences["end"],
+        ),
+    )
+
+
+"""
+Return the epigenetic track data in the given cell_line, chromosome_name and sequence
+"""
+async def epigenetic_track_data(cell_line, chromosome_name, sequences):
+    rows = await fetch_all(
+        """
+        SELECT *
+        FROM epigenetic_track
+        WHERE chrid = %s
+        AND cell_line = %s
+        AND start_value >= %s
+        AND end_value <= %s
+    """,
+        (chromosome_name, cell_line, sequences["start"], sequences["end"]),
+    )
+    return aggregate_epigenetic_tracks(rows)
+
+
+"""
+Return several facets of one region in a single call, the facet queries run concurrently on the pool
+"""
+async def region_bundle(cell_line, chromosome_name, sequences, facets=None):
+    facets = list(facets) if facets else list(REGION_BUNDLE_FACETS)
+    functions = {
+        "chromosome_data": chromosome_data,
+        "chromosome_valid_ibp_data": chromosome_valid_ibp_data,
+        "gene_list": gene_list,
+        "epigenetic_track_data": epigenetic_track_data,
+        "chromosome_size": chromosome_size,
+    }
+    tasks = region_bundle_tasks(cell_line, chromosome_name, sequences, facets, functions)
+
+    results = await asyncio.gather(*(func(*args) for func, args in tasks.values()), return_exceptions=True)
+
+    data, errors = {}, {}
+    for facet, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            errors[facet] = str(result)
+        else:
+            data[facet] = result
+
+    return finish_region_bundle(facets, data, errors)
+
+
+"""
+Return the distribution of selected beads in all samples
+"""
+async def bead_distribution(cell_line, chromosome_name, sequences, indices):
+    indices = [int(idx) for idx in indices]
+    process.region_access_log.touch(cell_line, chromosome_name, sequences)
+
+    rows = await fetch_all(
+        """
+        SELECT sampleid, distance_vector
+        FROM distance
+        WHERE chrid         = %s
+            AND cell_line   = %s
+            AND start_value = %s
+            AND end_value   = %s
+        ORDER BY sampleid
+        """,
+        (chromosome_name, cell_line, sequences["start"], sequences["end"]),
+    )
+
+    def collect():
+        distributions = {f"{i}-{j}": [] for i, j in combinations(indices, 2)}
+        for row in rows:
+            collect_bead_distances(distributions, indices, np.frombuffer(row["distance_vector"], dtype=np.float32))
+        return distributions
+
+    return await run_blocking(collect)
+
+
+"""
+Return the distribution of selected beads from existing 3D chromosome data
+"""
+async def exist_bead_distribution(cell_line, indices, chromosome_name="chr8", sequences={"start": 127300000, "end": 128300000}):
+    return await run_blocking(process.exist_bead_distribution, cell_line, indices, chromosome_name, sequences)
+
+
+"""
+Compute pairwise t-test p-values between groups for each bead pair category
+"""
+async def bead_distribution_pvalues(distribution_groups):
+    return await run_blocking(process.bead_distribution_pvalues, distribution_groups)
+
+
+"""
+Cluster cells from the bintu table and return options
+"""
+async def get_bintu_cell_clusters():
+    rows = await fetch_all(
+        """
+        SELECT
+            cell_line,
+            chrid,
+            start_value,
+            end_value,
+            COUNT(DISTINCT cell_id) as cell_count,
+            ARRAY_AGG(DISTINCT cell_id ORDER BY cell_id) as cell_ids
+        FROM bintu
+        GROUP BY cell_line, chrid, start_value, end_value
+        ORDER BY cell_line, chrid, start_value, end_value
+        """
+    )
+
+    options = []
+    for row in rows:
+        start_mb = row['start_value'] // 1000000
+        end_mb = row['end_value'] // 1000000
+        options.append({
+            "value": f"{row['cell_line']}_{row['chrid']}_{row['start_value']}_{row['end_value']}",
+            "label": f"{row['cell_line']}_{row['chrid']}-{start_mb}-{end_mb}Mb",
+            "cell_line": row['cell_line'],
+            "chrid": row['chrid'],
+            "start_value": row['start_value'],
+            "end_value": row['end_value'],
+            "cell_count": row['cell_count'],
+            "cell_ids": row['cell_ids']
+        })
+
+    return options
+
+
+"""
+Get Bintu distance matrix for a specific cell ID
+"""
+async def get_bintu_distance_matrix(cell_line, chrid, start_value, end_value, cell_id):
+    rows = await fetch_all(
+        """
+        SELECT segment_index, x, y, z
+        FROM bintu
+        WHERE cell_line = %s AND chrid = %s AND start_value = %s AND end_value = %s AND cell_id = %s
+        ORDER BY segment_index
+        """,
+        (cell_line, chrid, start_value, end_value, cell_id),
+    )
+    if not rows:
+        return None
+
+    return await run_blocking(build_bintu_distance_matrix, rows, cell_line, chrid, start_value, end_value, cell_id)
+
+
+"""
+Return currently existing GSE cell line options
+"""
+async def get_gse_cell_line_options():
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT cell_line
+        FROM gse
+        """
+    )
+    return [{"value": row["cell_line"], "label": row["cell_line"]} for row in rows]
+
+
+"""
+Return currently existing GSE cell ID options in the given cell line and resolution
+"""
+async def get_gse_cell_id_options(cell_line, resolution):
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT cell_id
+        FROM gse
+        WHERE cell_line = %s AND resolution = %s
+        """,
+        (cell_line, resolution),
+    )
+    return [{"value": row["cell_id"], "label": row["cell_id"]} for row in rows]
+
+
+"""
+Return the GSE chrid options in the given cell line and cell ID
+"""
+async def get_gse_chrid_options(cell_line, cell_id):
+    rows = await fetch_all(
+        """
+        SELECT DISTINCT chrid
+        FROM gse
+        WHERE cell_line = %s
+            AND cell_id = %s
+        ORDER BY chrid
+        """,
+        (cell_line, cell_id),
+    )
+    return [{"value": row["chrid"], "label": row["chrid"]} for row in rows]
+
+
+"""
+Get GSE distance matrix for given parameters
+"""
+async def get_gse_distance_matrix(cell_line, cell_id, chrid, resolution, start_value=None, end_value=None):
+    base_query = """
+        SELECT ibp, jbp, fq
+        FROM gse
+        WHERE cell_line = %s
+            AND cell_id = %s
+            AND chrid = %s
+            AND resolution = %s
+    """
+    params = [cell_line, cell_id, chrid, resolution]
+
+    if start_value is not None and end_value is not None:
+        base_query += " AND ibp >= %s AND ibp <= %s AND jbp >= %s AND jbp <= %s"
+        params.extend([start_value, end_value, start_value, end_value])
+
+    base_query += " ORDER BY ibp, jbp"
+
+    rows = await fetch_all(base_query, params)
+    if not rows:
+        return None
+
+    return await run_blocking(
+        build_gse_distance_matrix, rows, cell_line, cell_id, chrid, resolution, start_value, end_value
+    )
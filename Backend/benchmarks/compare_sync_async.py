@@ -0,0 +1,95 @@
+"""
+Drive the sync (Flask) and async (Quart) backends with the same request mix and compare them.
+
+Usage, from the Backend directory with both servers running:
+    python -m benchmarks.compare_sync_async \
+        --sync-url http://localhost:5001 --async-url http://localhost:5002 \
+        --concurrency 1000 --requests 5000 --read-delay 0.05
+
+--read-delay makes every client consume the response in small chunks with a pause between them,
+emulating heatmap loads on slow connections.
+"""
+import argparse
+import asyncio
+import json
+import random
+from time import perf_counter
+from benchmarks.http_client import http_request, summarize
+
+
+def build_request_mix(cell_line, chromosome_name, start, end):
+    """Weighted (name, method, path, body, weight) tuples mirroring a region selection in the frontend"""
+    region = {"cell_line": cell_line, "chromosome_name": chromosome_name, "sequences": {"start": start, "end": end}}
+    return [
+        ("getCellLines", "GET", "/api/getCellLines", None, 1),
+        ("getChromosomeSize", "POST", "/api/getChromosomeSize", {"chromosome_name": chromosome_name}, 2),
+        ("getChromosData", "POST", "/api/getChromosData", region, 4),
+        ("getChromosValidIBPData", "POST", "/api/getChromosValidIBPData", region, 3),
+        # The gene table stores the chromosome without the "chr" prefix, as the frontend sends it
+        ("getGeneList", "POST", "/api/getGeneList",
+         {"chromosome_name": chromosome_name.removeprefix("chr"), "sequences": region["sequences"]}, 3),
+        ("getepigeneticTrackData", "POST", "/api/getepigeneticTrackData", region, 2),
+        ("getRegionBundle", "POST", "/api/getRegionBundle",
+         dict(region, facets=["chromosome_data", "valid_ibps", "gene_list"]), 3),
+        ("getChromosome3DData", "POST", "/api/getChromosome3DData", dict(region, sample_id=0), 2),
+        ("getExample3DProgress", "GET",
+         f"/api/getExample3DProgress?cell_line={cell_line}&chromosome_name={chromosome_name}&start={start}&end={end}&sample_id=0&is_exist=false",
+         None, 3),
+    ]
+
+
+async def run_mix(base_url, mix, concurrency, total, read_delay, seed):
+    """Issue `total` requests drawn from the weighted mix with at most `concurrency` in flight"""
+    rng = random.Random(seed)
+    plan = rng.choices(mix, weights=[entry[4] for entry in mix], k=total)
+    queue = asyncio.Queue()
+    for entry in plan:
+        queue.put_nowait(entry)
+
+    results = []
+
+    async def worker():
+        while True:
+            try:
+                name, method, path, body, _ = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            status, received, latency = await http_request(base_url, method, path, body, read_chunk=4096, read_delay=read_delay)
+            results.append((name, status, received, latency))
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(results, perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync-url", default="http://localhost:5001")
+    parser.add_argument("--async-url", default="http://localhost:5002")
+    parser.add_argument("--cell-line", default="GM12878")
+    parser.add_argument("--chromosome-name", default="chr8")
+    parser.add_argument("--start", type=int, default=127300000)
+    parser.add_argument("--end", type=int, default=128300000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--read-delay", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    mix = build_request_mix(args.cell_line, args.chromosome_name, args.start, args.end)
+    report = {"parameters": vars(args), "results": {}}
+    for label, base_url in (("sync", args.sync_url), ("async", args.async_url)):
+        report["results"][label] = asyncio.run(
+            run_mix(base_url, mix, args.concurrency, args.requests, args.read_delay, args.seed)
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
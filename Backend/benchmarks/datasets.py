@@ -0,0 +1,331 @@
+"""
+Synthetic, seeded data sets for the benchmark suite.
+
+The generators build data shaped like the real imports and sBIF output: Hi-C contact tables at a
+configurable density with a distance decay, ensembles of S random-walk chains of N beads with their
+condensed float32 distance vectors, position rows and calc_distance summaries, Bintu traces with
+missing segments, and GSE single-cell contact tables. The same seed always yields the same bytes,
+so two benchmark runs measure the same work.
+
+load_dataset() creates the tables the backend reads (with the columns and indexes of init_db.py)
+and loads a data set with COPY.
+"""
+from dataclasses import dataclass, field
+from io import StringIO
+import numpy as np
+import pandas as pd
+from psycopg import sql
+from scipy.spatial.distance import pdist, squareform
+from exports import condensed_beads
+from data_generation import CREATE_GENERATION_TABLE_SQL, BUMP_GENERATION_SQL
+from region_requests import CREATE_REGION_REQUESTS_SQL, CREATE_PREFOLD_REGIONS_SQL
+from region_retention import CREATE_POSITION_SQL, CREATE_DISTANCE_SQL, CREATE_REGION_ACCESS_SQL, create_partitions
+
+
+# Mean distance between neighbouring beads of a chain, close to the sBIF output
+BEAD_STEP = 60.0
+
+
+@dataclass
+class DatasetConfig:
+    seed: int = 0
+    cell_lines: tuple = ("GM12878", "IMR90")
+    chromosome_name: str = "chr8"
+    chromosome_size: int = 145138636
+    start: int = 127300000
+    end: int = 128300000
+    # Hi-C bins and the share of bin pairs with a contact
+    resolution: int = 5000
+    hic_density: float = 0.2
+    beads: int = 200
+    samples: int = 200
+    genes: int = 50
+    bintu_cell_line: str = "HCT116"
+    bintu_chrid: str = "chr21"
+    bintu_start: int = 28000000
+    bintu_end: int = 30000000
+    bintu_cells: int = 100
+    bintu_segments: int = 65
+    bintu_missing: float = 0.05
+    gse_cell_line: str = "GM12878_dipc"
+    gse_cells: int = 20
+    gse_resolution: int = 50000
+    gse_density: float = 0.3
+
+    @property
+    def sequences(self):
+        return {"start": self.start, "end": self.end}
+
+
+@dataclass
+class Dataset:
+    config: DatasetConfig
+    # cell line -> DataFrame(chrid, ibp, jbp, fq, fdr, rawc)
+    hic: dict = field(default_factory=dict)
+    # cell line -> (samples, beads, 3) float64 coordinates
+    positions: dict = field(default_factory=dict)
+    # cell line -> (samples, beads * (beads - 1) / 2) float32 condensed distances
+    distances: dict = field(default_factory=dict)
+    genes: pd.DataFrame = None
+    bintu: pd.DataFrame = None
+    gse: pd.DataFrame = None
+
+
+def hic_contacts(rng, chromosome_name, start, end, resolution, density):
+    """Contacts between the bins of a region: a `density` share of the bin pairs, fq decaying with the pair distance"""
+    bins = np.arange(start, end + 1, resolution, dtype=np.int64)
+    i, j = np.triu_indices(len(bins))
+    keep = rng.random(len(i)) < density
+    i, j = i[keep], j[keep]
+    separation = (j - i + 1).astype(np.float64)
+    fq = np.clip(rng.gamma(2.0, 0.5 / separation ** 0.7), 1e-4, 1.0)
+    return pd.DataFrame({
+        "chrid": chromosome_name,
+        "ibp": bins[i],
+        "jbp": bins[j],
+        "fq": fq,
+        # Most contacts are significant, as in the refined non-random Hi-C tables
+        "fdr": rng.beta(0.5, 20.0, len(i)),
+        "rawc": rng.poisson(50 * fq + 1).astype(np.float64),
+    })
+
+
+def random_walk_ensemble(rng, samples, beads, step=BEAD_STEP):
+    """(samples, beads, 3) coordinates of random-walk chains"""
+    steps = rng.normal(0.0, step / np.sqrt(3), size=(samples, beads, 3))
+    steps[:, 0] = 0.0
+    return np.cumsum(steps, axis=1)
+
+
+def condensed_distances(positions):
+    """(samples, beads * (beads - 1) / 2) float32 condensed distance vectors, the layout of distance.distance_vector"""
+    return np.stack([pdist(chain) for chain in positions]).astype(np.float32)
+
+
+def calc_distance_summary(distances, contact_cutoff=2 * BEAD_STEP):
+    """
+    The calc_distance row of an ensemble: condensed average distances, the full contact frequency
+    matrix, and the sample closest to the average with its condensed vector
+    """
+    average = distances.mean(axis=0)
+    fq = squareform((distances < contact_cutoff).mean(axis=0)).astype(np.float32)
+    best_sample_id = int(np.argmax([np.corrcoef(vector, average)[0, 1] for vector in distances]))
+    return average.astype(np.float32), fq, best_sample_id, distances[best_sample_id]
+
+
+def gene_table(rng, chromosome_name, start, end, count):
+    """Genes overlapping the region, chromosome named without "chr" like the gene_list import"""
+    begin = np.sort(rng.integers(start - 50000, end, count))
+    length = rng.integers(1000, 100000, count)
+    return pd.DataFrame({
+        "chromosome": chromosome_name.removeprefix("chr"),
+        "orientation": rng.choice(["plus", "minus"], count),
+        "start_location": begin,
+        "end_location": begin + length,
+        "symbol": [f"GENE{i}" for i in range(count)],
+    })
+
+
+def bintu_traces(rng, cell_line, chrid, start, end, cells, segments, missing):
+    """Chromatin tracing table: one chain per cell, a `missing` share of the segments without coordinates"""
+    positions = random_walk_ensemble(rng, cells, segments, step=200.0)
+    cell_id, segment_index = np.divmod(np.arange(cells * segments), segments)
+    coordinates = positions.reshape(-1, 3).copy()
+    coordinates[rng.random(len(coordinates)) < missing] = np.nan
+    return pd.DataFrame({
+        "cell_line": cell_line,
+        "chrid": chrid,
+        "start_value": start,
+        "end_value": end,
+        "cell_id": cell_id,
+        "segment_index": segment_index,
+        "z": coordinates[:, 0],
+        "y": coordinates[:, 1],
+        "x": coordinates[:, 2],
+    })
+
+
+def gse_contacts(rng, cell_line, cells, chrid, start, end, resolution, density):
+    """Single-cell Hi-C contacts of `cells` cells at one resolution"""
+    frames = []
+    for cell in range(cells):
+        contacts = hic_contacts(rng, chrid, start, end, resolution, density)
+        frames.append(pd.DataFrame({
+            "cell_line": cell_line,
+            "cell_id": f"cell_{cell}",
+            "chrid": chrid,
+            "resolution": resolution,
+            "ibp": contacts["ibp"],
+            "jbp": contacts["jbp"],
+            "fq": np.ceil(contacts["fq"] * 10),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def generate(config=None):
+    config = config or DatasetConfig()
+    rng = np.random.default_rng(config.seed)
+    dataset = Dataset(config)
+    for cell_line in config.cell_lines:
+        dataset.hic[cell_line] = hic_contacts(
+            rng, config.chromosome_name, config.start, config.end, config.resolution, config.hic_density
+        )
+        dataset.positions[cell_line] = random_walk_ensemble(rng, config.samples, config.beads)
+        dataset.distances[cell_line] = condensed_distances(dataset.positions[cell_line])
+    dataset.genes = gene_table(rng, config.chromosome_name, config.start, config.end, config.genes)
+    dataset.bintu = bintu_traces(
+        rng, config.bintu_cell_line, config.bintu_chrid, config.bintu_start, config.bintu_end,
+        config.bintu_cells, config.bintu_segments, config.bintu_missing,
+    )
+    dataset.gse = gse_contacts(
+        rng, config.gse_cell_line, config.gse_cells, config.chromosome_name, config.start, config.end,
+        config.gse_resolution, config.gse_density,
+    )
+    return dataset
+
+
+def cell_line_table_name(cell_line):
+    return f"non_random_hic_{cell_line.replace('-', '_').replace('/', '_').replace(' ', '_')}".lower()
+
+
+# The tables of init_db.py the benchmarked code reads
+SCHEMA_SQL = [
+    "CREATE TABLE IF NOT EXISTS chromosome (chrid VARCHAR(50) PRIMARY KEY, size INT NOT NULL DEFAULT 0)",
+    """
+        CREATE TABLE IF NOT EXISTS gene (
+            gid SERIAL PRIMARY KEY, chromosome VARCHAR(50) NOT NULL, orientation VARCHAR(10) NOT NULL DEFAULT 'plus',
+            start_location BIGINT NOT NULL DEFAULT 0, end_location BIGINT NOT NULL DEFAULT 0, symbol VARCHAR(30) NOT NULL
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS bintu (
+            bid SERIAL PRIMARY KEY, cell_line VARCHAR(50) NOT NULL, chrid VARCHAR(50) NOT NULL,
+            start_value BIGINT NOT NULL DEFAULT 0, end_value BIGINT NOT NULL DEFAULT 0, cell_id INT NOT NULL,
+            segment_index INT NOT NULL DEFAULT 0, Z FLOAT DEFAULT NULL, Y FLOAT DEFAULT NULL, X FLOAT DEFAULT NULL
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS valid_regions (
+            vrid SERIAL PRIMARY KEY, chrid VARCHAR(50) NOT NULL, cell_line VARCHAR(50) NOT NULL,
+            start_value BIGINT NOT NULL DEFAULT 0, end_value BIGINT NOT NULL DEFAULT 0
+        )
+    """,
+    CREATE_POSITION_SQL,
+    CREATE_DISTANCE_SQL,
+    """
+        CREATE TABLE IF NOT EXISTS calc_distance (
+            cdid SERIAL PRIMARY KEY, cell_line VARCHAR(50) NOT NULL, chrid VARCHAR(50) NOT NULL,
+            start_value BIGINT NOT NULL, end_value BIGINT NOT NULL, best_sample_id INT NOT NULL DEFAULT 0,
+            avg_distance_vector BYTEA NOT NULL, fq_distance_vector BYTEA NOT NULL, best_vector BYTEA NOT NULL,
+            insert_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(cell_line, chrid, start_value, end_value)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS gse (
+            gseid SERIAL PRIMARY KEY, cell_line VARCHAR(50) NOT NULL, cell_id VARCHAR(50) NOT NULL,
+            chrid VARCHAR(50) NOT NULL, resolution INT NOT NULL, ibp BIGINT NOT NULL DEFAULT 0,
+            jbp BIGINT NOT NULL DEFAULT 0, fq FLOAT NOT NULL DEFAULT 0.0
+        )
+    """,
+    CREATE_GENERATION_TABLE_SQL,
+    CREATE_REGION_REQUESTS_SQL,
+    CREATE_PREFOLD_REGIONS_SQL,
+    CREATE_REGION_ACCESS_SQL,
+    "CREATE INDEX IF NOT EXISTS idx_gse_search ON gse (cell_line, resolution, cell_id, chrid)",
+]
+
+
+def copy_frame(cur, table, frame):
+    """COPY a DataFrame into the columns of the same names"""
+    buffer = StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep="")
+    columns = sql.SQL(", ").join(sql.Identifier(column) for column in frame.columns)
+    with cur.copy(sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(sql.Identifier(table), columns)) as copy:
+        copy.write(buffer.getvalue())
+
+
+def copy_positions(cur, region, positions, first_sample=0):
+    """COPY (samples, beads, 3) coordinates into position, region is (cell_line, chrid, start, end)"""
+    cell_line, chromosome_name, start, end = region
+    samples, beads, _ = positions.shape
+    copy_frame(cur, "position", pd.DataFrame({
+        "cell_line": cell_line,
+        "chrid": chromosome_name,
+        "sampleid": np.repeat(np.arange(first_sample, first_sample + samples), beads),
+        "start_value": start,
+        "end_value": end,
+        "x": positions[:, :, 0].ravel(),
+        "y": positions[:, :, 1].ravel(),
+        "z": positions[:, :, 2].ravel(),
+    }))
+
+
+def copy_distances(cur, region, distances, first_sample=0):
+    cell_line, chromosome_name, start, end = region
+    beads = condensed_beads(distances.shape[1])
+    with cur.copy(
+        "COPY distance (cell_line, chrid, sampleid, start_value, end_value, n_beads, distance_vector) FROM STDIN"
+    ) as copy:
+        for sample, vector in enumerate(distances, first_sample):
+            copy.write_row((cell_line, chromosome_name, sample, start, end, beads, vector.tobytes()))
+
+
+def insert_calc_distance(cur, region, average, fq, best_sample_id, best_vector):
+    cur.execute(
+        """
+            INSERT INTO calc_distance
+                (cell_line, chrid, start_value, end_value, best_sample_id, avg_distance_vector, fq_distance_vector, best_vector)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        (*region, best_sample_id, average.tobytes(), fq.tobytes(), best_vector.tobytes()),
+    )
+
+
+def load_dataset(conn, dataset):
+    """Create the schema and load the data set, replacing what an earlier load left"""
+    config = dataset.config
+    with conn.cursor() as cur:
+        for statement in SCHEMA_SQL:
+            cur.execute(statement)
+        for cell_line in config.cell_lines:
+            table_name = cell_line_table_name(cell_line)
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "hid SERIAL PRIMARY KEY, chrid VARCHAR(50) NOT NULL REFERENCES chromosome(chrid), "
+                "ibp BIGINT NOT NULL DEFAULT 0, jbp BIGINT NOT NULL DEFAULT 0, fq FLOAT NOT NULL DEFAULT 0.0, "
+                "fdr FLOAT NOT NULL DEFAULT 0.0, rawc FLOAT NOT NULL DEFAULT 0.0)"
+            ).format(sql.Identifier(table_name)))
+            cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (chrid, ibp, jbp)").format(
+                sql.Identifier(f"idx_{table_name}_search"), sql.Identifier(table_name)
+            ))
+
+        cur.execute(
+            "TRUNCATE chromosome, gene, bintu, valid_regions, position, distance, calc_distance, gse, "
+            "region_requests, prefold_regions, region_access RESTART IDENTITY CASCADE"
+        )
+        cur.execute(
+            "INSERT INTO chromosome (chrid, size) VALUES (%s, %s), (%s, %s)",
+            (config.chromosome_name, config.chromosome_size, config.bintu_chrid, config.bintu_end),
+        )
+        copy_frame(cur, "gene", dataset.genes)
+        copy_frame(cur, "bintu", dataset.bintu)
+        copy_frame(cur, "gse", dataset.gse)
+
+        for cell_line in config.cell_lines:
+            cur.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(cell_line_table_name(cell_line))))
+            copy_frame(cur, cell_line_table_name(cell_line), dataset.hic[cell_line])
+            cur.execute(
+                "INSERT INTO valid_regions (chrid, cell_line, start_value, end_value) VALUES (%s, %s, %s, %s)",
+                (config.chromosome_name, cell_line, config.start, config.end),
+            )
+
+            region = (cell_line, config.chromosome_name, config.start, config.end)
+            create_partitions(cur, region)
+            copy_positions(cur, region, dataset.positions[cell_line])
+            copy_distances(cur, region, dataset.distances[cell_line])
+            insert_calc_distance(cur, region, *calc_distance_summary(dataset.distances[cell_line]))
+
+        cur.execute(BUMP_GENERATION_SQL)
+        cur.execute("ANALYZE")
+    conn.commit()
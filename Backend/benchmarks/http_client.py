@@ -0,0 +1,100 @@
+"""
+Minimal asyncio HTTP/1.1 client used by the benchmark scripts.
+
+It opens one connection per request and can read the response body slowly, which is how
+a client on a poor connection looks to the server: the request keeps its worker busy until the
+last byte has been consumed.
+"""
+import asyncio
+import json
+from time import perf_counter
+from urllib.parse import urlsplit
+
+
+async def http_request(base_url, method, path, body=None, headers=None, read_chunk=65536, read_delay=0.0, timeout=300):
+    """Send one request and return (status, response bytes, latency in seconds)"""
+    url = urlsplit(base_url)
+    host = url.hostname
+    port = url.port or 80
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+
+    request_headers = {
+        "Host": f"{host}:{port}",
+        "Connection": "close",
+        "Accept-Encoding": "identity",
+    }
+    if body is not None:
+        request_headers["Content-Type"] = "application/json"
+        request_headers["Content-Length"] = str(len(payload))
+    request_headers.update(headers or {})
+
+    head = f"{method} {path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+
+    started = perf_counter()
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(head.encode("latin-1") + payload)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            status = int(status_line.split()[1]) if status_line else 0
+
+            received = 0
+            while True:
+                chunk = await reader.read(read_chunk)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if read_delay:
+                    await asyncio.sleep(read_delay)
+            return status, received
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    try:
+        status, received = await asyncio.wait_for(exchange(), timeout)
+    except (asyncio.TimeoutError, ConnectionError, OSError):
+        status, received = 0, 0
+
+    return status, received, perf_counter() - started
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(results, elapsed):
+    """Aggregate (name, status, bytes, latency) tuples into throughput, percentiles and error rate"""
+    def stats(rows):
+        latencies = sorted(row[3] for row in rows)
+        errors = sum(1 for row in rows if not 200 <= row[1] < 400)
+        return {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": errors / len(rows) if rows else 0.0,
+            "bytes": sum(row[2] for row in rows),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+    by_name = {}
+    for row in results:
+        by_name.setdefault(row[0], []).append(row)
+
+    summary = stats(results)
+    summary["elapsed"] = elapsed
+    summary["throughput"] = len(results) / elapsed if elapsed else 0.0
+    summary["by_request"] = {name: stats(rows) for name, rows in sorted(by_name.items())}
+    return summary
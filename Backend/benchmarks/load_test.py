@@ -0,0 +1,292 @@
+"""
+Load test the /api blueprint with weighted sessions modelled on the frontend.
+
+Each virtual user runs one session after another, picked by weight, with an exponentially
+distributed think time between its requests:
+    region_browse     cell lines, chromosomes, size, valid sequences, the region bundle and tracks
+    heatmap_zoom      the region bundle, then contacts and genes of ever narrower windows
+    example_3d        the example 3D view with its progress polling
+    sample_switch     the 3D data of a few other samples of a folded region
+    bead_distribution bead distributions of two cell lines and their p-values
+    download          the distance and position ensemble downloads
+    fold              the 3D data of a region that is not folded yet (runs sBIF), polling its progress
+
+Usage, from the Backend directory with the backend running:
+    python -m benchmarks.load_test --url http://localhost:5001 --users 50 --duration 120 \
+        --weights region_browse=4,heatmap_zoom=4,sample_switch=2,fold=0.2 --output load.json
+
+Every fold runs sBIF; start the backend with SBIF_EXE=./benchmarks/sbif_stub.py to fold with the
+deterministic stand-in instead. --load-dataset loads the synthetic data set of benchmarks.datasets
+into the database of the DB_* variables first, which empties its tables.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from time import perf_counter
+from urllib.parse import urlencode
+from benchmarks.http_client import http_request, percentile, summarize
+
+
+SCENARIO_WEIGHTS = {
+    "region_browse": 4,
+    "heatmap_zoom": 4,
+    "example_3d": 1,
+    "sample_switch": 2,
+    "bead_distribution": 2,
+    "download": 0.5,
+    "fold": 0,
+}
+
+
+class Session:
+    """Requests of one virtual user, appending (name, status, bytes, latency) rows to the shared results"""
+
+    def __init__(self, args, results, rng):
+        self.args = args
+        self.results = results
+        self.rng = rng
+        self.errors = 0
+
+    async def request(self, name, method, path, body=None, think=True):
+        status, received, latency = await http_request(
+            self.args.url, method, path, body, read_delay=self.args.read_delay, timeout=self.args.timeout
+        )
+        self.results.append((name, status, received, latency))
+        if not 200 <= status < 400:
+            self.errors += 1
+        if think and self.args.think_time:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time))
+        return status
+
+    def region(self, cell_line=None, start=None, end=None):
+        return {
+            "cell_line": cell_line or self.rng.choice(self.args.cell_lines),
+            "chromosome_name": self.args.chromosome_name,
+            "sequences": {"start": start or self.args.start, "end": end or self.args.end},
+        }
+
+    async def poll_progress(self, region, sample_id, is_exist):
+        """Progress polling of the frontend: once right away, then every --poll-interval until cancelled"""
+        query = urlencode({
+            "cell_line": region["cell_line"],
+            "chromosome_name": region["chromosome_name"],
+            "start": region["sequences"]["start"],
+            "end": region["sequences"]["end"],
+            "sample_id": sample_id,
+            "is_exist": "true" if is_exist else "false",
+        })
+        await asyncio.sleep(0.1)
+        while True:
+            await self.request("getExample3DProgress", "GET", f"/api/getExample3DProgress?{query}", think=False)
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def with_progress(self, region, sample_id, is_exist, name, path, body):
+        poller = asyncio.create_task(self.poll_progress(region, sample_id, is_exist))
+        try:
+            return await self.request(name, "POST", path, body)
+        finally:
+            poller.cancel()
+
+
+async def region_browse(session):
+    region = session.region()
+    cell_line, chromosome_name = region["cell_line"], region["chromosome_name"]
+    await session.request("getCellLines", "GET", "/api/getCellLines")
+    await session.request("getChromosomesList", "POST", "/api/getChromosomesList", {"cell_line": cell_line})
+    await session.request("getChromosomeSize", "POST", "/api/getChromosomeSize", {"chromosome_name": chromosome_name})
+    await session.request("getChromosomeOriginalValidSequence", "POST", "/api/getChromosomeOriginalValidSequence",
+                          {"cell_line": cell_line, "chromosome_name": chromosome_name})
+    await session.request("getRegionBundle", "POST", "/api/getRegionBundle",
+                          dict(region, facets=["chromosome_data", "valid_ibps", "gene_list"]))
+    await session.request("getepigeneticTrackData", "POST", "/api/getepigeneticTrackData", region)
+
+
+async def heatmap_zoom(session):
+    region = session.region()
+    await session.request("getRegionBundle", "POST", "/api/getRegionBundle",
+                          dict(region, facets=["chromosome_data", "valid_ibps", "gene_list"]))
+    start, end = session.args.start, session.args.end
+    for _ in range(3):
+        # Halve the window around a point of the current one, on bin boundaries as the brush snaps
+        width = (end - start) // 2
+        center = session.rng.randrange(start + width // 2, end - width // 2 + 1)
+        start = max(session.args.start, (center - width // 2) // 5000 * 5000)
+        end = min(session.args.end, start + width)
+        zoomed = dict(region, sequences={"start": start, "end": end})
+        await session.request("getChromosData", "POST", "/api/getChromosData", zoomed)
+        await session.request("getGeneList", "POST", "/api/getGeneList", {
+            "chromosome_name": region["chromosome_name"].removeprefix("chr"), "sequences": zoomed["sequences"],
+        })
+
+
+async def example_3d(session):
+    region = session.region()
+    body = dict(region, sample_id=0)
+    await session.with_progress(region, 0, True, "getExistChromosome3DData", "/api/getExistChromosome3DData", body)
+
+
+async def sample_switch(session):
+    region = session.region()
+    for sample_id in [0] + session.rng.sample(range(1, session.args.samples), min(3, session.args.samples - 1)):
+        body = dict(region, sample_id=sample_id)
+        await session.with_progress(region, sample_id, False, "getChromosome3DData", "/api/getChromosome3DData", body)
+
+
+async def bead_distribution(session):
+    beads = (session.args.end - session.args.start) // 5000
+    indices = sorted(session.rng.sample(range(beads), session.rng.randint(2, 5)))
+    for cell_line in session.args.cell_lines[:2]:
+        await session.request("getBeadDistribution", "POST", "/api/getBeadDistribution",
+                              dict(session.region(cell_line), indices=indices))
+    # The p-values are computed from the distributions the frontend holds, synthetic ones weigh the same
+    groups = {
+        cell_line: {
+            f"{i}-{j}": [session.rng.gammavariate(2.0, 40.0 * (j - i) ** 0.5) for _ in range(session.args.samples)]
+            for k, i in enumerate(indices) for j in indices[k + 1:]
+        }
+        for cell_line in session.args.cell_lines[:2]
+    }
+    await session.request("getBeadDistributionPValues", "POST", "/api/getBeadDistributionPValues", groups)
+
+
+async def download(session):
+    region = session.region()
+    query = {
+        "cell_line": region["cell_line"],
+        "chromosome_name": region["chromosome_name"],
+        "start": session.args.start,
+        "end": session.args.end,
+    }
+    await session.request("downloadFullChromosome3DDistanceData", "GET",
+                          f"/api/downloadFullChromosome3DDistanceData?{urlencode(query)}")
+    await session.request("downloadFullChromosome3DPositionData", "GET",
+                          f"/api/downloadFullChromosome3DPositionData?{urlencode(query)}")
+
+
+async def fold(session):
+    # A window of the loaded region at a random offset, most likely not folded yet
+    span = session.args.fold_span
+    start = session.rng.randrange(session.args.start, session.args.end - span + 1, 5000)
+    region = session.region(start=start, end=start + span)
+    body = dict(region, sample_id=0)
+    await session.with_progress(region, 0, False, "getChromosome3DData (fold)", "/api/getChromosome3DData", body)
+
+
+SCENARIOS = {
+    "region_browse": region_browse,
+    "heatmap_zoom": heatmap_zoom,
+    "example_3d": example_3d,
+    "sample_switch": sample_switch,
+    "bead_distribution": bead_distribution,
+    "download": download,
+    "fold": fold,
+}
+
+
+def parse_weights(value):
+    weights = dict(SCENARIO_WEIGHTS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight)
+    if not any(weight > 0 for weight in weights.values()):
+        raise argparse.ArgumentTypeError("at least one scenario needs a positive weight")
+    return weights
+
+
+async def virtual_user(index, args, results, sessions, deadline):
+    rng = random.Random(args.seed * 100003 + index)
+    names = [name for name, weight in args.weights.items() if weight > 0]
+    weights = [args.weights[name] for name in names]
+    # Users start spread over the ramp-up
+    await asyncio.sleep(args.ramp_up * index / args.users)
+    while perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        session = Session(args, results, rng)
+        started = perf_counter()
+        await SCENARIOS[name](session)
+        sessions.append((name, session.errors, perf_counter() - started))
+
+
+def summarize_sessions(sessions, elapsed):
+    by_name = {}
+    for name, errors, duration in sessions:
+        by_name.setdefault(name, []).append((errors, duration))
+    report = {}
+    for name, rows in sorted(by_name.items()):
+        durations = sorted(duration for _, duration in rows)
+        failed = sum(1 for errors, _ in rows if errors)
+        report[name] = {
+            "sessions": len(rows),
+            "sessions_per_second": len(rows) / elapsed if elapsed else 0.0,
+            "failed": failed,
+            "failure_rate": failed / len(rows),
+            "duration_p50": percentile(durations, 50),
+            "duration_p90": percentile(durations, 90),
+            "duration_p99": percentile(durations, 99),
+        }
+    return report
+
+
+async def run_load(args):
+    results, sessions = [], []
+    started = perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(virtual_user(i, args, results, sessions, deadline) for i in range(args.users)))
+    elapsed = perf_counter() - started
+    summary = summarize(results, elapsed)
+    summary["scenarios"] = summarize_sessions(sessions, elapsed)
+    return summary
+
+
+def load_dataset(seed):
+    import psycopg
+    from benchmarks.datasets import DatasetConfig, generate, load_dataset
+    conninfo = (
+        f"host={os.getenv('DB_HOST')} port={os.getenv('DB_PORT', 5432)} dbname={os.getenv('DB_NAME')} "
+        f"user={os.getenv('DB_USERNAME')} password={os.getenv('DB_PASSWORD')}"
+    )
+    with psycopg.connect(conninfo) as conn:
+        load_dataset(conn, generate(DatasetConfig(seed=seed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to start new sessions for")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which the users start")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between the requests of a user")
+    parser.add_argument("--weights", type=parse_weights, default=dict(SCENARIO_WEIGHTS),
+                        help="scenario=weight pairs overriding the defaults, e.g. fold=0.5,download=0")
+    parser.add_argument("--cell-lines", type=lambda value: value.split(","), default=["GM12878", "IMR90"])
+    parser.add_argument("--chromosome-name", default="chr8")
+    parser.add_argument("--start", type=int, default=127300000)
+    parser.add_argument("--end", type=int, default=128300000)
+    parser.add_argument("--samples", type=int, default=200, help="samples per folded region, for sample switching")
+    parser.add_argument("--fold-span", type=int, default=200000, help="width of the regions the fold sessions request")
+    parser.add_argument("--poll-interval", type=float, default=10.0)
+    parser.add_argument("--read-delay", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--load-dataset", action="store_true",
+                        help="load the synthetic data set into the DB_* database first (empties its tables)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.load_dataset:
+        load_dataset(args.seed)
+
+    report = {"parameters": vars(args), "results": asyncio.run(run_load(args))}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
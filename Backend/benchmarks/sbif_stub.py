@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-in for the sBIF binary, so the folding path can be load tested without building sBIF.
+
+It takes the command line sBIF.sh passes (-i interactions -c chrom -s start -e end -ns samples
+-nr samples per run -cl cell line -r resolution ...), writes a random-walk ensemble of
+(end - start) / resolution beads into position and distance and its summary into calc_distance,
+and prints the `[... DONE]` progress lines fold_region reads, the last one after the commit.
+The ensemble only depends on the region and SBIF_STUB_SEED. Point sBIF.sh at it with
+    SBIF_EXE=./benchmarks/sbif_stub.py
+
+SBIF_STUB_SAMPLES overrides the sample count (sBIF.sh asks for 5000), SBIF_STUB_SECONDS adds a
+sleep to every run of samples so a fold takes about as long as a real one. A region that is
+already in calc_distance is left as it is, as concurrent folds share the input folder.
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+
+# The stub runs as a program from the Backend directory, next to the modules it shares with the suite
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import psycopg
+from scipy.spatial.distance import squareform
+from benchmarks.datasets import (
+    BEAD_STEP,
+    condensed_distances,
+    copy_distances,
+    copy_positions,
+    insert_calc_distance,
+    random_walk_ensemble,
+)
+
+
+SBIF_STUB_SEED = int(os.getenv("SBIF_STUB_SEED", 0))
+SBIF_STUB_SAMPLES = int(os.getenv("SBIF_STUB_SAMPLES", 0))
+SBIF_STUB_SECONDS = float(os.getenv("SBIF_STUB_SECONDS", 0))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-i", dest="interactions", required=True)
+    parser.add_argument("-c", dest="chrom", required=True)
+    parser.add_argument("-l", dest="chrom_lengths")
+    parser.add_argument("-s", dest="start", type=int, required=True)
+    parser.add_argument("-e", dest="end", type=int, required=True)
+    parser.add_argument("-ns", dest="samples", type=int, default=5000)
+    parser.add_argument("-nr", dest="samples_per_run", type=int, default=100)
+    parser.add_argument("-cl", dest="cell_line", required=True)
+    parser.add_argument("-r", dest="resolution", type=int, default=5000)
+    parser.add_argument("-j", dest="job_prefix")
+    parser.add_argument("-p", dest="threads", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def done(message):
+    print(f"[{message} DONE]", flush=True)
+
+
+def region_seed(cell_line, chrom, start, end):
+    return zlib.crc32(f"{cell_line}:{chrom}:{start}:{end}".encode()) ^ SBIF_STUB_SEED
+
+
+def ensemble_runs(seed, samples, samples_per_run, beads):
+    """(first sample id, positions, condensed distances) per run, each run from its own seed so it can be redrawn"""
+    for run, first in enumerate(range(0, samples, samples_per_run)):
+        rng = np.random.default_rng((seed, run))
+        positions = random_walk_ensemble(rng, min(samples_per_run, samples - first), beads)
+        yield first, positions, condensed_distances(positions)
+
+
+def conninfo():
+    return (
+        f"host={os.getenv('DB_HOST')} port={os.getenv('DB_PORT', 5432)} dbname={os.getenv('DB_NAME')} "
+        f"user={os.getenv('DB_USERNAME')} password={os.getenv('DB_PASSWORD')}"
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    region = (args.cell_line, args.chrom, args.start, args.end)
+    beads = (args.end - args.start) // args.resolution
+    samples = SBIF_STUB_SAMPLES or args.samples
+    samples_per_run = max(1, min(args.samples_per_run, samples))
+    seed = region_seed(*region)
+
+    with open(args.interactions) as f:
+        interactions = sum(1 for _ in f)
+    done(f"Read {interactions} interactions")
+
+    with psycopg.connect(conninfo()) as conn:
+        with conn.cursor() as cur:
+            # One fold per region at a time, a second one finds the first one's rows
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (":".join(map(str, region)),))
+            cur.execute(
+                "SELECT 1 FROM calc_distance WHERE cell_line = %s AND chrid = %s AND start_value = %s AND end_value = %s",
+                region,
+            )
+            if cur.fetchone() is not None:
+                for message in ("Sampling", "Distances", "Average", "Contact frequency", "Best sample", "Commit"):
+                    done(message)
+                return 0
+
+            total = contacts = None
+            for first, positions, distances in ensemble_runs(seed, samples, samples_per_run, beads):
+                copy_positions(cur, region, positions, first)
+                copy_distances(cur, region, distances, first)
+                total = distances.sum(axis=0, dtype=np.float64) + (0 if total is None else total)
+                contacts = (distances < 2 * BEAD_STEP).sum(axis=0) + (0 if contacts is None else contacts)
+                if SBIF_STUB_SECONDS:
+                    time.sleep(SBIF_STUB_SECONDS * len(positions) / samples)
+            done("Sampling")
+            done("Distances")
+
+            average = (total / samples).astype(np.float32)
+            done("Average")
+            fq = squareform((contacts / samples).astype(np.float32))
+            done("Contact frequency")
+
+            # The sample closest to the average, the runs are redrawn rather than kept in memory
+            best_sample_id, best_corr, best_vector = 0, -np.inf, None
+            for first, _, distances in ensemble_runs(seed, samples, samples_per_run, beads):
+                corr = [np.corrcoef(vector, average)[0, 1] for vector in distances]
+                index = int(np.argmax(corr))
+                if corr[index] > best_corr:
+                    best_sample_id, best_corr, best_vector = first + index, corr[index], distances[index]
+            done("Best sample")
+
+            insert_calc_distance(cur, region, average, fq, best_sample_id, best_vector)
+        conn.commit()
+    done("Commit")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Throwaway Postgres and Redis servers for the benchmark suite.
+
+local_services() starts a fresh Postgres cluster (initdb + pg_ctl) and a redis-server without
+persistence on free ports under a temporary directory, and stops and removes them afterwards.
+The binaries are looked up on PATH, and in PG_BIN for Postgres (e.g. /usr/lib/postgresql/16/bin).
+"""
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+DB_NAME = "chromosome_bench"
+DB_USERNAME = "bench"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def find_binary(name, extra_dirs=()):
+    for directory in extra_dirs:
+        path = os.path.join(directory, name)
+        if os.access(path, os.X_OK):
+            return path
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(f"{name} not found, install it or point PG_BIN at the Postgres binaries")
+    return path
+
+
+def postgres_dirs():
+    dirs = [os.getenv("PG_BIN", "")]
+    # Debian / Ubuntu keep the server binaries off PATH
+    dirs += sorted(glob.glob("/usr/lib/postgresql/*/bin"), reverse=True)
+    return [directory for directory in dirs if directory]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port} after {timeout}s")
+
+
+@contextmanager
+def local_postgres(directory):
+    initdb = find_binary("initdb", postgres_dirs())
+    pg_ctl = find_binary("pg_ctl", postgres_dirs())
+    data_dir = os.path.join(directory, "pgdata")
+    port = free_port()
+    subprocess.run(
+        [initdb, "-D", data_dir, "-U", DB_USERNAME, "--auth=trust", "--encoding=UTF8", "--no-sync"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    options = f"-p {port} -k {directory} -c listen_addresses=127.0.0.1 -c fsync=off -c synchronous_commit=off"
+    subprocess.run(
+        [pg_ctl, "-D", data_dir, "-l", os.path.join(directory, "postgres.log"), "-o", options, "-w", "start"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    try:
+        subprocess.run(
+            [find_binary("createdb", postgres_dirs()), "-h", "127.0.0.1", "-p", str(port), "-U", DB_USERNAME, DB_NAME],
+            check=True,
+        )
+        yield {
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(port),
+            "DB_NAME": DB_NAME,
+            "DB_USERNAME": DB_USERNAME,
+            # Ignored under trust authentication, but an empty value would break the conninfo strings
+            "DB_PASSWORD": "bench",
+        }
+    finally:
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+
+
+@contextmanager
+def local_redis(directory):
+    port = free_port()
+    process = subprocess.Popen(
+        [find_binary("redis-server"), "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no",
+         "--dir", directory],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        yield {"REDIS_HOST": "127.0.0.1", "REDIS_PORT": str(port), "REDIS_DB": "0"}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+@contextmanager
+def local_services():
+    """Yields the environment (DB_* and REDIS_* variables, cache directories) pointing at the servers"""
+    directory = tempfile.mkdtemp(prefix="chromosome-bench-")
+    try:
+        with local_postgres(directory) as postgres_env, local_redis(directory) as redis_env:
+            yield {
+                **postgres_env,
+                **redis_env,
+                "DISK_CACHE_DIR": os.path.join(directory, "disk_cache"),
+                "EXPORT_CACHE_DIR": os.path.join(directory, "export_cache"),
+                "TRACE_FILE": os.path.join(directory, "traces.jsonl"),
+            }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
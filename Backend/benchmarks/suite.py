@@ -0,0 +1,322 @@
+"""
+Reproducible micro benchmarks of the data path, on a synthetic data set.
+
+`run` starts a throwaway Postgres and Redis (see benchmarks.services), loads a seeded synthetic data
+set into them (see benchmarks.datasets), then times the process.py functions and the download routes
+in-process, each case on the cache tier it names (e.g. chromosome_3D_data.database flushes Redis and
+the in-process caches before every round, chromosome_3D_data.l1 runs warm). The report holds the
+latency statistics per case next to the data set parameters, the git commit and the library versions.
+`compare` checks a report against a baseline and exits with status 1 when a case got slower.
+
+Usage, from the Backend directory (initdb refuses to run as root):
+    python -m benchmarks.suite run --output bench.json
+    python -m benchmarks.suite run --beads 500 --samples 1000 --case chromosome_3D_data
+    python -m benchmarks.suite compare baseline.json bench.json --threshold 0.1
+
+--services env benchmarks the servers of the DB_* / REDIS_* environment variables instead; add
+--load to load the data set there, which empties the tables of that database first.
+
+The sBIF fold itself is not benchmarked, the 3D cases read ensembles that are already in the database.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Callable
+import numpy as np
+from benchmarks.datasets import DatasetConfig, generate, load_dataset
+from benchmarks.http_client import percentile
+from benchmarks.services import local_services
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable
+    # Called before every round, outside of the timing, e.g. to empty a cache tier
+    setup: Callable = None
+    # Context manager factory wrapped around all rounds of the case
+    context: Callable = nullcontext
+
+
+def case_stats(timings):
+    timings = sorted(timings)
+    return {
+        "rounds": len(timings),
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "p90": percentile(timings, 90),
+        "p99": percentile(timings, 99),
+        "max": timings[-1],
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def run_case(case, rounds, warmup):
+    """Seconds of every timed round"""
+    timings = []
+    with case.context():
+        for i in range(warmup + rounds):
+            if case.setup is not None:
+                case.setup()
+            started = perf_counter()
+            case.run()
+            elapsed = perf_counter() - started
+            if i >= warmup:
+                timings.append(elapsed)
+    return timings
+
+
+@contextmanager
+def attribute(obj, name, value):
+    """Temporarily set obj.name, e.g. to switch a cache tier off for one case"""
+    old = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, old)
+
+
+def build_cases(config):
+    """The benchmark cases, process and app are imported here as they connect on import"""
+    import process
+    from app import app
+    from json_provider import dumps
+
+    cell_line = config.cell_lines[0]
+    chromosome_name = config.chromosome_name
+    sequences = config.sequences
+    client = app.test_client()
+
+    def flush_all():
+        process.redis_client.flushdb()
+        process.l1_cache.clear()
+
+    def no_disk_cache():
+        return attribute(process.disk_cache, "enabled", False)
+
+    def chromosome_3D(sample_id):
+        # Serialized like the route does, the payload encoding is part of the cost
+        return lambda: dumps(process.chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id))
+
+    indices = np.linspace(0, config.beads - 1, 5).astype(int).tolist()
+    groups = {}
+
+    def distribution_groups():
+        if not groups:
+            for group in config.cell_lines:
+                groups[group] = process.bead_distribution(group, chromosome_name, sequences, indices)
+        return groups
+
+    def download(path, headers=None, **params):
+        query = dict(cell_line=cell_line, chromosome_name=chromosome_name, start=config.start, end=config.end, **params)
+
+        def run():
+            response = client.get(path, query_string=query, headers=headers or {"Accept-Encoding": "identity"})
+            body = response.get_data()
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} {query} returned {response.status_code}: {body[:200]!r}")
+        return run
+
+    cases = [
+        Case("chromosome_data.cold", lambda: process.chromosome_data(cell_line, chromosome_name, sequences),
+             setup=process.region_cache.clear),
+        Case("chromosome_data.warm", lambda: process.chromosome_data(cell_line, chromosome_name, sequences)),
+        Case("chromosome_valid_ibp_data.warm",
+             lambda: process.chromosome_valid_ibp_data(cell_line, chromosome_name, sequences)),
+        Case("gene_list", lambda: process.gene_list(chromosome_name.removeprefix("chr"), sequences)),
+        Case("chromosome_3D_data.database", chromosome_3D(0), setup=flush_all, context=no_disk_cache),
+        Case("chromosome_3D_data.database.sample", chromosome_3D(config.samples // 2), setup=flush_all,
+             context=no_disk_cache),
+        Case("chromosome_3D_data.disk", chromosome_3D(0), setup=flush_all),
+        Case("chromosome_3D_data.redis", chromosome_3D(0), setup=process.l1_cache.clear),
+        Case("chromosome_3D_data.l1", chromosome_3D(0)),
+        Case("bead_distribution", lambda: process.bead_distribution(cell_line, chromosome_name, sequences, indices)),
+        Case("bead_distribution_pvalues", lambda: process.bead_distribution_pvalues(distribution_groups())),
+        Case("get_bintu_distance_matrix", lambda: process.get_bintu_distance_matrix(
+            config.bintu_cell_line, config.bintu_chrid, config.bintu_start, config.bintu_end, 0
+        )),
+        Case("get_gse_distance_matrix", lambda: process.get_gse_distance_matrix(
+            config.gse_cell_line, "cell_0", chromosome_name, config.gse_resolution, config.start, config.end
+        )),
+    ]
+
+    distance_path = "/api/downloadFullChromosome3DDistanceData"
+    position_path = "/api/downloadFullChromosome3DPositionData"
+    downloads = [
+        ("distance.npz", download(distance_path, format="npz")),
+        ("distance.parquet", download(distance_path, format="parquet")),
+        ("distance.npz.subset", download(distance_path, format="npz", samples=f"0-{config.samples // 4}",
+                                         beads=f"0-{config.beads // 2}")),
+        ("position.csv", download(position_path, format="csv")),
+        ("position.csv.gzip", download(position_path, headers={"Accept-Encoding": "gzip"}, format="csv")),
+        ("position.parquet", download(position_path, format="parquet")),
+    ]
+    for name, run in downloads:
+        cases.append(Case(f"download.{name}.generated", run,
+                          context=lambda: attribute(process.export_cache, "enabled", False)))
+        cases.append(Case(f"download.{name}.cached", run))
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    import pandas
+    import psycopg
+    import pyarrow
+    import scipy
+    return {
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "pandas": pandas.__version__,
+        "pyarrow": pyarrow.__version__,
+        "psycopg": psycopg.__version__,
+    }
+
+
+def load(config, env):
+    import psycopg
+    conninfo = (
+        f"host={env['DB_HOST']} port={env.get('DB_PORT', 5432)} dbname={env['DB_NAME']} "
+        f"user={env['DB_USERNAME']} password={env['DB_PASSWORD']}"
+    )
+    started = perf_counter()
+    dataset = generate(config)
+    with psycopg.connect(conninfo) as conn:
+        load_dataset(conn, dataset)
+    return perf_counter() - started
+
+
+def run_suite(args):
+    config = DatasetConfig(seed=args.seed, beads=args.beads, samples=args.samples, hic_density=args.hic_density)
+    with ExitStack() as stack:
+        if args.services == "local":
+            env = stack.enter_context(local_services())
+            os.environ.update(env)
+        else:
+            env = os.environ
+        load_seconds = load(config, env) if args.services == "local" or args.load else None
+
+        report = {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "environment": environment_info(),
+            "dataset": asdict(config),
+            "rounds": args.rounds,
+            "warmup": args.warmup,
+            "load_seconds": load_seconds,
+            "cases": {},
+        }
+        for case in build_cases(config):
+            if args.case and not any(pattern in case.name for pattern in args.case):
+                continue
+            stats = case_stats(run_case(case, args.rounds, args.warmup))
+            report["cases"][case.name] = stats
+            print(f"{case.name:<45} median {stats['median'] * 1000:10.2f} ms  p90 {stats['p90'] * 1000:10.2f} ms",
+                  file=sys.stderr)
+    return report
+
+
+def compare_reports(baseline, current, threshold):
+    """Median latency ratio of every case of both reports, flagging those more than threshold slower or faster"""
+    rows = {}
+    for name in sorted(set(baseline["cases"]) | set(current["cases"])):
+        before, after = baseline["cases"].get(name), current["cases"].get(name)
+        if before is None or after is None:
+            rows[name] = {"status": "added" if before is None else "removed"}
+            continue
+        ratio = after["median"] / before["median"] if before["median"] else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows[name] = {"baseline": before["median"], "current": after["median"], "ratio": ratio, "status": status}
+
+    if baseline.get("dataset") != current.get("dataset"):
+        print("The reports were made on different data sets, the ratios are not comparable", file=sys.stderr)
+    return rows
+
+
+def print_comparison(rows):
+    for name, row in rows.items():
+        if "ratio" in row:
+            print(f"{name:<45} {row['baseline'] * 1000:10.2f} ms -> {row['current'] * 1000:10.2f} ms "
+                  f"x{row['ratio']:.2f}  {row['status']}")
+        else:
+            print(f"{name:<45} {row['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks and write a JSON report")
+    run.add_argument("--services", choices=("local", "env"), default="local",
+                     help="start throwaway servers (local) or use those of the DB_* / REDIS_* variables (env)")
+    run.add_argument("--load", action="store_true", help="with --services env, load the data set (empties the tables)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--beads", type=int, default=DatasetConfig.beads)
+    run.add_argument("--samples", type=int, default=DatasetConfig.samples)
+    run.add_argument("--hic-density", type=float, default=DatasetConfig.hic_density)
+    run.add_argument("--rounds", type=int, default=20)
+    run.add_argument("--warmup", type=int, default=2)
+    run.add_argument("--case", action="append", help="only run the cases whose name contains this, repeatable")
+    run.add_argument("--output", help="write the JSON report to this file")
+    run.add_argument("--baseline", help="compare the new report with this one afterwards")
+    run.add_argument("--threshold", type=float, default=0.1)
+
+    compare = commands.add_parser("compare", help="compare a report with a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1,
+                         help="relative change of the median latency that counts as a regression (default 0.1)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run_suite(args)
+        output = json.dumps(current, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+        else:
+            print(output)
+        if not args.baseline:
+            return 0
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    rows = compare_reports(baseline, current, args.threshold)
+    print_comparison(rows)
+    return 1 if any(row["status"] == "regression" for row in rows.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
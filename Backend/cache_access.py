@@ -0,0 +1,178 @@
+"""
+Pipelined cache access for the 3D data endpoints.
+
+A CacheSession gathers the Redis traffic of one request: every key the request needs is read in a
+single pipeline (after the L1 lookups, and falling back to the disk cache), and cache value writes are
+buffered and sent together, either piggybacked on the next read or in one MULTI/EXEC pipeline on
+flush(). Progress updates are written right away, the frontend polls them while the request runs.
+Each pipeline or progress write is one round trip, counted per request and reported in the
+X-Redis-Round-Trips response header and per endpoint at /api/getRedisRoundTripStats. Redis hits
+and misses are counted per key family in the metrics. TTLs, sliding expiry and the largest payload
+written to Redis come from the key's family in cache_policy.
+"""
+from contextvars import ContextVar
+from threading import Lock
+from flask import request
+import cache_policy
+from l1_cache import value_nbytes
+from metrics import count_redis_lookup
+from tracing import payload_size, pipeline_span
+
+
+# Round trip counter of the request being served, set by the before_request hook
+current_round_trips = ContextVar("current_round_trips", default=None)
+
+endpoint_round_trips = {}
+endpoint_round_trips_lock = Lock()
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.count = 0
+
+
+def count_round_trip():
+    counter = current_round_trips.get()
+    if counter is not None:
+        counter.count += 1
+
+
+class CacheSession:
+    def __init__(self, redis_client, l1_cache, disk_cache, ttl=None):
+        self.redis_client = redis_client
+        self.l1_cache = l1_cache
+        self.disk_cache = disk_cache
+        # Overrides the TTLs of the key families if given
+        self.ttl = ttl
+        # (command, key, *arguments) SETEXs and EXPIREs not sent yet
+        self.pending = []
+        self.round_trips = 0
+
+    def execute(self, pipe):
+        self.round_trips += 1
+        count_round_trip()
+        with pipeline_span(pipe) as attributes:
+            replies = pipe.execute()
+            attributes["reply_bytes"] = payload_size(replies)
+        return replies
+
+    def get_many(self, keys, decoders, l1_values=None):
+        """
+        Read several keys: L1 first, then one Redis pipeline (which also carries the pending writes),
+        then the disk cache. decoders[i] turns the Redis bytes of keys[i] into the value kept in L1,
+        which expires with the Redis copy. Returns the values in key order, None where no tier has the key.
+        l1_values skips the L1 lookups when the caller has just done them.
+        """
+        values = list(l1_values) if l1_values is not None else [self.l1_cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if not missing:
+            return values
+
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            self.queue_pending(pipe)
+            for i in missing:
+                pipe.get(keys[i])
+                pipe.pttl(keys[i])
+            replies = self.execute(pipe)[len(self.pending):]
+        self.pending = []
+
+        for n, i in enumerate(missing):
+            blob, pttl = replies[2 * n], replies[2 * n + 1]
+            count_redis_lookup(keys[i], blob is not None)
+            cache_policy.count_lookup(keys[i], blob is not None)
+            if blob is None:
+                continue
+            # Sliding families get their expiry pushed out with the next pipeline
+            ttl = cache_policy.refresh_ttl(keys[i], pttl)
+            if ttl is not None:
+                self.pending.append(("expire", keys[i], ttl))
+                pttl = ttl * 1000
+            value = decoders[i](blob)
+            self.l1_cache.set(keys[i], value, value_nbytes(value, len(blob)), ttl=pttl / 1000 if pttl > 0 else None)
+            values[i] = value
+
+        # Disk hits are promoted to L1 only, re-encoding the JSON for Redis would cost more than the mmap read
+        for i in missing:
+            if values[i] is None:
+                value, nbytes = self.disk_cache.get(keys[i])
+                if value is not None:
+                    self.l1_cache.set(keys[i], value, nbytes)
+                    values[i] = value
+
+        return values
+
+    def get(self, key, decoder):
+        return self.get_many([key], [decoder])[0]
+
+    def touch(self, keys):
+        """Slide the expiry of keys just served from L1, their Redis copies are extended with the next pipeline"""
+        for key in keys:
+            family = cache_policy.family_of(key)
+            if family.sliding and self.l1_cache.touch(key, family.ttl):
+                cache_policy.count(family, "refreshes")
+                self.pending.append(("expire", key, family.ttl))
+
+    def set(self, key, value, blob, ttl=None):
+        """
+        Keep the decoded value in L1 and on disk, and queue the JSON bytes for Redis unless they are
+        above the item size of the key's family
+        """
+        ttl = cache_policy.write_ttl(key, len(blob), self.ttl if ttl is None else ttl)
+        if ttl is not None:
+            self.pending.append(("setex", key, ttl, blob))
+        self.l1_cache.set(key, value, value_nbytes(value, len(blob)), ttl=ttl)
+        self.disk_cache.put(key, value)
+
+    def set_progress(self, key, value, ttl=None):
+        """
+        Write a progress update right away with a plain SETEX: the frontend polls it while the request
+        runs, so it cannot wait in the pending writes like the cache values
+        """
+        ttl = cache_policy.write_ttl(key, cache_policy.payload_nbytes(value), self.ttl if ttl is None else ttl)
+        if ttl is not None:
+            self.round_trips += 1
+            count_round_trip()
+            self.redis_client.setex(key, ttl, value)
+
+    def queue_pending(self, pipe):
+        for command, key, *arguments in self.pending:
+            getattr(pipe, command)(key, *arguments)
+
+    def flush(self):
+        """Send the pending writes in one transactional pipeline"""
+        if not self.pending:
+            return
+        with self.redis_client.pipeline(transaction=True) as pipe:
+            self.queue_pending(pipe)
+            self.execute(pipe)
+        self.pending = []
+
+
+def begin_request():
+    current_round_trips.set(RoundTripCounter())
+
+
+def finish_request(response):
+    counter = current_round_trips.get()
+    if counter is None or counter.count == 0:
+        return response
+    response.headers["X-Redis-Round-Trips"] = str(counter.count)
+    with endpoint_round_trips_lock:
+        stats = endpoint_round_trips.setdefault(request.endpoint, {"requests": 0, "round_trips": 0, "max": 0})
+        stats["requests"] += 1
+        stats["round_trips"] += counter.count
+        stats["max"] = max(stats["max"], counter.count)
+    return response
+
+
+def round_trip_stats():
+    with endpoint_round_trips_lock:
+        return {
+            endpoint: dict(stats, mean=stats["round_trips"] / stats["requests"])
+            for endpoint, stats in endpoint_round_trips.items()
+        }
+
+
+def init_app(app):
+    app.before_request(begin_request)
+    app.after_request(finish_request)
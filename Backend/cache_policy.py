@@ -0,0 +1,271 @@
+"""
+Cache governance for the Redis keys.
+
+Every key belongs to a family (region matrices, per-sample distance vectors, positions, progress
+counters, tour flags, stored HTTP responses) with its own TTL, optional sliding expiry and largest
+item size, each overridable with CACHE_<FAMILY>_TTL / _SLIDING / _MAX_ITEM_BYTES / _MAX_BYTES.
+With sliding expiry a hit pushes the expiry out again, so the regions people keep opening stay
+resident. A payload above the family's item size is not written to Redis, one cold giant would
+otherwise push out many hot regions. Writes, skipped payloads, hits, misses and refreshes are counted
+per family in the worker process.
+
+Redis as a whole is bounded by maxmemory with volatile-lfu (docker-compose.yml), so only keys with a
+TTL can be evicted. Every family, the tour flags included, is written with a TTL; only the profiling
+arming keeps its expiry in the value and is never evicted. The progress counters are tiny, polled and
+short-lived.
+enforce_budgets() trims a family to its _MAX_BYTES, evicting the coldest and largest keys first, and
+inspect() and purge() back the admin endpoints, which are served to CACHE_ADMIN_ALLOWED_NETWORKS only.
+"""
+import fnmatch
+import os
+import re
+from threading import Lock
+import redis
+from data_generation import key_region
+from metrics import parse_networks
+
+
+CACHE_ADMIN_ALLOWED_NETWORKS = parse_networks(os.getenv("CACHE_ADMIN_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128"))
+# Most keys one inspection looks at, SCAN walks the whole keyspace
+CACHE_INSPECT_MAX_KEYS = int(os.getenv("CACHE_INSPECT_MAX_KEYS", 200_000))
+CACHE_SCAN_BATCH = 1000
+
+MB = 1024 * 1024
+
+
+class CacheFamily:
+    def __init__(self, name, pattern, ttl, sliding=False, max_item_bytes=0, max_bytes=0):
+        prefix = f"CACHE_{name.upper()}"
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.ttl = int(os.getenv(f"{prefix}_TTL", ttl))
+        self.sliding = os.getenv(f"{prefix}_SLIDING", str(sliding)).lower() == "true"
+        # 0 means no limit
+        self.max_item_bytes = int(os.getenv(f"{prefix}_MAX_ITEM_BYTES", max_item_bytes))
+        self.max_bytes = int(os.getenv(f"{prefix}_MAX_BYTES", max_bytes))
+
+    def admits(self, nbytes):
+        return not self.max_item_bytes or nbytes <= self.max_item_bytes
+
+    def describe(self):
+        return {
+            "ttl": self.ttl,
+            "sliding": self.sliding,
+            "max_item_bytes": self.max_item_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# First match wins, region keys are cell_line:chromosome:start:end:custom_name
+FAMILIES = [
+    CacheFamily("progress", r":(exist_)?\d+_progress$", 3600, max_item_bytes=64),
+    CacheFamily("position", r":3d_(example_)?\d+_position_data$", 3600, sliding=True, max_item_bytes=8 * MB),
+    CacheFamily("sample_vector", r":\d+_(example_)?distance_vector$", 3600, sliding=True, max_item_bytes=32 * MB),
+    CacheFamily(
+        "region_matrix",
+        r":(avg_distance_data|fq_data|best_corr_data|best_sample_id|avg_distance_example_data|fq_example_data)$",
+        6 * 3600, sliding=True, max_item_bytes=64 * MB,
+    ),
+    CacheFamily("tour", r"^tour_seen:", 60 * 60 * 24 * 365, max_item_bytes=64),
+    CacheFamily("http_response", r"^http:", int(os.getenv("HTTP_CACHE_STORE_TTL", 3600)), max_item_bytes=16 * MB),
+]
+OTHER = CacheFamily("other", r"", 3600)
+FAMILIES_BY_NAME = {family.name: family for family in FAMILIES + [OTHER]}
+
+
+def family_of(key):
+    if isinstance(key, bytes):
+        key = key.decode("utf-8", "replace")
+    for family in FAMILIES:
+        if family.pattern.search(key):
+            return family
+    return OTHER
+
+
+COUNTER_FIELDS = ("writes", "bytes_written", "skipped_oversize", "hits", "misses", "refreshes")
+
+counts_lock = Lock()
+counts = {name: dict.fromkeys(COUNTER_FIELDS, 0) for name in FAMILIES_BY_NAME}
+
+
+def count(family, field, amount=1):
+    with counts_lock:
+        counts[family.name][field] += amount
+
+
+def count_lookup(key, hit):
+    count(family_of(key), "hits" if hit else "misses")
+
+
+def payload_nbytes(value):
+    return len(value) if isinstance(value, (bytes, bytearray)) else len(str(value))
+
+
+def write_ttl(key, nbytes, ttl=None):
+    """
+    TTL to write key with, or None if the payload is above its family's item size and must not be
+    cached. Counts the write or the skip.
+    """
+    family = family_of(key)
+    if not family.admits(nbytes):
+        count(family, "skipped_oversize")
+        return None
+    count(family, "writes")
+    count(family, "bytes_written", nbytes)
+    return family.ttl if ttl is None else ttl
+
+
+def refresh_ttl(key, pttl_ms):
+    """The TTL to extend key to on a hit, None unless its family slides and half of its TTL is used up"""
+    family = family_of(key)
+    if not family.sliding or pttl_ms is None or pttl_ms < 0 or pttl_ms > family.ttl * 500:
+        return None
+    count(family, "refreshes")
+    return family.ttl
+
+
+def stats():
+    with counts_lock:
+        snapshot = {name: dict(values) for name, values in counts.items()}
+    return {
+        name: dict(FAMILIES_BY_NAME[name].describe(), **values)
+        for name, values in snapshot.items()
+    }
+
+
+def scan_keys(redis_client, match="*", limit=CACHE_INSPECT_MAX_KEYS):
+    """Up to limit keys matching the glob pattern, and whether the scan stopped early"""
+    keys = []
+    for key in redis_client.scan_iter(match=match, count=CACHE_SCAN_BATCH):
+        if len(keys) >= limit:
+            return keys, True
+        keys.append(key)
+    return keys, False
+
+
+def key_details(redis_client, keys):
+    """
+    {key, family, bytes, ttl, freq, idle} per key. OBJECT FREQ only answers under an LFU maxmemory
+    policy and OBJECT IDLETIME only under the others, whichever fails is None.
+    """
+    details = []
+    for i in range(0, len(keys), CACHE_SCAN_BATCH):
+        batch = keys[i:i + CACHE_SCAN_BATCH]
+        with redis_client.pipeline(transaction=False) as pipe:
+            for key in batch:
+                pipe.memory_usage(key, samples=0)
+                pipe.pttl(key)
+                pipe.object("freq", key)
+                pipe.object("idletime", key)
+            replies = pipe.execute(raise_on_error=False)
+        for n, key in enumerate(batch):
+            nbytes, pttl, freq, idle = (
+                None if isinstance(reply, redis.RedisError) else reply for reply in replies[4 * n:4 * n + 4]
+            )
+            if nbytes is None:
+                # Expired or deleted since the scan
+                continue
+            name = key.decode("utf-8", "replace")
+            details.append({
+                "key": name,
+                "family": family_of(name).name,
+                "bytes": nbytes,
+                "ttl": pttl / 1000 if pttl is not None and pttl >= 0 else None,
+                "freq": freq,
+                "idle": idle,
+            })
+    return details
+
+
+def inspect(redis_client, family=None, match="*", limit=50):
+    """Resident keys and bytes per family and the `limit` largest keys, optionally of one family only"""
+    keys, truncated = scan_keys(redis_client, match)
+    details = key_details(redis_client, keys)
+    if family is not None:
+        details = [detail for detail in details if detail["family"] == family]
+
+    families = {}
+    for detail in details:
+        totals = families.setdefault(detail["family"], {"keys": 0, "bytes": 0})
+        totals["keys"] += 1
+        totals["bytes"] += detail["bytes"]
+    details.sort(key=lambda detail: detail["bytes"], reverse=True)
+    return {
+        "scanned": len(keys),
+        "truncated": truncated,
+        "families": families,
+        "top_keys": details[:limit],
+    }
+
+
+def purge(redis_client, family=None, match=None, l1_cache=None, region_generations=None):
+    """
+    Delete the keys of a family and / or matching a glob pattern (e.g. "GM12878:chr8:*"), from Redis and
+    from this worker's L1 cache. The disk cache and the L1 caches of the other workers are not reached
+    from here: the generation of every region among the deleted keys, and of the region the pattern
+    names, is bumped in region_generations instead, so they stop serving it. Returns the number of
+    Redis keys removed.
+    """
+    if family is None and match is None:
+        raise ValueError("A purge needs a family or a key pattern")
+    if family is not None and family not in FAMILIES_BY_NAME:
+        raise ValueError(f"Unknown cache family {family!r}")
+
+    # The whole keyspace is walked, a purge stopping at CACHE_INSPECT_MAX_KEYS would leave keys behind
+    removed = 0
+    batch = []
+    regions = set()
+    if match is not None and not any(char in "*?[" for char in key_region(match)):
+        regions.add(key_region(match))
+    for key in redis_client.scan_iter(match=match or "*", count=CACHE_SCAN_BATCH):
+        if family is not None and family_of(key).name != family:
+            continue
+        batch.append(key)
+        regions.add(key_region(key.decode("utf-8", "replace") if isinstance(key, bytes) else key))
+        if len(batch) >= CACHE_SCAN_BATCH:
+            removed += redis_client.unlink(*batch)
+            batch = []
+    if batch:
+        removed += redis_client.unlink(*batch)
+
+    if l1_cache is not None:
+        discarded = l1_cache.discard(lambda key: (family is None or family_of(key).name == family)
+                                     and (match is None or fnmatch.fnmatchcase(key, match)))
+        regions.update(key_region(key) for key in discarded)
+    if region_generations is not None:
+        region_generations.bump(regions)
+    return removed
+
+
+def coldness(detail):
+    """Eviction order within a family: large keys that are rarely (LFU) or long ago (LRU) used go first"""
+    if detail["freq"] is not None:
+        return detail["bytes"] / (detail["freq"] + 1)
+    return detail["bytes"] * ((detail["idle"] or 0) + 1)
+
+
+def enforce_budgets(redis_client):
+    """Evict the coldest keys of every family above its max_bytes, returns {family: (keys, bytes) evicted}"""
+    budgets = {family.name: family.max_bytes for family in FAMILIES_BY_NAME.values() if family.max_bytes}
+    if not budgets:
+        return {}
+
+    keys, _ = scan_keys(redis_client)
+    by_family = {}
+    for detail in key_details(redis_client, keys):
+        if detail["family"] in budgets:
+            by_family.setdefault(detail["family"], []).append(detail)
+
+    evicted = {}
+    for name, details in by_family.items():
+        excess = sum(detail["bytes"] for detail in details) - budgets[name]
+        victims = []
+        for detail in sorted(details, key=coldness, reverse=True):
+            if excess <= 0:
+                break
+            victims.append(detail)
+            excess -= detail["bytes"]
+        if victims:
+            redis_client.unlink(*(detail["key"] for detail in victims))
+            evicted[name] = (len(victims), sum(detail["bytes"] for detail in victims))
+    return evicted
@@ -0,0 +1,158 @@
+"""
+Data generation counter.
+
+The data_generation table holds a single row whose counter is bumped whenever stored data changes
+in a way that can alter an existing response: a data import or a new cell line. Cache layers and
+ETags are stamped with it, so bumping it invalidates them all. The value is cached in-process and
+re-read at most every DATA_GENERATION_REFRESH seconds, which keeps it off the hot path of every request.
+
+Evicting a folded ensemble or purging its Redis keys only concerns its region: region_generation counts
+the evictions and purges per region, and the L1, disk and export caches and the ETags of a region are
+stamped with its counter too.
+"""
+import os
+from datetime import datetime, timezone
+from threading import Lock
+from time import time
+
+
+DATA_GENERATION_REFRESH = float(os.getenv("DATA_GENERATION_REFRESH", 30))
+
+CREATE_GENERATION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS data_generation (
+        id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        generation BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+BUMP_GENERATION_SQL = """
+    INSERT INTO data_generation (id, generation, updated_at)
+    VALUES (1, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (id) DO UPDATE
+    SET generation = data_generation.generation + 1, updated_at = CURRENT_TIMESTAMP
+"""
+
+
+CREATE_REGION_GENERATION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS region_generation (
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        start_value BIGINT NOT NULL,
+        end_value BIGINT NOT NULL,
+        generation BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (cell_line, chrid, start_value, end_value)
+    )
+"""
+
+BUMP_REGION_GENERATION_SQL = """
+    INSERT INTO region_generation (cell_line, chrid, start_value, end_value)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (cell_line, chrid, start_value, end_value) DO UPDATE
+    SET generation = region_generation.generation + 1, updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def key_region(key):
+    """Region (cell_line:chromosome:start:end) of a region cache key, e.g. GM12878:chr8:127300000:128300000:fq_data"""
+    return ":".join(key.split(":", 4)[:4])
+
+
+def parse_region(region):
+    """(cell_line, chromosome, start, end) of a cell_line:chromosome:start:end region, None if it is not one"""
+    parts = region.split(":")
+    if len(parts) != 4 or not parts[2].isdigit() or not parts[3].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2]), int(parts[3])
+
+
+class DataGeneration:
+    """In-process view of the data_generation row, refreshed lazily from Postgres"""
+
+    def __init__(self, db_conn, refresh_interval=DATA_GENERATION_REFRESH):
+        self.db_conn = db_conn
+        self.refresh_interval = refresh_interval
+        self.generation = 0
+        self.updated_at = datetime.now(timezone.utc).replace(microsecond=0)
+        self.checked_at = 0.0
+        self.lock = Lock()
+
+    def load(self):
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT generation, updated_at FROM data_generation WHERE id = 1")
+                return cur.fetchone()
+
+    def current(self):
+        """Return (generation, updated_at), re-reading the table when the cached value is stale"""
+        if time() - self.checked_at >= self.refresh_interval:
+            with self.lock:
+                if time() - self.checked_at >= self.refresh_interval:
+                    try:
+                        row = self.load()
+                        if row is not None:
+                            self.generation = row[0]
+                            self.updated_at = row[1].replace(tzinfo=timezone.utc)
+                    except Exception as e:
+                        # Keep serving the last known generation while the database is unavailable
+                        print(f"Failed to read data generation: {e}")
+                    self.checked_at = time()
+        return self.generation, self.updated_at
+
+    def bump(self):
+        """Advance the generation, invalidating every generation-stamped cache entry"""
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(BUMP_GENERATION_SQL)
+            conn.commit()
+        self.checked_at = 0.0
+        return self.current()
+
+
+class RegionGenerations:
+    """In-process view of the region_generation rows, refreshed lazily from Postgres like DataGeneration"""
+
+    def __init__(self, db_conn, refresh_interval=DATA_GENERATION_REFRESH):
+        self.db_conn = db_conn
+        self.refresh_interval = refresh_interval
+        # cell_line:chromosome:start:end -> generation, regions never evicted are not in it
+        self.generations = {}
+        self.checked_at = 0.0
+        self.lock = Lock()
+
+    def load(self):
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT cell_line, chrid, start_value, end_value, generation FROM region_generation")
+                return {f"{cell_line}:{chrid}:{start}:{end}": generation for cell_line, chrid, start, end, generation in cur}
+
+    def current(self):
+        if time() - self.checked_at >= self.refresh_interval:
+            with self.lock:
+                if time() - self.checked_at >= self.refresh_interval:
+                    try:
+                        self.generations = self.load()
+                    except Exception as e:
+                        print(f"Failed to read region generations: {e}")
+                    self.checked_at = time()
+        return self.generations
+
+    def of(self, region):
+        """Generation of a region (cell_line:chromosome:start:end), 0 until it is first evicted or purged"""
+        return self.current().get(region, 0)
+
+    def bump(self, regions):
+        """
+        Advance the generation of the regions (cell_line:chromosome:start:end), retiring their entries in
+        the L1, disk and export caches of every worker. Returns the regions bumped.
+        """
+        rows = sorted({row for row in map(parse_region, regions) if row is not None})
+        if not rows:
+            return []
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(BUMP_REGION_GENERATION_SQL, rows)
+            conn.commit()
+        self.checked_at = 0.0
+        return [f"{cell_line}:{chrid}:{start}:{end}" for cell_line, chrid, start, end in rows]
@@ -0,0 +1,225 @@
+"""
+Persistent on-disk L2 cache for derived 3D payloads.
+
+Sits between Redis and Postgres/feather in the lookup chain, so a region whose Redis copy expired
+or was flushed is restored from local disk instead of being decoded again from BYTEA vectors or
+feather files. Files are addressed by the hash of their cache key (and of the generation of its region,
+so a region evicted by the retention job is not served from older files) under a folder per data generation:
+matrices are stored as .npy and read back through mmap, everything else (position records, scalars)
+as JSON. Writes go to a temporary file that is renamed into place, so a reader never sees a partial
+file, and they run on a background thread off the request path. Least recently read files are
+evicted once DISK_CACHE_MAX_BYTES is exceeded; read times are kept in the file mtimes, so the LRU
+order, like the files, survives restarts. The limit holds for the folder as a whole, which every worker
+process (and the async backend) writes to: sizes are taken from the folder itself by a trim on the
+background thread, under a lock file, whenever a process has written TRIM_SHARE of the limit since its
+last trim. Indexing the folder of a new generation is such a trim too, never on the request path.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import numpy as np
+import orjson
+from data_generation import key_region
+
+
+DISK_CACHE_DIR = os.getenv("DISK_CACHE_DIR", "./disk_cache")
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+DISK_CACHE_ENABLED = os.getenv("DISK_CACHE_ENABLED", "true").lower() == "true"
+# Share of max_bytes a process writes before it scans the folder and evicts again, the other
+# processes' writes are only seen by a scan
+TRIM_SHARE = 0.05
+
+
+class DiskCache:
+    def __init__(self, generation=None, directory=DISK_CACHE_DIR, max_bytes=DISK_CACHE_MAX_BYTES, enabled=DISK_CACHE_ENABLED,
+                 region_generations=None):
+        self.generation = generation
+        self.region_generations = region_generations
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        # path -> size, least recently used first
+        self.files = OrderedDict()
+        self.nbytes = 0
+        self.cached_generation = None
+        # Bytes this process wrote since its last trim, and whether a trim is queued
+        self.unaccounted = 0
+        self.trim_queued = False
+        self.lock = Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache-writer")
+        self.counts = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def generation_directory(self, generation):
+        return os.path.join(self.directory, f"g{generation}")
+
+    def check_generation(self):
+        """Switch to the folder of the current generation, a trim indexes what an earlier run left there"""
+        current = self.generation.current()[0] if self.generation is not None else 0
+        if current == self.cached_generation:
+            return
+        self.cached_generation = current
+        self.files.clear()
+        self.nbytes = 0
+
+        current_directory = self.generation_directory(current)
+        os.makedirs(current_directory, exist_ok=True)
+        stale = [
+            entry.path for entry in os.scandir(self.directory)
+            if entry.is_dir() and entry.path != current_directory
+        ]
+        for path in stale:
+            # Files of older generations can never be read again
+            self.writer.submit(shutil.rmtree, path, True)
+        self.queue_trim()
+
+    def queue_trim(self):
+        """Called with self.lock held"""
+        if not self.trim_queued:
+            self.trim_queued = True
+            self.writer.submit(self.trim)
+
+    def trim(self):
+        """
+        Index the files of the current generation's folder and evict the least recently read ones
+        over max_bytes, under a lock file so the processes sharing the folder do not evict at once
+        """
+        with self.lock:
+            generation = self.cached_generation
+            self.trim_queued = False
+            self.unaccounted = 0
+        directory = self.generation_directory(generation)
+
+        evicted = 0
+        with open(os.path.join(self.directory, ".trim.lock"), "wb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            found = []
+            for root, _, names in os.walk(directory):
+                for name in names:
+                    if name.startswith("."):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+            found.sort()
+            total = sum(size for _, _, size in found)
+            while total > self.max_bytes and len(found) > 1:
+                _, path, size = found.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+
+        with self.lock:
+            self.counts["evictions"] += evicted
+            if generation == self.cached_generation:
+                self.files = OrderedDict((path, size) for _, path, size in found)
+                self.nbytes = total
+
+    def region_of(self, key):
+        return key_region(key)
+
+    def path(self, key, extension):
+        if self.region_generations is not None:
+            region_generation = self.region_generations.of(self.region_of(key))
+            if region_generation:
+                key = f"{key}#{region_generation}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.generation_directory(self.cached_generation), digest[:2], f"{digest}{extension}")
+
+    def get(self, key):
+        """Return (value, file size) with matrices memory-mapped read-only, or (None, 0)"""
+        if not self.enabled:
+            return None, 0
+        with self.lock:
+            self.check_generation()
+            candidates = [self.path(key, ".npy"), self.path(key, ".json")]
+
+        for path in candidates:
+            try:
+                if path.endswith(".npy"):
+                    # A plain ndarray view of the mapping, which orjson serializes like any other array
+                    value = np.asarray(np.load(path, mmap_mode="r"))
+                    size = value.nbytes
+                else:
+                    with open(path, "rb") as f:
+                        blob = f.read()
+                    value, size = orjson.loads(blob), len(blob)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                print(f"Failed to read disk cache file {path}: {e}")
+                continue
+
+            with self.lock:
+                if path in self.files:
+                    self.files.move_to_end(path)
+                self.counts["hits"] += 1
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return value, size
+
+        with self.lock:
+            self.counts["misses"] += 1
+        return None, 0
+
+    def put(self, key, value):
+        """Queue a value for writing, matrices as .npy and anything else as JSON"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.check_generation()
+            path = self.path(key, ".npy" if isinstance(value, np.ndarray) else ".json")
+        self.writer.submit(self.write, path, value)
+
+    def write(self, path, value):
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(value, np.ndarray):
+                    np.save(f, value, allow_pickle=False)
+                else:
+                    f.write(orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY))
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            print(f"Failed to write disk cache file {path}: {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.add_file(path, size)
+
+    def add_file(self, path, size):
+        """Account for a file just renamed into place, trimming the folder once enough was written"""
+        with self.lock:
+            self.nbytes -= self.files.pop(path, 0)
+            self.files[path] = size
+            self.nbytes += size
+            self.unaccounted += size
+            self.counts["writes"] += 1
+            if self.nbytes > self.max_bytes or self.unaccounted >= self.max_bytes * TRIM_SHARE:
+                self.queue_trim()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                self.counts,
+                enabled=self.enabled,
+                entries=len(self.files),
+                bytes=self.nbytes,
+                max_bytes=self.max_bytes,
+            )
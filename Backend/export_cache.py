@@ -0,0 +1,132 @@
+"""
+Content-addressed cache of the generated ensemble downloads.
+
+An export is addressed by what it contains: region, kind, sample / bead selection, format and
+encoding, under the folder of the data generation it was built from, so a data reload retires every
+cached export at once, and by the generation of its region, which the retention job bumps. The first
+download of an export writes it at database speed into a temporary file that is renamed into place
+once complete, so its connection and snapshot are not held while a slow client downloads. Every
+download, the first included, is then a plain send_file response with a length, conditional and
+Range support, which costs only disk I/O. A per-export lock file makes the build single-flight across
+threads and worker processes: concurrent downloads of an export that is being built wait for it and
+are then served from disk. Files are evicted least recently used once EXPORT_CACHE_MAX_BYTES is
+exceeded. With the cache disabled there is no file to build, and an export streams straight from its
+query into the response.
+"""
+import fcntl
+import os
+import tempfile
+from disk_cache import DiskCache
+
+
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "./export_cache")
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+EXPORT_CACHE_ENABLED = os.getenv("EXPORT_CACHE_ENABLED", "true").lower() == "true"
+
+
+def export_key(kind, cell_line, chromosome_name, sequences, is_example, export_format, encoding="identity", selection=None):
+    """selection is the canonical sample / bead selection of a sub-selection export, see exports.selection_key()"""
+    key = f"{kind}:{cell_line}:{chromosome_name}:{sequences['start']}:{sequences['end']}:{int(bool(is_example))}:{export_format}:{encoding}"
+    if selection is not None and selection != "all:all":
+        key += f":{selection}"
+    return key
+
+
+class ExportCache(DiskCache):
+    def __init__(self, generation=None, directory=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES, enabled=EXPORT_CACHE_ENABLED,
+                 region_generations=None):
+        super().__init__(generation, directory, max_bytes, enabled, region_generations)
+
+    def region_of(self, key):
+        # kind:cell_line:chromosome:start:end:...
+        return ":".join(key.split(":", 5)[1:5])
+
+    def lookup(self, path):
+        """Mark a cached file as used, returns False if it is not there (any more)"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            if path in self.files:
+                self.files.move_to_end(path)
+            self.counts["hits"] += 1
+        return True
+
+    def etag(self, path):
+        """Strong ETag of a cached export: its generation and content key, the bytes of a rebuild are identical"""
+        generation = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        return f"{generation}-{os.path.basename(path)}"
+
+    def fetch(self, key, extension, produce):
+        """
+        Returns (path, None) once the export is cached, building it first if needed. produce() returns
+        the chunks of the export, or None if there is nothing to export, which is returned as (None, None).
+        With the cache disabled (None, chunks) is returned, the chunks of produce() to stream as they come.
+        """
+        if not self.enabled:
+            return None, produce()
+
+        with self.lock:
+            self.check_generation()
+            path = self.path(key, extension)
+        if self.lookup(path):
+            return path, None
+
+        directory, name = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        # Waits while another request or worker builds the same export
+        lock_file = self.acquire(os.path.join(directory, f".{name}.lock"))
+        try:
+            if self.lookup(path):
+                return path, None
+
+            with self.lock:
+                self.counts["misses"] += 1
+            chunks = produce()
+            if chunks is None:
+                return None, None
+            self.build(path, chunks)
+            return path, None
+        finally:
+            self.release(lock_file)
+
+    def build(self, path, chunks):
+        """Write the chunks to the cache, the file only appears once the export is complete"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temp_path, path)
+            temp_path = None
+            self.add_file(path, os.path.getsize(path))
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                # The build failed, the next download starts over
+                os.remove(temp_path)
+
+    def acquire(self, lock_path):
+        """
+        Open and lock the lock file of an export. The holder unlinks it on release, so a waiter that
+        got the lock of an unlinked file retries on the file now at lock_path, or two builds would run.
+        """
+        while True:
+            lock_file = open(lock_path, "wb")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def release(self, lock_file):
+        # Unlinked while still locked, waiters on this inode notice and retry in acquire()
+        try:
+            os.remove(lock_file.name)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
@@ -0,0 +1,292 @@
+"""
+Streaming file exports.
+
+The containers are written chunk by chunk as the rows arrive, so an export holds one batch of rows
+in memory at a time. With the export cache enabled the chunks are written into the cache at database
+speed and sent from there; without it they go straight into the response body, with no temporary
+file, and the download starts before the last row has been read from Postgres.
+"""
+import io
+import math
+import os
+import zipfile
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Text exports are gzip-compressed on the fly for clients that accept it
+EXPORT_GZIP = os.getenv("EXPORT_GZIP", "true").lower() == "true"
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+# Columnar exports: codec of the Parquet pages / Arrow IPC buffers, and samples per row group / record batch
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+EXPORT_BATCH_SAMPLES = int(os.getenv("EXPORT_BATCH_SAMPLES", 100))
+# Bounds on the connection of an export that streams to a slow client: the longest pause between two
+# reads of its rows before Postgres ends the session, and the longest a single query (a COPY included) may run
+EXPORT_IDLE_TIMEOUT_MS = int(os.getenv("EXPORT_IDLE_TIMEOUT_MS", 30_000))
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", 600_000))
+# Samples of a folded ensemble (sBIF.sh -ns), the sample ids of a selection are below it
+ENSEMBLE_SAMPLES = int(os.getenv("ENSEMBLE_SAMPLES", 5000))
+
+# format -> (mimetype, file extension)
+COLUMNAR_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", ".arrow"),
+}
+EXPORT_FILE_TYPES = {
+    "npz": ("application/zip", ".npz"),
+    "csv": ("text/csv", ".csv"),
+    **COLUMNAR_FORMATS,
+}
+
+POSITION_SCHEMA = pa.schema([
+    ("pid", pa.int32()),
+    ("cell_line", pa.dictionary(pa.int32(), pa.string())),
+    ("chrid", pa.dictionary(pa.int32(), pa.string())),
+    ("sampleid", pa.int32()),
+    ("start_value", pa.int64()),
+    ("end_value", pa.int64()),
+    ("x", pa.float64()),
+    ("y", pa.float64()),
+    ("z", pa.float64()),
+    ("insert_time", pa.timestamp("us")),
+])
+
+
+def parse_samples(value, n_samples=ENSEMBLE_SAMPLES):
+    """
+    Sample ids to export: a list of ids, or a string of ids and inclusive ranges such as "0-199,250",
+    all below n_samples. Returns them sorted and unique, or None (all samples) for an empty value.
+    Raises ValueError for anything else.
+    """
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        ids = set()
+        for part in value.split(","):
+            first, _, last = part.strip().partition("-")
+            first = int(first)
+            last = int(last) if last else first
+            # Checked before range(), a wide range would be built in full
+            if first < 0 or last < first or last >= n_samples:
+                raise ValueError(f"Invalid sample range: {part.strip()}, sample ids go from 0 to {n_samples - 1}")
+            ids.update(range(first, last + 1))
+        return sorted(ids)
+    if isinstance(value, list) and all(isinstance(sampleid, int) and not isinstance(sampleid, bool) for sampleid in value):
+        if any(sampleid < 0 or sampleid >= n_samples for sampleid in value):
+            raise ValueError(f"Invalid samples, sample ids go from 0 to {n_samples - 1}")
+        return sorted(set(value))
+    raise ValueError(f"Invalid samples: {value!r}")
+
+
+def parse_beads(value):
+    """
+    Inclusive (first, last) bead index range to export, from [first, last] or "first-last".
+    Returns None (all beads) for an empty value, raises ValueError for anything else.
+    """
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        bounds = value.split("-")
+    elif isinstance(value, list):
+        bounds = value
+    else:
+        bounds = ()
+    if len(bounds) != 2:
+        raise ValueError(f"Invalid bead range: {value!r}")
+    first, last = (int(bound) for bound in bounds)
+    if first < 0 or last <= first:
+        raise ValueError(f"Invalid bead range: {value!r}, it needs at least two beads")
+    return first, last
+
+
+def selection_key(samples, beads):
+    """Canonical text of a selection for the export key, ids are compacted back into ranges"""
+    if samples is None:
+        sample_text = "all"
+    else:
+        ranges, start = [], 0
+        for i in range(1, len(samples) + 1):
+            if i == len(samples) or samples[i] != samples[i - 1] + 1:
+                ranges.append(str(samples[start]) if i - 1 == start else f"{samples[start]}-{samples[i - 1]}")
+                start = i
+        sample_text = ",".join(ranges)
+    bead_text = "all" if beads is None else f"{beads[0]}-{beads[1]}"
+    return f"{sample_text}:{bead_text}"
+
+
+def condensed_beads(vector_length):
+    """Number of beads of a condensed distance vector of the given length, n * (n - 1) / 2 entries"""
+    n_beads = (1 + math.isqrt(1 + 8 * vector_length)) // 2
+    if n_beads * (n_beads - 1) // 2 != vector_length:
+        raise ValueError(f"{vector_length} is not the length of a condensed distance vector")
+    return n_beads
+
+
+def condensed_block(n_beads, first, last):
+    """
+    Locate the condensed vector of beads first..last (inclusive) inside the condensed vector of all
+    n_beads beads, without going through the square matrix. Pair (i, j), i < j, sits at
+    n * i - i * (i + 1) / 2 + j - i - 1, so the pairs of bead i within the block are one contiguous
+    run. Returns (offset, length, indexes): the span of the full vector that covers the block, and the
+    positions of the block entries within that span, in condensed order.
+    """
+    def pair(i, j):
+        return n_beads * i - i * (i + 1) // 2 + j - i - 1
+
+    offset = pair(first, first + 1)
+    length = pair(last - 1, last) + 1 - offset
+    indexes = np.concatenate([
+        np.arange(pair(i, i + 1), pair(i, last) + 1) - offset for i in range(first, last)
+    ])
+    return offset, length, indexes
+
+
+class StreamBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that hands out what has been written since the last take()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def npy_header(dtype, shape):
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": tuple(shape)}
+    )
+    return header.getvalue()
+
+
+def npz_stream(name, dtype, shape, batches):
+    """
+    Yield an uncompressed .npz holding a single array `name` of the given dtype and shape, filled
+    from `batches` (arrays of whole rows, in order). The zip is written without seeking, the sizes
+    and checksum of the entry follow its data, so np.load reads the result like any other .npz.
+    Raises ValueError if the batches do not add up to the announced shape.
+    """
+    dtype = np.dtype(dtype)
+    header = npy_header(dtype, shape)
+    # A fixed timestamp keeps the bytes of a rebuilt export identical, as its strong ETag requires
+    info = zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    # Known up front, lets zipfile pick zip64 for exports over 4 GB
+    info.file_size = len(header) + int(np.prod(shape)) * dtype.itemsize
+
+    sink = StreamBuffer()
+    with zipfile.ZipFile(sink, mode="w") as archive:
+        with archive.open(info, mode="w") as entry:
+            entry.write(header)
+            yield sink.take()
+            written = len(header)
+            for batch in batches:
+                data = np.ascontiguousarray(batch, dtype=dtype)
+                entry.write(data.data)
+                written += data.nbytes
+                yield sink.take()
+            if written != info.file_size:
+                raise ValueError(f"{name} has {written - len(header)} data bytes, {info.file_size - len(header)} were announced")
+    yield sink.take()
+
+
+def gzip_stream(chunks, level=EXPORT_GZIP_LEVEL):
+    """Gzip a stream of byte chunks as they come, yielding compressed output as soon as there is some"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def distance_schema(vector_length):
+    return pa.schema([("sampleid", pa.int32()), ("distance", pa.list_(pa.float32(), vector_length))])
+
+
+def distance_record_batch(sampleids, matrix):
+    """One row per sample: its id and its condensed distance vector as a fixed size list"""
+    vectors = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(matrix, dtype=np.float32).ravel()), matrix.shape[1])
+    return pa.record_batch([pa.array(sampleids, type=pa.int32()), vectors], schema=distance_schema(matrix.shape[1]))
+
+
+def rows_record_batch(schema, rows):
+    """Column-wise record batch from row tuples in schema order"""
+    columns = list(zip(*rows))
+    return pa.record_batch(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def sample_batches(chunks, sample_index, samples_per_batch=EXPORT_BATCH_SAMPLES):
+    """Regroup chunks of rows sorted by sample into lists holding `samples_per_batch` whole samples"""
+    batch, samples, last = [], 0, None
+    for rows in chunks:
+        for row in rows:
+            sample = row[sample_index]
+            if sample != last:
+                if samples == samples_per_batch:
+                    yield batch
+                    batch, samples = [], 0
+                samples += 1
+                last = sample
+            batch.append(row)
+    if batch:
+        yield batch
+
+
+def table_sample_batches(table, samples_per_batch=EXPORT_BATCH_SAMPLES):
+    """Record batches of `samples_per_batch` whole samples from a table sorted by sampleid"""
+    sampleids = table["sampleid"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, sampleids[1:] != sampleids[:-1]])
+    bounds = [*starts[::samples_per_batch], len(sampleids)]
+    for start, end in zip(bounds, bounds[1:]):
+        yield from table.slice(start, end - start).combine_chunks().to_batches()
+
+
+def dictionary_schema(schema):
+    """The schema with its string columns dictionary-encoded"""
+    return pa.schema([
+        pa.field(field.name, pa.dictionary(pa.int32(), pa.string())) if pa.types.is_string(field.type) else field
+        for field in schema
+    ])
+
+
+def columnar_stream(export_format, schema, batches, compression=EXPORT_COMPRESSION):
+    """
+    Yield a Parquet or Arrow IPC file written batch by batch: every record batch becomes one
+    Parquet row group or one Arrow record batch, so the rows keep the order of `batches`.
+    """
+    sink = StreamBuffer()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=compression, use_dictionary=True)
+    else:
+        writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    with writer:
+        yield sink.take()
+        for batch in batches:
+            batch = batch.cast(schema) if batch.schema != schema else batch
+            if export_format == "parquet":
+                writer.write_batch(batch, row_group_size=max(batch.num_rows, 1))
+            else:
+                writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
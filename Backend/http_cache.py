@@ -0,0 +1,195 @@
+"""
+HTTP caching and compression for the /api responses.
+
+Every cacheable route gets a strong ETag derived from the route, its canonical request parameters
+and the current data generation (and, for a request about a region, the generation the retention
+job bumps when it evicts the region's ensemble), so a matching If-None-Match is answered with 304
+before the view runs: no Postgres or Redis access. JSON bodies above a size threshold are compressed with brotli or
+gzip depending on Accept-Encoding, and the compressed bytes can optionally be kept in Redis under the
+ETag so the next client without a cached copy skips both the view and the compression.
+"""
+import gzip
+import hashlib
+import os
+from functools import wraps
+import orjson
+from flask import g, request, make_response, Response
+import cache_policy
+from process import data_generation, redis_client, region_generations
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", 300))
+HTTP_COMPRESS_MIN_SIZE = int(os.getenv("HTTP_COMPRESS_MIN_SIZE", 1024))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", 6))
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", 5))
+HTTP_CACHE_STORE_COMPRESSED = os.getenv("HTTP_CACHE_STORE_COMPRESSED", "false").lower() == "true"
+HTTP_CACHE_STORE_MIN_SIZE = int(os.getenv("HTTP_CACHE_STORE_MIN_SIZE", 64 * 1024))
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def request_identity(method, args, body):
+    """Canonical bytes of the request parameters: sorted query args or the sorted JSON body"""
+    if method == "GET":
+        return orjson.dumps(sorted(args.items(multi=True)))
+    return orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+
+
+def request_region(params):
+    """Region (cell_line:chromosome:start:end) named by the JSON body of a request, None if it names none"""
+    if not isinstance(params, dict):
+        return None
+    sequences = params.get("sequences")
+    if "cell_line" not in params or not isinstance(sequences, dict) or "start" not in sequences or "end" not in sequences:
+        return None
+    # The example views default to the example region's chromosome
+    chromosome_name = params.get("chromosome_name", "chr8")
+    return f"{params['cell_line']}:{chromosome_name}:{sequences['start']}:{sequences['end']}"
+
+
+def compute_etag(path, identity, generation):
+    digest = hashlib.sha256()
+    digest.update(path.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(identity)
+    digest.update(b"\0")
+    digest.update(str(generation).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check that also accepts the encoding-suffixed variants of the same ETag"""
+    if not if_none_match:
+        return False
+    variants = [etag] + [f"{etag}-{encoding}" for encoding in SUPPORTED_ENCODINGS]
+    return any(if_none_match.contains_weak(variant) for variant in variants)
+
+
+def negotiate_encoding(accept_encodings):
+    """Pick the best supported content coding from the Accept-Encoding header, or None"""
+    return accept_encodings.best_match(SUPPORTED_ENCODINGS)
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    # A fixed mtime keeps the gzip bytes identical across requests, as a strong ETag requires
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+def make_store_key(etag, encoding):
+    return f"http:{etag}:{encoding}"
+
+
+def apply_cache_headers(response, etag, last_modified, public):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if public:
+        response.headers["Cache-Control"] = f"public, max-age={HTTP_CACHE_MAX_AGE}"
+    else:
+        # POST bodies are not cached by browsers, clients revalidate with If-None-Match
+        response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def http_cached(public=False, on_skip=None):
+    """
+    Mark a view as cacheable for the lifetime of the current data generation. A view whose response must
+    not be reused, e.g. a partial one, sets g.http_cache_no_store.
+    public=True additionally lets browsers and CDNs reuse a GET response for HTTP_CACHE_MAX_AGE seconds.
+    on_skip(params) is called with the JSON body when a 304 or a stored response skips the view, for the
+    bookkeeping the view would have done (e.g. the region access log).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            generation, last_modified = data_generation.current()
+            params = request.get_json(silent=True)
+            identity = request_identity(request.method, request.args, params)
+            region = request_region(params)
+            region_generation = region_generations.of(region) if region is not None else 0
+            if region_generation:
+                generation = f"{generation}.{region_generation}"
+            etag = compute_etag(request.path, identity, generation)
+
+            if etag_matches(request.if_none_match, etag):
+                if on_skip is not None:
+                    on_skip(params)
+                response = Response(status=304)
+                return apply_cache_headers(response, etag, last_modified, public)
+
+            encoding = negotiate_encoding(request.accept_encodings)
+            if HTTP_CACHE_STORE_COMPRESSED and encoding:
+                stored = redis_client.get(make_store_key(etag, encoding))
+                if stored is not None:
+                    if on_skip is not None:
+                        on_skip(params)
+                    response = Response(stored, content_type="application/json")
+                    response.headers["Content-Encoding"] = encoding
+                    apply_cache_headers(response, f"{etag}-{encoding}", last_modified, public)
+                    g.http_cache_compressed = True
+                    return response
+
+            response = make_response(view(*args, **kwargs))
+            if g.get("http_cache_no_store"):
+                response.headers["Cache-Control"] = "no-store"
+            elif response.status_code == 200:
+                apply_cache_headers(response, etag, last_modified, public)
+                g.http_cache_etag = etag
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def compress_response(response):
+    """after_request hook: compress JSON bodies above the size threshold"""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype != "application/json"
+        or g.get("http_cache_compressed")
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < HTTP_COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    compressed = compress(body, encoding)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    # A differently encoded representation needs its own strong validator
+    etag = g.get("http_cache_etag")
+    if etag is not None:
+        response.set_etag(f"{etag}-{encoding}")
+        if HTTP_CACHE_STORE_COMPRESSED and len(body) >= HTTP_CACHE_STORE_MIN_SIZE:
+            key = make_store_key(etag, encoding)
+            # HTTP_CACHE_STORE_TTL is the TTL of the http_response cache family
+            ttl = cache_policy.write_ttl(key, len(compressed))
+            try:
+                if ttl is not None:
+                    redis_client.setex(key, ttl, compressed)
+            except Exception as e:
+                print(f"Failed to store compressed response: {e}")
+
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
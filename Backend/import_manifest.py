@@ -0,0 +1,375 @@
+"""
+Manifest of the imported data files.
+
+init_db.py and insert_new_data.py record every source file they load in import_manifest: its
+SHA-256, size, target table, status and the rows loaded so far. A file is loaded in chunks, each
+committed in one transaction with its manifest update, so an import that crashed resumes after the
+last committed chunk of the file it was loading instead of starting over. A file whose checksum
+matches a complete entry is skipped, also under another path (a new cell line moved from
+new_cell_line/ into Data/). A changed file has the rows of its previous version deleted and is
+loaded again: every entry keeps the scope of its rows, a list of {"table", "where"} filters.
+Entries whose scopes overlap the deleted ones are reloaded with it, as their rows went too.
+
+The checksum is only recomputed when the size or modification time of a file changed, unless
+IMPORT_VERIFY_CHECKSUMS=true.
+
+A database imported before the manifest existed is adopted file by file: a file without an entry
+whose scope already has rows that no entry accounts for is recorded as complete rather than loaded
+a second time, whichever script sees it first.
+
+    python import_manifest.py                  # list the manifest
+    python import_manifest.py --status failed  # only the failed files, with their errors
+"""
+import argparse
+import hashlib
+import json
+import os
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from dotenv import load_dotenv
+
+
+IMPORT_VERIFY_CHECKSUMS = os.getenv("IMPORT_VERIFY_CHECKSUMS", "false").lower() == "true"
+CHECKSUM_BLOCK = 1024 * 1024
+
+CREATE_IMPORT_MANIFEST_SQL = """
+    CREATE TABLE IF NOT EXISTS import_manifest (
+        source_path TEXT PRIMARY KEY,
+        target_table VARCHAR(100) NOT NULL,
+        checksum CHAR(64) NOT NULL,
+        size_bytes BIGINT NOT NULL,
+        modified_ns BIGINT NOT NULL,
+        -- loading, complete or failed
+        status VARCHAR(20) NOT NULL DEFAULT 'loading',
+        chunks_loaded INT NOT NULL DEFAULT 0,
+        -- NULL for the files of an adopted database
+        row_count BIGINT DEFAULT 0,
+        scope JSONB NOT NULL DEFAULT '[]',
+        error TEXT,
+        started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_import_manifest_checksum ON import_manifest (checksum, target_table);
+"""
+
+# Files loaded or replaced by this process, the scripts bump the data generation only when it is not 0
+changed_files = 0
+
+
+def file_checksum(path):
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(path):
+    return os.path.normpath(path)
+
+
+def merge_scopes(*scopes):
+    """Union of scope lists, without duplicates and in a stable order"""
+    merged = {}
+    for scope in scopes:
+        for item in scope:
+            merged.setdefault(json.dumps(item, sort_keys=True), item)
+    return [merged[key] for key in sorted(merged)]
+
+
+def scopes_overlap(first, second):
+    """True when a filter of one scope can select rows of a filter of the other"""
+    for a in first:
+        for b in second:
+            if a["table"] != b["table"]:
+                continue
+            if all(a["where"][column] == b["where"][column] for column in a["where"].keys() & b["where"].keys()):
+                return True
+    return False
+
+
+def scope_filter(item):
+    """WHERE clause and parameters of a scope filter"""
+    columns = sorted(item["where"])
+    if not columns:
+        return sql.SQL(""), []
+    return sql.SQL(" WHERE ") + sql.SQL(" AND ").join(
+        sql.SQL("{} = %s").format(sql.Identifier(column)) for column in columns
+    ), [item["where"][column] for column in columns]
+
+
+def delete_scope(cur, scope):
+    """Delete the rows a scope selects, returns their count"""
+    deleted = 0
+    for item in scope:
+        where, params = scope_filter(item)
+        cur.execute(sql.SQL("DELETE FROM {}").format(sql.Identifier(item["table"])) + where, params)
+        deleted += cur.rowcount
+    return deleted
+
+
+def scope_has_rows(conn, scope):
+    """True when a filter of the scope selects rows of an existing table"""
+    with conn.cursor() as cur:
+        for item in scope:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (item["table"],))
+            if not cur.fetchone()[0]:
+                continue
+            where, params = scope_filter(item)
+            cur.execute(
+                sql.SQL("SELECT EXISTS (SELECT 1 FROM {}").format(sql.Identifier(item["table"])) + where + sql.SQL(")"),
+                params,
+            )
+            if cur.fetchone()[0]:
+                return True
+    return False
+
+
+class FileLoad:
+    """A file to load, from chunk start_chunk on when an earlier import left it partial"""
+
+    def __init__(self, path, target_table, start_chunk=0):
+        self.path = path
+        self.key = source_key(path)
+        self.target_table = target_table
+        self.start_chunk = start_chunk
+
+    def advance(self, cur, rows, scope):
+        """Record a chunk of the file, in the transaction that wrote its rows"""
+        cur.execute(
+            """
+                UPDATE import_manifest
+                SET chunks_loaded = chunks_loaded + 1, row_count = row_count + %s, scope = %s, error = NULL
+                WHERE source_path = %s
+            """,
+            (rows, Jsonb(merge_scopes(self.current_scope(cur), scope)), self.key),
+        )
+
+    def current_scope(self, cur):
+        cur.execute("SELECT scope FROM import_manifest WHERE source_path = %s", (self.key,))
+        return cur.fetchone()[0]
+
+
+class ImportManifest:
+    """The manifest entries of one connection, and the planning and running of file loads"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        with conn.cursor() as cur:
+            cur.execute(CREATE_IMPORT_MANIFEST_SQL)
+        conn.commit()
+
+    def entries(self, cur, target_table):
+        cur.execute("SELECT * FROM import_manifest WHERE target_table = %s", (target_table,))
+        return {row["source_path"]: row for row in cur.fetchall()}
+
+    def reset(self, cur, entries, scope):
+        """Delete the rows of scope and of every entry overlapping it, and mark those entries for loading"""
+        global changed_files
+        pending, scope = list(entries), merge_scopes(scope)
+        while True:
+            overlapping = [entry for entry in pending if scopes_overlap(entry["scope"], scope)]
+            if not overlapping:
+                break
+            for entry in overlapping:
+                pending.remove(entry)
+                scope = merge_scopes(scope, entry["scope"])
+                cur.execute(
+                    """
+                        UPDATE import_manifest
+                        SET status = 'loading', chunks_loaded = 0, row_count = 0, scope = '[]', finished_at = NULL
+                        WHERE source_path = %s
+                    """,
+                    (entry["source_path"],),
+                )
+                print(f"{entry['source_path']} shares rows with a changed file, it will be loaded again.")
+        deleted = delete_scope(cur, scope)
+        if deleted:
+            changed_files += 1
+            print(f"Deleted {deleted} rows of the previous versions.")
+
+    def plan(self, target_table, paths, scope_of=None, has_data=None):
+        """
+        The FileLoads of paths that are new, changed or partial. A file without an entry is adopted
+        when its scope scope_of(path) already has rows that no entry of the target accounts for: its
+        data predates the manifest. has_data() is a cheaper check of the whole target that skips the
+        scopes when there is nothing to adopt.
+        """
+        with self.conn.cursor(row_factory=dict_row) as cur:
+            entries = self.entries(cur, target_table)
+            may_adopt = None
+            for path in paths:
+                key = source_key(path)
+                stat = os.stat(path)
+                entry = entries.get(key)
+                unchanged = entry is not None and entry["size_bytes"] == stat.st_size and \
+                    entry["modified_ns"] == stat.st_mtime_ns
+                checksum = entry["checksum"] if unchanged and not IMPORT_VERIFY_CHECKSUMS else file_checksum(path)
+
+                if entry is not None and entry["checksum"] == checksum:
+                    if entry["status"] == "complete":
+                        print(f"{key} is already imported, skipping.")
+                    else:
+                        print(f"{key} was left {entry['status']} after {entry['chunks_loaded']} chunks, resuming.")
+                    cur.execute(
+                        "UPDATE import_manifest SET size_bytes = %s, modified_ns = %s WHERE source_path = %s",
+                        (stat.st_size, stat.st_mtime_ns, key),
+                    )
+                    continue
+
+                if entry is not None:
+                    print(f"{key} changed since it was imported, replacing its rows.")
+                    others = [other for other in entries.values() if other["source_path"] != key]
+                    self.reset(cur, others, entry["scope"])
+                    entries = self.entries(cur, target_table)
+                    cur.execute(
+                        """
+                            UPDATE import_manifest
+                            SET checksum = %s, size_bytes = %s, modified_ns = %s, status = 'loading',
+                                chunks_loaded = 0, row_count = 0, scope = '[]', error = NULL,
+                                started_at = CURRENT_TIMESTAMP, finished_at = NULL
+                            WHERE source_path = %s
+                        """,
+                        (checksum, stat.st_size, stat.st_mtime_ns, key),
+                    )
+                    self.conn.commit()
+                    continue
+
+                cur.execute(
+                    """
+                        SELECT row_count, scope FROM import_manifest
+                        WHERE checksum = %s AND target_table = %s AND status = 'complete'
+                        LIMIT 1
+                    """,
+                    (checksum, target_table),
+                )
+                same = cur.fetchone()
+                adopted = None
+                if same is None and scope_of is not None:
+                    if may_adopt is None:
+                        may_adopt = has_data is None or has_data()
+                    if may_adopt:
+                        scope = scope_of(path)
+                        # Rows a file loaded through the manifest are no sign of an earlier import of this one,
+                        # the overlapping files of an adopted import are adopted alike (their row_count is NULL)
+                        loaded = [other for other in entries.values() if other["row_count"] is not None]
+                        if not any(scopes_overlap(scope, other["scope"]) for other in loaded) and \
+                                scope_has_rows(self.conn, scope):
+                            adopted = scope
+                if same is not None or adopted is not None:
+                    row_count, scope = (same["row_count"], same["scope"]) if same is not None else (None, adopted)
+                    cur.execute(
+                        """
+                            INSERT INTO import_manifest
+                                (source_path, target_table, checksum, size_bytes, modified_ns, status, row_count, scope, finished_at)
+                            VALUES (%s, %s, %s, %s, %s, 'complete', %s, %s, CURRENT_TIMESTAMP)
+                        """,
+                        (key, target_table, checksum, stat.st_size, stat.st_mtime_ns, row_count, Jsonb(scope)),
+                    )
+                    if same is not None:
+                        print(f"{key} is already in {target_table}, recorded as imported.")
+                    else:
+                        print(f"{key} was imported before the import manifest, adopted.")
+                    continue
+
+                cur.execute(
+                    """
+                        INSERT INTO import_manifest (source_path, target_table, checksum, size_bytes, modified_ns)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    (key, target_table, checksum, stat.st_size, stat.st_mtime_ns),
+                )
+
+            # Read back, a changed file may have reset the entries of files planned before it
+            entries = self.entries(cur, target_table)
+            keys = [source_key(path) for path in paths]
+            listed = set(keys)
+            keys += sorted(key for key in entries if key not in listed)
+            loads = []
+            for key in keys:
+                entry = entries[key]
+                if entry["status"] == "complete":
+                    continue
+                if os.path.exists(key):
+                    loads.append(FileLoad(key, target_table, entry["chunks_loaded"]))
+                else:
+                    print(f"{key} is {entry['status']} but missing, it is loaded once it is back.")
+        self.conn.commit()
+        return loads
+
+    def run(self, load, load_file):
+        """
+        Load a file with load_file(cur, path, start_chunk), a generator that writes a chunk and yields
+        its (rows, scope), skipping the chunks before start_chunk. Every chunk is committed with its
+        manifest update. Returns the rows loaded, None when the load failed.
+        """
+        global changed_files
+        rows_loaded = 0
+        with self.conn.cursor() as cur:
+            try:
+                for rows, scope in load_file(cur, load.path, load.start_chunk):
+                    load.advance(cur, rows, scope)
+                    self.conn.commit()
+                    rows_loaded += rows
+                cur.execute(
+                    "UPDATE import_manifest SET status = 'complete', finished_at = CURRENT_TIMESTAMP WHERE source_path = %s",
+                    (load.key,),
+                )
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                cur.execute(
+                    "UPDATE import_manifest SET status = 'failed', error = %s WHERE source_path = %s",
+                    (str(e), load.key),
+                )
+                self.conn.commit()
+                print(f"Error importing {load.key}: {e}")
+                return None
+        changed_files += 1
+        print(f"{load.key}: {rows_loaded} rows imported into {load.target_table}.")
+        return rows_loaded
+
+    def load(self, target_table, paths, load_file, scope_of=None, has_data=None):
+        """Plan and run the loads of paths, returns the number of files loaded"""
+        loaded = 0
+        for load in self.plan(target_table, paths, scope_of, has_data):
+            if self.run(load, load_file) is not None:
+                loaded += 1
+        return loaded
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", choices=["loading", "complete", "failed"])
+    args = parser.parse_args()
+
+    # Runs in the data-importer container, which has the database settings only
+    with psycopg.connect(
+        host=os.getenv("DB_HOST"), user=os.getenv("DB_USERNAME"), password=os.getenv("DB_PASSWORD"),
+        dbname=os.getenv("DB_NAME"),
+    ) as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(
+                """
+                    SELECT source_path, target_table, status, chunks_loaded, row_count, left(checksum, 12) AS checksum,
+                           finished_at, error
+                    FROM import_manifest
+                    WHERE %(status)s::text IS NULL OR status = %(status)s
+                    ORDER BY target_table, source_path
+                """,
+                {"status": args.status},
+            )
+            for row in cur.fetchall():
+                rows = "adopted" if row["row_count"] is None else f"{row['row_count']} rows"
+                print(f"{row['status']:<9} {row['target_table']:<16} {row['source_path']}  {rows}, "
+                      f"{row['chunks_loaded']} chunks, sha256 {row['checksum']}, {row['finished_at'] or '-'}")
+                if row["error"]:
+                    print(f"          {row['error']}")
+
+
+if __name__ == "__main__":
+    main()
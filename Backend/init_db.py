@@ -6,6 +6,11 @@ from psycopg import sql
 import pandas as pd
 from dotenv import load_dotenv
 from cell_line_labels import label_mapping
+from data_generation import CREATE_GENERATION_TABLE_SQL, BUMP_GENERATION_SQL, CREATE_REGION_GENERATION_TABLE_SQL
+from region_requests import CREATE_REGION_REQUESTS_SQL, CREATE_PREFOLD_REGIONS_SQL
+from region_retention import CREATE_POSITION_SQL, CREATE_DISTANCE_SQL, CREATE_REGION_ACCESS_SQL
+import import_manifest
+from import_manifest import ImportManifest
 
 
 load_dotenv()
@@ -211,20 +216,8 @@ def initialize_tables():
 
     if not table_exists(cur, "position"):
         print("Creating position table...")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS position ("
-            "pid serial PRIMARY KEY,"
-            "cell_line VARCHAR(50) NOT NULL,"
-            "chrid VARCHAR(50) NOT NULL,"
-            "sampleid INT NOT NULL DEFAULT 0,"
-            "start_value BIGINT NOT NULL DEFAULT 0,"
-            "end_value BIGINT NOT NULL DEFAULT 0,"
-            "X FLOAT NOT NULL DEFAULT 0.0,"
-            "Y FLOAT NOT NULL DEFAULT 0.0,"
-            "Z FLOAT NOT NULL DEFAULT 0.0,"
-            "insert_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
-            ");"
-        )
+        # Partitioned by region, see region_retention.py
+        cur.execute(CREATE_POSITION_SQL)
         conn.commit()
         print("position table created successfully.")
     else:
@@ -232,20 +225,7 @@ def initialize_tables():
 
     if not table_exists(cur, "distance"):
         print("Creating distance table...")
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS distance ("
-            "did Serial PRIMARY KEY,"
-            "cell_line VARCHAR(50) NOT NULL,"
-            "chrid VARCHAR(50) NOT NULL,"
-            "sampleid INT NOT NULL DEFAULT 0,"
-            "start_value BIGINT NOT NULL DEFAULT 0,"
-            "end_value BIGINT NOT NULL DEFAULT 0,"
-            "n_beads INT NOT NULL,"
-            "distance_vector BYTEA NOT NULL,"
-            "insert_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
-            "UNIQUE(cell_line, chrid, sampleid, start_value, end_value, n_beads)"
-            ");"
-        )
+        cur.execute(CREATE_DISTANCE_SQL)
         conn.commit()
         print("distance table created successfully.")
     else:
@@ -273,6 +253,46 @@ def initialize_tables():
     else:
         print("calc_distance table already exists, skipping creation.")
 
+    if not table_exists(cur, "data_generation"):
+        print("Creating data_generation table...")
+        cur.execute(CREATE_GENERATION_TABLE_SQL)
+        conn.commit()
+        print("data_generation table created successfully.")
+    else:
+        print("data_generation table already exists, skipping creation.")
+
+    if not table_exists(cur, "region_generation"):
+        print("Creating region_generation table...")
+        cur.execute(CREATE_REGION_GENERATION_TABLE_SQL)
+        conn.commit()
+        print("region_generation table created successfully.")
+    else:
+        print("region_generation table already exists, skipping creation.")
+
+    if not table_exists(cur, "region_requests"):
+        print("Creating region_requests table...")
+        cur.execute(CREATE_REGION_REQUESTS_SQL)
+        conn.commit()
+        print("region_requests table created successfully.")
+    else:
+        print("region_requests table already exists, skipping creation.")
+
+    if not table_exists(cur, "region_access"):
+        print("Creating region_access table...")
+        cur.execute(CREATE_REGION_ACCESS_SQL)
+        conn.commit()
+        print("region_access table created successfully.")
+    else:
+        print("region_access table already exists, skipping creation.")
+
+    if not table_exists(cur, "prefold_regions"):
+        print("Creating prefold_regions table...")
+        cur.execute(CREATE_PREFOLD_REGIONS_SQL)
+        conn.commit()
+        print("prefold_regions table created successfully.")
+    else:
+        print("prefold_regions table already exists, skipping creation.")
+
     if not table_exists(cur, "gse"):
         print("Creating gse table...")
         cur.execute(
@@ -297,21 +317,26 @@ def initialize_tables():
     conn.close()
 
 
-def process_chromosome_data(cur, file_path):
-    """Process and insert chromosome data from the specified file."""
+def process_chromosome_data(cur, file_path, start_chunk=0):
+    """Insert or update the chromosome sizes of the specified file. Rows are never deleted, the cell line tables reference them."""
+    if start_chunk:
+        return
     with open(file_path, "r") as f:
         data_to_insert = []
-        query = "INSERT INTO chromosome (chrid, size) VALUES (%s, %s);"
+        query = "INSERT INTO chromosome (chrid, size) VALUES (%s, %s) ON CONFLICT (chrid) DO UPDATE SET size = EXCLUDED.size;"
         for line in f:
             # Split each line by tab and strip extra spaces/newlines
             data = line.strip().split("\t")
             data_to_insert.append((data[0], int(data[1])))
 
         cur.executemany(query, data_to_insert)
+    yield len(data_to_insert), []
 
 
-def process_gene_data(cur, file_path):
+def process_gene_data(cur, file_path, start_chunk=0):
     """Process and insert gene data from the specified file."""
+    if start_chunk:
+        return
     gene_df = pd.read_csv(file_path, sep="\t")
     gene_df = gene_df[["Chromosome", "Begin", "End", "Orientation", "Symbol"]]
 
@@ -324,72 +349,85 @@ def process_gene_data(cur, file_path):
     ].values.tolist()
 
     cur.executemany(query, data_to_insert)
+    yield len(data_to_insert), gene_scope(file_path)
 
 
-def process_non_random_hic_data(chromosome_dir):
-    """Process and insert data into separate cell line tables"""
-    for file_name in os.listdir(chromosome_dir):
-        if not file_name.endswith(".csv.gz"):
-            continue
+def gene_scope(file_path):
+    """The gene list is a single file, its rows are the whole table"""
+    return [{"table": "gene", "where": {}}]
+
 
-        file_path = os.path.join(chromosome_dir, file_name)
-        print(f"Processing file: {file_name}")
+def process_non_random_hic_data(cur, file_path, start_chunk=0):
+    """Insert a Hi-C file into the separate cell line tables, one chunk of 100000 rows at a time"""
+    file_name = os.path.basename(file_path)
+    print(f"Processing file: {file_name}")
 
-        for chunk in pd.read_csv(
+    for index, chunk in enumerate(
+        pd.read_csv(
             file_path,
             usecols=["chr", "ibp", "jbp", "fq", "fdr", "rawc", "cell_line"],
             chunksize=100000,
             compression="gzip",
-        ):
-            chunk.rename(columns={"chr": "chrid"}, inplace=True)
-
-            # Group by cell line and insert into separate tables
-            for cell_line, group in chunk.groupby("cell_line"):
-                if cell_line not in label_mapping:
-                    print(
-                        f"Warning: Cell line '{cell_line}' not found in label_mapping. Skipping."
-                    )
-                    continue
-
-                table_name = get_cell_line_table_name(cell_line)
-
-                # Remove cell_line column since it's redundant in separate tables
-                group_data = group[["chrid", "ibp", "jbp", "fq", "fdr", "rawc"]]
-
-                buffer = StringIO()
-                group_data.to_csv(buffer, sep="\t", index=False, header=False)
-                buffer.seek(0)
-
-                conn = get_db_connection(database=DB_NAME)
-                cur = conn.cursor()
-
-                copy_sql = sql.SQL(
-                    "COPY {} ({}) FROM STDIN WITH (FORMAT text, DELIMITER E'\\t')"
-                ).format(
-                    sql.Identifier(table_name),
-                    sql.SQL(", ").join(
-                        [
-                            sql.Identifier(col)
-                            for col in ("chrid", "ibp", "jbp", "fq", "fdr", "rawc")
-                        ]
-                    ),
+        )
+    ):
+        # Committed by an earlier, interrupted import
+        if index < start_chunk:
+            continue
+        chunk.rename(columns={"chr": "chrid"}, inplace=True)
+        rows, scope = 0, []
+
+        # Group by cell line and insert into separate tables
+        for cell_line, group in chunk.groupby("cell_line"):
+            if cell_line not in label_mapping:
+                print(
+                    f"Warning: Cell line '{cell_line}' not found in label_mapping. Skipping."
                 )
+                continue
+
+            table_name = get_cell_line_table_name(cell_line)
+
+            # Remove cell_line column since it's redundant in separate tables
+            group_data = group[["chrid", "ibp", "jbp", "fq", "fdr", "rawc"]]
+
+            buffer = StringIO()
+            group_data.to_csv(buffer, sep="\t", index=False, header=False)
+            buffer.seek(0)
+
+            copy_sql = sql.SQL(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT text, DELIMITER E'\\t')"
+            ).format(
+                sql.Identifier(table_name),
+                sql.SQL(", ").join(
+                    [
+                        sql.Identifier(col)
+                        for col in ("chrid", "ibp", "jbp", "fq", "fdr", "rawc")
+                    ]
+                ),
+            )
+
+            with cur.copy(copy_sql) as copy:
+                data_str = buffer.getvalue()
+                copy.write(data_str.encode("utf-8"))
+
+            print(
+                f"Inserted {len(group_data)} records into {table_name} from {file_name}."
+            )
+            rows += len(group_data)
+            scope += [{"table": table_name, "where": {"chrid": chrid}} for chrid in group_data["chrid"].unique()]
 
-                try:
-                    with cur.copy(copy_sql) as copy:
-                        data_str = buffer.getvalue()
-                        copy.write(data_str.encode("utf-8"))
+        yield rows, scope
 
-                    conn.commit()
-                    print(
-                        f"Inserted {len(group_data)} records into {table_name} from {file_name}."
-                    )
-                except Exception as e:
-                    print(f"Error inserting data into {table_name}: {e}")
-                    conn.rollback()
-                finally:
-                    cur.close()
-                    conn.close()
+
+def non_random_hic_scope(file_path):
+    """(cell line table, chromosome) pairs of a Hi-C file, read without loading it"""
+    scope = set()
+    for chunk in pd.read_csv(
+        file_path, usecols=["chr", "cell_line"], chunksize=1000000, compression="gzip"
+    ):
+        for cell_line, chrid in chunk.drop_duplicates().itertuples(index=False):
+            if cell_line in label_mapping:
+                scope.add((get_cell_line_table_name(cell_line), chrid))
+    return [{"table": table_name, "where": {"chrid": chrid}} for table_name, chrid in sorted(scope)]
 
 
 # def process_epigenetic_track_data(cur):
@@ -446,221 +484,259 @@ def process_sequence_data(cur):
             cur.executemany(query, data_to_insert)
 
 
-def process_valid_regions_data(cur):
-    """Process and insert valid regions data from all CSV files in the specified folder."""
-    folder_path = os.path.join(ROOT_DIR, "valid_regions")
-    for filename in os.listdir(folder_path):
-        # check if the file is a CSV.gz file
-        if filename.endswith(".csv.gz"):
-            file_path = os.path.join(folder_path, filename)
-            try:
-                df = pd.read_csv(
-                    file_path,
-                    usecols=["chrID", "cell_line", "start_value", "end_value"],
-                )
+def read_valid_regions(file_path):
+    return pd.read_csv(
+        file_path,
+        usecols=["chrID", "cell_line", "start_value", "end_value"],
+    )[["chrID", "cell_line", "start_value", "end_value"]]
 
-                df = df[["chrID", "cell_line", "start_value", "end_value"]]
 
-                query = """
-                    INSERT INTO valid_regions (chrid, cell_line, start_value, end_value)
-                    VALUES (%s, %s, %s, %s);
-                """
+def valid_regions_scope(file_path, df=None):
+    """(cell line, chromosome) pairs of a valid regions file"""
+    if df is None:
+        df = read_valid_regions(file_path)
+    pairs = df[["cell_line", "chrID"]].drop_duplicates().itertuples(index=False)
+    return [{"table": "valid_regions", "where": {"cell_line": cell_line, "chrid": chrid}} for cell_line, chrid in pairs]
 
-                data_to_insert = df.to_records(index=False).tolist()
-                cur.executemany(query, data_to_insert)
 
-                print(f"{filename}, inserted {len(df)} records")
-            except Exception as e:
-                print(f"file {filename} error: {e}")
+def process_valid_regions_data(cur, file_path, start_chunk=0):
+    """Process and insert the valid regions of a CSV file."""
+    if start_chunk:
+        return
+    df = read_valid_regions(file_path)
 
+    query = """
+        INSERT INTO valid_regions (chrid, cell_line, start_value, end_value)
+        VALUES (%s, %s, %s, %s);
+    """
 
-def process_bintu_data(cur):
-    """Process and insert Bintu data from all CSV files in the Bintu folder."""
-    folder_path = os.path.join(ROOT_DIR, "Bintu")
+    data_to_insert = df.to_records(index=False).tolist()
+    cur.executemany(query, data_to_insert)
 
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".csv"):
-            file_path = os.path.join(folder_path, filename)
+    print(f"{os.path.basename(file_path)}, inserted {len(df)} records")
+    yield len(df), valid_regions_scope(file_path, df)
 
-            try:
-                # Parse filename to extract metadata
-                # Format: {cell_line}_chr{chrid}-{start}-{end}Mb.csv or similar
-                base_name = filename.replace(".csv", "")
-                print(f"Processing file: {filename}")
 
-                # Handle special cases like HCT116_chr21-28-30Mb_untreated.csv
-                if "_untreated" in base_name:
-                    base_name = base_name.replace("_untreated", "")
+def parse_bintu_file_name(filename):
+    """(cell_line, chrid, start_value, end_value) of a Bintu file name"""
+    # Format: {cell_line}_chr{chrid}-{start}-{end}Mb.csv or similar
+    base_name = filename.replace(".csv", "")
 
-                parts = base_name.split("_")
-                cell_line = parts[0]
+    # Handle special cases like HCT116_chr21-28-30Mb_untreated.csv
+    if "_untreated" in base_name:
+        base_name = base_name.replace("_untreated", "")
 
-                chr_pos_part = parts[1]
+    parts = base_name.split("_")
+    cell_line = parts[0]
 
-                chr_parts = chr_pos_part.split("-")
-                chrid = chr_parts[0]
+    chr_pos_part = parts[1]
 
-                # Extract start and end values (in Mb, need to convert to bp)
-                # Handle decimal values like 18.6Mb
-                # e.g., 28 or 18.6
-                start_mb = float(chr_parts[1])
-                end_mb = float(chr_parts[2].replace("Mb", ""))
+    chr_parts = chr_pos_part.split("-")
+    chrid = chr_parts[0]
 
-                start_value = int(start_mb * 1000000)
-                end_value = int(end_mb * 1000000)
+    # Extract start and end values (in Mb, need to convert to bp)
+    # Handle decimal values like 18.6Mb
+    # e.g., 28 or 18.6
+    start_mb = float(chr_parts[1])
+    end_mb = float(chr_parts[2].replace("Mb", ""))
 
-                print(
-                    f"Parsed: cell_line={cell_line}, chrid={chrid}, start={start_value}, end={end_value}"
-                )
+    return cell_line, chrid, int(start_mb * 1000000), int(end_mb * 1000000)
 
-                df = pd.read_csv(file_path, skiprows=1)
 
-                df = df.rename(
-                    columns={
-                        "Chromosome index": "cell_id",
-                        "Segment index": "segment_index",
-                        "Z": "Z",
-                        "X": "Y",
-                        "Y": "X",
-                    }
-                )
+def bintu_scope(file_path):
+    cell_line, chrid, start_value, end_value = parse_bintu_file_name(os.path.basename(file_path))
+    return [{
+        "table": "bintu",
+        "where": {"cell_line": cell_line, "chrid": chrid, "start_value": start_value, "end_value": end_value},
+    }]
 
-                df["cell_line"] = cell_line
-                df["chrid"] = chrid
-                df["start_value"] = start_value
-                df["end_value"] = end_value
 
-                for col in ["Z", "Y", "X"]:
-                    df[col] = df[col].where(pd.notna(df[col]), None)
+def process_bintu_data(cur, file_path, start_chunk=0):
+    """Process and insert the Bintu data of a CSV file of the Bintu folder."""
+    if start_chunk:
+        return
+    filename = os.path.basename(file_path)
+    print(f"Processing file: {filename}")
+    cell_line, chrid, start_value, end_value = parse_bintu_file_name(filename)
 
-                # Prepare data for insertion
-                df = df[
-                    [
-                        "cell_line",
-                        "chrid",
-                        "start_value",
-                        "end_value",
-                        "cell_id",
-                        "segment_index",
-                        "Z",
-                        "Y",
-                        "X",
-                    ]
-                ]
+    print(
+        f"Parsed: cell_line={cell_line}, chrid={chrid}, start={start_value}, end={end_value}"
+    )
 
-                query = """
-                    INSERT INTO bintu (cell_line, chrid, start_value, end_value, cell_id, segment_index, Z, Y, X)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (cell_line, chrid, start_value, end_value, cell_id, segment_index) DO NOTHING;
-                """
+    df = pd.read_csv(file_path, skiprows=1)
 
-                data_to_insert = df.to_records(index=False).tolist()
-                cur.executemany(query, data_to_insert)
+    df = df.rename(
+        columns={
+            "Chromosome index": "cell_id",
+            "Segment index": "segment_index",
+            "Z": "Z",
+            "X": "Y",
+            "Y": "X",
+        }
+    )
 
-                print(
-                    f"{filename}: inserted {len(df)} records for {cell_line} {chrid} ({start_mb}-{end_mb}Mb)"
-                )
+    df["cell_line"] = cell_line
+    df["chrid"] = chrid
+    df["start_value"] = start_value
+    df["end_value"] = end_value
+
+    for col in ["Z", "Y", "X"]:
+        df[col] = df[col].where(pd.notna(df[col]), None)
+
+    # Prepare data for insertion
+    df = df[
+        [
+            "cell_line",
+            "chrid",
+            "start_value",
+            "end_value",
+            "cell_id",
+            "segment_index",
+            "Z",
+            "Y",
+            "X",
+        ]
+    ]
 
-            except Exception as e:
-                print(f"Error processing file {filename}: {e}")
+    query = """
+        INSERT INTO bintu (cell_line, chrid, start_value, end_value, cell_id, segment_index, Z, Y, X)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (cell_line, chrid, start_value, end_value, cell_id, segment_index) DO NOTHING;
+    """
+
+    data_to_insert = df.to_records(index=False).tolist()
+    cur.executemany(query, data_to_insert)
 
+    print(
+        f"{filename}: inserted {len(df)} records for {cell_line} {chrid} ({start_value}-{end_value})"
+    )
+    yield len(df), bintu_scope(file_path)
 
-def process_gse_data(cur):
-    """Process CSV files from GM12878_dipc and K562_limca folders with resolution subdirectories and insert into GSE table"""
-    gse_dir = "GSE"
 
-    # Define the folders and their corresponding cell_lines
-    folders = {"GM12878_dipc": "GM12878_dipc", "K562_limca": "K562_limca"}
+# GSE folders and their corresponding cell_lines
+GSE_FOLDERS = {"GM12878_dipc": "GM12878_dipc", "K562_limca": "K562_limca"}
 
-    # Define resolution mapping from folder name to integer value
-    resolution_mapping = {"5k": 5000, "50k": 50000, "100k": 100000}
+# Resolution mapping from folder name to integer value
+GSE_RESOLUTIONS = {"5k": 5000, "50k": 50000, "100k": 100000}
 
-    total_inserted = 0
 
-    for folder_name, cell_line in folders.items():
+def gse_files(gse_dir="GSE"):
+    """CSV files of the GSE folders with resolution subdirectories"""
+    paths = []
+    for folder_name in GSE_FOLDERS:
         folder_path = os.path.join(gse_dir, folder_name)
 
         if not os.path.exists(folder_path):
             print(f"Warning: Folder {folder_path} does not exist.")
             continue
 
-        print(f"Processing folder: {folder_path}")
-
         # Check for resolution subdirectories
-        subdirs = [
-            d
-            for d in os.listdir(folder_path)
-            if os.path.isdir(os.path.join(folder_path, d))
-        ]
-
-        for resolution_dir in subdirs:
-            if resolution_dir not in resolution_mapping:
+        for resolution_dir in sorted(os.listdir(folder_path)):
+            resolution_path = os.path.join(folder_path, resolution_dir)
+            if not os.path.isdir(resolution_path):
+                continue
+            if resolution_dir not in GSE_RESOLUTIONS:
                 print(
                     f"Warning: Unknown resolution directory {resolution_dir}. Skipping."
                 )
                 continue
 
-            resolution_value = resolution_mapping[resolution_dir]
-            resolution_path = os.path.join(folder_path, resolution_dir)
+            paths += [os.path.join(resolution_path, f) for f in sorted(os.listdir(resolution_path)) if f.endswith(".csv")]
+    return paths
 
-            print(
-                f"Processing resolution directory: {resolution_dir} (value: {resolution_value})"
+
+def parse_gse_path(csv_path):
+    """(cell_line, cell_id, resolution) of a GSE file, from its folder, resolution directory and name"""
+    resolution_path, csv_file = os.path.split(csv_path)
+    folder_path, resolution_dir = os.path.split(resolution_path)
+    # Extract cell_id from filename (remove .csv extension)
+    return GSE_FOLDERS[os.path.basename(folder_path)], csv_file[:-4], GSE_RESOLUTIONS[resolution_dir]
+
+
+def gse_scope(csv_path):
+    cell_line, cell_id, resolution_value = parse_gse_path(csv_path)
+    return [{"table": "gse", "where": {"cell_line": cell_line, "cell_id": cell_id, "resolution": resolution_value}}]
+
+
+def process_gse_data(cur, csv_path, start_chunk=0):
+    """Process a CSV file of the GM12878_dipc and K562_limca folders and insert it into the GSE table"""
+    if start_chunk:
+        return
+    cell_line, cell_id, resolution_value = parse_gse_path(csv_path)
+    csv_file = os.path.basename(csv_path)
+
+    print(
+        f"Processing file: {csv_file} (cell_line: {cell_line}, cell_id: {cell_id}, resolution: {resolution_value})"
+    )
+
+    df = pd.read_csv(csv_path)
+
+    # Check if required columns exist
+    required_columns = ["chr", "ibp", "jbp", "fq"]
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError(f"File {csv_file} missing required columns. Expected: {required_columns}")
+
+    # Prepare data for insertion
+    insert_data = []
+    for _, row in df.iterrows():
+        insert_data.append(
+            (
+                cell_line,
+                cell_id,
+                row["chr"],
+                resolution_value,
+                int(row["ibp"]),
+                int(row["jbp"]),
+                float(row["fq"]),
             )
+        )
 
-            # Get all CSV files in the resolution directory
-            csv_files = [f for f in os.listdir(resolution_path) if f.endswith(".csv")]
+    # Batch insert data
+    if insert_data:
+        cur.executemany(
+            "INSERT INTO gse (cell_line, cell_id, chrid, resolution, ibp, jbp, fq) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            insert_data,
+        )
+        print(f"Inserted {len(insert_data)} rows from {csv_file}")
 
-            for csv_file in csv_files:
-                csv_path = os.path.join(resolution_path, csv_file)
-                # Extract cell_id from filename (remove .csv extension)
-                cell_id = csv_file[:-4]
+    yield len(insert_data), gse_scope(csv_path)
 
-                print(
-                    f"Processing file: {csv_file} (cell_line: {cell_line}, cell_id: {cell_id}, resolution: {resolution_value})"
-                )
 
-                try:
-                    df = pd.read_csv(csv_path)
-
-                    # Check if required columns exist
-                    required_columns = ["chr", "ibp", "jbp", "fq"]
-                    if not all(col in df.columns for col in required_columns):
-                        print(
-                            f"Warning: File {csv_file} missing required columns. Expected: {required_columns}"
-                        )
-                        continue
-
-                    # Prepare data for insertion
-                    insert_data = []
-                    for _, row in df.iterrows():
-                        insert_data.append(
-                            (
-                                cell_line,
-                                cell_id,
-                                row["chr"],
-                                resolution_value,
-                                int(row["ibp"]),
-                                int(row["jbp"]),
-                                float(row["fq"]),
-                            )
-                        )
-
-                    # Batch insert data
-                    if insert_data:
-                        cur.executemany(
-                            "INSERT INTO gse (cell_line, cell_id, chrid, resolution, ibp, jbp, fq) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                            insert_data,
-                        )
-
-                        rows_inserted = len(insert_data)
-                        total_inserted += rows_inserted
-                        print(f"Inserted {rows_inserted} rows from {csv_file}")
-
-                except Exception as e:
-                    print(f"Error processing file {csv_file}: {e}")
-                    continue
-
-    print(f"GSE data processing completed. Total rows inserted: {total_inserted}")
+def csv_files(folder_path, suffix):
+    """Paths of the files of a folder with the suffix, in name order"""
+    return [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path)) if f.endswith(suffix)]
+
+
+def import_chromosome_data(manifest, cur):
+    manifest.load(
+        "chromosome", [os.path.join(ROOT_DIR, "chromosome_sizes.txt")], process_chromosome_data,
+        lambda file_path: [], lambda: data_exists(cur, "chromosome"),
+    )
+
+
+def import_gene_data(manifest, cur):
+    manifest.load(
+        "gene", [os.path.join(ROOT_DIR, "gene_list.csv")], process_gene_data,
+        gene_scope, lambda: data_exists(cur, "gene"),
+    )
+
+
+def import_valid_regions_data(manifest, cur):
+    manifest.load(
+        "valid_regions", csv_files(os.path.join(ROOT_DIR, "valid_regions"), ".csv.gz"), process_valid_regions_data,
+        valid_regions_scope, lambda: data_exists(cur, "valid_regions"),
+    )
+
+
+def import_bintu_data(manifest, cur):
+    manifest.load(
+        "bintu", csv_files(os.path.join(ROOT_DIR, "Bintu"), ".csv"), process_bintu_data,
+        bintu_scope, lambda: data_exists(cur, "bintu"),
+    )
+
+
+def import_gse_data(manifest, cur):
+    manifest.load("gse", gse_files(), process_gse_data, gse_scope, lambda: data_exists(cur, "gse"))
 
 
 def insert_bintu_data_only():
@@ -672,14 +748,9 @@ def insert_bintu_data_only():
 
     cur = conn.cursor()
 
-    # Insert Bintu data
-    if not data_exists(cur, "bintu"):
-        print("Inserting Bintu data...")
-        process_bintu_data(cur)
-        conn.commit()
-        print("Bintu data inserted successfully.")
-    else:
-        print("Bintu data already exists, skipping insertion.")
+    # Insert the new and changed Bintu files
+    print("Importing Bintu data...")
+    import_bintu_data(ImportManifest(conn), cur)
 
     cur.close()
     conn.close()
@@ -694,14 +765,9 @@ def insert_gse_data_only():
 
     cur = conn.cursor()
 
-    # Insert GSE data
-    if not data_exists(cur, "gse"):
-        print("Inserting GSE data...")
-        process_gse_data(cur)
-        conn.commit()
-        print("GSE data inserted successfully.")
-    else:
-        print("GSE data already exists, skipping insertion.")
+    # Insert the new and changed GSE files
+    print("Importing GSE data...")
+    import_gse_data(ImportManifest(conn), cur)
 
     cur.close()
     conn.close()
@@ -827,27 +893,16 @@ def process_gse_index():
 
 
 def insert_data():
-    """Insert data(Except for the data of non random HiC) into the database if not already present."""
+    """Insert the new and changed data files (Except for the data of non random HiC) into the database."""
     conn = get_db_connection(database=DB_NAME)
     cur = conn.cursor()
+    manifest = ImportManifest(conn)
 
-    # Insert chromosome data only if the table is empty
-    if not data_exists(cur, "chromosome"):
-        file_path = os.path.join(ROOT_DIR, "chromosome_sizes.txt")
-        print("Inserting chromosome data...")
-        process_chromosome_data(cur, file_path)
-        print("Chromosome data inserted successfully.")
-    else:
-        print("Chromosome data already exists, skipping insertion.")
-
-    # Insert gene data only if the table is empty
-    if not data_exists(cur, "gene"):
-        file_path = os.path.join(ROOT_DIR, "gene_list.csv")
-        print("Inserting gene data...")
-        process_gene_data(cur, file_path)
-        print("Gene data inserted successfully.")
-    else:
-        print("Gene data already exists, skipping insertion.")
+    print("Importing chromosome data...")
+    import_chromosome_data(manifest, cur)
+
+    print("Importing gene data...")
+    import_gene_data(manifest, cur)
 
     # Insert sequence data only if the table is empty
     # if not data_exists(cur, "sequence"):
@@ -857,29 +912,14 @@ def insert_data():
     # else:
     #     print("Sequence data already exists, skipping insertion.")
 
-    # Insert valid regions data only if the table is empty
-    if not data_exists(cur, "valid_regions"):
-        print("Inserting valid regions data...")
-        process_valid_regions_data(cur)
-        print("valid regions data inserted successfully.")
-    else:
-        print("valid regions data already exists, skipping insertion.")
+    print("Importing valid regions data...")
+    import_valid_regions_data(manifest, cur)
 
-    # Insert Bintu data only if the table is empty
-    if not data_exists(cur, "bintu"):
-        print("Inserting Bintu data...")
-        process_bintu_data(cur)
-        print("Bintu data inserted successfully.")
-    else:
-        print("Bintu data already exists, skipping insertion.")
+    print("Importing Bintu data...")
+    import_bintu_data(manifest, cur)
 
-    # Insert GSE data only if the table is empty
-    if not data_exists(cur, "gse"):
-        print("Inserting GSE data...")
-        process_gse_data(cur)
-        print("GSE data inserted successfully.")
-    else:
-        print("GSE data already exists, skipping insertion.")
+    print("Importing GSE data...")
+    import_gse_data(manifest, cur)
 
     # Insert epigenetic track data only if the table is empty
     # if not data_exists(cur, "epigenetic_track"):
@@ -889,8 +929,6 @@ def insert_data():
     # else:
     #     print("epigenetic track data already exists, skipping insertion.")
 
-    # Commit changes and close connection
-    conn.commit()
     cur.close()
     conn.close()
 
@@ -913,23 +951,40 @@ def check_cell_line_tables_have_data():
 
 
 def insert_non_random_HiC_data():
-    """Insert non random HiC data into the database if not already present.(it is separated from insert_data() to avoid long running transactions)"""
-
-    # Check if any cell line table has data
-    if check_cell_line_tables_have_data():
-        print(
-            "Non-random Hi-C data already exists in cell line tables, skipping insertion."
-        )
-        return
+    """Insert the new, changed and partially imported non random HiC files.(it is separated from insert_data() to avoid long running transactions)"""
+    conn = get_db_connection(database=DB_NAME)
+    manifest = ImportManifest(conn)
 
+    # Each file commits every chunk, a crashed import resumes after the last one
     chromosome_dir = os.path.join(ROOT_DIR, "refined_processed_HiC")
-    process_non_random_hic_data(chromosome_dir)
+    manifest.load(
+        "non_random_hic", csv_files(chromosome_dir, ".csv.gz"), process_non_random_hic_data,
+        non_random_hic_scope, check_cell_line_tables_have_data,
+    )
+    conn.close()
+    # Also after a run that loaded nothing, an earlier one may have stopped before the indexes
     process_non_random_hic_index()
 
 
+def bump_data_generation():
+    """Advance the data generation so the backend drops cached responses built from the previous data."""
+    if not import_manifest.changed_files:
+        print("No data files imported, the data generation is unchanged.")
+        return
+    conn = get_db_connection(database=DB_NAME)
+    cur = conn.cursor()
+    cur.execute(CREATE_GENERATION_TABLE_SQL)
+    cur.execute(BUMP_GENERATION_SQL)
+    conn.commit()
+    print("Data generation bumped.")
+    cur.close()
+    conn.close()
+
+
 initialize_tables()
 process_position_index()
 process_distance_index()
 process_gse_index()
 insert_data()
 insert_non_random_HiC_data()
+bump_data_generation()
@@ -4,6 +4,9 @@ from psycopg import sql
 import pandas as pd
 from io import StringIO
 from cell_line_labels import label_mapping
+from data_generation import CREATE_GENERATION_TABLE_SQL, BUMP_GENERATION_SQL
+import import_manifest
+from import_manifest import ImportManifest
 
 NEW_DATA_DIR = "./new_cell_line"
 
@@ -67,94 +70,83 @@ def get_db_connection(database=None):
         return None
 
 
-def process_non_random_hic_data(chromosome_dir):
-    """Process and insert data into separate cell line tables"""
-    # Get all unique cell lines from all files to create tables once
+def process_non_random_hic_data(cur, file_path, start_chunk=0):
+    """Process and insert a Hi-C file into separate cell line tables, one chunk of 100000 rows at a time"""
+    file_name = os.path.basename(file_path)
+    print(f"Processing file: {file_name}")
     created_tables = set()
 
-    for file_name in os.listdir(chromosome_dir):
-        if not file_name.endswith(".csv.gz"):
-            continue
-
-        file_path = os.path.join(chromosome_dir, file_name)
-        print(f"Processing file: {file_name}")
-
-        for chunk in pd.read_csv(
+    for index, chunk in enumerate(
+        pd.read_csv(
             file_path,
             usecols=["chr", "ibp", "jbp", "fq", "fdr", "rawc", "cell_line"],
             chunksize=100000,
             compression="gzip",
-        ):
-            chunk.rename(columns={"chr": "chrid"}, inplace=True)
-
-            # Group by cell line and insert into separate tables
-            for cell_line, group in chunk.groupby("cell_line"):
-                if cell_line not in label_mapping:
-                    print(
-                        f"Warning: Cell line '{cell_line}' not found in label_mapping. Skipping."
-                    )
-                    continue
-
-                table_name = get_cell_line_table_name(cell_line)
-
-                # Check if table exists and create if necessary
-                if cell_line not in created_tables:
-                    conn = get_db_connection(database=DB_NAME)
-                    cur = conn.cursor()
-                    try:
-                        table_created = create_cell_line_table(cur, cell_line)
-                        if table_created:
-                            conn.commit()
-                        created_tables.add(cell_line)
-                    except Exception as e:
-                        print(f"Error creating table for {cell_line}: {e}")
-                        conn.rollback()
-                        cur.close()
-                        conn.close()
-                        continue
-                    finally:
-                        cur.close()
-                        conn.close()
-
-                # Insert data into the table
-                conn = get_db_connection(database=DB_NAME)
-                cur = conn.cursor()
-
-                try:
-                    # Remove cell_line column since it's redundant in separate tables
-                    group_data = group[["chrid", "ibp", "jbp", "fq", "fdr", "rawc"]]
-
-                    buffer = StringIO()
-                    group_data.to_csv(buffer, sep="\t", index=False, header=False)
-                    buffer.seek(0)
-
-                    copy_sql = sql.SQL(
-                        "COPY {} ({}) FROM STDIN WITH (FORMAT text, DELIMITER E'\\t')"
-                    ).format(
-                        sql.Identifier(table_name),
-                        sql.SQL(", ").join(
-                            [
-                                sql.Identifier(col)
-                                for col in ("chrid", "ibp", "jbp", "fq", "fdr", "rawc")
-                            ]
-                        ),
-                    )
-
-                    with cur.copy(copy_sql) as copy:
-                        data_str = buffer.getvalue()
-                        copy.write(data_str.encode("utf-8"))
-
-                    conn.commit()
-                    print(
-                        f"Inserted {len(group_data)} records into {table_name} from {file_name}."
-                    )
-
-                except Exception as e:
-                    print(f"Error processing data for {table_name}: {e}")
-                    conn.rollback()
-                finally:
-                    cur.close()
-                    conn.close()
+        )
+    ):
+        # Committed by an earlier, interrupted import
+        if index < start_chunk:
+            continue
+        chunk.rename(columns={"chr": "chrid"}, inplace=True)
+        rows, scope = 0, []
+
+        # Group by cell line and insert into separate tables
+        for cell_line, group in chunk.groupby("cell_line"):
+            if cell_line not in label_mapping:
+                print(
+                    f"Warning: Cell line '{cell_line}' not found in label_mapping. Skipping."
+                )
+                continue
+
+            table_name = get_cell_line_table_name(cell_line)
+
+            # Create the table if necessary, committed with the first chunk written to it
+            if cell_line not in created_tables:
+                create_cell_line_table(cur, cell_line)
+                created_tables.add(cell_line)
+
+            # Remove cell_line column since it's redundant in separate tables
+            group_data = group[["chrid", "ibp", "jbp", "fq", "fdr", "rawc"]]
+
+            buffer = StringIO()
+            group_data.to_csv(buffer, sep="\t", index=False, header=False)
+            buffer.seek(0)
+
+            copy_sql = sql.SQL(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT text, DELIMITER E'\\t')"
+            ).format(
+                sql.Identifier(table_name),
+                sql.SQL(", ").join(
+                    [
+                        sql.Identifier(col)
+                        for col in ("chrid", "ibp", "jbp", "fq", "fdr", "rawc")
+                    ]
+                ),
+            )
+
+            with cur.copy(copy_sql) as copy:
+                data_str = buffer.getvalue()
+                copy.write(data_str.encode("utf-8"))
+
+            print(
+                f"Inserted {len(group_data)} records into {table_name} from {file_name}."
+            )
+            rows += len(group_data)
+            scope += [{"table": table_name, "where": {"chrid": chrid}} for chrid in group_data["chrid"].unique()]
+
+        yield rows, scope
+
+
+def non_random_hic_scope(file_path):
+    """(cell line table, chromosome) pairs of a Hi-C file, read without loading it"""
+    scope = set()
+    for chunk in pd.read_csv(
+        file_path, usecols=["chr", "cell_line"], chunksize=1000000, compression="gzip"
+    ):
+        for cell_line, chrid in chunk.drop_duplicates().itertuples(index=False):
+            if cell_line in label_mapping:
+                scope.add((get_cell_line_table_name(cell_line), chrid))
+    return [{"table": table_name, "where": {"chrid": chrid}} for table_name, chrid in sorted(scope)]
 
 
 # def process_sequence_data(cur):
@@ -207,143 +199,168 @@ def create_bintu_table(cur):
         return False
 
 
-def process_valid_regions_data(cur):
-    """Process and insert valid regions data from all CSV files in the specified folder."""
-    folder_path = os.path.join(NEW_DATA_DIR, "valid_regions")
-    for filename in os.listdir(folder_path):
-        # check if the file is a CSV.gz file
-        if filename.endswith(".csv.gz"):
-            file_path = os.path.join(folder_path, filename)
-            try:
-                df = pd.read_csv(
-                    file_path,
-                    usecols=["chrID", "cell_line", "start_value", "end_value"],
-                )
+def csv_files(folder_path, suffix):
+    """Paths of the files of a folder with the suffix, in name order"""
+    return [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path)) if f.endswith(suffix)]
 
-                df = df[["chrID", "cell_line", "start_value", "end_value"]]
 
-                query = """
-                    INSERT INTO valid_regions (chrid, cell_line, start_value, end_value)
-                    VALUES (%s, %s, %s, %s);
-                """
+def read_valid_regions(file_path):
+    return pd.read_csv(
+        file_path,
+        usecols=["chrID", "cell_line", "start_value", "end_value"],
+    )[["chrID", "cell_line", "start_value", "end_value"]]
 
-                data_to_insert = df.to_records(index=False).tolist()
-                cur.executemany(query, data_to_insert)
 
-                print(f"{filename}, inserted {len(df)} records")
-            except Exception as e:
-                print(f"file {filename} error: {e}")
+def valid_regions_scope(file_path, df=None):
+    """(cell line, chromosome) pairs of a valid regions file"""
+    if df is None:
+        df = read_valid_regions(file_path)
+    pairs = df[["cell_line", "chrID"]].drop_duplicates().itertuples(index=False)
+    return [{"table": "valid_regions", "where": {"cell_line": cell_line, "chrid": chrid}} for cell_line, chrid in pairs]
 
 
-def process_bintu_data(cur):
-    """Process and insert Bintu data from all CSV files in the Bintu folder."""
-    folder_path = "./Bintu"
-
-    if not os.path.exists(folder_path):
-        print(f"Bintu folder not found at {folder_path}")
+def process_valid_regions_data(cur, file_path, start_chunk=0):
+    """Process and insert the valid regions of a CSV file."""
+    if start_chunk:
         return
+    df = read_valid_regions(file_path)
 
-    # Ensure the bintu table exists before processing data
-    create_bintu_table(cur)
+    query = """
+        INSERT INTO valid_regions (chrid, cell_line, start_value, end_value)
+        VALUES (%s, %s, %s, %s);
+    """
 
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".csv"):
-            file_path = os.path.join(folder_path, filename)
+    data_to_insert = df.to_records(index=False).tolist()
+    cur.executemany(query, data_to_insert)
 
-            try:
-                # Parse filename to extract metadata
-                # Format: {cell_line}_chr{chrid}-{start}-{end}Mb.csv or similar
-                base_name = filename.replace(".csv", "")
-                print(f"Processing file: {filename}")
+    print(f"{os.path.basename(file_path)}, inserted {len(df)} records")
+    yield len(df), valid_regions_scope(file_path, df)
 
-                # Handle special cases like HCT116_chr21-28-30Mb_untreated.csv
-                if "_untreated" in base_name:
-                    base_name = base_name.replace("_untreated", "")
 
-                parts = base_name.split("_")
-                cell_line = parts[0]
+def parse_bintu_file_name(filename):
+    """(cell_line, chrid, start_value, end_value) of a Bintu file name"""
+    # Format: {cell_line}_chr{chrid}-{start}-{end}Mb.csv or similar
+    base_name = filename.replace(".csv", "")
 
-                chr_pos_part = parts[1]
+    # Handle special cases like HCT116_chr21-28-30Mb_untreated.csv
+    if "_untreated" in base_name:
+        base_name = base_name.replace("_untreated", "")
 
-                chr_parts = chr_pos_part.split("-")
-                chrid = chr_parts[0]
+    parts = base_name.split("_")
+    cell_line = parts[0]
 
-                # Extract start and end values (in Mb, need to convert to bp)
-                # Handle decimal values like 18.6Mb
-                # e.g., 28 or 18.6
-                start_mb = float(chr_parts[1])
-                end_mb = float(chr_parts[2].replace("Mb", ""))
+    chr_pos_part = parts[1]
 
-                start_value = int(start_mb * 1000000)
-                end_value = int(end_mb * 1000000)
+    chr_parts = chr_pos_part.split("-")
+    chrid = chr_parts[0]
 
-                print(
-                    f"Parsed: cell_line={cell_line}, chrid={chrid}, start={start_value}, end={end_value}"
-                )
+    # Extract start and end values (in Mb, need to convert to bp)
+    # Handle decimal values like 18.6Mb
+    # e.g., 28 or 18.6
+    start_mb = float(chr_parts[1])
+    end_mb = float(chr_parts[2].replace("Mb", ""))
 
-                df = pd.read_csv(file_path, skiprows=1)
+    return cell_line, chrid, int(start_mb * 1000000), int(end_mb * 1000000)
 
-                df = df.rename(
-                    columns={
-                        "Chromosome index": "cell_id",
-                        "Segment index": "segment_index",
-                        "Z": "Z",
-                        "X": "Y",
-                        "Y": "X",
-                    }
-                )
 
-                df["cell_line"] = cell_line
-                df["chrid"] = chrid
-                df["start_value"] = start_value
-                df["end_value"] = end_value
+def bintu_scope(file_path):
+    cell_line, chrid, start_value, end_value = parse_bintu_file_name(os.path.basename(file_path))
+    return [{
+        "table": "bintu",
+        "where": {"cell_line": cell_line, "chrid": chrid, "start_value": start_value, "end_value": end_value},
+    }]
 
-                for col in ["Z", "Y", "X"]:
-                    df[col] = df[col].where(pd.notna(df[col]), None)
 
-                # Prepare data for insertion
-                df = df[
-                    [
-                        "cell_line",
-                        "chrid",
-                        "start_value",
-                        "end_value",
-                        "cell_id",
-                        "segment_index",
-                        "Z",
-                        "Y",
-                        "X",
-                    ]
-                ]
+def process_bintu_data(cur, file_path, start_chunk=0):
+    """Process and insert the Bintu data of a CSV file of the Bintu folder."""
+    if start_chunk:
+        return
+    filename = os.path.basename(file_path)
+    print(f"Processing file: {filename}")
+    cell_line, chrid, start_value, end_value = parse_bintu_file_name(filename)
 
-                query = """
-                    INSERT INTO bintu (cell_line, chrid, start_value, end_value, cell_id, segment_index, Z, Y, X)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (cell_line, chrid, start_value, end_value, cell_id, segment_index) DO NOTHING;
-                """
+    print(
+        f"Parsed: cell_line={cell_line}, chrid={chrid}, start={start_value}, end={end_value}"
+    )
 
-                data_to_insert = df.to_records(index=False).tolist()
-                cur.executemany(query, data_to_insert)
+    df = pd.read_csv(file_path, skiprows=1)
 
-                print(
-                    f"{filename}: inserted {len(df)} records for {cell_line} {chrid} ({start_mb}-{end_mb}Mb)"
-                )
+    df = df.rename(
+        columns={
+            "Chromosome index": "cell_id",
+            "Segment index": "segment_index",
+            "Z": "Z",
+            "X": "Y",
+            "Y": "X",
+        }
+    )
+
+    df["cell_line"] = cell_line
+    df["chrid"] = chrid
+    df["start_value"] = start_value
+    df["end_value"] = end_value
+
+    for col in ["Z", "Y", "X"]:
+        df[col] = df[col].where(pd.notna(df[col]), None)
+
+    # Prepare data for insertion
+    df = df[
+        [
+            "cell_line",
+            "chrid",
+            "start_value",
+            "end_value",
+            "cell_id",
+            "segment_index",
+            "Z",
+            "Y",
+            "X",
+        ]
+    ]
+
+    query = """
+        INSERT INTO bintu (cell_line, chrid, start_value, end_value, cell_id, segment_index, Z, Y, X)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (cell_line, chrid, start_value, end_value, cell_id, segment_index) DO NOTHING;
+    """
+
+    data_to_insert = df.to_records(index=False).tolist()
+    cur.executemany(query, data_to_insert)
+
+    print(
+        f"{filename}: inserted {len(df)} records for {cell_line} {chrid} ({start_value}-{end_value})"
+    )
+    yield len(df), bintu_scope(file_path)
 
-            except Exception as e:
-                print(f"Error processing file {filename}: {e}")
+
+def import_bintu_files(manifest, cur):
+    """Import the new and changed files of the Bintu folder."""
+    folder_path = "./Bintu"
+
+    if not os.path.exists(folder_path):
+        print(f"Bintu folder not found at {folder_path}")
+        return
+
+    # Ensure the bintu table exists before processing data
+    create_bintu_table(cur)
+    manifest.conn.commit()
+
+    manifest.load("bintu", csv_files(folder_path, ".csv"), process_bintu_data, bintu_scope)
 
 
 def insert_new_cell_line():
-    """Insert non random HiC data into the database if not already present.(it is seperated from insert_data() to avoid long running transactions)"""
+    """Insert the new and changed files of a new cell line into the database.(it is seperated from insert_data() to avoid long running transactions)"""
     conn = get_db_connection(database=DB_NAME)
     cur = conn.cursor()
+    manifest = ImportManifest(conn)
 
-    # Insert non-random Hi-C data only if the table is empty
+    # Each Hi-C file commits every chunk, a crashed import resumes after the last one
     chromosome_dir = os.path.join(NEW_DATA_DIR, "refined_processed_HiC")
     if os.path.exists(chromosome_dir):
-        process_non_random_hic_data(chromosome_dir)
-        conn.commit()
-        print("New cell line Non-random Hi-C data inserted successfully.")
+        manifest.load(
+            "non_random_hic", csv_files(chromosome_dir, ".csv.gz"), process_non_random_hic_data, non_random_hic_scope
+        )
+        print("New cell line Non-random Hi-C data imported.")
     else:
         print(f"Refined processed HiC directory not found at {chromosome_dir}")
 
@@ -355,17 +372,17 @@ def insert_new_cell_line():
     # Process valid regions data
     valid_regions_dir = os.path.join(NEW_DATA_DIR, "valid_regions")
     if os.path.exists(valid_regions_dir):
-        process_valid_regions_data(cur)
-        conn.commit()
-        print("New cell line valid regions data inserted successfully.")
+        manifest.load(
+            "valid_regions", csv_files(valid_regions_dir, ".csv.gz"), process_valid_regions_data, valid_regions_scope
+        )
+        print("New cell line valid regions data imported.")
     else:
         print(f"Valid regions directory not found at {valid_regions_dir}")
 
     # Process Bintu data
     print("Processing Bintu data...")
-    process_bintu_data(cur)
-    conn.commit()
-    print("New cell line Bintu data inserted successfully.")
+    import_bintu_files(manifest, cur)
+    print("New cell line Bintu data imported.")
 
     cur.close()
     conn.close()
@@ -383,9 +400,8 @@ def insert_bintu_data():
     try:
         # Process Bintu data
         print("Processing Bintu data...")
-        process_bintu_data(cur)
-        conn.commit()
-        print("Bintu data inserted successfully.")
+        import_bintu_files(ImportManifest(conn), cur)
+        print("Bintu data imported.")
 
     except Exception as e:
         print(f"Error during Bintu data insertion: {e}")
@@ -439,109 +455,97 @@ def process_gse_index(cur):
         print("Index idx_gse_search created successfully.")
 
 
-def process_gse_data(cur):
-    """Process CSV files from GM12878_dipc and K562_limca folders and insert into GSE table"""
-    gse_dir = "GSE"
+# GSE folders and their corresponding cell_lines
+GSE_FOLDERS = {"GM12878_dipc": "GM12878_dipc", "K562_limca": "K562_limca"}
 
-    # Define the folders and their corresponding cell_lines
-    folders = {"GM12878_dipc": "GM12878_dipc", "K562_limca": "K562_limca"}
+# Resolution mapping from folder name to integer value
+GSE_RESOLUTIONS = {"5k": 5000, "50k": 50000, "100k": 100000}
 
-    # Define resolution mapping from folder name to integer value
-    resolution_mapping = {"5k": 5000, "50k": 50000, "100k": 100000}
 
-    create_gse_table(cur)
-    process_gse_index(cur)
-
-    total_inserted = 0
-
-    for folder_name, cell_line in folders.items():
+def gse_files(gse_dir="GSE"):
+    """CSV files of the GM12878_dipc and K562_limca folders, in their resolution subdirectories"""
+    paths = []
+    for folder_name in GSE_FOLDERS:
         folder_path = os.path.join(gse_dir, folder_name)
 
         if not os.path.exists(folder_path):
             print(f"Warning: Folder {folder_path} does not exist.")
             continue
 
-        print(f"Processing folder: {folder_path}")
-
         # Check if this folder has resolution subdirectories
-        subdirs = [
-            d
-            for d in os.listdir(folder_path)
-            if os.path.isdir(os.path.join(folder_path, d))
-        ]
-
-        for resolution_dir in subdirs:
-            if resolution_dir not in resolution_mapping:
+        for resolution_dir in sorted(os.listdir(folder_path)):
+            resolution_path = os.path.join(folder_path, resolution_dir)
+            if not os.path.isdir(resolution_path):
+                continue
+            if resolution_dir not in GSE_RESOLUTIONS:
                 print(
                     f"Warning: Unknown resolution directory {resolution_dir}. Skipping."
                 )
                 continue
 
-            resolution_value = resolution_mapping[resolution_dir]
-            resolution_path = os.path.join(folder_path, resolution_dir)
+            paths += csv_files(resolution_path, ".csv")
+    return paths
 
-            print(
-                f"Processing resolution directory: {resolution_dir} (value: {resolution_value})"
-            )
 
-            # Get all CSV files in the resolution directory
-            csv_files = [f for f in os.listdir(resolution_path) if f.endswith(".csv")]
+def parse_gse_path(csv_path):
+    """(cell_line, cell_id, resolution) of a GSE file, from its folder, resolution directory and name"""
+    resolution_path, csv_file = os.path.split(csv_path)
+    folder_path, resolution_dir = os.path.split(resolution_path)
+    # Extract cell_id from filename (remove .csv extension)
+    return GSE_FOLDERS[os.path.basename(folder_path)], csv_file[:-4], GSE_RESOLUTIONS[resolution_dir]
 
-            for csv_file in csv_files:
-                csv_path = os.path.join(resolution_path, csv_file)
-                # Extract cell_id from filename (remove .csv extension)
-                cell_id = csv_file[:-4]
 
-                print(
-                    f"Processing file: {csv_file} (cell_line: {cell_line}, cell_id: {cell_id}, resolution: {resolution_value})"
-                )
+def gse_scope(csv_path):
+    cell_line, cell_id, resolution_value = parse_gse_path(csv_path)
+    return [{"table": "gse", "where": {"cell_line": cell_line, "cell_id": cell_id, "resolution": resolution_value}}]
+
+
+def process_gse_data(cur, csv_path, start_chunk=0):
+    """Process a CSV file of the GSE folders and insert it into the GSE table"""
+    if start_chunk:
+        return
+    cell_line, cell_id, resolution_value = parse_gse_path(csv_path)
+    csv_file = os.path.basename(csv_path)
+
+    print(
+        f"Processing file: {csv_file} (cell_line: {cell_line}, cell_id: {cell_id}, resolution: {resolution_value})"
+    )
+
+    df = pd.read_csv(csv_path)
+
+    # Check if required columns exist
+    required_columns = ["chr", "ibp", "jbp", "fq"]
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError(f"File {csv_file} missing required columns. Expected: {required_columns}")
+
+    # Prepare data for insertion
+    insert_data = []
+    for _, row in df.iterrows():
+        insert_data.append(
+            (
+                cell_line,
+                cell_id,
+                row["chr"],
+                resolution_value,
+                int(row["ibp"]),
+                int(row["jbp"]),
+                float(row["fq"]),
+            )
+        )
+
+    # Batch insert data
+    if insert_data:
+        cur.executemany(
+            "INSERT INTO gse (cell_line, cell_id, chrid, resolution, ibp, jbp, fq) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            insert_data,
+        )
+        print(f"Inserted {len(insert_data)} rows from {csv_file}")
 
-                try:
-                    df = pd.read_csv(csv_path)
-
-                    # Check if required columns exist
-                    required_columns = ["chr", "ibp", "jbp", "fq"]
-                    if not all(col in df.columns for col in required_columns):
-                        print(
-                            f"Warning: File {csv_file} missing required columns. Expected: {required_columns}"
-                        )
-                        continue
-
-                    # Prepare data for insertion
-                    insert_data = []
-                    for _, row in df.iterrows():
-                        insert_data.append(
-                            (
-                                cell_line,
-                                cell_id,
-                                row["chr"],
-                                resolution_value,
-                                int(row["ibp"]),
-                                int(row["jbp"]),
-                                float(row["fq"]),
-                            )
-                        )
-
-                    # Batch insert data
-                    if insert_data:
-                        cur.executemany(
-                            "INSERT INTO gse (cell_line, cell_id, chrid, resolution, ibp, jbp, fq) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                            insert_data,
-                        )
-
-                        rows_inserted = len(insert_data)
-                        total_inserted += rows_inserted
-                        print(f"Inserted {rows_inserted} rows from {csv_file}")
-
-                except Exception as e:
-                    print(f"Error processing file {csv_file}: {e}")
-                    continue
-
-    print(f"GSE data processing completed. Total rows inserted: {total_inserted}")
+    yield len(insert_data), gse_scope(csv_path)
 
 
 def insert_gse_data():
-    """Standalone function to insert GSE data"""
+    """Standalone function to insert the new and changed GSE files"""
     conn = get_db_connection(database=DB_NAME)
     if conn is None:
         print("Failed to connect to database")
@@ -550,11 +554,14 @@ def insert_gse_data():
     cur = conn.cursor()
 
     try:
+        create_gse_table(cur)
+        process_gse_index(cur)
+        conn.commit()
+
         # Process GSE data
         print("Processing GSE data...")
-        process_gse_data(cur)
-        conn.commit()
-        print("GSE data inserted successfully.")
+        ImportManifest(conn).load("gse", gse_files(), process_gse_data, gse_scope)
+        print("GSE data imported.")
 
     except Exception as e:
         print(f"Error during GSE data insertion: {e}")
@@ -564,6 +571,22 @@ def insert_gse_data():
         conn.close()
 
 
+def bump_data_generation():
+    """Advance the data generation so the backend drops cached responses built from the previous data."""
+    if not import_manifest.changed_files:
+        print("No data files imported, the data generation is unchanged.")
+        return
+    conn = get_db_connection(database=DB_NAME)
+    cur = conn.cursor()
+    cur.execute(CREATE_GENERATION_TABLE_SQL)
+    cur.execute(BUMP_GENERATION_SQL)
+    conn.commit()
+    print("Data generation bumped.")
+    cur.close()
+    conn.close()
+
+
 # insert_new_cell_line()
 # insert_bintu_data()
-insert_gse_data()
\ No newline at end of file
+insert_gse_data()
+bump_data_generation()
\ No newline at end of file
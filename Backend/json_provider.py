@@ -0,0 +1,55 @@
+"""
+orjson as the JSON serializer of every /api response.
+
+Installed as app.json on both the Flask and the Quart app, so jsonify() goes through orjson. NumPy
+arrays are serialized natively, and cached JSON payloads wrapped in orjson.Fragment are spliced into
+the response as they are, without being parsed and serialized again. Values orjson does not know
+are converted the way Flask's default provider converts them.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+from metrics import stage
+
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Serialize to JSON bytes, for routes that build their Response themselves"""
+    with stage("response_serialize"):
+        return orjson.dumps(value, default=default, option=ORJSON_OPTIONS)
+
+
+class OrjsonProvider(JSONProvider):
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def init_app(app):
+    app.json = OrjsonProvider(app)
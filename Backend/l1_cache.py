@@ -0,0 +1,167 @@
+"""
+Byte-bounded in-process L1 cache in front of Redis.
+
+Holds the values of the hottest 3D region keys (NumPy matrices, or the cached JSON itself as
+orjson.Fragment, ready to be spliced into a response), so a hit costs no Redis round trip. Entries expire with the same TTL as their Redis
+copy and are evicted least recently used once L1_CACHE_MAX_BYTES is exceeded. A TinyLFU admission
+filter keeps a one-off region from pushing out the regions everyone keeps opening: a new entry only
+replaces the LRU victims if it has been asked for more often than they have. Entries belong to the
+data generation they were loaded under, and the whole cache is dropped once a data reload bumps it.
+They also remember the generation of their region, an entry of a region evicted since is a miss.
+"""
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+import numpy as np
+from data_generation import key_region
+
+
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Matches the setex TTL used for the Redis copies
+L1_CACHE_TTL = int(os.getenv("L1_CACHE_TTL", 3600))
+
+
+class FrequencySketch:
+    """Count-min sketch of key access counts, halved every `sample_size` increments so it follows recent popularity"""
+
+    def __init__(self, width=4096, depth=4, sample_size=40960):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.additions = 0
+
+    def indexes(self, key):
+        return [hash((row, key)) % self.width for row in range(self.depth)]
+
+    def increment(self, key):
+        for row, index in enumerate(self.indexes(key)):
+            self.table[row, index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table >>= 1
+            self.additions //= 2
+
+    def estimate(self, key):
+        return int(min(self.table[row, index] for row, index in enumerate(self.indexes(key))))
+
+
+def value_nbytes(value, default):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return default
+
+
+class L1Cache:
+    def __init__(self, generation=None, max_bytes=L1_CACHE_MAX_BYTES, ttl=L1_CACHE_TTL, region_generations=None):
+        self.generation = generation
+        self.region_generations = region_generations
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, nbytes, expires_at, region generation), least recently used first
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.sketch = FrequencySketch()
+        self.cached_generation = None
+        self.lock = Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "rejections": 0, "expirations": 0}
+
+    def check_generation(self):
+        if self.generation is None:
+            return
+        current = self.generation.current()[0]
+        if current != self.cached_generation:
+            self.entries.clear()
+            self.nbytes = 0
+            self.cached_generation = current
+
+    def region_generation(self, key):
+        if self.region_generations is None:
+            return 0
+        return self.region_generations.of(key_region(key))
+
+    def remove(self, key):
+        nbytes = self.entries.pop(key)[1]
+        self.nbytes -= nbytes
+
+    def get(self, key):
+        with self.lock:
+            self.check_generation()
+            self.sketch.increment(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counts["misses"] += 1
+                return None
+            if entry[2] <= monotonic() or entry[3] != self.region_generation(key):
+                self.remove(key)
+                self.counts["expirations"] += 1
+                self.counts["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value, nbytes, ttl=None):
+        """Cache a decoded value, ttl in seconds (e.g. the remaining Redis TTL). Returns False if not admitted"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or nbytes > self.max_bytes:
+            return False
+        if isinstance(value, np.ndarray):
+            # Shared between requests, nobody may modify it in place
+            value.flags.writeable = False
+
+        with self.lock:
+            self.check_generation()
+            if key in self.entries:
+                self.remove(key)
+
+            now = monotonic()
+            candidate_frequency = self.sketch.estimate(key)
+            victims, freed = [], 0
+            for victim_key, (_, victim_nbytes, expires_at, _) in self.entries.items():
+                if self.nbytes - freed + nbytes <= self.max_bytes:
+                    break
+                if expires_at > now and self.sketch.estimate(victim_key) > candidate_frequency:
+                    self.counts["rejections"] += 1
+                    return False
+                victims.append(victim_key)
+                freed += victim_nbytes
+
+            for victim_key in victims:
+                self.remove(victim_key)
+                self.counts["evictions"] += 1
+            self.entries[key] = (value, nbytes, now + ttl, self.region_generation(key))
+            self.nbytes += nbytes
+            return True
+
+    def touch(self, key, ttl):
+        """
+        Extend a live entry to ttl seconds (capped at the L1 TTL) once half of that is used up, as its
+        Redis copy slides. Returns True if it was extended.
+        """
+        ttl = min(ttl, self.ttl)
+        with self.lock:
+            entry = self.entries.get(key)
+            now = monotonic()
+            if entry is None or entry[2] <= now or entry[2] - now > ttl / 2:
+                return False
+            self.entries[key] = (entry[0], entry[1], now + ttl, entry[3])
+            return True
+
+    def discard(self, predicate):
+        """Drop the entries whose key matches predicate, e.g. after a cache purge, and return their keys"""
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                self.remove(key)
+        return keys
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, entries=len(self.entries), bytes=self.nbytes, max_bytes=self.max_bytes)
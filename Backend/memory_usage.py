@@ -0,0 +1,336 @@
+"""
+Memory accounting of the requests and of the named stages of the data path.
+
+Every request and every metrics.stage() records two peaks above its start: of the process RSS,
+which also covers the pyarrow / pandas buffers, and, with MEMORY_TRACEMALLOC=true, of the Python
+allocations tracemalloc traces (numpy arrays included), which costs some speed. Both are process-wide,
+so a request that overlaps with others is charged with their allocations too: the numbers are upper
+bounds. The RSS is sampled every MEMORY_SAMPLE_INTERVAL seconds while requests run and at the start
+and end of every request and stage.
+
+A request above MEMORY_LOG_MB is logged with its stage breakdown, and the peaks are exported as the
+http_request_memory_peak_bytes and stage_memory_peak_bytes histograms of /metrics.
+
+MEMORY_LIMITS sets soft limits per endpoint or path in MB, e.g.
+    MEMORY_LIMITS=/api/downloadFullChromosome3DDistanceData=4096,/api/getBeadDistribution=2048,*=8192
+The requests of a limited endpoint are admitted while the predicted peaks of its running requests
+stay under the limit. The prediction is the 90th percentile of its recent peaks per squared region
+width (the matrices grow with the square of the bead count), times the squared width of the request.
+A request that does not fit waits up to MEMORY_QUEUE_TIMEOUT seconds for running ones to finish, or
+with MEMORY_LIMIT_ACTION=reject is answered with 503 right away. One request of an endpoint is always
+admitted, however large, so a limit below a single request does not lock the endpoint out.
+"""
+import os
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic, sleep
+from flask import jsonify, request
+
+
+MEMORY_TRACKING_ENABLED = os.getenv("MEMORY_TRACKING_ENABLED", "true").lower() == "true"
+MEMORY_TRACEMALLOC = os.getenv("MEMORY_TRACEMALLOC", "false").lower() == "true"
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", 0.05))
+MEMORY_LOG_MB = float(os.getenv("MEMORY_LOG_MB", 256))
+MEMORY_LIMIT_ACTION = os.getenv("MEMORY_LIMIT_ACTION", "queue")
+MEMORY_QUEUE_TIMEOUT = float(os.getenv("MEMORY_QUEUE_TIMEOUT", 30))
+# Recent peaks per endpoint the prediction is made from
+MEMORY_HISTORY = 50
+BEAD_SIZE = 5000
+
+MB = 1024 * 1024
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def parse_limits(value):
+    """{endpoint or path: bytes} of a comma separated list of name=MB pairs"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, megabytes = item.rpartition("=")
+        limits[name.strip()] = float(megabytes) * MB
+    return limits
+
+
+MEMORY_LIMITS = parse_limits(os.getenv("MEMORY_LIMITS", ""))
+
+
+def rss_bytes():
+    """Resident set size of this process, 0 where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class Usage:
+    """Memory of a request or a stage, peaks in bytes above the process totals at its start"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rss_start = rss_bytes()
+        self.traced_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.rss_peak = 0
+        self.traced_peak = 0
+        self.rss_delta = 0
+        # Peak of each stage run within a request, the largest run of a stage
+        self.stages = {}
+
+    @property
+    def peak(self):
+        """The traced peak when tracemalloc runs, it is exact for numpy, the RSS peak otherwise"""
+        return self.traced_peak if self.traced_start is not None else self.rss_peak
+
+    def update(self, rss, traced_peak):
+        self.rss_peak = max(self.rss_peak, rss - self.rss_start)
+        if traced_peak is not None and self.traced_start is not None:
+            self.traced_peak = max(self.traced_peak, traced_peak - self.traced_start)
+
+    def describe(self):
+        return {
+            "peak_bytes": self.peak,
+            "rss_peak_bytes": self.rss_peak,
+            "rss_delta_bytes": self.rss_delta,
+            "traced_peak_bytes": self.traced_peak if self.traced_start is not None else None,
+            "stages": dict(self.stages),
+        }
+
+
+open_usages = set()
+usages_lock = threading.Lock()
+sampler = None
+
+
+def fold():
+    """Charge the process peaks since the last fold to every open request and stage"""
+    rss = rss_bytes()
+    with usages_lock:
+        traced_peak = None
+        if tracemalloc.is_tracing():
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        for usage in open_usages:
+            usage.update(rss, traced_peak)
+    return rss
+
+
+def sample_forever():
+    while True:
+        sleep(MEMORY_SAMPLE_INTERVAL)
+        if open_usages:
+            fold()
+
+
+def open_usage(name):
+    global sampler
+    # The peak so far belongs to the usages already open
+    fold()
+    usage = Usage(name)
+    with usages_lock:
+        open_usages.add(usage)
+        if sampler is None:
+            sampler = threading.Thread(target=sample_forever, name="memory-sampler", daemon=True)
+            sampler.start()
+    return usage
+
+
+def close_usage(usage):
+    rss = fold()
+    with usages_lock:
+        open_usages.discard(usage)
+    usage.rss_delta = rss - usage.rss_start
+
+
+# Memory of the request being served, set by the before_request hook
+request_usage = ContextVar("request_usage", default=None)
+
+
+@contextmanager
+def track(name):
+    """Record the memory of the enclosed block, yields its Usage (None with tracking off)"""
+    if not MEMORY_TRACKING_ENABLED:
+        yield None
+        return
+    usage = open_usage(name)
+    try:
+        yield usage
+    finally:
+        close_usage(usage)
+        parent = request_usage.get()
+        if parent is not None:
+            parent.stages[name] = max(parent.stages.get(name, 0), usage.peak)
+
+
+def region_size(current_request):
+    """Squared bead count of the requested region, 1 when the request names none"""
+    start, end = current_request.args.get("start", type=int), current_request.args.get("end", type=int)
+    if start is None or end is None:
+        body = current_request.get_json(silent=True) if current_request.is_json else None
+        sequences = body.get("sequences") if isinstance(body, dict) else None
+        if isinstance(sequences, dict):
+            start, end = sequences.get("start"), sequences.get("end")
+    try:
+        beads = max(1.0, (float(end) - float(start)) / BEAD_SIZE)
+    except (TypeError, ValueError):
+        return 1.0
+    return beads * beads
+
+
+class EndpointBudget:
+    """Recent peaks and running requests of one endpoint, and its admission under the soft limit"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.ratios = deque(maxlen=MEMORY_HISTORY)
+        # Predicted bytes of the running requests
+        self.running = {}
+        self.condition = threading.Condition()
+        self.counts = {"admitted": 0, "queued": 0, "rejected": 0}
+        self.last_peak = None
+
+    def predict(self, size):
+        with self.condition:
+            ratios = sorted(self.ratios)
+        if not ratios:
+            return None
+        return ratios[min(len(ratios) - 1, int(len(ratios) * 0.9))] * size
+
+    def fits(self, predicted):
+        return not self.running or self.limit is None or predicted is None or \
+            sum(self.running.values()) + predicted <= self.limit
+
+    def admit(self, token, predicted):
+        """True when the request may run, waiting for room up to MEMORY_QUEUE_TIMEOUT unless the action is reject"""
+        with self.condition:
+            if not self.fits(predicted):
+                if MEMORY_LIMIT_ACTION == "reject":
+                    self.counts["rejected"] += 1
+                    return False
+                self.counts["queued"] += 1
+                deadline = monotonic() + MEMORY_QUEUE_TIMEOUT
+                while not self.fits(predicted):
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.counts["rejected"] += 1
+                        return False
+                    self.condition.wait(remaining)
+            self.counts["admitted"] += 1
+            self.running[token] = predicted or 0
+            return True
+
+    def release(self, token):
+        with self.condition:
+            if self.running.pop(token, None) is not None:
+                self.condition.notify_all()
+
+    def record(self, peak, size):
+        with self.condition:
+            self.ratios.append(peak / size)
+            self.last_peak = peak
+
+    def describe(self):
+        with self.condition:
+            return dict(self.counts, limit_bytes=self.limit, running=len(self.running),
+                        running_predicted_bytes=sum(self.running.values()), last_peak_bytes=self.last_peak,
+                        samples=len(self.ratios))
+
+
+budgets = {}
+budgets_lock = threading.Lock()
+
+
+def budget_of(endpoint, path):
+    with budgets_lock:
+        budget = budgets.get(endpoint)
+        if budget is None:
+            limit = MEMORY_LIMITS.get(endpoint, MEMORY_LIMITS.get(path, MEMORY_LIMITS.get("*")))
+            budget = budgets[endpoint] = EndpointBudget(limit)
+        return budget
+
+
+def stats():
+    with budgets_lock:
+        endpoints = dict(budgets)
+    return {
+        "rss_bytes": rss_bytes(),
+        "tracemalloc": tracemalloc.is_tracing(),
+        "traced_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        "action": MEMORY_LIMIT_ACTION,
+        "endpoints": {endpoint: budget.describe() for endpoint, budget in sorted(endpoints.items())},
+    }
+
+
+# (budget, admission token, region size) of the request being served
+request_admission = ContextVar("request_admission", default=None)
+
+
+def init_app(app):
+    """Account the memory of the requests of a Flask app and enforce MEMORY_LIMITS"""
+    if not MEMORY_TRACKING_ENABLED:
+        return
+    if MEMORY_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    def begin_request():
+        request_usage.set(None)
+        request_admission.set(None)
+        if request.endpoint is None:
+            return None
+        budget = budget_of(request.endpoint, request.path)
+        size = region_size(request)
+        token = object()
+        if not budget.admit(token, budget.predict(size)):
+            response = jsonify({"error": "The server is short of memory for this request, retry later"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(max(1, int(MEMORY_QUEUE_TIMEOUT)))
+            return response
+        request_admission.set((budget, token, size))
+        request_usage.set(open_usage(request.endpoint))
+        return None
+
+    def settle(usage, admission, method, path):
+        """Record the peak of a finished request and release its admission"""
+        close_usage(usage)
+        budget, token, size = admission
+        budget.record(usage.peak, size)
+        budget.release(token)
+        if usage.peak >= MEMORY_LOG_MB * MB:
+            stages = ", ".join(f"{name} {peak / MB:.0f} MB" for name, peak in
+                               sorted(usage.stages.items(), key=lambda item: item[1], reverse=True))
+            print(f"Memory of {method} {path}: peak {usage.peak / MB:.0f} MB, "
+                  f"RSS {usage.rss_delta / MB:+.0f} MB ({stages or 'no stages'})")
+
+    def finish_request(response):
+        usage = request_usage.get()
+        admission = request_admission.get()
+        if usage is None or admission is None:
+            return response
+        # Handed over, end_request must not release the admission of a response still being sent
+        request_usage.set(None)
+        request_admission.set(None)
+        if response.is_streamed:
+            # A streamed export produces its data while it is sent, after the view returned
+            method, path = request.method, request.path
+            response.call_on_close(lambda: settle(usage, admission, method, path))
+        else:
+            settle(usage, admission, request.method, request.path)
+        return response
+
+    def end_request(exception=None):
+        # Only left for requests that never reached finish_request
+        admission = request_admission.get()
+        if admission is not None:
+            budget, token, _ = admission
+            budget.release(token)
+            request_admission.set(None)
+        usage = request_usage.get()
+        if usage is not None:
+            with usages_lock:
+                open_usages.discard(usage)
+            request_usage.set(None)
+
+    app.before_request(begin_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
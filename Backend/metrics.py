@@ -0,0 +1,325 @@
+"""
+Process metrics in the Prometheus text exposition format.
+
+Latency histograms per endpoint and per named stage of the 3D data path (db_fetch, decode,
+squareform, serialize, fold, ...), counters of the Redis cache lookups per key family, and gauges
+read at scrape time (connection pool, active folds). The metrics live in the memory of the worker
+process; GET /metrics renders them for clients in METRICS_ALLOWED_NETWORKS (loopback by default),
+so the endpoint is not reachable through the public API.
+"""
+import ipaddress
+import os
+import re
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from flask import Response, request
+import memory_usage
+from tracing import span
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+
+def parse_networks(value):
+    """Networks of a comma separated list, e.g. 127.0.0.0/8,10.0.0.0/8"""
+    return [ipaddress.ip_network(network.strip()) for network in value.split(",") if network.strip()]
+
+
+METRICS_ALLOWED_NETWORKS = parse_networks(os.getenv("METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128"))
+# Upper bounds in seconds, from cache hits (sub-millisecond) to sBIF runs (minutes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Upper bounds in bytes, from 1 MB to 16 GB
+MEMORY_BUCKETS = tuple(2 ** exponent for exponent in range(20, 35))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def header(self):
+        return [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total {self.kind}"]
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + [
+            f"{self.name}_total{format_labels(self.label_names, labels)} {format_value(value)}" for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}" for labels, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            # per label set: [count per bucket (non-cumulative, last one is +Inf), sum]
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def render(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        lines = self.header()
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests by endpoint", ("endpoint", "method", "status")
+))
+stage_duration = registry.register(Histogram(
+    "stage_duration_seconds", "Latency of the named stages of the data path", ("stage",)
+))
+redis_cache_lookups = registry.register(Counter(
+    "redis_cache_lookups", "Redis cache lookups by key family and result (hit, miss)", ("family", "result")
+))
+active_folds = registry.register(Gauge("active_folds", "sBIF folds running in this process"))
+active_folds.set(0)
+request_memory = registry.register(Histogram(
+    "http_request_memory_peak_bytes", "Peak memory of the HTTP requests above their start by endpoint",
+    ("endpoint",), buckets=MEMORY_BUCKETS,
+))
+stage_memory = registry.register(Histogram(
+    "stage_memory_peak_bytes", "Peak memory of the named stages of the data path above their start", ("stage",),
+    buckets=MEMORY_BUCKETS,
+))
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the data path, e.g. `with stage("db_fetch"):`, also recorded as a tracing span.
+    Its peak memory goes to the span, the stage_memory histogram and the request's breakdown.
+    """
+    with span(name) as attributes:
+        with memory_usage.track(name) as usage:
+            if not METRICS_ENABLED:
+                yield
+            else:
+                with stage_duration.time(name):
+                    yield
+        if usage is not None:
+            attributes["memory_peak_bytes"] = usage.peak
+            if METRICS_ENABLED:
+                stage_memory.observe(usage.peak, name)
+
+
+def key_family(key):
+    """Family of a region cache key: its custom name with the sample ids folded, e.g. 3d_N_position_data"""
+    return re.sub(r"(^|_)\d+(?=_|$)", r"\1N", key.rsplit(":", 1)[-1])
+
+
+def count_redis_lookup(key, hit):
+    if METRICS_ENABLED:
+        redis_cache_lookups.inc(key_family(key), "hit" if hit else "miss")
+
+
+# psycopg_pool statistics: (stat, metric name, kind, scale)
+POOL_STATS = (
+    ("pool_min", "db_pool_min_connections", "gauge", 1),
+    ("pool_max", "db_pool_max_connections", "gauge", 1),
+    ("pool_size", "db_pool_connections", "gauge", 1),
+    ("pool_available", "db_pool_available_connections", "gauge", 1),
+    ("requests_waiting", "db_pool_requests_waiting", "gauge", 1),
+    ("requests_num", "db_pool_requests_total", "counter", 1),
+    ("requests_queued", "db_pool_requests_queued_total", "counter", 1),
+    ("requests_wait_ms", "db_pool_requests_wait_seconds_total", "counter", 0.001),
+    ("requests_errors", "db_pool_requests_errors_total", "counter", 1),
+    ("connections_num", "db_pool_connections_opened_total", "counter", 1),
+)
+
+
+class PoolStats:
+    """Renders the statistics of the psycopg_pool connection pools at scrape time, labelled by pool name"""
+
+    def __init__(self):
+        self.pools = {}
+
+    def render(self):
+        stats = {}
+        for name, pool in sorted(self.pools.items()):
+            try:
+                stats[name] = pool.get_stats()
+            except Exception:
+                continue
+        if not stats:
+            return []
+        lines = []
+        for stat, metric_name, kind, scale in POOL_STATS:
+            lines.append(f"# TYPE {metric_name} {kind}")
+            for name, pool_stats in stats.items():
+                lines.append(f'{metric_name}{format_labels(("pool",), (name,))} {format_value(pool_stats.get(stat, 0) * scale)}')
+        return lines
+
+
+pool_stats = registry.register(PoolStats())
+
+
+def register_pool(name, pool):
+    pool_stats.pools[name] = pool
+
+
+class MemoryStats:
+    """Renders the process RSS and the memory admissions per endpoint at scrape time"""
+
+    def render(self):
+        stats = memory_usage.stats()
+        lines = [
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {stats['rss_bytes']}",
+        ]
+        if stats["traced_bytes"] is not None:
+            lines += ["# TYPE process_traced_memory_bytes gauge", f"process_traced_memory_bytes {stats['traced_bytes']}"]
+        lines.append("# TYPE memory_admissions_total counter")
+        for endpoint, budget in stats["endpoints"].items():
+            for result in ("admitted", "queued", "rejected"):
+                lines.append(f'memory_admissions_total{format_labels(("endpoint", "result"), (endpoint, result))} '
+                             f"{budget[result]}")
+        return lines
+
+
+registry.register(MemoryStats())
+
+
+# Start of the request being served, set by the before_request hook
+request_start = ContextVar("request_start", default=None)
+
+
+def is_allowed(address, networks=METRICS_ALLOWED_NETWORKS):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def init_app(app, current_request=request, response_class=Response):
+    """Measure the requests of a Flask app, or of a Quart app given quart.request and quart.Response, and serve /metrics"""
+    if not METRICS_ENABLED:
+        return
+
+    def begin_request():
+        request_start.set(perf_counter())
+
+    def finish_request(response):
+        start = request_start.get()
+        if start is not None and current_request.endpoint is not None:
+            request_duration.observe(
+                perf_counter() - start, current_request.endpoint, current_request.method, str(response.status_code)
+            )
+        # Closed by the memory_usage hook, which runs first as it is registered later
+        usage = memory_usage.request_usage.get()
+        if usage is not None and current_request.endpoint is not None:
+            request_memory.observe(usage.peak, current_request.endpoint)
+        return response
+
+    def metrics_view():
+        if not is_allowed(current_request.remote_addr):
+            return response_class("Forbidden\n", status=403, mimetype="text/plain")
+        return response_class(registry.render(), content_type=CONTENT_TYPE)
+
+    app.before_request(begin_request)
+    app.after_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
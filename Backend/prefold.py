@@ -0,0 +1,129 @@
+"""
+Pre-fold scheduler.
+
+The first visitor of a region that is not in calc_distance waits for a full sBIF run. This worker
+folds the most requested (or trending) of those regions ahead of time, during the idle hours and
+within a CPU budget, so that the next visitor finds them in the database. region_retention.py evicts the least recently
+used ensembles once they outgrow their storage budget, a pre-fold counts as an access.
+
+Run it next to the backend (same image, sBIF is built there):
+    python -u prefold.py            # loop forever, folding during PREFOLD_IDLE_HOURS
+    python -u prefold.py --once     # one pass now, regardless of the idle hours
+"""
+import argparse
+import os
+import resource
+from datetime import datetime, timedelta
+from time import sleep, time
+from process import fold_region, region_request_log, db_conn
+from region_requests import CREATE_REGION_REQUESTS_SQL, CREATE_PREFOLD_REGIONS_SQL, PREFOLD_WINDOW_DAYS
+
+
+# Local hours during which pre-folding may run, "start-end" with end exclusive (may wrap midnight)
+PREFOLD_IDLE_HOURS = os.getenv("PREFOLD_IDLE_HOURS", "4-7")
+PREFOLD_TOP_N = int(os.getenv("PREFOLD_TOP_N", 10))
+PREFOLD_TRENDING_HOURS = int(os.getenv("PREFOLD_TRENDING_HOURS", 24))
+PREFOLD_TRENDING_WEIGHT = float(os.getenv("PREFOLD_TRENDING_WEIGHT", 3))
+# CPU seconds (user + system, summed over sBIF threads) one idle window may spend
+PREFOLD_CPU_BUDGET = float(os.getenv("PREFOLD_CPU_BUDGET", 4 * 3600))
+PREFOLD_THREADS = int(os.getenv("PREFOLD_THREADS", 8))
+PREFOLD_CHECK_INTERVAL = int(os.getenv("PREFOLD_CHECK_INTERVAL", 300))
+# sBIF folds every file in its input folder, so pre-folds never share the request path's folder
+PREFOLD_INPUT_PATH = os.getenv("PREFOLD_INPUT_PATH", "./Prefold_input")
+
+
+def parse_idle_hours(value):
+    start, end = (int(hour) for hour in value.split("-"))
+    return start, end
+
+
+def in_idle_hours(now, idle_hours):
+    start, end = idle_hours
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def ensure_tables():
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_REGION_REQUESTS_SQL)
+            cur.execute(CREATE_PREFOLD_REGIONS_SQL)
+        conn.commit()
+
+
+def prune_requests():
+    """The requests older than the window are never read again, without this region_requests grows forever"""
+    try:
+        deleted = region_request_log.prune(PREFOLD_WINDOW_DAYS)
+    except Exception as e:
+        print(f"Pruning region requests failed: {e}")
+        return
+    if deleted:
+        print(f"Deleted {deleted} region requests older than {PREFOLD_WINDOW_DAYS} days")
+
+
+def run_once(cpu_budget, should_continue=lambda: True):
+    """Fold the top candidates until the budget is spent, returns the CPU seconds used"""
+    spent = 0.0
+    candidates = region_request_log.candidates(
+        PREFOLD_TOP_N, PREFOLD_WINDOW_DAYS, PREFOLD_TRENDING_HOURS, PREFOLD_TRENDING_WEIGHT
+    )
+    for cell_line, chromosome_name, sequences in candidates:
+        if spent >= cpu_budget or not should_continue():
+            break
+
+        print(f"Pre-folding {cell_line} {chromosome_name}:{sequences['start']}-{sequences['end']}")
+        cpu_before, t1 = children_cpu_seconds(), time()
+        try:
+            folded = fold_region(
+                cell_line, chromosome_name, sequences, input_path=PREFOLD_INPUT_PATH, threads=PREFOLD_THREADS, wait=True
+            )
+        except Exception as e:
+            print(f"Pre-folding failed: {e}")
+            continue
+        cpu_seconds = children_cpu_seconds() - cpu_before
+        spent += cpu_seconds
+        region_request_log.record_prefold(cell_line, chromosome_name, sequences, folded, cpu_seconds)
+        print(f"Pre-folded in {time() - t1:.1f} seconds, {cpu_seconds:.1f} CPU seconds")
+
+    return spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run a single pass now and exit")
+    args = parser.parse_args()
+
+    ensure_tables()
+    if args.once:
+        prune_requests()
+        run_once(PREFOLD_CPU_BUDGET)
+        print(region_request_log.stats())
+        return
+
+    idle_hours = parse_idle_hours(PREFOLD_IDLE_HOURS)
+    # The budget is per idle window, keyed by the date the window started
+    window, spent = None, 0.0
+    while True:
+        now = datetime.now()
+        if in_idle_hours(now, idle_hours):
+            started = (now - timedelta(hours=idle_hours[0])).date()
+            if started != window:
+                window, spent = started, 0.0
+                prune_requests()
+            if spent < PREFOLD_CPU_BUDGET:
+                spent += run_once(
+                    PREFOLD_CPU_BUDGET - spent, lambda: in_idle_hours(datetime.now(), idle_hours)
+                )
+                print(region_request_log.stats())
+        sleep(PREFOLD_CHECK_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
-from flask import send_file
+from flask import Response, send_file
 import numpy as np
-from scipy.sparse import csr_matrix, save_npz
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
+import contextvars
 import pandas as pd
+import io
 import os
 import re
-import tempfile
 import subprocess
 import redis
 import psycopg
@@ -14,12 +14,50 @@ from psycopg_pool import ConnectionPool
 from itertools import combinations
 import math
 import json
+import orjson
 from scipy.spatial.distance import squareform, pdist
+from scipy.sparse import load_npz
 from dotenv import load_dotenv
-from time import time
+from time import perf_counter_ns, time_ns
+import pyarrow as pa
 import pyarrow.feather as feather
+import pyarrow.csv as pa_csv
 from concurrent.futures import ThreadPoolExecutor
 from cell_line_labels import label_mapping
+from data_generation import DataGeneration, RegionGenerations
+from region_cache import RegionCache
+from region_requests import RegionRequestLog
+from region_retention import RegionAccessLog, create_partitions
+from l1_cache import L1Cache
+from disk_cache import DiskCache
+from export_cache import ExportCache, export_key
+from cache_access import CacheSession
+import cache_policy
+import metrics
+import slow_queries
+import tracing
+from metrics import stage
+from exports import (
+    COLUMNAR_FORMATS,
+    ENSEMBLE_SAMPLES,
+    EXPORT_BATCH_SAMPLES,
+    EXPORT_FILE_TYPES,
+    EXPORT_IDLE_TIMEOUT_MS,
+    EXPORT_STATEMENT_TIMEOUT_MS,
+    POSITION_SCHEMA,
+    columnar_stream,
+    condensed_beads,
+    condensed_block,
+    dictionary_schema,
+    distance_record_batch,
+    distance_schema,
+    gzip_stream,
+    npz_stream,
+    rows_record_batch,
+    sample_batches,
+    selection_key,
+    table_sample_batches,
+)
 from scipy.stats import ttest_ind
 import glob
 
@@ -45,11 +83,17 @@ conn_pool = ConnectionPool(
     min_size=5,
     max_size=50,
     max_waiting=20,
+    configure=slow_queries.configure_connection,
 )
+metrics.register_pool("sync", conn_pool)
 
 # Create a Redis connection pool
 redis_pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
-redis_client = redis.Redis(connection_pool=redis_pool)
+redis_client = tracing.TracedRedis(connection_pool=redis_pool)
+
+# sBIF folding input folder and default thread count (see sBIF.sh)
+FOLDING_INPUT_PATH = "./Folding_input"
+SBIF_THREADS = 50
 
 """
 Read feather file using pandas
@@ -76,14 +120,102 @@ def get_cell_line_table_name(cell_line):
 
 
 """
-Establish a connection pool to the database.
+Establish a connection pool to the database, the wait for a free connection is measured as the pool_wait stage.
 """
 @contextmanager
 def db_conn():
-    with conn_pool.connection() as conn:
+    with ExitStack() as stack:
+        with stage("pool_wait"):
+            conn = stack.enter_context(conn_pool.connection())
         yield conn
 
 
+# Data generation shared by the HTTP and data caches
+data_generation = DataGeneration(db_conn)
+
+# Per-region counters the retention job bumps when it evicts an ensemble, invalidating only that region
+region_generations = RegionGenerations(db_conn)
+
+# History of the 3D region requests, drives the pre-fold scheduler
+region_request_log = RegionRequestLog(db_conn)
+
+# Last access of the folded regions, the retention job evicts the least recently used ones
+region_access_log = RegionAccessLog(db_conn)
+
+# Decoded 3D matrices and positions of the hottest regions, in front of Redis
+l1_cache = L1Cache(data_generation, region_generations=region_generations)
+
+# Local disk copies of the same payloads, behind Redis and in front of Postgres and the feather files
+disk_cache = DiskCache(data_generation, region_generations=region_generations)
+
+# Generated ensemble downloads, served from local disk when they are downloaded again
+export_cache = ExportCache(data_generation, region_generations=region_generations)
+
+
+"""
+Start a cache session that batches the Redis reads and writes of one request
+"""
+def cache_session():
+    return CacheSession(redis_client, l1_cache, disk_cache)
+
+
+"""
+Returns the hit, miss and eviction counts and the size of the in-process L1 cache
+"""
+def l1_cache_stats():
+    return l1_cache.stats()
+
+
+"""
+Returns the hit, miss and eviction counts and the size of the on-disk L2 cache
+"""
+def disk_cache_stats():
+    return disk_cache.stats()
+
+
+"""
+Returns the hit, miss and eviction counts and the size of the export artifact cache
+"""
+def export_cache_stats():
+    return export_cache.stats()
+
+
+"""
+Returns the policy and the write, hit, miss, refresh and skipped-payload counts of every Redis key family
+"""
+def redis_cache_stats():
+    return cache_policy.stats()
+
+
+"""
+Returns the calls, time and slow calls of the statements run by this worker, most total time first
+"""
+def slow_query_stats(limit=100):
+    return slow_queries.stats(limit)
+
+
+"""
+Returns the resident keys and bytes per Redis key family and the largest keys
+"""
+def inspect_redis_cache(family=None, match="*", limit=50):
+    return cache_policy.inspect(redis_client, family, match, limit)
+
+
+"""
+Deletes the Redis keys of a family and / or matching a glob pattern and their L1 copies in this worker,
+and bumps the generation of their regions so the disk cache and the other workers stop serving them
+"""
+def purge_redis_cache(family=None, match=None):
+    return cache_policy.purge(redis_client, family, match, l1_cache, region_generations)
+
+
+"""
+Evicts the coldest keys of the Redis key families above their byte budget
+"""
+def enforce_redis_cache_budgets():
+    return cache_policy.enforce_budgets(redis_client)
+
+
 """
 Return the list of genes
 """
@@ -161,6 +293,13 @@ def chromosomes_list(cell_line):
             )
             chromosomes = [row["chrid"] for row in cur.fetchall()]
 
+    return sort_chromosomes(chromosomes)
+
+
+"""
+Sort chromosome names numerically (chr1, chr2, ..., chrX) and format them as options
+"""
+def sort_chromosomes(chromosomes):
     def sort_key(chromosome):
         match = re.match(r"chr(\d+|\D+)", chromosome)
         if match:
@@ -226,30 +365,6 @@ def chromosome_original_valid_sequences(cell_line, chromosome_name):
 Returns the all valid merged sequences of the chromosome data in the given cell line, chromosome name
 """
 def chromosome_merged_valid_sequences(cell_line, chromosome_name):
-    def merge_intervals(intervals):
-        if not intervals:
-            return []
-
-        intervals.sort(key=lambda x: x["start_value"])
-
-        merged = []
-        current_start = intervals[0]["start_value"]
-        current_end = intervals[0]["end_value"]
-
-        for interval in intervals[1:]:
-            start = interval["start_value"]
-            end = interval["end_value"]
-
-            if start <= current_end:
-                current_end = max(current_end, end)
-            else:
-                merged.append({"start": current_start, "end": current_end})
-                current_start = start
-                current_end = end
-
-        merged.append({"start": current_start, "end": current_end})
-        return merged
-
     with db_conn() as conn:
         with conn.cursor(row_factory=dict_row) as cur:
             cur.execute(
@@ -269,6 +384,34 @@ def chromosome_merged_valid_sequences(cell_line, chromosome_name):
     return merged_valid_regions
 
 
+"""
+Merge overlapping valid region rows into continuous {start, end} sequences
+"""
+def merge_intervals(intervals):
+    if not intervals:
+        return []
+
+    intervals.sort(key=lambda x: x["start_value"])
+
+    merged = []
+    current_start = intervals[0]["start_value"]
+    current_end = intervals[0]["end_value"]
+
+    for interval in intervals[1:]:
+        start = interval["start_value"]
+        end = interval["end_value"]
+
+        if start <= current_end:
+            current_end = max(current_end, end)
+        else:
+            merged.append({"start": current_start, "end": current_end})
+            current_start = start
+            current_end = end
+
+    merged.append({"start": current_start, "end": current_end})
+    return merged
+
+
 """
 Return the chromosome size in the given gene name
 """
@@ -292,74 +435,118 @@ def chromosome_size_by_gene_name(gene_name):
 
 
 """
-Returns the existing chromosome data in the given cell line, chromosome name, start, end
+Returns the query and parameters of the (ibp, jbp, fq, fdr, rawc) Hi-C contacts with both ends in [start, end],
+leaving out the contacts with both ends in the exclude range that the region cache already holds
 """
-def chromosome_data(cell_line, chromosome_name, sequences):
+def contact_rows_query(cell_line, chromosome_name, start, end, exclude=None):
     if cell_line not in label_mapping:
         raise ValueError(f"Cell line '{cell_line}' not found in label_mapping")
-    
+
     table_name = get_cell_line_table_name(cell_line)
-    
+    query = f"""
+        SELECT ibp, jbp, fq, fdr, rawc
+        FROM {table_name}
+        WHERE chrid = %s
+        AND ibp >= %s
+        AND ibp <= %s
+        AND jbp >= %s
+        AND jbp <= %s
+    """
+    params = [chromosome_name, start, end, start, end]
+    if exclude is not None:
+        query += "AND NOT (ibp >= %s AND ibp <= %s AND jbp >= %s AND jbp <= %s)"
+        params += [exclude[0], exclude[1], exclude[0], exclude[1]]
+
+    return query, params
+
+
+"""
+Returns the (ibp, jbp, fq, fdr, rawc) Hi-C contacts with both ends in [start, end], except the exclude range
+"""
+def fetch_contact_rows(cell_line, chromosome_name, start, end, exclude=None):
+    query, params = contact_rows_query(cell_line, chromosome_name, start, end, exclude)
+
     with db_conn() as conn:
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(
-                f"""
-                SELECT %s as cell_line, chrid, fdr, ibp, jbp, fq, rawc
-                FROM {table_name}
-                WHERE chrid = %s
-                AND ibp >= %s
-                AND ibp <= %s
-                AND jbp >= %s
-                AND jbp <= %s
-            """,
-                (
-                    cell_line,
-                    chromosome_name,
-                    sequences["start"],
-                    sequences["end"],
-                    sequences["start"],
-                    sequences["end"],
-                ),
-            )
-            chromosome_sequence = cur.fetchall()
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+    return rows
+
 
-    return chromosome_sequence
+# Hi-C contacts of recently viewed regions, sub-ranges are sliced out without a query
+region_cache = RegionCache(fetch_contact_rows, data_generation)
+
+
+"""
+Returns the contact records of the chromosome data out of region cache columns
+"""
+def contact_records(cell_line, chromosome_name, columns):
+    return [
+        {"cell_line": cell_line, "chrid": chromosome_name, "fdr": fdr, "ibp": ibp, "jbp": jbp, "fq": fq, "rawc": rawc}
+        for ibp, jbp, fq, fdr, rawc in zip(
+            columns["ibp"].tolist(),
+            columns["jbp"].tolist(),
+            columns["fq"].tolist(),
+            columns["fdr"].tolist(),
+            columns["rawc"].tolist(),
+        )
+    ]
+
+
+"""
+Returns the distinct valid ibp values out of region cache columns
+"""
+def valid_ibps(columns):
+    return np.unique(columns["ibp"]).tolist()
+
+
+"""
+Returns the existing chromosome data in the given cell line, chromosome name, start, end
+"""
+def chromosome_data(cell_line, chromosome_name, sequences):
+    columns = region_cache.get(cell_line, chromosome_name, sequences["start"], sequences["end"])
+
+    return contact_records(cell_line, chromosome_name, columns)
 
 
 """
 Returns the existing chromosome data in the given cell line, chromosome name, start, end
 """
 def chromosome_valid_ibp_data(cell_line, chromosome_name, sequences):
-    if cell_line not in label_mapping:
-        raise ValueError(f"Cell line '{cell_line}' not found in label_mapping")
-    
-    table_name = get_cell_line_table_name(cell_line)
-    
-    with db_conn() as conn:
-        with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(
-                f"""
-                    SELECT DISTINCT ibp
-                    FROM {table_name}
-                    WHERE chrid = %s
-                    AND ibp >= %s
-                    AND ibp <= %s
-                    AND jbp >= %s
-                    AND jbp <= %s
-                """,
-                (
-                    chromosome_name,
-                    sequences["start"],
-                    sequences["end"],
-                    sequences["start"],
-                    sequences["end"],
-                ),
-            )
-            chromosome_valid_ibps = cur.fetchall()
+    columns = region_cache.get(cell_line, chromosome_name, sequences["start"], sequences["end"])
 
-    ibp_values = [ibp["ibp"] for ibp in chromosome_valid_ibps]
+    return valid_ibps(columns)
 
-    return ibp_values
+
+"""
+Returns how many first visits the pre-folded regions saved
+"""
+def prefold_stats():
+    return region_request_log.stats()
+
+
+"""
+Returns the hit, partial hit and miss counts and the size of the Hi-C region cache
+"""
+def region_cache_stats():
+    return region_cache.stats()
+
+
+"""
+Decode a calc_distance row into full avg, fq and best sample matrices
+"""
+def decode_calc_distance_row(row):
+    avg_half_arr = np.frombuffer(row["avg_distance_vector"], dtype=np.float32)
+    best_half_arr = np.frombuffer(row["best_vector"], dtype=np.float32)
+    avg_full_mat = squareform(avg_half_arr)
+    best_full_mat = squareform(best_half_arr)
+
+    fq_arr = np.frombuffer(row["fq_distance_vector"], dtype=np.float32)
+    n = int(np.sqrt(fq_arr.size))
+    fq_full_mat = fq_arr.reshape(n, n)
+
+    return avg_full_mat, fq_full_mat, best_full_mat
 
 
 """
@@ -389,72 +576,81 @@ def exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name="c
     
     # Establish the progress key for tracking whole progress (use original sample_id)
     progress_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"exist_{original_sample_id}_progress")
-    redis_client.setex(progress_key, 3600, 0)
-
-    def checking_existing_data(cell_line, sample_id):
-        redis_3d_position_data_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_example_{sample_id}_position_data")
-        redis_sample_distance_vector_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_example_distance_vector")
+    cache = cache_session()
+
+    position_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_example_{sample_id}_position_data")
+    sample_distance_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_example_distance_vector")
+    avg_distance_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "avg_distance_example_data")
+    fq_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "fq_example_data")
+    cache_keys = [position_key, sample_distance_key, avg_distance_key, fq_key]
+
+    # Hot example regions are served from L1 alone, only the final progress the frontend polls is written
+    l1_values = [l1_cache.get(key) for key in cache_keys]
+    if all(value is not None for value in l1_values):
+        cache.touch(cache_keys)
+        cache.set_progress(progress_key, 99)
+        cache.flush()
+        position_data, sample_distance_vector, avg_distance_matrix, fq_data = l1_values
+        return {
+            "position_data": position_data,
+            "avg_distance_data": avg_distance_matrix,
+            "fq_data": fq_data,
+            "sample_distance_vector": sample_distance_vector
+        }
 
-        cached_3d_example_position_data = redis_client.get(redis_3d_position_data_key)
-        cached_example_sample_distance_vector = redis_client.get(redis_sample_distance_vector_key)
+    cache.set_progress(progress_key, 0)
 
-        return cached_3d_example_position_data, cached_example_sample_distance_vector
-    
     def get_position_data(cell_line, sid):
-        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_example_{sid}_position_data")
         records = position_df[position_df['sampleid'] == sid].to_dict(orient='records')
-        
-        data_json = json.dumps(records, ensure_ascii=False, default=str)
-        redis_client.setex(cache_key, 3600, data_json.encode("utf-8"))
-        
+
+        data_json = json.dumps(records, ensure_ascii=False, default=str).encode("utf-8")
+        records = orjson.Fragment(data_json)
+        cache.set(position_key, records, data_json)
+
         return records
-    
+
     def get_fq_data(cell_line):
-        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "fq_example_data")
+        if cached_fq_data is not None:
+            return cached_fq_data
+
         full_distance_matrix = np.load(f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_fq_matrix.npy")
-        
-        data_json = json.dumps(full_distance_matrix.tolist(), ensure_ascii=False)
-        redis_client.setex(cache_key, 3600, data_json.encode("utf-8"))
-        
-        return full_distance_matrix.tolist()
+        cache.set(fq_key, full_distance_matrix, orjson.dumps(full_distance_matrix, option=orjson.OPT_SERIALIZE_NUMPY))
+
+        return full_distance_matrix
 
     def get_avg_distance_data(cell_line):
-        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "avg_distance_example_data")
+        if cached_avg_distance_data is not None:
+            return cached_avg_distance_data
 
-        if redis_client.get(cache_key):
-            return json.loads(redis_client.get(cache_key).decode("utf-8"))
-        else:
-            full_distance_matrix = np.load(f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_avg_distance_matrix.npy")
-            
-            data_json = json.dumps(full_distance_matrix.tolist(), ensure_ascii=False)
-            redis_client.setex(cache_key, 3600, data_json.encode("utf-8"))
+        full_distance_matrix = np.load(f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_avg_distance_matrix.npy")
+        cache.set(avg_distance_key, full_distance_matrix, orjson.dumps(full_distance_matrix, option=orjson.OPT_SERIALIZE_NUMPY))
 
-            return full_distance_matrix.tolist()
+        return full_distance_matrix
 
     def get_distance_vector_by_sample(cell_line, sid):
-        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sid}_example_distance_vector")
-        
-        if redis_client.get(cache_key):
-            vec = json.loads(redis_client.get(cache_key).decode("utf-8"))
-            return vec
-        else:
-            vec = np.array(distance_df['distance_vector'].iloc[sid], dtype=float)
-            mat = squareform(vec).tolist()
+        if cached_sample_distance_vector is not None:
+            return cached_sample_distance_vector
 
-            data_json = json.dumps(mat, ensure_ascii=False)
-            redis_client.setex(cache_key, 3600, data_json.encode("utf-8"))
+        vec = np.array(distance_df['distance_vector'].iloc[sid], dtype=float)
+        mat = squareform(vec)
+        cache.set(sample_distance_key, mat, orjson.dumps(mat, option=orjson.OPT_SERIALIZE_NUMPY))
 
-            return mat
-    
-    cached_3d_example_position_data, cached_example_sample_distance_vector = checking_existing_data(cell_line, sample_id)
-    redis_client.setex(progress_key, 3600, 15)
-    if cached_3d_example_position_data and cached_example_sample_distance_vector is not None:
-        position_data = json.loads(cached_3d_example_position_data.decode("utf-8"))
-        sample_distance_vector = json.loads(cached_example_sample_distance_vector.decode("utf-8"))
-        redis_client.setex(progress_key, 3600, 80)
+        return mat
+
+    cached_position_data, cached_sample_distance_vector, cached_avg_distance_data, cached_fq_data = cache.get_many(
+        cache_keys,
+        [orjson.Fragment] * 4,
+        l1_values,
+    )
+    cache.set_progress(progress_key, 15)
+    if cached_position_data and cached_sample_distance_vector is not None:
+        position_data = cached_position_data
+        sample_distance_vector = cached_sample_distance_vector
+        cache.set_progress(progress_key, 80)
         avg_distance_matrix = get_avg_distance_data(cell_line)
         fq_data = get_fq_data(cell_line)
-        redis_client.setex(progress_key, 3600, 99)
+        cache.set_progress(progress_key, 99)
+        cache.flush()
 
         return {
             "position_data": position_data,
@@ -466,6 +662,7 @@ def exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name="c
         pos_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_original_position.feather"
         dist_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_original_distance.feather"
 
+        cache.flush()
         with ThreadPoolExecutor(max_workers=10) as pool:
             fut_pos  = pool.submit(read_feather_pa, pos_path)
             fut_dist = pool.submit(read_feather_pa, dist_path)
@@ -473,17 +670,18 @@ def exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name="c
         position_df = fut_pos.result()
         distance_df = fut_dist.result()
         
-        redis_client.setex(progress_key, 3600, 20)
+        cache.set_progress(progress_key, 20)
 
         position_data = get_position_data(cell_line, sample_id)
-        redis_client.setex(progress_key, 3600, 50)
+        cache.set_progress(progress_key, 50)
 
         avg_distance_matrix = get_avg_distance_data(cell_line)
-        redis_client.setex(progress_key, 3600, 70)
+        cache.set_progress(progress_key, 70)
         
         fq_data = get_fq_data(cell_line)
         sample_distance_vector = get_distance_vector_by_sample(cell_line, sample_id)
-        redis_client.setex(progress_key, 3600, 99)
+        cache.set_progress(progress_key, 99)
+        cache.flush()
 
         return {
                 "position_data": position_data,
@@ -493,40 +691,165 @@ def exist_chromosome_3D_data(cell_line, sample_id, sequences, chromosome_name="c
             }
 
 
+"""
+Filter Hi-C data for significant interactions based on the alpha threshold
+"""
+def get_spe_inter(hic_data, alpha=0.05):
+    hic_spe = hic_data.loc[hic_data["fdr"] < alpha]
+    return hic_spe
+
+
+"""
+Prepare folding input file from the filtered significant interactions
+"""
+def get_fold_inputs(spe_df):
+    spe_out_df = spe_df[["ibp", "jbp", "fq", "chrid", "fdr"]].copy()
+    spe_out_df["w"] = 1
+    result = spe_out_df[["chrid", "ibp", "jbp", "fq", "w"]]
+    return result
+
+
+"""
+Fold the region with sBIF, which writes the samples into position, distance and calc_distance.
+Returns False when the region has no Hi-C contacts to fold.
+sBIF.sh folds every input file in input_path, so concurrent callers must use separate folders.
+With wait=True the sBIF run is reaped before returning, so its CPU time shows up in RUSAGE_CHILDREN.
+"""
+def fold_region(cell_line, chromosome_name, sequences, input_path=FOLDING_INPUT_PATH, threads=SBIF_THREADS, progress_key=None, wait=False):
+    def set_progress(value):
+        if progress_key is not None:
+            redis_client.setex(progress_key, cache_policy.write_ttl(progress_key, cache_policy.payload_nbytes(value)), value)
+
+    if cell_line not in label_mapping:
+        raise ValueError(f"Cell line '{cell_line}' not found in label_mapping")
+
+    table_name = get_cell_line_table_name(cell_line)
+
+    with stage("db_fetch"), db_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(
+            f"""
+                SELECT *
+                FROM {table_name}
+                WHERE chrid = %s
+                AND ibp >= %s
+                AND ibp <= %s
+                AND jbp >= %s
+                AND jbp <= %s
+            """,
+                (
+                    chromosome_name,
+                    sequences["start"],
+                    sequences["end"],
+                    sequences["start"],
+                    sequences["end"],
+                ),
+            )
+            original_data = cur.fetchall()
+    set_progress(10)
+    if not original_data:
+        return False
+
+    # sBIF writes into the region's own partitions, which the retention job drops as a whole
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            create_partitions(cur, (cell_line, chromosome_name, sequences["start"], sequences["end"]))
+        conn.commit()
+
+    original_df = pd.DataFrame(
+        original_data, columns=["chrid", "fdr", "ibp", "jbp", "fq"]
+    )
+
+    filtered_df = get_spe_inter(original_df)
+    fold_inputs = get_fold_inputs(filtered_df)
+
+    txt_data = fold_inputs.to_csv(index=False, sep="\t", header=False)
+    custom_name = (
+        f"{cell_line}.{chromosome_name}.{sequences['start']}.{sequences['end']}"
+    )
+
+    # Ensure the custom path exists, create it if it doesn't
+    os.makedirs(input_path, exist_ok=True)
+
+    # Define the full path where the file will be stored
+    custom_file_path = os.path.join(
+        input_path, custom_name + ".txt"
+    )
+
+    # Write the file to the custom path
+    with open(custom_file_path, "w") as temp_file:
+        temp_file.write(txt_data)
+    set_progress(20)
+    script = "./sBIF.sh"
+    n_samples = ENSEMBLE_SAMPLES
+    n_samples_per_run = 100
+    metrics.active_folds.inc()
+    try:
+        with stage("fold"):
+            result = subprocess.Popen(
+                ["bash", script, str(n_samples), str(n_samples_per_run), str(threads), input_path],
+                text=True,
+                stdout=subprocess.PIPE,
+                bufsize=1,
+            )
+            pattern = re.compile(r'^\[.*DONE\]')
+            progress_values = [50, 90, 91, 92, 93, 94, 95]
+            matches = (line.strip() for line in result.stdout if pattern.match(line))
+            # Every DONE line closes a stage of the sBIF run, recorded as a span of the request's trace
+            stage_start, stage_started = time_ns(), perf_counter_ns()
+            for val, line in zip(progress_values, matches):
+                print(line)
+                elapsed = perf_counter_ns() - stage_started
+                tracing.record_span("sbif.stage", stage_start, elapsed, line=line)
+                stage_start, stage_started = stage_start + elapsed, stage_started + elapsed
+                set_progress(val)
+            if wait:
+                result.communicate()
+    finally:
+        metrics.active_folds.dec()
+    os.remove(custom_file_path)
+
+    return True
+
+
 """
 Returns the example 3D chromosome data in the given cell line, chromosome name, start, end
 """
 def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
-    temp_folding_input_path = "./Folding_input"
-    
     # Establish the progress key for tracking whole progress
     progress_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_progress")
-    redis_client.setex(progress_key, 3600, 0)
+    cache = cache_session()
 
-    def get_spe_inter(hic_data, alpha=0.05):
-        """Filter Hi-C data for significant interactions based on the alpha threshold."""
-        hic_spe = hic_data.loc[hic_data["fdr"] < alpha]
-        return hic_spe
+    redis_3d_position_data_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_{sample_id}_position_data")
+    if sample_id == 0:
+        redis_sample_distance_vector_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "best_corr_data")
+    else:
+        redis_sample_distance_vector_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_distance_vector")
+    avg_distance_data_cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "avg_distance_data")
+    fq_data_cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "fq_data")
+    cache_keys = [redis_3d_position_data_key, redis_sample_distance_vector_key, avg_distance_data_cache_key, fq_data_cache_key]
+    region_access_log.touch(cell_line, chromosome_name, sequences)
+
+    # Hot regions are served from L1 alone, only the final progress the frontend polls is written
+    l1_values = [l1_cache.get(key) for key in cache_keys]
+    if all(value is not None for value in l1_values):
+        cache.touch(cache_keys)
+        cache.set_progress(progress_key, 99)
+        cache.flush()
+        region_request_log.record(cell_line, chromosome_name, sequences, "l1")
+        position_data, sample_distance_vector, avg_distance_matrix, fq_data = l1_values
+        return {
+            "position_data": position_data,
+            "avg_distance_data": avg_distance_matrix,
+            "fq_data": fq_data,
+            "sample_distance_vector": sample_distance_vector
+        }
 
-    def get_fold_inputs(spe_df):
-        """Prepare folding input file from the filtered significant interactions."""
-        spe_out_df = spe_df[["ibp", "jbp", "fq", "chrid", "fdr"]].copy()
-        spe_out_df["w"] = 1
-        result = spe_out_df[["chrid", "ibp", "jbp", "fq", "w"]]
-        return result
+    cache.set_progress(progress_key, 0)
 
     # Check if the data already exists in the redis cache
-    def checking_existing_cache_data(chromosome_name, cell_line, sequences, sample_id):
-        redis_3d_position_data_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_{sample_id}_position_data")
-        if sample_id == 0:
-            redis_sample_distance_vector_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "best_corr_data")
-        else:
-            redis_sample_distance_vector_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_distance_vector")
-        
-        cached_3d_position_data = redis_client.get(redis_3d_position_data_key)
-        cached_sample_distance_vector = redis_client.get(redis_sample_distance_vector_key)
-
-        return cached_3d_position_data, cached_sample_distance_vector
+    def checking_existing_cache_data():
+        return cache.get_many(cache_keys, [orjson.Fragment] * 4, l1_values)
 
     # Check if the data already exists in the database
     def checking_existing_data(chromosome_name, cell_line, sequences):
@@ -564,8 +887,11 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
 
     def get_position_data(chromosome_name, cell_line, sequences, sample_id):
         cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"3d_{sample_id}_position_data")
+        cached_position_data = cache.get_many([cache_key], [orjson.Fragment])[0]
+        if cached_position_data is not None:
+            return cached_position_data
 
-        with db_conn() as conn:
+        with stage("db_fetch"), db_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(
                     """
@@ -582,9 +908,11 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
                 )
                 data = cur.fetchall()
 
-        position_json = json.dumps(data, ensure_ascii=False, default=str)
-        redis_client.setex(cache_key, 3600, position_json.encode("utf-8"))
-        
+        with stage("serialize"):
+            position_json = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        data = orjson.Fragment(position_json)
+        cache.set(cache_key, data, position_json)
+
         return data
 
     # get the average distance data and frequency data of 5000 chain samples
@@ -594,14 +922,15 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
         cache_best_corr_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "best_corr_data")
         cache_best_sample_id_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "best_sample_id")
 
-        if redis_client.get(cache_avg_key) and redis_client.get(cache_fq_key):
-            avg_distance_data = json.loads(redis_client.get(cache_avg_key).decode("utf-8"))
-            fq_data = json.loads(redis_client.get(cache_fq_key).decode("utf-8"))
-            best_corr_data = json.loads(redis_client.get(cache_best_corr_key).decode("utf-8"))
-            best_sample_id = int(redis_client.get(cache_best_sample_id_key).decode("utf-8"))
-            return avg_distance_data, fq_data, best_corr_data, best_sample_id
-        
-        with db_conn() as conn:
+        cached = cache.get_many(
+            [cache_avg_key, cache_fq_key, cache_best_corr_key, cache_best_sample_id_key],
+            [orjson.Fragment, orjson.Fragment, orjson.Fragment, int],
+        )
+        if all(value is not None for value in cached):
+            return tuple(cached)
+
+
+        with stage("db_fetch"), db_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(
                     """
@@ -615,33 +944,25 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
                     (chromosome_name, cell_line, sequences["start"], sequences["end"]),
                 )
                 row = cur.fetchone()
-                raw_avg = row["avg_distance_vector"]
-                raw_fq  = row["fq_distance_vector"]
-                raw_best = row["best_vector"]
-                best_sample_id = row["best_sample_id"]
-
-                avg_half_arr = np.frombuffer(raw_avg, dtype=np.float32)
-                best_half_arr = np.frombuffer(raw_best, dtype=np.float32)
-                avg_full_mat = squareform(avg_half_arr)
-                best_full_mat = squareform(best_half_arr)
-                
-                fq_arr = np.frombuffer(raw_fq, dtype=np.float32)
-                n = int(np.sqrt(fq_arr.size))
-                fq_full_mat = fq_arr.reshape(n, n)
-
-                avg_data_json = json.dumps(avg_full_mat.tolist(), ensure_ascii=False)
-                fq_data_json = json.dumps(fq_full_mat.tolist(), ensure_ascii=False)
-                best_corr_json = json.dumps(best_full_mat.tolist(), ensure_ascii=False)
-        
-        redis_client.setex(cache_avg_key, 3600, avg_data_json)
-        redis_client.setex(cache_fq_key, 3600, fq_data_json)
-        redis_client.setex(cache_best_corr_key, 3600, best_corr_json)
-        redis_client.setex(cache_best_sample_id_key, 3600, best_sample_id)
+        best_sample_id = row["best_sample_id"]
+        with stage("decode"):
+            avg_full_mat, fq_full_mat, best_full_mat = decode_calc_distance_row(row)
+
+        for key, mat in ((cache_avg_key, avg_full_mat), (cache_fq_key, fq_full_mat), (cache_best_corr_key, best_full_mat)):
+            with stage("serialize"):
+                blob = orjson.dumps(mat, option=orjson.OPT_SERIALIZE_NUMPY)
+            cache.set(key, mat, blob)
+        cache.set(cache_best_sample_id_key, best_sample_id, str(best_sample_id).encode("utf-8"))
 
-        return avg_full_mat.tolist(), fq_full_mat.tolist(), best_full_mat.tolist(), best_sample_id
+        return avg_full_mat, fq_full_mat, best_full_mat, best_sample_id
 
     def get_distance_vector_by_sample(cell_line, chromosome_name, sequences, sample_id):
-        with db_conn() as conn:
+        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_distance_vector")
+        cached_distance_vector = cache.get_many([cache_key], [orjson.Fragment])[0]
+        if cached_distance_vector is not None:
+            return cached_distance_vector
+
+        with stage("db_fetch"), db_conn() as conn:
             with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(
                     """
@@ -656,37 +977,35 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
                     (cell_line, chromosome_name, sequences["start"], sequences["end"], sample_id),
                 )
                 row = cur.fetchone()
-                raw_vector = row["distance_vector"]
+        raw_vector = row["distance_vector"]
 
-                vectors = np.frombuffer(raw_vector, dtype=np.float32)
-                full_mat = squareform(vectors).tolist()
+        with stage("decode"):
+            vectors = np.frombuffer(raw_vector, dtype=np.float32)
+        with stage("squareform"):
+            full_mat = squareform(vectors)
 
-        cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], f"{sample_id}_distance_vector")
-
-        data_json = json.dumps(full_mat, ensure_ascii=False)
-        redis_client.setex(cache_key, 3600, data_json.encode("utf-8"))
+        with stage("serialize"):
+            blob = orjson.dumps(full_mat, option=orjson.OPT_SERIALIZE_NUMPY)
+        cache.set(cache_key, full_mat, blob)
 
         return full_mat
 
-    t1 = time()
-    cached_3d_position_data, cached_sample_distance_vector = checking_existing_cache_data(chromosome_name, cell_line, sequences, sample_id)
-    data_in_db_exist_status = checking_existing_data(chromosome_name, cell_line, sequences)
-    redis_client.setex(progress_key, 3600, 5)
-    t2 = time()
-    print(f"[DEBUG] Checking existing data took {t2 - t1:.4f} seconds")
+    with stage("cache_check"):
+        cached_3d_position_data, cached_sample_distance_vector, cached_avg_distance_data, cached_fq_data = checking_existing_cache_data()
+    with stage("db_check"):
+        data_in_db_exist_status = checking_existing_data(chromosome_name, cell_line, sequences)
+    cache.set_progress(progress_key, 5)
 
-    if cached_3d_position_data is not None and cached_sample_distance_vector is not None:
+    if all(value is not None for value in (cached_3d_position_data, cached_sample_distance_vector, cached_avg_distance_data, cached_fq_data)):
         print("Using Redis Cache Data")
-        position_data = json.loads(cached_3d_position_data.decode("utf-8"))
-        sample_distance_vector = json.loads(cached_sample_distance_vector.decode("utf-8"))
-
-        avg_distance_data_cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "avg_distance_data")
-        fq_data_cache_key = make_redis_cache_key(cell_line, chromosome_name, sequences["start"], sequences["end"], "fq_data")
-        
-        avg_distance_matrix = json.loads(redis_client.get(avg_distance_data_cache_key).decode("utf-8"))
-        fq_data = json.loads(redis_client.get(fq_data_cache_key).decode("utf-8"))
-
-        redis_client.setex(progress_key, 3600, 99)
+        region_request_log.record(cell_line, chromosome_name, sequences, "redis")
+        position_data = cached_3d_position_data
+        sample_distance_vector = cached_sample_distance_vector
+        avg_distance_matrix = cached_avg_distance_data
+        fq_data = cached_fq_data
+
+        cache.set_progress(progress_key, 99)
+        cache.flush()
         return {
             "position_data": position_data,
             "avg_distance_data": avg_distance_matrix,
@@ -695,6 +1014,7 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
         }
     elif data_in_db_exist_status["position_exists"] and data_in_db_exist_status["distance_exists"]:
         print("Using Existing Database Data")
+        region_request_log.record(cell_line, chromosome_name, sequences, "database")
         avg_distance_matrix, fq_data, sample_distance_vector, best_sample_id = get_avg_fq_best_corr_data(cell_line, chromosome_name, sequences)
 
         if sample_id != 0:
@@ -705,7 +1025,8 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
             position_data = get_position_data(chromosome_name, cell_line, sequences, best_sample_id)
             print(f"Existing Database Data condition -- Using Best Sample {best_sample_id} Data")
         
-        redis_client.setex(progress_key, 3600, 99)
+        cache.set_progress(progress_key, 99)
+        cache.flush()
         return {
             "position_data": position_data,
             "avg_distance_data": avg_distance_matrix,
@@ -714,107 +1035,21 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
         }
     else:
         print("Using SBIF Generated Data")
-        if cell_line not in label_mapping:
-            raise ValueError(f"Cell line '{cell_line}' not found in label_mapping")
-        
-        table_name = get_cell_line_table_name(cell_line)
-        
-        t3 = time()
-        with db_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute(
-                f"""
-                    SELECT *
-                    FROM {table_name}
-                    WHERE chrid = %s
-                    AND ibp >= %s
-                    AND ibp <= %s
-                    AND jbp >= %s
-                    AND jbp <= %s
-                """,
-                    (
-                        chromosome_name,
-                        sequences["start"],
-                        sequences["end"],
-                        sequences["start"],
-                        sequences["end"],
-                    ),
-                )
-                original_data = cur.fetchall()
-        t4 = time()
-        redis_client.setex(progress_key, 3600, 10)
-        print(f"[DEBUG] Fetching original data took {t4 - t3:.4f} seconds")
-        if original_data:
-            t5 = time()
-            original_df = pd.DataFrame(
-                original_data, columns=["chrid", "fdr", "ibp", "jbp", "fq"]
-            )
-
-            filtered_df = get_spe_inter(original_df)
-            fold_inputs = get_fold_inputs(filtered_df)
-
-            txt_data = fold_inputs.to_csv(index=False, sep="\t", header=False)
-            custom_name = (
-                f"{cell_line}.{chromosome_name}.{sequences['start']}.{sequences['end']}"
-            )
-
-            # Ensure the custom path exists, create it if it doesn't
-            os.makedirs(temp_folding_input_path, exist_ok=True)
-
-            # Define the full path where the file will be stored
-            custom_file_path = os.path.join(
-                temp_folding_input_path, custom_name + ".txt"
-            )
-
-            # Write the file to the custom path
-            with open(custom_file_path, "w") as temp_file:
-                temp_file.write(txt_data)
-            redis_client.setex(progress_key, 3600, 20)
-            t6 = time()
-            print(f"[DEBUG] Writing folding input file took {t6 - t5:.4f} seconds")
-            t7 = time()
-            script = "./sBIF.sh"
-            n_samples = 5000
-            n_samples_per_run = 100
-            result = subprocess.Popen(
-                ["bash", script, str(n_samples), str(n_samples_per_run)],
-                text=True,
-                stdout=subprocess.PIPE,
-                bufsize=1,
-            )
-            pattern = re.compile(r'^\[.*DONE\]')
-            progress_values = [50, 90, 91, 92, 93, 94, 95]
-            matches = (line.strip() for line in result.stdout if pattern.match(line))
-            for val, line in zip(progress_values, matches):
-                print(line)
-                redis_client.setex(progress_key, 3600, val)
-            t8 = time()
-            print(f"[DEBUG] Running folding script took {t8 - t7:.4f} seconds")
-            t_remove_start = time()
-            os.remove(custom_file_path)
-            t_remove_end = time()
-            print(f"[DEBUG] Removing folding input file took {t_remove_end - t_remove_start:.4f} seconds")
-
-            t11 = time()
+        region_request_log.record(cell_line, chromosome_name, sequences, "sbif")
+        # fold_region reports its progress directly, everything queued so far goes out first
+        cache.flush()
+        if fold_region(cell_line, chromosome_name, sequences, progress_key=progress_key):
             avg_distance_matrix, fq_data, sample_distance_vector, best_sample_id = get_avg_fq_best_corr_data(cell_line, chromosome_name, sequences)
-            t12 = time()
-            print(f"[DEBUG] Fetching fq data took {t12 - t11:.4f} seconds")
-            
+
             if sample_id != 0:
-                t15 = time()
                 sample_distance_vector = get_distance_vector_by_sample(cell_line, chromosome_name, sequences, sample_id)
                 position_data = get_position_data(chromosome_name, cell_line, sequences, sample_id)
                 print(f"SBIF Generated Data condition -- Using Sample {sample_id} Data")
-                t16 = time()
-                redis_client.setex(progress_key, 3600, 99)
-                print(f"[DEBUG] Finding best chain sample took {t16 - t15:.4f} seconds")
             else:
-                t15 = time()
                 position_data = get_position_data(chromosome_name, cell_line, sequences, best_sample_id)
                 print(f"SBIF Generated Data condition -- Using Best Sample {best_sample_id} Data")
-                t16 = time()
-                redis_client.setex(progress_key, 3600, 99)
-                print(f"[DEBUG] Finding best chain sample took {t16 - t15:.4f} seconds")
+            cache.set_progress(progress_key, 99)
+            cache.flush()
             
             return {
                 "position_data": position_data,
@@ -823,142 +1058,383 @@ def chromosome_3D_data(cell_line, chromosome_name, sequences, sample_id):
                 "sample_distance_vector": sample_distance_vector
             }
         else:
-            redis_client.setex(progress_key, 3600, 99)
+            cache.set_progress(progress_key, 99)
+            cache.flush()
             return []
 
 
 """
-Download the full 3D chromosome samples distance data in the given cell line, chromosome name
+Bound how long an export transaction can hold its pooled connection while a client reads slowly:
+Postgres ends the session once the rows have not been read for EXPORT_IDLE_TIMEOUT_MS, and cancels
+a single query, a COPY included, after EXPORT_STATEMENT_TIMEOUT_MS
 """
-def download_full_chromosome_3D_distance_data(cell_line, chromosome_name, sequences, is_example):
-    def checking_existing_data():
-        with db_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                query = """
-                    SELECT EXISTS (
-                        SELECT 1 FROM distance
+def limit_export_transaction(cur):
+    cur.execute(f"SET LOCAL idle_in_transaction_session_timeout = {EXPORT_IDLE_TIMEOUT_MS}")
+    cur.execute(f"SET LOCAL statement_timeout = {EXPORT_STATEMENT_TIMEOUT_MS}")
+
+
+"""
+Stream the distance vectors of the samples of a region in sampleid order, optionally only the samples
+in `samples` (sorted ids) and the pairs of the beads first..last of `beads`. The first item is
+(sample count, vector length), the following ones are (sampleids, (rows, vector length) float32 matrix) batches.
+Count and rows are read from one snapshot, so a cleanup running meanwhile cannot change the shape.
+A bead range is cut out of each condensed vector by its byte layout: only the span of the vector that
+holds the range is read from Postgres, and the entries of the range are picked from it.
+"""
+def stream_distance_vectors(cell_line, chromosome_name, sequences, batch_size=1000, samples=None, beads=None):
+    params = (cell_line, chromosome_name, sequences["start"], sequences["end"])
+    sample_filter = ""
+    if samples is not None:
+        sample_filter = "AND sampleid = ANY(%s)"
+        params += (samples,)
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            limit_export_transaction(cur)
+            cur.execute(
+                f"""
+                    SELECT COUNT(*), (
+                        SELECT octet_length(distance_vector)
+                        FROM distance
                         WHERE cell_line = %s
                             AND chrid = %s
                             AND start_value = %s
                             AND end_value = %s
+                            {sample_filter}
                         LIMIT 1
-                    );
-                """
-                cur.execute(query, (cell_line, chromosome_name, sequences["start"], sequences["end"]))
-                data = cur.fetchone()
+                    )
+                    FROM distance
+                    WHERE cell_line = %s
+                        AND chrid = %s
+                        AND start_value = %s
+                        AND end_value = %s
+                        {sample_filter}
+                """,
+                params + params,
+            )
+            sample_count, vector_bytes = cur.fetchone()
+        itemsize = np.dtype(np.float32).itemsize
+        vector_length = (vector_bytes or 0) // itemsize
+
+        # Byte span of each vector to read, and the entries of the bead range within it
+        offset, span, indexes = 0, vector_length, None
+        if beads is not None and sample_count:
+            n_beads = condensed_beads(vector_length)
+            first, last = beads[0], min(beads[1], n_beads - 1)
+            if first >= last:
+                sample_count = 0
+            else:
+                offset, span, indexes = condensed_block(n_beads, first, last)
+                vector_length = len(indexes)
+        yield sample_count, vector_length
+        if not sample_count:
+            return
 
-        return data
-    
-    def get_distance_data():
-        vectors = []
-        batch_size = 1000
-        
-        with db_conn() as conn:
-            with conn.cursor(name="distance_download_stream") as cur:
-                query = """
-                    SELECT distance_vector
+        with conn.cursor(name="distance_download_stream") as cur:
+            cur.execute(
+                f"""
+                    SELECT sampleid, substring(distance_vector FROM %s FOR %s)
                     FROM distance
                     WHERE cell_line = %s
                         AND chrid = %s
                         AND start_value = %s
                         AND end_value = %s
+                        {sample_filter}
                     ORDER BY sampleid
-                """
-                cur.execute(query, (cell_line, chromosome_name, sequences["start"], sequences["end"]))
-
+                """,
+                (offset * itemsize + 1, span * itemsize) + params,
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                sampleids = [sampleid for sampleid, _ in rows]
+                matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), span)
+                if indexes is not None:
+                    matrix = matrix[:, indexes]
+                yield sampleids, matrix
 
-                while True:
-                    rows = cur.fetchmany(batch_size)
-                    if not rows:
-                        break
-                    for (blob,) in rows:
-                        vec = np.frombuffer(blob, dtype=np.float32)
-                        vectors.append(vec)
 
-        if not vectors:
-            print("No valid distance_vector")
-            return None
+"""
+Send a file as a download that can be resumed: conditional on its ETag / Last-Modified, honoring
+Range and If-Range on GET and HEAD, and advertising that on every response so download managers
+know they may resume. The WSGI server's file_wrapper (sendfile) is used when it provides one.
+"""
+def send_download(path, download_name, mimetype=None, etag=True):
+    response = send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name, conditional=True, etag=etag)
+    response.accept_ranges = "bytes"
+    return response
 
-        matrix = np.stack(vectors, axis=0).astype(np.float32)
-        sparse_matrix = csr_matrix(matrix)
 
-        with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.npz') as tmp_file:
-            save_npz(tmp_file.name, sparse_matrix)
-            sparse_file_path = tmp_file.name
+"""
+Respond with a generated export from the export cache, where produce() builds it at database speed
+the first time, so the connection is released before the client downloads. The response has a length
+and honors Range / If-Range. With the export cache disabled the chunks of produce() are streamed as
+they come instead. Returns None if produce() finds no data.
+"""
+def export_response(key, export_format, base_name, produce, encoding=None):
+    mimetype, extension = EXPORT_FILE_TYPES[export_format]
+    download_name = f"{base_name}{extension}"
+    path, chunks = export_cache.fetch(key, extension if encoding is None else f"{extension}.{encoding}", produce)
+
+    if path is not None:
+        response = send_download(path, download_name, mimetype=mimetype, etag=export_cache.etag(path))
+    elif chunks is not None:
+        response = Response(chunks, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={download_name}"})
+    else:
+        return None
 
-        return sparse_file_path
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    return response
 
-    existing_data_status = checking_existing_data()
 
-    if not is_example:
-        if existing_data_status['exists']:
-            parquet_file_path = get_distance_data()
-            print(f"Existing data found: {parquet_file_path}")
-            return parquet_file_path, send_file(
-                parquet_file_path,
-                as_attachment=True,
-                download_name=f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_distance_data.npz",
-            )
-        else:
-            return None, None
-    else:
+"""
+Download the full 3D chromosome samples distance data in the given cell line, chromosome name.
+export_format is "npz" or one of the columnar formats, "parquet" or "arrow", with a row per sample.
+`samples` (sorted sample ids) and `beads` (inclusive bead index range) limit the export to these
+samples and to the condensed vector of these beads.
+"""
+def download_full_chromosome_3D_distance_data(cell_line, chromosome_name, sequences, is_example, export_format="npz", samples=None, beads=None):
+    base_name = f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_distance_data"
+    if samples is not None or beads is not None:
+        base_name += "_subset"
+    columnar = export_format in COLUMNAR_FORMATS
+    example_file_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_converted_distance.npz"
+
+    if is_example and not columnar and samples is None and beads is None:
         # For example data, we can directly return the path to the example file
-        example_file_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_converted_distance.npz"
         if os.path.exists(example_file_path):
-            return example_file_path, send_file(
-                example_file_path,
-                as_attachment=True,
-                download_name=f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_distance_data.npz",
-            )
+            return send_download(example_file_path, f"{base_name}.npz")
         else:
-            return None, None
+            return None
+
+    if not is_example:
+        region_access_log.touch(cell_line, chromosome_name, sequences)
+
+    def produce():
+        if is_example:
+            if not os.path.exists(example_file_path):
+                return None
+            # The example files hold one sparse row per sample, in sample order
+            matrix = load_npz(example_file_path).toarray().astype(np.float32)
+            sampleids = np.arange(len(matrix))
+            if samples is not None:
+                sampleids = sampleids[np.isin(sampleids, samples)]
+                matrix = matrix[sampleids]
+            if beads is not None:
+                n_beads = condensed_beads(matrix.shape[1])
+                first, last = beads[0], min(beads[1], n_beads - 1)
+                if first >= last:
+                    return None
+                offset, _, indexes = condensed_block(n_beads, first, last)
+                matrix = matrix[:, offset + indexes]
+            if not len(matrix):
+                return None
+            batches = [
+                (sampleids[start:start + EXPORT_BATCH_SAMPLES], matrix[start:start + EXPORT_BATCH_SAMPLES])
+                for start in range(0, len(matrix), EXPORT_BATCH_SAMPLES)
+            ]
+            if not columnar:
+                return npz_stream("distance", np.float32, matrix.shape, (batch for _, batch in batches))
+            return columnar_stream(export_format, distance_schema(matrix.shape[1]), (distance_record_batch(*batch) for batch in batches))
+
+        vectors = stream_distance_vectors(
+            cell_line, chromosome_name, sequences, batch_size=EXPORT_BATCH_SAMPLES if columnar else 1000, samples=samples, beads=beads
+        )
+        sample_count, vector_length = next(vectors)
+        if not sample_count:
+            vectors.close()
+            return None
+
+        if columnar:
+            batches = (distance_record_batch(sampleids, matrix) for sampleids, matrix in vectors)
+            return columnar_stream(export_format, distance_schema(vector_length), batches)
+
+        # A dense (samples, vector_length) float32 array named "distance", np.load(path)["distance"]
+        return npz_stream("distance", np.float32, (sample_count, vector_length), (matrix for _, matrix in vectors))
+
+    key = export_key("distance", cell_line, chromosome_name, sequences, is_example, export_format, selection=selection_key(samples, beads))
+    return export_response(key, export_format, base_name, produce)
+
+"""
+Stream the positions of the samples of a region as CSV with a header line, straight from COPY TO STDOUT,
+optionally only the samples in `samples` and the beads first..last of `beads`.
+The first item tells whether the region has any positions, the following ones are CSV chunks.
+"""
+def stream_position_csv(cell_line, chromosome_name, sequences, samples=None, beads=None):
+    params = (cell_line, chromosome_name, sequences["start"], sequences["end"])
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            limit_export_transaction(cur)
+            exists = position_exists(cur, params)
+            yield exists
+            if not exists:
+                return
+
+            query, query_params = position_selection_query(params, samples, beads)
+            with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER)", query_params) as copy:
+                for chunk in copy:
+                    yield bytes(chunk)
+
+
+"""
+Check whether a region has any positions, params are (cell_line, chrid, start, end)
+"""
+def position_exists(cur, params):
+    cur.execute(
+        """
+            SELECT EXISTS (
+                SELECT 1 FROM position
+                WHERE cell_line = %s
+                    AND chrid = %s
+                    AND start_value = %s
+                    AND end_value = %s
+            )
+        """,
+        params,
+    )
+    return cur.fetchone()[0]
+
 
 """
-Download the full 3D chromosome samples position data in the given cell line, chromosome name
+Query of the positions of a region in POSITION_SCHEMA column order, ordered by sampleid and pid,
+params are (cell_line, chrid, start, end). `samples` limits it to these sample ids, `beads` to the
+beads first..last (inclusive) of every sample, a bead's index being its rank by pid within its sample.
+Returns (query, query params).
 """
-def download_full_chromosome_3D_position_data(cell_line, chromosome_name, sequences, is_example):
-    query = """
-        SELECT *
+def position_selection_query(params, samples=None, beads=None):
+    columns = ", ".join(POSITION_SCHEMA.names)
+    sample_filter = ""
+    if samples is not None:
+        sample_filter = "AND sampleid = ANY(%s)"
+        params += (samples,)
+    query = f"""
+        SELECT {columns}
         FROM position
         WHERE cell_line = %s
             AND chrid = %s
             AND start_value = %s
             AND end_value = %s
+            {sample_filter}
         ORDER BY sampleid, pid
     """
-    if not is_example:
-        with db_conn() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute(query, (cell_line, chromosome_name, sequences["start"], sequences["end"]))
-                rows = cur.fetchall()
+    if beads is None:
+        return query, params
+
+    query = f"""
+        SELECT {columns}
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY sampleid ORDER BY pid) - 1 AS bead
+            FROM position
+            WHERE cell_line = %s
+                AND chrid = %s
+                AND start_value = %s
+                AND end_value = %s
+                {sample_filter}
+        ) AS region
+        WHERE bead BETWEEN %s AND %s
+        ORDER BY sampleid, pid
+    """
+    return query, params + tuple(beads)
+
+
+"""
+Stream the positions of the samples of a region as row tuples in POSITION_SCHEMA column order,
+ordered by sampleid and pid, optionally only the samples in `samples` and the beads of `beads`.
+The first item tells whether the region has any positions, the following ones are lists of rows.
+"""
+def stream_position_rows(cell_line, chromosome_name, sequences, batch_size=10000, samples=None, beads=None):
+    params = (cell_line, chromosome_name, sequences["start"], sequences["end"])
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            limit_export_transaction(cur)
+            exists = position_exists(cur, params)
+        yield exists
+        if not exists:
+            return
+
+        with conn.cursor(name="position_download_stream") as cur:
+            cur.execute(*position_selection_query(params, samples, beads))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
 
-        if not rows:
-            return None, None
 
-        # Convert to DataFrame
-        df = pd.DataFrame(rows)
+"""
+The rows of an example position table (sorted by sampleid and pid) in `samples` and, per sample, the
+beads first..last of `beads`
+"""
+def select_position_table(table, samples=None, beads=None):
+    sampleids = table["sampleid"].to_numpy()
+    keep = np.ones(len(sampleids), dtype=bool)
+    if samples is not None:
+        keep &= np.isin(sampleids, samples)
+    if beads is not None:
+        sample_starts = np.flatnonzero(np.r_[True, sampleids[1:] != sampleids[:-1]])
+        bead_index = np.arange(len(sampleids)) - np.repeat(sample_starts, np.diff(np.r_[sample_starts, len(sampleids)]))
+        keep &= (bead_index >= beads[0]) & (bead_index <= beads[1])
+    return table.filter(pa.array(keep))
 
-        # Save to a temporary CSV file
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as tmp_file:
-            df.to_csv(tmp_file.name, index=False)
-            csv_file_path = tmp_file.name
 
-        return csv_file_path, send_file(
-            csv_file_path,
-            as_attachment=True,
-            download_name=f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_position_data.csv",
-        )
-    else:
+"""
+Download the full 3D chromosome samples position data in the given cell line, chromosome name.
+export_format is "csv" (gzip-compressed on the fly when gzip is set) or "parquet" / "arrow".
+`samples` and `beads` limit the export to these sample ids and to these beads of every sample.
+"""
+def download_full_chromosome_3D_position_data(cell_line, chromosome_name, sequences, is_example, gzip=False, export_format="csv", samples=None, beads=None):
+    base_name = f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_position_data"
+    if samples is not None or beads is not None:
+        base_name += "_subset"
+    columnar = export_format in COLUMNAR_FORMATS
+    example_file_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_original_position.csv"
+
+    if is_example and not columnar and samples is None and beads is None:
         # For example data, we can directly return the path to the example file
-        example_file_path = f"./example_data/{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_original_position.csv"
         if os.path.exists(example_file_path):
-            return example_file_path, send_file(
-                example_file_path,
-                as_attachment=True,
-                download_name=f"{cell_line}_{chromosome_name}_{sequences['start']}_{sequences['end']}_position_data.csv",
-            )
+            return send_download(example_file_path, f"{base_name}.csv")
         else:
-            return None, None
+            return None
+
+    encoding = "gzip" if gzip and not columnar else None
+
+    if not is_example:
+        region_access_log.touch(cell_line, chromosome_name, sequences)
+
+    def produce():
+        if is_example:
+            if not os.path.exists(example_file_path):
+                return None
+            table = select_position_table(pa_csv.read_csv(example_file_path), samples, beads)
+            if not table.num_rows:
+                return None
+            if not columnar:
+                csv_file = io.BytesIO()
+                pa_csv.write_csv(table, csv_file)
+                chunks = [csv_file.getvalue()]
+                return gzip_stream(chunks) if encoding == "gzip" else chunks
+            return columnar_stream(export_format, dictionary_schema(table.schema), table_sample_batches(table))
+
+        if columnar:
+            chunks = stream_position_rows(cell_line, chromosome_name, sequences, samples=samples, beads=beads)
+        else:
+            chunks = stream_position_csv(cell_line, chromosome_name, sequences, samples=samples, beads=beads)
+        if not next(chunks):
+            chunks.close()
+            return None
+
+        if columnar:
+            batches = (rows_record_batch(POSITION_SCHEMA, rows) for rows in sample_batches(chunks, POSITION_SCHEMA.get_field_index("sampleid")))
+            return columnar_stream(export_format, POSITION_SCHEMA, batches)
+        return gzip_stream(chunks) if encoding == "gzip" else chunks
+
+    key = export_key("position", cell_line, chromosome_name, sequences, is_example, export_format, encoding or "identity", selection_key(samples, beads))
+    response = export_response(key, export_format, base_name, produce, encoding)
+    if response is not None and not columnar:
+        response.vary.add("Accept-Encoding")
+    return response
 
 """
 Returns currently existing other cell line list in given chromosome name and sequences
@@ -1040,6 +1516,13 @@ def epigenetic_track_data(cell_line, chromosome_name, sequences):
             # Fetch all the data from the query
             epigenetic_track_data = cur.fetchall()
 
+    return aggregate_epigenetic_tracks(epigenetic_track_data)
+
+
+"""
+Group epigenetic track rows by their epigenetic key
+"""
+def aggregate_epigenetic_tracks(epigenetic_track_data):
     # Initialize a dictionary to store the aggregated data by epigenetic key
     aggregated_data = {}
 
@@ -1056,11 +1539,101 @@ def epigenetic_track_data(cell_line, chromosome_name, sequences):
     return aggregated_data
 
 
+# Facets of a region that the frontend loads together on every region selection
+REGION_BUNDLE_FACETS = ("chromosome_data", "valid_ibps", "gene_list", "epigenetic_track_data", "chromosome_size")
+
+
+"""
+Return the distinct ibps of already fetched Hi-C contacts, same as chromosome_valid_ibp_data
+"""
+def valid_ibps_from_contacts(contacts):
+    return sorted({row["ibp"] for row in contacts})
+
+
+"""
+Return the region bundle facet tasks as {facet: (function, args)}
+Valid ibps are derived from the Hi-C fetch when chromosome_data is requested as well
+"""
+def region_bundle_tasks(cell_line, chromosome_name, sequences, facets, functions):
+    # The gene table stores chromosomes without the "chr" prefix
+    gene_chromosome_name = chromosome_name[3:] if chromosome_name.startswith("chr") else chromosome_name
+
+    tasks = {
+        "chromosome_data": (functions["chromosome_data"], (cell_line, chromosome_name, sequences)),
+        "valid_ibps": (functions["chromosome_valid_ibp_data"], (cell_line, chromosome_name, sequences)),
+        "gene_list": (functions["gene_list"], (gene_chromosome_name, sequences)),
+        "epigenetic_track_data": (functions["epigenetic_track_data"], (cell_line, chromosome_name, sequences)),
+        "chromosome_size": (functions["chromosome_size"], (chromosome_name,)),
+    }
+    selected = {facet: tasks[facet] for facet in facets if facet in tasks}
+    if "chromosome_data" in selected:
+        selected.pop("valid_ibps", None)
+    return selected
+
+
+"""
+Assemble the region bundle response from the finished facet results and errors
+"""
+def finish_region_bundle(facets, data, errors):
+    if "valid_ibps" in facets and "valid_ibps" not in data and "valid_ibps" not in errors:
+        if "chromosome_data" in data:
+            data["valid_ibps"] = valid_ibps_from_contacts(data["chromosome_data"])
+        else:
+            errors["valid_ibps"] = errors.get("chromosome_data", "Hi-C data unavailable")
+
+    for facet in facets:
+        if facet not in REGION_BUNDLE_FACETS:
+            errors[facet] = f"Unknown facet '{facet}'"
+
+    return {"data": data, "errors": errors}
+
+
+"""
+Return several facets of one region in a single call, running the independent queries concurrently
+on the connection pool. A failing facet is reported under "errors" without failing the others.
+"""
+def region_bundle(cell_line, chromosome_name, sequences, facets=None):
+    facets = list(facets) if facets else list(REGION_BUNDLE_FACETS)
+    functions = {
+        "chromosome_data": chromosome_data,
+        "chromosome_valid_ibp_data": chromosome_valid_ibp_data,
+        "gene_list": gene_list,
+        "epigenetic_track_data": epigenetic_track_data,
+        "chromosome_size": chromosome_size,
+    }
+    tasks = region_bundle_tasks(cell_line, chromosome_name, sequences, facets, functions)
+
+    data, errors = {}, {}
+    if tasks:
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            # A copy of the request's context per task, so their spans and stages stay in the request's trace
+            futures = {facet: pool.submit(contextvars.copy_context().run, func, *args) for facet, (func, args) in tasks.items()}
+
+        for facet, future in futures.items():
+            try:
+                data[facet] = future.result()
+            except Exception as e:
+                errors[facet] = str(e)
+
+    return finish_region_bundle(facets, data, errors)
+
+
+"""
+Count a request the HTTP cache answered without running its view (304 or a stored response) as a visit
+of the region, as the view would have: for the retention job and, given served_from, the pre-fold scheduler
+"""
+def record_region_visit(cell_line, chromosome_name, sequences, served_from=None):
+    region_access_log.touch(cell_line, chromosome_name, sequences)
+    if served_from is not None:
+        region_request_log.record(cell_line, chromosome_name, sequences, served_from)
+
+
 """
 Return the distribution of selected beads in all samples
 """
 def bead_distribution(cell_line, chromosome_name, sequences, indices):
     indices = [int(idx) for idx in indices]
+    region_access_log.touch(cell_line, chromosome_name, sequences)
 
     distributions: dict[str, list[float]] = {
         f"{i}-{j}": [] for i, j in combinations(indices, 2)
@@ -1090,22 +1663,28 @@ def bead_distribution(cell_line, chromosome_name, sequences, indices):
     for row in rows:
         blob = row["distance_vector"]
         dist_vec = np.frombuffer(blob, dtype=np.float32)  # shape = (L,)
+        collect_bead_distances(distributions, indices, dist_vec)
+
+    return distributions
 
-        L = dist_vec.shape[0]
-        N = int((1 + math.isqrt(1 + 8 * L)) // 2)
 
-        for i, j in combinations(indices, 2):
-            if i < 0 or j < 0 or i >= N or j >= N:
-                continue
+"""
+Append the selected bead pair distances of one condensed distance vector to the distributions
+"""
+def collect_bead_distances(distributions, indices, dist_vec):
+    L = dist_vec.shape[0]
+    N = int((1 + math.isqrt(1 + 8 * L)) // 2)
 
-            row_offset = i * N - (i * (i + 1) // 2)
-            in_row_offset = j - i - 1
-            idx = row_offset + in_row_offset
+    for i, j in combinations(indices, 2):
+        if i < 0 or j < 0 or i >= N or j >= N:
+            continue
 
-            dist_val = max(0.0, float(dist_vec[idx]) - 34.3)   # diameter of beads
-            distributions[f"{i}-{j}"].append(dist_val)
+        row_offset = i * N - (i * (i + 1) // 2)
+        in_row_offset = j - i - 1
+        idx = row_offset + in_row_offset
 
-    return distributions
+        dist_val = max(0.0, float(dist_vec[idx]) - 34.3)   # diameter of beads
+        distributions[f"{i}-{j}"].append(dist_val)
 
 
 """
@@ -1126,20 +1705,7 @@ def exist_bead_distribution(cell_line, indices, chromosome_name="chr8", sequence
     distance_df = fut_dist.result()
     for _, row in distance_df.iterrows():
         dist_vec = np.array(row['distance_vector'], dtype=float)  # shape = (L,)
-
-        L = dist_vec.shape[0]
-        N = int((1 + math.isqrt(1 + 8 * L)) // 2)
-
-        for i, j in combinations(indices, 2):
-            if i < 0 or j < 0 or i >= N or j >= N:
-                continue
-
-            row_offset = i * N - (i * (i + 1) // 2)
-            in_row_offset = j - i - 1
-            idx = row_offset + in_row_offset
-
-            dist_val = max(0.0, float(dist_vec[idx]) - 34.3)   # diameter of beads
-            distributions[f"{i}-{j}"].append(dist_val)
+        collect_bead_distances(distributions, indices, dist_vec)
 
     return distributions
 
@@ -1291,7 +1857,14 @@ def get_bintu_distance_matrix(cell_line, chrid, start_value, end_value, cell_id)
     
     if not rows:
         return None
-    
+
+    return build_bintu_distance_matrix(rows, cell_line, chrid, start_value, end_value, cell_id)
+
+
+"""
+Build the Bintu heatmap payload from the ordered 3D coordinate rows of one cell
+"""
+def build_bintu_distance_matrix(rows, cell_line, chrid, start_value, end_value, cell_id):
     # Extract coordinates and segment indices
     segment_indices = [row['segment_index'] for row in rows]
     coordinates = np.array([(row['x'], row['y'], row['z']) for row in rows], dtype=float)
@@ -1377,12 +1950,7 @@ def download_bintu_csv(cell_line: str, chrid: str, start_value: int, end_value:
     if not candidate_path:
         return None
 
-    return send_file(
-        candidate_path,
-        as_attachment=True,
-        download_name=candidate_name,
-        mimetype='text/csv'
-    )
+    return send_download(candidate_path, candidate_name, mimetype='text/csv')
 
 
 """
@@ -1398,12 +1966,7 @@ def download_gse_csv(cell_line: str, resolution: str, cell_id: str):
         return None
     
     # Return the file for download
-    return send_file(
-        file_path,
-        as_attachment=True,
-        download_name=f"{cell_line}_{resolution}_{cell_id}.csv",
-        mimetype='text/csv'
-    )
+    return send_download(file_path, f"{cell_line}_{resolution}_{cell_id}.csv", mimetype='text/csv')
 
 
 """
@@ -1522,7 +2085,14 @@ def get_gse_distance_matrix(cell_line: str, cell_id: str, chrid: str, resolution
     
     if not rows:
         return None
-    
+
+    return build_gse_distance_matrix(rows, cell_line, cell_id, chrid, resolution, start_value, end_value)
+
+
+"""
+Build the GSE heatmap payload from the ordered ibp, jbp, fq rows
+"""
+def build_gse_distance_matrix(rows, cell_line, cell_id, chrid, resolution, start_value=None, end_value=None):
     # Create the result structure similar to chromosome_data for heatmap rendering
     result = []
     
@@ -0,0 +1,361 @@
+"""
+Opt-in CPU profiles of single requests.
+
+A request is profiled when it carries an X-Profile header and comes from PROFILING_ALLOWED_NETWORKS
+(loopback by default) or carries PROFILING_TOKEN as the header value, or when an admin armed profiling
+for its route with POST /api/setProfiling, e.g. every tenth /api/getBeadDistributionPValues request
+for the next 10 minutes, at most 20 profiles. The arming lives in Redis, so every worker follows it.
+Only the Flask app is profiled, of the async app the routes it hands to the Flask app.
+
+Two modes:
+    cprofile  deterministic profile of the request thread, stored as pstats (.prof), open it with
+              `python -m pstats` or snakeviz
+    sample    the request thread's stack sampled every PROFILING_SAMPLE_INTERVAL seconds, stored as a
+              speedscope file (.speedscope.json) for https://www.speedscope.app, low overhead
+cProfile allows one profile per process at a time, a request arriving while another one is profiled
+falls back to sampling. Work the request hands to thread pools is not in its profile.
+
+Every profile is stored in PROFILING_DIR next to a .json file with the route, method, query and body
+parameters, status and duration, and the oldest ones are deleted above PROFILING_MAX_FILES.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import monotonic, perf_counter, time
+import orjson
+from flask import request
+from metrics import is_allowed, parse_networks
+from tracing import current_trace
+
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+PROFILING_DIR = os.getenv("PROFILING_DIR", "./profiles")
+PROFILING_ALLOWED_NETWORKS = parse_networks(os.getenv("PROFILING_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128"))
+# Lets callers outside the allowed networks, e.g. behind the proxy, profile their request
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", 0.005))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 200))
+# How long a worker relies on the arming it read from Redis
+PROFILING_ARMING_REFRESH = 5
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-ID"
+MODES = ("cprofile", "sample")
+# Written without a Redis TTL so volatile-lfu never evicts them, the arming carries its own expiry
+ARMING_KEY = "profiling:arming"
+REMAINING_KEY = "profiling:remaining"
+# Longest query or body parameter repr kept in the metadata
+PARAM_LENGTH = 500
+
+# Profile of the request being served, set by the before_request hook
+active_profile = ContextVar("active_profile", default=None)
+# cProfile can only run once per process
+cprofile_lock = threading.Lock()
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread, kept as speedscope frames and samples"""
+
+    def __init__(self, thread_id, interval=PROFILING_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []
+        self.frame_index = {}
+        self.samples = []
+        self.weights = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+
+    def frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frame_index.get(key)
+        if index is None:
+            index = self.frame_index[key] = len(self.frames)
+            self.frames.append({"name": getattr(code, "co_qualname", code.co_name), "file": code.co_filename,
+                                "line": code.co_firstlineno})
+        return index
+
+    def run(self):
+        last = perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def speedscope(self, name):
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "chromosome-backend",
+            "name": name,
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(self.weights),
+                "samples": self.samples,
+                "weights": self.weights,
+            }],
+        }
+
+
+class Profile:
+    def __init__(self, mode):
+        if mode == "cprofile" and not cprofile_lock.acquire(blocking=False):
+            mode = "sample"
+        self.mode = mode
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.created = datetime.now(timezone.utc)
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = StackSampler(threading.get_ident())
+
+    def start(self):
+        self.started = perf_counter()
+        if self.mode == "cprofile":
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self.profiler.disable()
+            cprofile_lock.release()
+        else:
+            self.profiler.stop()
+        self.duration = perf_counter() - self.started
+
+    def save(self, metadata):
+        """Writes the profile and its metadata, returns the file name of the profile"""
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        endpoint = re.sub(r"[^\w.-]", "_", metadata["endpoint"] or "unknown")
+        base = f"{self.created:%Y%m%dT%H%M%S}_{endpoint}_{self.profile_id}"
+        if self.mode == "cprofile":
+            filename = f"{base}.prof"
+            self.profiler.dump_stats(os.path.join(PROFILING_DIR, filename))
+        else:
+            filename = f"{base}.speedscope.json"
+            with open(os.path.join(PROFILING_DIR, filename), "wb") as f:
+                f.write(orjson.dumps(self.profiler.speedscope(f"{metadata['method']} {metadata['path']}")))
+        metadata = dict(metadata, id=self.profile_id, file=filename, mode=self.mode,
+                        created=self.created.isoformat(timespec="milliseconds"), duration_ms=self.duration * 1000)
+        with open(os.path.join(PROFILING_DIR, f"{base}.json"), "wb") as f:
+            f.write(orjson.dumps(metadata))
+        prune()
+        return filename
+
+
+def prune(max_files=PROFILING_MAX_FILES):
+    """Delete the oldest profiles above max_files"""
+    for metadata in list_profiles()[max_files:]:
+        for name in (metadata["file"], metadata["metadata_file"]):
+            try:
+                os.remove(os.path.join(PROFILING_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first"""
+    profiles = []
+    if not os.path.isdir(PROFILING_DIR):
+        return profiles
+    for name in os.listdir(PROFILING_DIR):
+        if not name.endswith(".json") or name.endswith(".speedscope.json"):
+            continue
+        try:
+            with open(os.path.join(PROFILING_DIR, name), "rb") as f:
+                metadata = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            continue
+        metadata["metadata_file"] = name
+        profiles.append(metadata)
+    profiles.sort(key=lambda metadata: metadata["created"], reverse=True)
+    return profiles
+
+
+def profile_path(filename):
+    """Path of a stored profile, None unless filename is one of them"""
+    if os.path.basename(filename) != filename or not filename.endswith((".prof", ".speedscope.json")):
+        return None
+    path = os.path.join(PROFILING_DIR, filename)
+    return path if os.path.isfile(path) else None
+
+
+def truncated(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value if not isinstance(value, str) else value[:PARAM_LENGTH]
+    return repr(value)[:PARAM_LENGTH]
+
+
+def request_parameters(current_request):
+    body = current_request.get_json(silent=True) if current_request.is_json else None
+    return {
+        "query": {key: truncated(value) for key, value in current_request.args.items()},
+        "body": {key: truncated(value) for key, value in body.items()} if isinstance(body, dict) else truncated(body),
+    }
+
+
+class Arming:
+    """Admin toggle that profiles a share of the requests of an endpoint, shared by the workers through Redis"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.cached = None
+        self.read_at = None
+        self.lock = threading.Lock()
+
+    def arm(self, endpoint, mode="sample", rate=1.0, count=10, duration=600):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, one of {', '.join(MODES)}")
+        if not 0 < rate <= 1:
+            raise ValueError("rate must be in (0, 1]")
+        if count < 1 or duration <= 0:
+            raise ValueError("count and duration must be positive")
+        arming = {"endpoint": endpoint, "mode": mode, "rate": rate}
+        with self.redis_client.pipeline() as pipe:
+            pipe.set(ARMING_KEY, orjson.dumps(dict(arming, expires_at=time() + duration)))
+            pipe.set(REMAINING_KEY, int(count))
+            pipe.execute()
+        self.forget()
+        return dict(arming, count=count, duration=duration)
+
+    def disarm(self):
+        self.redis_client.delete(ARMING_KEY, REMAINING_KEY)
+        self.forget()
+
+    def forget(self):
+        with self.lock:
+            self.read_at = None
+
+    def current(self):
+        with self.lock:
+            if self.read_at is not None and monotonic() - self.read_at < PROFILING_ARMING_REFRESH:
+                return self.cached
+        try:
+            value = self.redis_client.get(ARMING_KEY)
+            arming = orjson.loads(value) if value is not None else None
+            if arming is not None and arming["expires_at"] <= time():
+                self.redis_client.delete(ARMING_KEY, REMAINING_KEY)
+                arming = None
+        except Exception as e:
+            print(f"Reading the profiling arming failed: {e}")
+            arming = None
+        with self.lock:
+            self.cached, self.read_at = arming, monotonic()
+        return arming
+
+    def status(self):
+        arming = self.current()
+        if arming is None:
+            return None
+        remaining = self.redis_client.get(REMAINING_KEY)
+        return dict(arming, remaining=max(int(remaining), 0) if remaining is not None else 0,
+                    expires_in=max(int(arming["expires_at"] - time()), 0))
+
+    def claim(self, endpoint, path):
+        """Mode to profile this request with, None unless armed for its endpoint or path and profiles remain"""
+        arming = self.current()
+        if arming is None or arming["endpoint"] not in (endpoint, path, "*") or random.random() >= arming["rate"]:
+            return None
+        if self.redis_client.decr(REMAINING_KEY) < 0:
+            self.forget()
+            return None
+        return arming["mode"]
+
+
+arming = None
+
+
+def header_mode(current_request):
+    """Mode the X-Profile header asks for, None unless the caller may profile"""
+    value = current_request.headers.get(PROFILE_HEADER)
+    if value is None:
+        return None
+    mode, _, token = value.partition(";")
+    mode = mode.strip().lower() or "cprofile"
+    if mode not in MODES:
+        # X-Profile: <token> profiles with cProfile
+        mode, token = "cprofile", value
+    if is_allowed(current_request.remote_addr, PROFILING_ALLOWED_NETWORKS):
+        return mode
+    if PROFILING_TOKEN and hmac.compare_digest(token.strip(), PROFILING_TOKEN):
+        return mode
+    return None
+
+
+def init_app(app, redis_client):
+    """Profile the requests of a Flask app that ask for it or that an admin armed profiling for"""
+    global arming
+    arming = Arming(redis_client)
+    if not PROFILING_ENABLED:
+        return
+
+    def begin_request():
+        mode = header_mode(request)
+        if mode is None and request.endpoint is not None:
+            mode = arming.claim(request.endpoint, request.path)
+        if mode is None:
+            return
+        profile = Profile(mode)
+        active_profile.set(profile)
+        profile.start()
+
+    def finish_request(response):
+        profile = active_profile.get()
+        if profile is None:
+            return response
+        active_profile.set(None)
+        profile.stop()
+        trace = current_trace.get()
+        try:
+            profile.save({
+                "endpoint": request.endpoint,
+                "method": request.method,
+                "path": request.path,
+                "parameters": request_parameters(request),
+                "status": response.status_code,
+                "request_id": trace.request_id if trace is not None else None,
+            })
+        except OSError as e:
+            print(f"Saving the profile failed: {e}")
+            return response
+        response.headers[PROFILE_ID_HEADER] = profile.profile_id
+        return response
+
+    def abandon_request(exception=None):
+        # A request that ended without a response still has to release cProfile
+        profile = active_profile.get()
+        if profile is not None:
+            active_profile.set(None)
+            profile.stop()
+
+    app.before_request(begin_request)
+    app.after_request(finish_request)
+    app.teardown_request(abandon_request)
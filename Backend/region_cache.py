@@ -0,0 +1,183 @@
+"""
+Overlap-aware in-process cache for Hi-C contact queries.
+
+A contact query for [start, end] returns every contact with both ibp and jbp inside the range, so a
+cached range answers any request it covers: binary search on the ibp-sorted columns narrows the rows
+and a jbp mask finishes the slice. When a request only overlaps a cached range, just the missing part
+of the contact square is fetched and merged into one wider entry, so panning and zooming within an
+already loaded window mostly stays off Postgres. Entries are evicted least recently used once the
+cached arrays exceed REGION_CACHE_MAX_BYTES, and everything is dropped when the data generation moves.
+"""
+import os
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+
+
+REGION_CACHE_MAX_BYTES = int(os.getenv("REGION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Widest range a merged entry may grow to, beyond it an overlapping request gets its own entry
+REGION_CACHE_MAX_SPAN = int(os.getenv("REGION_CACHE_MAX_SPAN", 20_000_000))
+
+CONTACT_COLUMNS = ("ibp", "jbp", "fq", "fdr", "rawc")
+CONTACT_DTYPES = {"ibp": np.int64, "jbp": np.int64, "fq": np.float64, "fdr": np.float64, "rawc": np.float64}
+
+
+def columns_from_rows(rows):
+    """Columnar arrays from (ibp, jbp, fq, fdr, rawc) rows, sorted by ibp then jbp"""
+    columns = {
+        name: np.fromiter((row[i] for row in rows), dtype=CONTACT_DTYPES[name], count=len(rows))
+        for i, name in enumerate(CONTACT_COLUMNS)
+    }
+    return sort_columns(columns)
+
+
+def sort_columns(columns):
+    order = np.lexsort((columns["jbp"], columns["ibp"]))
+    return {name: values[order] for name, values in columns.items()}
+
+
+def concat_columns(*parts):
+    return sort_columns({name: np.concatenate([part[name] for part in parts]) for name in CONTACT_COLUMNS})
+
+
+def slice_columns(columns, start, end):
+    """Contacts with both ibp and jbp in [start, end] out of ibp-sorted columns"""
+    lo = np.searchsorted(columns["ibp"], start, side="left")
+    hi = np.searchsorted(columns["ibp"], end, side="right")
+    jbp = columns["jbp"][lo:hi]
+    mask = (jbp >= start) & (jbp <= end)
+    return {name: values[lo:hi][mask] for name, values in columns.items()}
+
+
+def columns_nbytes(columns):
+    return sum(values.nbytes for values in columns.values())
+
+
+class RegionCache:
+    """
+    fetch(cell_line, chromosome_name, start, end, exclude) must return the (ibp, jbp, fq, fdr, rawc)
+    rows with both ends in [start, end], leaving out those with both ends in the exclude range if given.
+    get() fetches through it; plan() and complete() split a lookup around the fetch instead, so an
+    async caller can run the query on its own connection pool.
+    """
+
+    def __init__(self, fetch, generation=None, max_bytes=REGION_CACHE_MAX_BYTES, max_span=REGION_CACHE_MAX_SPAN):
+        self.fetch = fetch
+        self.generation = generation
+        self.max_bytes = max_bytes
+        self.max_span = max_span
+        # (cell_line, chromosome_name, start, end) -> columns, oldest first
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.cached_generation = None
+        self.lock = Lock()
+        self.counts = {"hits": 0, "partial_hits": 0, "misses": 0, "evictions": 0}
+
+    def check_generation(self):
+        if self.generation is None:
+            return
+        current = self.generation.current()[0]
+        if current != self.cached_generation:
+            self.entries.clear()
+            self.nbytes = 0
+            self.cached_generation = current
+
+    def find(self, cell_line, chromosome_name, start, end):
+        """Return (covering key, None) or (None, best overlapping key); both None on a miss"""
+        overlapping, overlap_size = None, -1
+        for key in reversed(self.entries):
+            key_cell_line, key_chromosome, key_start, key_end = key
+            if key_cell_line != cell_line or key_chromosome != chromosome_name:
+                continue
+            if key_start <= start and end <= key_end:
+                return key, None
+            # Ranges that overlap or touch can be extended into one another
+            if key_start <= end + 1 and start <= key_end + 1:
+                size = min(end, key_end) - max(start, key_start)
+                if size > overlap_size:
+                    overlapping, overlap_size = key, size
+        return None, overlapping
+
+    def store(self, key, columns, replaces=()):
+        with self.lock:
+            for old_key in replaces:
+                old = self.entries.pop(old_key, None)
+                if old is not None:
+                    self.nbytes -= columns_nbytes(old)
+            # A wider entry makes any range it covers redundant
+            start, end = key[2], key[3]
+            for old_key in [k for k in self.entries if k[:2] == key[:2] and start <= k[2] and k[3] <= end]:
+                self.nbytes -= columns_nbytes(self.entries.pop(old_key))
+
+            size = columns_nbytes(columns)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = columns
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= columns_nbytes(evicted)
+                self.counts["evictions"] += 1
+
+    def plan(self, cell_line, chromosome_name, start, end):
+        """
+        Return (covering columns, None) when a cached range covers [start, end], else (None, miss)
+        where miss = (fetch start, fetch end, exclude, overlapping key, its columns) names the rows to fetch.
+        Only dictionary lookups run here, the covering columns still have to be sliced to [start, end].
+        """
+        with self.lock:
+            self.check_generation()
+            covering, overlapping = self.find(cell_line, chromosome_name, start, end)
+            if covering is not None:
+                self.entries.move_to_end(covering)
+                self.counts["hits"] += 1
+                return self.entries[covering], None
+            cached = self.entries[overlapping] if overlapping is not None else None
+            self.counts["partial_hits" if cached is not None else "misses"] += 1
+
+        if cached is None:
+            return None, (start, end, None, None, None)
+
+        _, _, cached_start, cached_end = overlapping
+        merged_start, merged_end = min(start, cached_start), max(end, cached_end)
+        if merged_end - merged_start <= self.max_span:
+            # Grow the cached entry to the union, fetching only the part of the square it lacks
+            return None, (merged_start, merged_end, (cached_start, cached_end), overlapping, cached)
+
+        overlap = (max(start, cached_start), min(end, cached_end))
+        return None, (start, end, overlap if overlap[0] <= overlap[1] else None, None, cached)
+
+    def complete(self, cell_line, chromosome_name, start, end, miss, rows):
+        """Merge the rows fetched for a miss of plan() into the cache, return the columns of [start, end]"""
+        fetch_start, fetch_end, _, overlapping, cached = miss
+        if cached is None:
+            columns = columns_from_rows(rows)
+            self.store((cell_line, chromosome_name, start, end), columns)
+            return columns
+
+        if overlapping is not None:
+            merged = concat_columns(cached, columns_from_rows(rows))
+            self.store((cell_line, chromosome_name, fetch_start, fetch_end), merged, replaces=(overlapping,))
+            return slice_columns(merged, start, end)
+
+        columns = concat_columns(slice_columns(cached, start, end), columns_from_rows(rows))
+        self.store((cell_line, chromosome_name, start, end), columns)
+        return columns
+
+    def get(self, cell_line, chromosome_name, start, end):
+        """Columns of every contact with both ends in [start, end]"""
+        covering, miss = self.plan(cell_line, chromosome_name, start, end)
+        if miss is None:
+            return slice_columns(covering, start, end)
+        fetch_start, fetch_end, exclude, _, _ = miss
+        rows = self.fetch(cell_line, chromosome_name, fetch_start, fetch_end, exclude)
+        return self.complete(cell_line, chromosome_name, start, end, miss, rows)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, entries=len(self.entries), bytes=self.nbytes, max_bytes=self.max_bytes)
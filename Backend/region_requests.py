@@ -0,0 +1,226 @@
+"""
+Request history of the folded 3D regions.
+
+Every /api/getChromosome3DData call is logged to region_requests together with where it was served
+from: "l1", "redis", "disk", "database" (folded earlier), "http" (a 304 or stored response that skipped the
+view) or "sbif" (folded on demand, the slow first visit). The
+pre-fold scheduler (prefold.py) picks its candidates from this history and records its folds in
+prefold_regions. A later request that finds a pre-folded region is counted there as a hit, and the
+first such hit after a fold as a saved first visit. region_retention.py marks the pre-folds it evicts,
+which are only folded again once the region is requested after the eviction. Only the last
+PREFOLD_WINDOW_DAYS of requests are kept and counted, the scheduler deletes the older ones.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+REGION_REQUEST_LOG = os.getenv("REGION_REQUEST_LOG", "true").lower() == "true"
+# Requests the pre-fold candidates and the stats are drawn from
+PREFOLD_WINDOW_DAYS = int(os.getenv("PREFOLD_WINDOW_DAYS", 14))
+
+CREATE_REGION_REQUESTS_SQL = """
+    CREATE TABLE IF NOT EXISTS region_requests (
+        rrid BIGSERIAL PRIMARY KEY,
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        start_value BIGINT NOT NULL,
+        end_value BIGINT NOT NULL,
+        served_from VARCHAR(20) NOT NULL,
+        requested_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_region_requests_time ON region_requests (requested_at);
+"""
+
+CREATE_PREFOLD_REGIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS prefold_regions (
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        start_value BIGINT NOT NULL,
+        end_value BIGINT NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        folds INT NOT NULL DEFAULT 0,
+        saved INT NOT NULL DEFAULT 0,
+        hits INT NOT NULL DEFAULT 0,
+        cpu_seconds FLOAT NOT NULL DEFAULT 0.0,
+        folded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        first_hit_at TIMESTAMP,
+        evicted_at TIMESTAMP,
+        PRIMARY KEY (cell_line, chrid, start_value, end_value)
+    );
+    ALTER TABLE prefold_regions ADD COLUMN IF NOT EXISTS evicted_at TIMESTAMP;
+"""
+
+# Logs the request and, when it did not have to fold, credits a pre-fold of the region in one round trip
+LOG_REQUEST_SQL = """
+    WITH logged AS (
+        INSERT INTO region_requests (cell_line, chrid, start_value, end_value, served_from)
+        VALUES (%(cell_line)s, %(chrid)s, %(start)s, %(end)s, %(served_from)s)
+    )
+    UPDATE prefold_regions
+    SET hits = hits + 1,
+        saved = saved + (CASE WHEN first_hit_at IS NULL THEN 1 ELSE 0 END),
+        first_hit_at = COALESCE(first_hit_at, CURRENT_TIMESTAMP)
+    WHERE cell_line = %(cell_line)s
+    AND chrid = %(chrid)s
+    AND start_value = %(start)s
+    AND end_value = %(end)s
+    AND status = 'folded'
+    AND %(served_from)s <> 'sbif'
+"""
+
+# Requests over the window plus an extra weight for the recent (trending) ones, skipping regions
+# that are already folded or known to have no Hi-C contacts. The requests before the eviction of a
+# pre-fold do not count, or the retention job and the scheduler would evict and fold it in turns
+CANDIDATES_SQL = """
+    SELECT r.cell_line, r.chrid, r.start_value, r.end_value,
+        COUNT(*) + %(trending_weight)s * COUNT(*) FILTER (
+            WHERE r.requested_at >= CURRENT_TIMESTAMP - make_interval(hours => %(trending_hours)s)
+        ) AS score
+    FROM region_requests r
+    WHERE r.requested_at >= CURRENT_TIMESTAMP - make_interval(days => %(window_days)s)
+    AND NOT EXISTS (
+        SELECT 1 FROM calc_distance c
+        WHERE c.cell_line = r.cell_line
+        AND c.chrid = r.chrid
+        AND c.start_value = r.start_value
+        AND c.end_value = r.end_value
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM prefold_regions p
+        WHERE p.cell_line = r.cell_line
+        AND p.chrid = r.chrid
+        AND p.start_value = r.start_value
+        AND p.end_value = r.end_value
+        AND (p.status = 'empty' OR (p.status = 'evicted' AND r.requested_at <= p.evicted_at))
+    )
+    GROUP BY r.cell_line, r.chrid, r.start_value, r.end_value
+    ORDER BY score DESC
+    LIMIT %(limit)s
+"""
+
+RECORD_PREFOLD_SQL = """
+    INSERT INTO prefold_regions (cell_line, chrid, start_value, end_value, status, folds, cpu_seconds, folded_at)
+    VALUES (%(cell_line)s, %(chrid)s, %(start)s, %(end)s, %(status)s, 1, %(cpu_seconds)s, CURRENT_TIMESTAMP)
+    ON CONFLICT (cell_line, chrid, start_value, end_value) DO UPDATE
+    SET status = EXCLUDED.status,
+        folds = prefold_regions.folds + 1,
+        cpu_seconds = prefold_regions.cpu_seconds + EXCLUDED.cpu_seconds,
+        folded_at = CURRENT_TIMESTAMP,
+        first_hit_at = NULL
+"""
+
+PRUNE_REQUESTS_SQL = """
+    DELETE FROM region_requests WHERE requested_at < CURRENT_TIMESTAMP - make_interval(days => %(window_days)s)
+"""
+
+# Over the window, the pre-folds by their last fold
+STATS_SQL = """
+    WITH prefolds AS (
+        SELECT * FROM prefold_regions
+        WHERE folded_at >= CURRENT_TIMESTAMP - make_interval(days => %(window_days)s)
+    ), requests AS (
+        SELECT * FROM region_requests
+        WHERE requested_at >= CURRENT_TIMESTAMP - make_interval(days => %(window_days)s)
+    )
+    SELECT
+        (SELECT COALESCE(SUM(folds), 0) FROM prefolds WHERE status IN ('folded', 'evicted')) AS prefolds,
+        (SELECT COALESCE(SUM(saved), 0) FROM prefolds) AS saved_first_visits,
+        (SELECT COALESCE(SUM(hits), 0) FROM prefolds) AS prefold_hits,
+        (SELECT COALESCE(SUM(cpu_seconds), 0) FROM prefolds) AS cpu_seconds,
+        (SELECT COUNT(*) FROM requests WHERE served_from = 'sbif') AS on_demand_folds,
+        (SELECT COUNT(*) FROM requests) AS requests
+"""
+
+
+class RegionRequestLog:
+    def __init__(self, db_conn, enabled=REGION_REQUEST_LOG):
+        self.db_conn = db_conn
+        self.enabled = enabled
+        # A single writer keeps the inserts off the request path and in order
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="region-request-log")
+
+    def record(self, cell_line, chromosome_name, sequences, served_from):
+        """Queue one 3D data request for logging, the request never waits for or fails on the insert"""
+        if self.enabled:
+            self.writer.submit(self.write, cell_line, chromosome_name, dict(sequences), served_from)
+
+    def write(self, cell_line, chromosome_name, sequences, served_from):
+        try:
+            with self.db_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        LOG_REQUEST_SQL,
+                        {
+                            "cell_line": cell_line,
+                            "chrid": chromosome_name,
+                            "start": sequences["start"],
+                            "end": sequences["end"],
+                            "served_from": served_from,
+                        },
+                    )
+                conn.commit()
+        except Exception as e:
+            print(f"Failed to log region request: {e}")
+
+    def candidates(self, limit, window_days, trending_hours, trending_weight):
+        """The most requested regions that are not folded yet, best first"""
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    CANDIDATES_SQL,
+                    {
+                        "limit": limit,
+                        "window_days": window_days,
+                        "trending_hours": trending_hours,
+                        "trending_weight": trending_weight,
+                    },
+                )
+                return [
+                    (cell_line, chrid, {"start": start_value, "end": end_value})
+                    for cell_line, chrid, start_value, end_value, _ in cur.fetchall()
+                ]
+
+    def record_prefold(self, cell_line, chromosome_name, sequences, folded, cpu_seconds):
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    RECORD_PREFOLD_SQL,
+                    {
+                        "cell_line": cell_line,
+                        "chrid": chromosome_name,
+                        "start": sequences["start"],
+                        "end": sequences["end"],
+                        "status": "folded" if folded else "empty",
+                        "cpu_seconds": cpu_seconds,
+                    },
+                )
+            conn.commit()
+
+    def prune(self, window_days=PREFOLD_WINDOW_DAYS):
+        """Delete the requests older than the window, returns how many"""
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PRUNE_REQUESTS_SQL, {"window_days": window_days})
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+    def stats(self, window_days=PREFOLD_WINDOW_DAYS):
+        """Pre-fold hit rate over the window: the share of pre-folds that a later visitor found ready"""
+        with self.db_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(STATS_SQL, {"window_days": window_days})
+                prefolds, saved, hits, cpu_seconds, on_demand, requests = cur.fetchone()
+
+        first_visits = saved + on_demand
+        return {
+            "window_days": window_days,
+            "requests": requests,
+            "prefolds": prefolds,
+            "prefold_hits": hits,
+            "saved_first_visits": saved,
+            "on_demand_folds": on_demand,
+            "prefold_hit_rate": saved / prefolds if prefolds else 0.0,
+            "first_visit_saved_rate": saved / first_visits if first_visits else 0.0,
+            "prefold_cpu_seconds": cpu_seconds,
+        }
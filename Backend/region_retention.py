@@ -0,0 +1,391 @@
+"""
+Retention of the folded ensembles.
+
+position and distance are partitioned by region: fold_region() attaches a partition of each table
+for the region before sBIF writes it, rows of a region without partitions land in the default ones.
+Reads of a region's ensemble (3D view, downloads, bead distributions) record its last access in
+region_access, off the request path and at most once per RETENTION_TOUCH_INTERVAL seconds per worker.
+
+While the ensembles take more than RETENTION_BUDGET_GB, evict() removes the least recently used
+regions that were idle for at least RETENTION_MIN_IDLE_HOURS (so folds in progress are kept): their
+two partitions are dropped and their calc_distance row deleted, a catalog change instead of a DELETE
+of millions of rows and the VACUUM after it. A region whose partitions are in use is skipped after
+RETENTION_LOCK_TIMEOUT_MS and retried on the next pass. The eviction bumps the region's generation
+(region_generation) and afterwards its Redis keys are deleted, so no cache serves parts of an ensemble
+that a later fold of the region replaces, while the caches of every other region stay warm.
+
+Run it next to the backend (same image):
+    python -u region_retention.py              # evict every RETENTION_INTERVAL seconds
+    python -u region_retention.py --once       # one pass now
+    python -u region_retention.py --dry-run    # list what one pass would evict
+    python -u region_retention.py --migrate    # move unpartitioned position / distance tables into partitions
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+import psycopg
+from psycopg import sql
+from data_generation import BUMP_REGION_GENERATION_SQL, CREATE_REGION_GENERATION_TABLE_SQL
+from region_requests import CREATE_PREFOLD_REGIONS_SQL
+
+
+REGION_ACCESS_LOG = os.getenv("REGION_ACCESS_LOG", "true").lower() == "true"
+RETENTION_TOUCH_INTERVAL = float(os.getenv("RETENTION_TOUCH_INTERVAL", 300))
+RETENTION_BUDGET_GB = float(os.getenv("RETENTION_BUDGET_GB", 200))
+RETENTION_MIN_IDLE_HOURS = float(os.getenv("RETENTION_MIN_IDLE_HOURS", 24))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 3600))
+RETENTION_LOCK_TIMEOUT_MS = int(os.getenv("RETENTION_LOCK_TIMEOUT_MS", 5000))
+
+GB = 1024 ** 3
+PARTITIONED_TABLES = ("position", "distance")
+
+# Partitioned by region, the key columns are part of every unique constraint
+CREATE_POSITION_SQL = """
+    CREATE TABLE IF NOT EXISTS position (
+        pid SERIAL,
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        sampleid INT NOT NULL DEFAULT 0,
+        start_value BIGINT NOT NULL DEFAULT 0,
+        end_value BIGINT NOT NULL DEFAULT 0,
+        X FLOAT NOT NULL DEFAULT 0.0,
+        Y FLOAT NOT NULL DEFAULT 0.0,
+        Z FLOAT NOT NULL DEFAULT 0.0,
+        insert_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT position_region_pkey PRIMARY KEY (pid, cell_line, chrid, start_value, end_value)
+    ) PARTITION BY RANGE (cell_line, chrid, start_value, end_value);
+    CREATE TABLE IF NOT EXISTS position_default PARTITION OF position DEFAULT;
+    CREATE INDEX IF NOT EXISTS idx_position_search ON position (cell_line, chrid, start_value, end_value, sampleid);
+"""
+
+CREATE_DISTANCE_SQL = """
+    CREATE TABLE IF NOT EXISTS distance (
+        did SERIAL,
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        sampleid INT NOT NULL DEFAULT 0,
+        start_value BIGINT NOT NULL DEFAULT 0,
+        end_value BIGINT NOT NULL DEFAULT 0,
+        n_beads INT NOT NULL,
+        distance_vector BYTEA NOT NULL,
+        insert_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT distance_region_pkey PRIMARY KEY (did, cell_line, chrid, start_value, end_value),
+        CONSTRAINT distance_region_sample_key UNIQUE (cell_line, chrid, sampleid, start_value, end_value, n_beads)
+    ) PARTITION BY RANGE (cell_line, chrid, start_value, end_value);
+    CREATE TABLE IF NOT EXISTS distance_default PARTITION OF distance DEFAULT;
+    CREATE INDEX IF NOT EXISTS idx_distance_search ON distance (cell_line, chrid, start_value, end_value, sampleid);
+"""
+
+CREATE_REGION_ACCESS_SQL = """
+    CREATE TABLE IF NOT EXISTS region_access (
+        cell_line VARCHAR(50) NOT NULL,
+        chrid VARCHAR(50) NOT NULL,
+        start_value BIGINT NOT NULL,
+        end_value BIGINT NOT NULL,
+        last_access TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        -- Recorded accesses, throttled per worker, so a lower bound
+        accesses BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (cell_line, chrid, start_value, end_value)
+    );
+    CREATE INDEX IF NOT EXISTS idx_region_access_time ON region_access (last_access);
+"""
+
+TOUCH_SQL = """
+    INSERT INTO region_access (cell_line, chrid, start_value, end_value, last_access, accesses)
+    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, 1)
+    ON CONFLICT (cell_line, chrid, start_value, end_value) DO UPDATE
+    SET last_access = CURRENT_TIMESTAMP, accesses = region_access.accesses + 1
+"""
+
+# Least recently used first, with the stored size of the calc_distance row
+CANDIDATES_SQL = """
+    SELECT a.cell_line, a.chrid, a.start_value, a.end_value, a.last_access,
+        COALESCE(pg_column_size(c.avg_distance_vector) + pg_column_size(c.fq_distance_vector)
+            + pg_column_size(c.best_vector), 0) AS summary_bytes
+    FROM region_access a
+    LEFT JOIN calc_distance c
+        ON c.cell_line = a.cell_line
+        AND c.chrid = a.chrid
+        AND c.start_value = a.start_value
+        AND c.end_value = a.end_value
+    WHERE a.last_access < CURRENT_TIMESTAMP - make_interval(secs => %(min_idle_seconds)s)
+    ORDER BY a.last_access
+"""
+
+STORAGE_SQL = """
+    SELECT
+        (SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree('position') WHERE isleaf),
+        (SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree('distance') WHERE isleaf),
+        pg_total_relation_size('calc_distance')
+"""
+
+DELETE_REGION_SQL = "DELETE FROM {} WHERE cell_line = %s AND chrid = %s AND start_value = %s AND end_value = %s"
+
+# prefold.py folds an evicted region again only once it is requested after the eviction
+MARK_PREFOLD_EVICTED_SQL = """
+    UPDATE prefold_regions SET status = 'evicted', evicted_at = CURRENT_TIMESTAMP
+    WHERE cell_line = %s AND chrid = %s AND start_value = %s AND end_value = %s AND status = 'folded'
+"""
+
+MOVE_REGION_SQL = (
+    "INSERT INTO {} SELECT * FROM {} WHERE cell_line = %s AND chrid = %s AND start_value = %s AND end_value = %s"
+)
+
+# Regions of an older install start from their fold time, or the migration if they have no summary
+SEED_ACCESS_SQL = """
+    INSERT INTO region_access (cell_line, chrid, start_value, end_value, last_access)
+    SELECT cell_line, chrid, start_value, end_value, insert_time FROM calc_distance
+    ON CONFLICT DO NOTHING
+"""
+
+
+def region_key(region):
+    return ":".join(str(value) for value in region)
+
+
+def partition_name(table, region):
+    """Name of a region's partition of table, the region itself may not be a valid identifier"""
+    return f"{table}_{hashlib.md5(region_key(region).encode()).hexdigest()[:24]}"
+
+
+def create_partitions(cur, region, touch=True):
+    """
+    Attach a partition of position and of distance for region (cell_line, chrid, start, end) unless it
+    has them, and record the access. ATTACH PARTITION does not block the readers of the parent table
+    like CREATE TABLE ... PARTITION OF would. Commit to release the region's lock.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"partition:{region_key(region)}",))
+    lower = sql.SQL(", ").join(sql.Literal(value) for value in region)
+    upper = sql.SQL(", ").join(sql.Literal(value) for value in (*region[:3], region[3] + 1))
+    for table in PARTITIONED_TABLES:
+        name = partition_name(table, region)
+        cur.execute("SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s)", (name,))
+        if cur.fetchone() is not None:
+            continue
+        cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+            sql.Identifier(name), sql.Identifier(table)
+        ))
+        cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})").format(
+            sql.Identifier(table), sql.Identifier(name), lower, upper
+        ))
+    if touch:
+        cur.execute(TOUCH_SQL, region)
+
+
+class RegionAccessLog:
+    """Last access of the folded regions, written by a background thread at most once per interval per region"""
+
+    def __init__(self, db_conn, enabled=REGION_ACCESS_LOG, interval=RETENTION_TOUCH_INTERVAL):
+        self.db_conn = db_conn
+        self.enabled = enabled
+        self.interval = interval
+        self.touched = {}
+        self.lock = Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="region-access-log")
+
+    def touch(self, cell_line, chromosome_name, sequences):
+        """Queue the access of a region, the request never waits for or fails on the write"""
+        if not self.enabled:
+            return
+        region = (cell_line, chromosome_name, int(sequences["start"]), int(sequences["end"]))
+        now = monotonic()
+        with self.lock:
+            last = self.touched.get(region)
+            if last is not None and now - last < self.interval:
+                return
+            self.touched[region] = now
+            # Regions not touched for a whole interval will be written again anyway
+            if len(self.touched) > 100_000:
+                self.touched = {key: value for key, value in self.touched.items() if now - value < self.interval}
+        self.writer.submit(self.write, region)
+
+    def write(self, region):
+        try:
+            with self.db_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(TOUCH_SQL, region)
+                conn.commit()
+        except Exception as e:
+            print(f"Failed to record region access: {e}")
+
+
+def storage(cur):
+    """Bytes of the position and distance partitions and of calc_distance"""
+    cur.execute(STORAGE_SQL)
+    position_bytes, distance_bytes, summary_bytes = cur.fetchone()
+    return {"position": position_bytes, "distance": distance_bytes, "calc_distance": summary_bytes}
+
+
+def eviction_candidates(cur, min_idle_hours):
+    """[(region, last_access, bytes)] of the regions idle long enough, least recently used first"""
+    cur.execute(CANDIDATES_SQL, {"min_idle_seconds": min_idle_hours * 3600})
+    rows = cur.fetchall()
+    names = [partition_name(table, row[:4]) for row in rows for table in PARTITIONED_TABLES]
+    cur.execute(
+        "SELECT name, COALESCE(pg_total_relation_size(to_regclass(name)), 0) FROM unnest(%s::text[]) AS name",
+        (names,),
+    )
+    sizes = dict(cur.fetchall())
+    return [
+        (row[:4], row[4], row[5] + sum(sizes.get(partition_name(table, row[:4]), 0) for table in PARTITIONED_TABLES))
+        for row in rows
+    ]
+
+
+def evict_region(conn, region):
+    """
+    Drop a region's partitions and summary, bump its generation and mark its pre-fold evicted in one
+    transaction, False if they stayed locked
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("SET LOCAL lock_timeout = {}").format(sql.Literal(f"{RETENTION_LOCK_TIMEOUT_MS}ms")))
+            for table in ("calc_distance", "region_access"):
+                cur.execute(sql.SQL(DELETE_REGION_SQL).format(sql.Identifier(table)), region)
+            for table in PARTITIONED_TABLES:
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(partition_name(table, region))))
+            cur.execute(BUMP_REGION_GENERATION_SQL, region)
+            cur.execute(MARK_PREFOLD_EVICTED_SQL, region)
+        conn.commit()
+        return True
+    except psycopg.errors.LockNotAvailable:
+        conn.rollback()
+        return False
+
+
+def evict(conn, budget_bytes, min_idle_hours=RETENTION_MIN_IDLE_HOURS, dry_run=False):
+    """
+    Evict the least recently used regions until the ensembles fit budget_bytes.
+    Returns the evicted (or, dry, the to be evicted) regions and the storage before.
+    """
+    with conn.cursor() as cur:
+        if not dry_run:
+            cur.execute(CREATE_REGION_GENERATION_TABLE_SQL)
+            cur.execute(CREATE_PREFOLD_REGIONS_SQL)
+        before = storage(cur)
+        total = sum(before.values())
+        candidates = eviction_candidates(cur, min_idle_hours) if total > budget_bytes else []
+    conn.commit()
+
+    evicted = []
+    for region, last_access, nbytes in candidates:
+        if total <= budget_bytes:
+            break
+        if dry_run or evict_region(conn, region):
+            evicted.append({"region": region, "last_access": last_access, "bytes": nbytes})
+            total -= nbytes
+    return evicted, before
+
+
+def purge_region_keys(redis_client, regions):
+    """
+    Delete the Redis keys of the regions, e.g. GM12878:chr8:127300000:128300000:fq_data. Their other
+    cache tiers were retired by the region generation bump in evict_region().
+    """
+    import cache_policy
+    return sum(cache_policy.purge(redis_client, match=f"{region_key(region)}:*") for region in regions)
+
+
+def run_once(budget_bytes, dry_run=False):
+    from process import db_conn, redis_client
+    with db_conn() as conn:
+        evicted, before = evict(conn, budget_bytes, dry_run=dry_run)
+    freed = sum(item["bytes"] for item in evicted)
+    print(f"Ensembles take {sum(before.values()) / GB:.1f} GB of {budget_bytes / GB:.1f} GB, "
+          f"{'would evict' if dry_run else 'evicted'} {len(evicted)} regions, {freed / GB:.1f} GB")
+    for item in evicted:
+        print(f"  {region_key(item['region'])} last accessed {item['last_access']}, {item['bytes'] / 2 ** 20:.0f} MB")
+    if evicted and not dry_run:
+        removed = purge_region_keys(redis_client, [item["region"] for item in evicted])
+        print(f"Region generations bumped, {removed} Redis keys deleted")
+    return evicted
+
+
+def migrate(conn):
+    """
+    Turn unpartitioned position and distance tables of an older install into partitioned ones, moving
+    the rows of every region into its own partitions, one region per transaction. The accesses start
+    from the calc_distance insert times.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('position')")
+        row = cur.fetchone()
+        if row is not None and row[0] == "p":
+            print("position and distance are partitioned already")
+            return
+        cur.execute(CREATE_REGION_ACCESS_SQL)
+        for table in PARTITIONED_TABLES:
+            cur.execute(sql.SQL("ALTER TABLE IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(table), sql.Identifier(f"{table}_legacy")
+            ))
+            cur.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(f"idx_{table}_search"), sql.Identifier(f"idx_{table}_legacy_search")
+            ))
+        cur.execute(CREATE_POSITION_SQL)
+        cur.execute(CREATE_DISTANCE_SQL)
+        for table, column in (("position", "pid"), ("distance", "did")):
+            cur.execute(sql.SQL("SELECT setval(pg_get_serial_sequence({}, {}), (SELECT COALESCE(MAX({}), 0) + 1 FROM {}))").format(
+                sql.Literal(table), sql.Literal(column), sql.Identifier(column), sql.Identifier(f"{table}_legacy")
+            ))
+        cur.execute(SEED_ACCESS_SQL)
+        cur.execute("""
+            SELECT cell_line, chrid, start_value, end_value FROM position_legacy
+            UNION
+            SELECT cell_line, chrid, start_value, end_value FROM distance_legacy
+        """)
+        regions = cur.fetchall()
+    conn.commit()
+
+    for n, region in enumerate(regions, 1):
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO region_access (cell_line, chrid, start_value, end_value) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT DO NOTHING",
+                region,
+            )
+            create_partitions(cur, region, touch=False)
+            for table in PARTITIONED_TABLES:
+                cur.execute(sql.SQL(MOVE_REGION_SQL).format(
+                    sql.Identifier(table), sql.Identifier(f"{table}_legacy")
+                ), region)
+        conn.commit()
+        print(f"[{n}/{len(regions)}] {region_key(region)} moved")
+
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(f"{table}_legacy")))
+    conn.commit()
+    print("position and distance are partitioned by region")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run a single eviction pass now and exit")
+    parser.add_argument("--dry-run", action="store_true", help="list the regions one pass would evict")
+    parser.add_argument("--migrate", action="store_true", help="partition the tables of an older install")
+    parser.add_argument("--budget-gb", type=float, default=RETENTION_BUDGET_GB)
+    args = parser.parse_args()
+
+    if args.migrate:
+        from process import db_conn
+        with db_conn() as conn:
+            migrate(conn)
+        return
+
+    budget_bytes = args.budget_gb * GB
+    if args.once or args.dry_run:
+        run_once(budget_bytes, dry_run=args.dry_run)
+        return
+    while True:
+        try:
+            run_once(budget_bytes)
+        except Exception as e:
+            print(f"Eviction failed: {e}")
+        sleep(RETENTION_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,18 @@
 ##parameters
 chrlensfile="./chromosome_sizes.txt"
 res=5000
-threads=50
-EXE_PATH="../sBIF/bin/sBIF"
+threads=${3:-50}
+# SBIF_EXE swaps in another folding program, e.g. benchmarks/sbif_stub.py for load tests
+EXE_PATH="${SBIF_EXE:-../sBIF/bin/sBIF}"
 n_samples=$1
 n_samples_per_run=$2
+input_dir=${4:-./Folding_input}
 
 count=1
-total_files=$(find ./Folding_input -name "*.txt" | wc -l | xargs)
+total_files=$(find "$input_dir" -name "*.txt" | wc -l | xargs)
 
 
-for interfile in ./Folding_input/*.txt; do
+for interfile in "$input_dir"/*.txt; do
     filename=$(basename "$interfile")
     
     # Extract cell_line, chromosome, start, and end from the filename
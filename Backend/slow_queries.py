@@ -0,0 +1,358 @@
+"""
+Slow-query capture for the pooled Postgres connections.
+
+configure_connection() is the pool's configure callback: on top of the tracing cursors it times
+every statement and aggregates the timings per normalized statement (literals and parameters folded
+to ?), served at /api/getSlowQueryStats. A statement taking SLOW_QUERY_MS or longer is appended with
+its parameters and row count to SLOW_QUERY_LOG, one JSON object per line, rotated to SLOW_QUERY_LOG.1
+at TRACE_FILE_MAX_BYTES like the traces. A SLOW_QUERY_EXPLAIN_SAMPLE
+share of the slow SELECTs, at most one per statement every SLOW_QUERY_EXPLAIN_INTERVAL seconds, is run
+again under EXPLAIN (ANALYZE, BUFFERS) by a background thread on its own connection, so the request
+never waits for the plan, and the plan is logged with the statement.
+
+Named cursors are timed up to the DECLARE, not over their fetches, and COPY statements are not timed.
+executemany() batches are timed as a whole and logged without their parameters.
+
+Report the slow statements of all workers from the log, slowest total first:
+    python -m slow_queries --log slow_queries/slow_queries.jsonl --top 20
+"""
+import argparse
+import os
+import queue
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+import orjson
+import psycopg
+from tracing import (
+    TracedAsyncCursor,
+    TracedCursor,
+    TracedServerCursor,
+    TraceExporter,
+    current_trace,
+)
+
+
+SLOW_QUERY_ENABLED = os.getenv("SLOW_QUERY_ENABLED", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "./slow_queries/slow_queries.jsonl")
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", 0.1))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+# EXPLAIN ANALYZE runs the statement again, a runaway one is cancelled after this
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 60000))
+# Distinct normalized statements aggregated in memory, later ones are counted under "other"
+SLOW_QUERY_MAX_STATEMENTS = int(os.getenv("SLOW_QUERY_MAX_STATEMENTS", 1000))
+# Longest parameter repr kept in the log, distance vectors are megabytes
+SLOW_QUERY_PARAM_LENGTH = 200
+
+
+def query_text(query, conn=None):
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    if isinstance(query, str):
+        return query
+    # psycopg.sql.Composed and friends
+    try:
+        return query.as_string(conn)
+    except Exception:
+        return repr(query)
+
+
+def normalize(statement):
+    """The statement with its literals and parameters replaced by ?, e.g. to group the calls of one query"""
+    text = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    text = re.sub(r"%s|%b|%t|%\(\w+\)[sbt]|\$\d+", "?", text)
+    text = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])", "?", text)
+    text = " ".join(text.split())
+    # IN lists and VALUES rows of any length
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", text)
+
+
+def format_params(params):
+    if params is None:
+        return None
+    values = params.values() if isinstance(params, dict) else params
+    formatted = []
+    for value in values:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            formatted.append(f"<{len(value)} bytes>")
+        else:
+            formatted.append(repr(value)[:SLOW_QUERY_PARAM_LENGTH])
+    return dict(zip(params, formatted)) if isinstance(params, dict) else formatted
+
+
+def is_read_only(statement):
+    return re.match(r"\s*(\(\s*)*(SELECT|WITH|VALUES|TABLE)\b", statement, re.IGNORECASE) is not None and not re.search(
+        r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|DROP|ALTER|TRUNCATE)\b", statement, re.IGNORECASE
+    )
+
+
+class StatementStats:
+    """Timings per normalized statement in this worker"""
+
+    def __init__(self, max_statements=SLOW_QUERY_MAX_STATEMENTS):
+        self.max_statements = max_statements
+        self.statements = {}
+        self.lock = threading.Lock()
+        # When each statement was last explained, for the rate limit
+        self.explained_at = {}
+
+    def record(self, normalized, duration_ms, rowcount, slow):
+        with self.lock:
+            stats = self.statements.get(normalized)
+            if stats is None:
+                if len(self.statements) >= self.max_statements:
+                    normalized = "other"
+                stats = self.statements.setdefault(normalized, {
+                    "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "slow_calls": 0, "rows": 0, "plan": None,
+                })
+            stats["calls"] += 1
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["rows"] += max(rowcount, 0)
+            if slow:
+                stats["slow_calls"] += 1
+
+    def should_explain(self, normalized):
+        now = monotonic()
+        with self.lock:
+            last = self.explained_at.get(normalized)
+            if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            if random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE:
+                return False
+            self.explained_at[normalized] = now
+            return True
+
+    def set_plan(self, normalized, plan):
+        with self.lock:
+            if normalized in self.statements:
+                self.statements[normalized]["plan"] = plan
+
+    def snapshot(self, limit=100):
+        with self.lock:
+            rows = [dict(stats, statement=normalized) for normalized, stats in self.statements.items()]
+        for row in rows:
+            row["mean_ms"] = row["total_ms"] / row["calls"]
+            row["mean_rows"] = row["rows"] / row["calls"]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return {"threshold_ms": SLOW_QUERY_MS, "statements": rows[:limit]}
+
+
+statement_stats = StatementStats()
+log_writer = TraceExporter(SLOW_QUERY_LOG, otlp_endpoint="")
+
+
+class Explainer:
+    """Runs EXPLAIN (ANALYZE, BUFFERS) of sampled slow statements on its own connection, in a background thread"""
+
+    def __init__(self, conninfo=None):
+        self.conninfo = conninfo
+        self.queue = queue.Queue(maxsize=100)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def submit(self, statement, params, entry):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="slow-query-explain", daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait((statement, params, entry))
+        except queue.Full:
+            log_writer.export(entry)
+
+    def explain(self, statement, params):
+        if self.conn is None or self.conn.closed:
+            # Read on first use, the importing module loads the .env file after its imports
+            conninfo = self.conninfo or (
+                f"host={os.getenv('DB_HOST')} port={os.getenv('DB_PORT')} dbname={os.getenv('DB_NAME')} "
+                f"user={os.getenv('DB_USERNAME')} password={os.getenv('DB_PASSWORD')}"
+            )
+            self.conn = psycopg.connect(conninfo)
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", params)
+                return "\n".join(row[0] for row in cur.fetchall())
+        finally:
+            # Nothing the statement did is kept
+            self.conn.rollback()
+
+    def run(self):
+        while True:
+            statement, params, entry = self.queue.get()
+            try:
+                entry["plan"] = self.explain(statement, params)
+                statement_stats.set_plan(entry["normalized"], entry["plan"])
+            except Exception as e:
+                entry["plan_error"] = str(e)
+                if self.conn is not None and self.conn.broken:
+                    self.conn = None
+            log_writer.export(entry)
+
+
+explainer = Explainer()
+
+
+def record(cursor, query, params, duration_ms):
+    statement = query_text(query, cursor.connection)
+    normalized = normalize(statement)
+    slow = duration_ms >= SLOW_QUERY_MS
+    statement_stats.record(normalized, duration_ms, cursor.rowcount, slow)
+    if not slow:
+        return
+
+    trace = current_trace.get()
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "normalized": normalized,
+        "statement": statement,
+        "params": format_params(params),
+        "duration_ms": duration_ms,
+        "rowcount": cursor.rowcount,
+        "request_id": trace.request_id if trace is not None else None,
+    }
+    print(f"Slow query ({duration_ms:.0f} ms): {normalized[:200]}")
+    if is_read_only(statement) and statement_stats.should_explain(normalized):
+        explainer.submit(statement, params, entry)
+    else:
+        log_writer.export(entry)
+
+
+class TimedCursor(TracedCursor):
+    def execute(self, query, params=None, **kwargs):
+        started = perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            record(self, query, params, (perf_counter() - started) * 1000)
+
+    def executemany(self, query, params_seq, **kwargs):
+        started = perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            record(self, query, None, (perf_counter() - started) * 1000)
+
+
+class TimedServerCursor(TracedServerCursor):
+    def execute(self, query, params=None, **kwargs):
+        started = perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            record(self, query, params, (perf_counter() - started) * 1000)
+
+
+class TimedAsyncCursor(TracedAsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        started = perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            record(self, query, params, (perf_counter() - started) * 1000)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        started = perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            record(self, query, None, (perf_counter() - started) * 1000)
+
+
+def configure_connection(conn):
+    """ConnectionPool configure callback, times and traces the statements run on the pooled connections"""
+    if not SLOW_QUERY_ENABLED:
+        conn.cursor_factory = TracedCursor
+        conn.server_cursor_factory = TracedServerCursor
+        return
+    conn.cursor_factory = TimedCursor
+    conn.server_cursor_factory = TimedServerCursor
+
+
+async def configure_async_connection(conn):
+    """AsyncConnectionPool configure callback"""
+    conn.cursor_factory = TimedAsyncCursor if SLOW_QUERY_ENABLED else TracedAsyncCursor
+
+
+def stats(limit=100):
+    return statement_stats.snapshot(limit)
+
+
+def percentile(sorted_values, pct):
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def report(path, top=20, since=None):
+    """
+    Slow statements of the log grouped by normalized text, slowest total first. trend compares the
+    mean duration of the newer half of the captures with the older half, a value well above 1 means
+    the statement is getting slower, e.g. as its tables grow.
+    """
+    groups = {}
+    # The rotated backup holds the older captures
+    for log_path in (f"{path}.1", path):
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, "rb") as f:
+            for line in f:
+                entry = orjson.loads(line)
+                if since is not None and entry["time"] < since:
+                    continue
+                groups.setdefault(entry["normalized"], []).append(entry)
+
+    rows = []
+    for normalized, entries in groups.items():
+        entries.sort(key=lambda entry: entry["time"])
+        durations = sorted(entry["duration_ms"] for entry in entries)
+        half = len(entries) // 2
+        older = [entry["duration_ms"] for entry in entries[:half]]
+        newer = [entry["duration_ms"] for entry in entries[half:]]
+        plans = [entry for entry in entries if entry.get("plan")]
+        rows.append({
+            "statement": normalized,
+            "count": len(entries),
+            "total_ms": sum(durations),
+            "p50_ms": percentile(durations, 50),
+            "p95_ms": percentile(durations, 95),
+            "max_ms": durations[-1],
+            "mean_rows": sum(max(entry["rowcount"], 0) for entry in entries) / len(entries),
+            "trend": (sum(newer) / len(newer)) / (sum(older) / len(older)) if older else None,
+            "first_seen": entries[0]["time"],
+            "last_seen": entries[-1]["time"],
+            "last_params": entries[-1]["params"],
+            "last_plan": plans[-1]["plan"] if plans else None,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=SLOW_QUERY_LOG)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--since", help="only captures from this ISO time on, e.g. 2026-01-01")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    rows = report(args.log, args.top, args.since)
+    if args.json:
+        print(orjson.dumps(rows, option=orjson.OPT_INDENT_2).decode())
+        return
+    for row in rows:
+        trend = f"x{row['trend']:.2f}" if row["trend"] is not None else "-"
+        print(f"{row['count']:6d} slow  total {row['total_ms'] / 1000:9.1f} s  p50 {row['p50_ms']:9.1f} ms  "
+              f"p95 {row['p95_ms']:9.1f} ms  max {row['max_ms']:9.1f} ms  rows {row['mean_rows']:10.0f}  trend {trend}")
+        print(f"    {row['statement'][:300]}")
+        if row["last_plan"]:
+            print("    " + row["last_plan"].replace("\n", "\n    "))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Request-scoped tracing.
+
+Every request gets an id (the incoming X-Request-ID, or a new one), returned in the X-Request-ID
+response header. While it is served, connection pool checkouts, SQL statements, Redis commands and
+pipelines, the stages of the data path (metrics.stage) and the stages of an sBIF run are recorded as
+spans with their timings and sizes, nested under the request span. Finished traces are written by a
+background thread, one JSON object per line, to TRACE_FILE, and posted to an OTLP/HTTP collector at
+TRACE_OTLP_ENDPOINT when one is set. TRACE_MIN_DURATION_MS (default 500) keeps only the traces of
+slow requests, so tail latencies can be investigated without tracing every fast cache hit to disk.
+Once TRACE_FILE reaches TRACE_FILE_MAX_BYTES it is renamed to TRACE_FILE.1, replacing the previous
+one, so the traces on disk stay below twice that size. A trace ends with the response object, the body
+of a streamed download is not part of it.
+"""
+import os
+import queue
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns, time_ns
+import orjson
+import psycopg
+import redis
+import redis.asyncio as aioredis
+import requests
+from flask import request
+
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_MIN_DURATION_MS = float(os.getenv("TRACE_MIN_DURATION_MS", 500))
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", 100 * 1024 * 1024))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "chromosome-backend")
+# Longest SQL text kept on a span
+TRACE_STATEMENT_LENGTH = 500
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Trace of the request being served, the span new spans are nested under, and the request span
+# (span id, wall clock start, perf counter start)
+current_trace = ContextVar("current_trace", default=None)
+current_span_id = ContextVar("current_span_id", default=None)
+request_span = ContextVar("request_span", default=None)
+
+
+class Trace:
+    def __init__(self, request_id=None):
+        self.trace_id = secrets.token_hex(16)
+        self.request_id = request_id or self.trace_id
+        # Spans are appended from the request thread and from offloaded work, list.append is atomic
+        self.spans = []
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+def record_span(name, start_ns, duration_ns, parent_id=None, **attributes):
+    """Add a finished span to the current trace, start_ns is wall clock time in ns"""
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    span_id = new_span_id()
+    trace.spans.append({
+        "span_id": span_id,
+        "parent_span_id": parent_id if parent_id is not None else current_span_id.get(),
+        "name": name,
+        "start_time_unix_nano": start_ns,
+        "end_time_unix_nano": start_ns + duration_ns,
+        "duration_ms": duration_ns / 1e6,
+        "attributes": attributes,
+    })
+    return span_id
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record the enclosed block as a span of the current trace, nested under the enclosing span.
+    Yields the attributes dict, so sizes known only at the end can be added to it.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+
+    span_id = new_span_id()
+    parent_id = current_span_id.get()
+    token = current_span_id.set(span_id)
+    start_ns, started = time_ns(), perf_counter_ns()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        duration_ns = perf_counter_ns() - started
+        current_span_id.reset(token)
+        trace.spans.append({
+            "span_id": span_id,
+            "parent_span_id": parent_id,
+            "name": name,
+            "start_time_unix_nano": start_ns,
+            "end_time_unix_nano": start_ns + duration_ns,
+            "duration_ms": duration_ns / 1e6,
+            "attributes": attributes,
+        })
+
+
+def payload_size(value):
+    """Bytes of a Redis reply, 0 for non-byte replies"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    return 0
+
+
+def statement_text(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        # psycopg.sql.Composed and friends
+        query = repr(query)
+    return " ".join(query.split())[:TRACE_STATEMENT_LENGTH]
+
+
+class TracedCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        with span("db.execute", statement=statement_text(query)) as attributes:
+            result = super().execute(query, params, **kwargs)
+            attributes["rowcount"] = self.rowcount
+            return result
+
+    def executemany(self, query, params_seq, **kwargs):
+        with span("db.executemany", statement=statement_text(query)) as attributes:
+            result = super().executemany(query, params_seq, **kwargs)
+            attributes["rowcount"] = self.rowcount
+            return result
+
+    def copy(self, statement, params=None, **kwargs):
+        return traced_copy(super().copy(statement, params, **kwargs), statement)
+
+
+class TracedServerCursor(psycopg.ServerCursor):
+    def execute(self, query, params=None, **kwargs):
+        with span("db.execute", statement=statement_text(query), cursor=self.name):
+            return super().execute(query, params, **kwargs)
+
+
+@contextmanager
+def traced_copy(copy_manager, statement):
+    with span("db.copy", statement=statement_text(statement)):
+        with copy_manager as copy:
+            yield copy
+
+
+class TracedAsyncCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        with span("db.execute", statement=statement_text(query)) as attributes:
+            result = await super().execute(query, params, **kwargs)
+            attributes["rowcount"] = self.rowcount
+            return result
+
+    async def executemany(self, query, params_seq, **kwargs):
+        with span("db.executemany", statement=statement_text(query)) as attributes:
+            result = await super().executemany(query, params_seq, **kwargs)
+            attributes["rowcount"] = self.rowcount
+            return result
+
+
+def configure_connection(conn):
+    """ConnectionPool configure callback, traces the statements run on the pooled connections"""
+    conn.cursor_factory = TracedCursor
+    conn.server_cursor_factory = TracedServerCursor
+
+
+async def configure_async_connection(conn):
+    """AsyncConnectionPool configure callback"""
+    conn.cursor_factory = TracedAsyncCursor
+
+
+class TracedRedis(redis.Redis):
+    """redis.Redis recording every command as a span with the size of its reply"""
+
+    def execute_command(self, *args, **options):
+        with span("redis.command", command=str(args[0])) as attributes:
+            result = super().execute_command(*args, **options)
+            attributes["reply_bytes"] = payload_size(result)
+            return result
+
+
+class TracedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        with span("redis.command", command=str(args[0])) as attributes:
+            result = await super().execute_command(*args, **options)
+            attributes["reply_bytes"] = payload_size(result)
+            return result
+
+
+@contextmanager
+def pipeline_span(pipe):
+    """Span of one Redis pipeline round trip, yields the attributes to add the reply size to"""
+    with span("redis.pipeline", commands=len(pipe)) as attributes:
+        yield attributes
+
+
+class TraceExporter:
+    """Writes finished traces from a background thread, so requests never wait on the file or the collector"""
+
+    def __init__(self, path=TRACE_FILE, otlp_endpoint=TRACE_OTLP_ENDPOINT, max_bytes=TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        # 0 means the file is never rotated
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=10000)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def export(self, record):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="trace-exporter", daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        while True:
+            records = [self.queue.get()]
+            while not self.queue.empty() and len(records) < 100:
+                records.append(self.queue.get_nowait())
+            if self.path:
+                try:
+                    self.rotate()
+                    with open(self.path, "ab") as f:
+                        for record in records:
+                            f.write(orjson.dumps(record, default=str) + b"\n")
+                except OSError as e:
+                    print(f"Writing traces failed: {e}")
+            if self.otlp_endpoint:
+                try:
+                    requests.post(self.otlp_endpoint, data=orjson.dumps(otlp_payload(records), default=str),
+                                  headers={"Content-Type": "application/json"}, timeout=5)
+                except requests.RequestException as e:
+                    print(f"Sending traces failed: {e}")
+
+    def rotate(self):
+        """Keep the file full enough to rotate as the one backup, every worker writing to it may do it"""
+        if not self.max_bytes:
+            return
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            # Not written yet, or another worker rotated it first
+            pass
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(records):
+    """OTLP/HTTP JSON body (ExportTraceServiceRequest) of the given traces"""
+    spans = [
+        {
+            "traceId": record["trace_id"],
+            "spanId": span["span_id"],
+            **({"parentSpanId": span["parent_span_id"]} if span["parent_span_id"] else {}),
+            "name": span["name"],
+            "kind": 2 if span["parent_span_id"] is None else 1,
+            "startTimeUnixNano": str(span["start_time_unix_nano"]),
+            "endTimeUnixNano": str(span["end_time_unix_nano"]),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span["attributes"].items()],
+        }
+        for record in records
+        for span in record["spans"]
+    ]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]
+    }
+
+
+exporter = TraceExporter()
+
+
+def finish_trace(trace, root_duration_ns, exporter=exporter):
+    if root_duration_ns / 1e6 < TRACE_MIN_DURATION_MS:
+        return
+    root = next((span for span in trace.spans if span["parent_span_id"] is None), None)
+    exporter.export({
+        "trace_id": trace.trace_id,
+        "request_id": trace.request_id,
+        "name": root["name"] if root else None,
+        "duration_ms": root_duration_ns / 1e6,
+        "spans": sorted(trace.spans, key=lambda span: span["start_time_unix_nano"]),
+    })
+
+
+def incoming_request_id(current_request):
+    """The caller's request id when it is a plain token, e.g. one set by a proxy"""
+    incoming = current_request.headers.get(REQUEST_ID_HEADER, "")
+    if 0 < len(incoming) <= 64 and incoming.replace("-", "").isalnum():
+        return incoming
+    return None
+
+
+def init_app(app, current_request=request):
+    """Trace the requests of a Flask app, or of a Quart app given quart.request"""
+    if not TRACING_ENABLED:
+        return
+
+    def begin_request():
+        current_trace.set(Trace(incoming_request_id(current_request)))
+        root_id = new_span_id()
+        current_span_id.set(root_id)
+        request_span.set((root_id, time_ns(), perf_counter_ns()))
+
+    def finish_request(response):
+        trace = current_trace.get()
+        if trace is None:
+            return response
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        root_id, start_ns, started = request_span.get()
+        duration_ns = perf_counter_ns() - started
+        trace.spans.append({
+            "span_id": root_id,
+            "parent_span_id": None,
+            "name": f"{current_request.method} {current_request.endpoint}",
+            "start_time_unix_nano": start_ns,
+            "end_time_unix_nano": start_ns + duration_ns,
+            "duration_ms": duration_ns / 1e6,
+            "attributes": {
+                "path": current_request.path,
+                "status": response.status_code,
+                "response_bytes": response.content_length,
+            },
+        })
+        current_trace.set(None)
+        finish_trace(trace, duration_ns)
+        return response
+
+    app.before_request(begin_request)
+    app.after_request(finish_request)
@@ -6,6 +6,7 @@ import { ChromosomeBar } from './chromosomeBar.js';
 import { Chromosome3D } from './chromosome3D.js';
 import { ProjectIntroduction } from './projectIntroduction.js';
 import { PlusOutlined, MinusOutlined, InfoCircleOutlined, ExperimentOutlined, DownloadOutlined, SyncOutlined, FolderViewOutlined, LeftOutlined, RightOutlined } from "@ant-design/icons";
+import { fetchCached } from './utils/etagClient.js';
 
 
 function App() {
@@ -338,9 +339,7 @@ function App() {
       setChromosome3DComponentIndex(1);
       setChromosome3DExampleID(0);
       setChromosome3DExampleData({});
-      fetchChromosomeData(selectedChromosomeSequence);
-      fetchValidChromosomeValidIbpData(selectedChromosomeSequence);
-      fetchGeneList(selectedChromosomeSequence);
+      fetchRegionBundle(selectedChromosomeSequence);
       setChromosome3DCellLineName(cellLineName);
     }
   }, [selectedChromosomeSequence]);
@@ -612,7 +611,7 @@ function App() {
       // Start progress polling for example data
       progressPolling(cellLineName, chromosomeName, selectedChromosomeSequence, apiSampleID, true);
 
-      fetch('/api/getExistChromosome3DData', {
+      fetchCached('/api/getExistChromosome3DData', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -676,7 +675,7 @@ function App() {
       // Start progress polling for non-example data
       progressPolling(cellLineName, chromosomeName, selectedChromosomeSequence, apiSampleID, false);
 
-      fetch('/api/getChromosome3DData', {
+      fetchCached('/api/getChromosome3DData', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -739,7 +738,7 @@ function App() {
   }
 
   const fetchMergedValidChromosomeSequences = () => {
-    fetch('/api/getChromosMergedValidSequence', {
+    fetchCached('/api/getChromosMergedValidSequence', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -753,7 +752,7 @@ function App() {
   }
 
   const fetchOriginalValidChromosomeSequences = () => {
-    fetch('/api/getChromosomeOriginalValidSequence', {
+    fetchCached('/api/getChromosomeOriginalValidSequence', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -790,7 +789,7 @@ function App() {
   };
 
   const fetchChromosomeList = (value) => {
-    fetch('/api/getChromosomesList', {
+    fetchCached('/api/getChromosomesList', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -804,7 +803,7 @@ function App() {
   };
 
   const fetchChromosomeSize = (value) => {
-    fetch("/api/getChromosomeSize", {
+    fetchCached("/api/getChromosomeSize", {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -818,7 +817,7 @@ function App() {
   };
 
   const fetchChromosomeSizeByGeneName = (value) => {
-    fetch("/api/getChromosomeSizeByGeneName", {
+    fetchCached("/api/getChromosomeSizeByGeneName", {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -835,7 +834,7 @@ function App() {
         const chromosomeName = `chr${data.chromosome}`;
         fetchChromosomeSize(chromosomeName);
         setChromosomeName(chromosomeName);
-        fetch('/api/getChromosomeOriginalValidSequence', {
+        fetchCached('/api/getChromosomeOriginalValidSequence', {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
@@ -858,39 +857,54 @@ function App() {
       })
   }
 
-  const fetchChromosomeData = (sequence) => {
+  // Load heatmap contacts, valid ibps and genes of a region in one request
+  const fetchRegionBundle = (sequence) => {
     if (!cellLineName || !chromosomeName) {
       warning('noData');
     } else {
-      fetch("/api/getChromosData", {
+      fetchCached("/api/getRegionBundle", {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ cell_line: cellLineName, chromosome_name: chromosomeName, sequences: sequence })
+        body: JSON.stringify({
+          cell_line: cellLineName,
+          chromosome_name: chromosomeName,
+          sequences: sequence,
+          facets: ["chromosome_data", "valid_ibps", "gene_list"]
+        })
       })
         .then(res => res.json())
-        .then(data => {
-          setChromosomeData(data);
+        .then(({ data = {}, errors = {} }) => {
+          // A failed facet is cleared, so the previous region's data is not shown for this one
+          setChromosomeData(data.chromosome_data || []);
+          setValidChromosomeValidIbpData(data.valid_ibps || []);
+          setGeneList(data.gene_list || []);
+          if (Object.keys(errors).length > 0) {
+            console.error('Error fetching region bundle:', errors);
+            messageApi.open({
+              type: 'error',
+              content: `Failed to load ${Object.keys(errors).join(', ')} for this region`,
+              duration: 3,
+            });
+          }
+          setHeatmapLoading(false);
+        })
+        .catch(error => {
+          console.error('Error fetching region bundle:', error);
+          setChromosomeData([]);
+          setValidChromosomeValidIbpData([]);
+          setGeneList([]);
+          messageApi.open({
+            type: 'error',
+            content: 'Failed to load the region',
+            duration: 3,
+          });
           setHeatmapLoading(false);
         });
     }
   };
 
-  const fetchValidChromosomeValidIbpData = (sequence) => {
-    fetch("/api/getChromosValidIBPData", {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ cell_line: cellLineName, chromosome_name: chromosomeName, sequences: sequence })
-    })
-      .then(res => res.json())
-      .then(data => {
-        setValidChromosomeValidIbpData(data);
-      });
-  }
-
   const fetchExampleChromos3DData = (cell_line, sample_id, sampleChange, componentId = null) => {
     if (cell_line && chromosomeName && selectedChromosomeSequence) {
       const isComparison = componentId !== null;
@@ -930,7 +944,7 @@ function App() {
         return;
       }
 
-      fetch("/api/getChromosome3DData", {
+      fetchCached("/api/getChromosome3DData", {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -991,25 +1005,8 @@ function App() {
     }
   };
 
-  const fetchGeneList = (sequence) => {
-    if (chromosomeName && sequence) {
-      let filteredChromosomeName = chromosomeName.slice(3);
-      fetch("/api/getGeneList", {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ chromosome_name: filteredChromosomeName, sequences: sequence })
-      })
-        .then(res => res.json())
-        .then(data => {
-          setGeneList(data);
-        });
-    }
-  };
-
   const fetchGeneNameBySearch = (value) => {
-    fetch("/api/geneNamesListSearch", {
+    fetchCached("/api/geneNamesListSearch", {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1100,7 +1097,7 @@ function App() {
         : bintu
     ));
 
-    fetch('/api/getBintuDistanceMatrix', {
+    fetchCached('/api/getBintuDistanceMatrix', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1134,7 +1131,7 @@ function App() {
 
         // Fetch gene list for the region
         const sequences = { start: startValue, end: endValue };
-        fetch('/api/getGeneList', {
+        fetchCached('/api/getGeneList', {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
@@ -1283,7 +1280,7 @@ function App() {
       requestBody.resolution = resolution;
     }
 
-    fetch('/api/getGseCellIdOptions', {
+    fetchCached('/api/getGseCellIdOptions', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1310,7 +1307,7 @@ function App() {
       return;
     }
 
-    fetch('/api/getGseChrIdOptions', {
+    fetchCached('/api/getGseChrIdOptions', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1359,7 +1356,7 @@ function App() {
       requestBody.resolution = resolution;
     }
 
-    fetch('/api/getGseDistanceMatrix', {
+    fetchCached('/api/getGseDistanceMatrix', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1388,7 +1385,7 @@ function App() {
         // Fetch gene list for the region using data from GSE response
         if (data && data.start_value !== undefined && data.end_value !== undefined) {
           const sequences = { start: data.start_value, end: data.end_value };
-          fetch('/api/getGeneList', {
+          fetchCached('/api/getGeneList', {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
@@ -2244,9 +2241,7 @@ function App() {
       setCurrentChromosomeSequence(newSequence);
     }
 
-    fetchChromosomeData(newSequence);
-    fetchValidChromosomeValidIbpData(newSequence);
-    fetchGeneList(newSequence);
+    fetchRegionBundle(newSequence);
 
     // Trigger updates for all existing comparison heatmaps
     if (comparisonHeatmapList.length > 0) {
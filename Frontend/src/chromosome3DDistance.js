@@ -7,6 +7,7 @@ import { Text, OrbitControls } from '@react-three/drei';
 import { BeadDistributionViolinPlot } from './beadDistributionViolinPlot';
 import { RollbackOutlined, CaretUpOutlined, DownloadOutlined, SettingOutlined } from "@ant-design/icons";
 import "./Styles/chromosome3D.css";
+import { fetchCached } from './utils/etagClient';
 
 const CameraFacingText = ({ position, children, ...props }) => {
     const textRef = useRef();
@@ -352,7 +353,7 @@ export const Chromosome3DDistance = ({ selectedSphereList, setShowChromosome3DDi
         setLoading(true);
 
         if (isExampleMode(celllineName, chromosomeName, currentChromosomeSequence)) {
-            fetch('/api/getExistBeadDistribution', {
+            fetchCached('/api/getExistBeadDistribution', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -381,7 +382,7 @@ export const Chromosome3DDistance = ({ selectedSphereList, setShowChromosome3DDi
                 setLoading(false);
                 return;
             }
-            fetch('/api/getBeadDistribution', {
+            fetchCached('/api/getBeadDistribution', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
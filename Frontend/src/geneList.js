@@ -2,6 +2,7 @@ import React, { useEffect, useRef, useState } from "react";
 import * as d3 from "d3";
 
 import { calculateAxisValues, calculateTickValues, formatTickLabel } from './utils/axisUtils';
+import { fetchCached } from './utils/etagClient';
 
 export const GeneList = ({ geneList, currentChromosomeSequence, minDimension, geneName, setGeneName, setGeneSize, step = 5000, isBintuMode = false, zoomedChromosomeData = [], leftOffset = 0, isGseMode = false }) => {
     const svgRef = useRef();
@@ -12,7 +13,7 @@ export const GeneList = ({ geneList, currentChromosomeSequence, minDimension, ge
     const initialHeightRef = useRef(null);
 
     const fetchChromosomeSizeByGeneName = (value) => {
-        fetch("/api/getChromosomeSizeByGeneName", {
+        fetchCached("/api/getChromosomeSizeByGeneName", {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
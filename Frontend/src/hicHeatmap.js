@@ -7,6 +7,7 @@ import { MergedCellLinesHeatmap } from './mergedCellLinesHeatmap.js';
 import { calculateAxisValues, calculateTickValues, formatTickLabel } from './utils/axisUtils.js';
 import "./Styles/canvasHeatmap.css";
 import * as d3 from 'd3';
+import { fetchCached } from './utils/etagClient.js';
 
 export const Heatmap = ({ comparisonHeatmapId, cellLineName, chromosomeName, chromosomeData, currentChromosomeSequence, setCurrentChromosomeSequence, selectedChromosomeSequence, totalChromosomeSequences, geneList, setSelectedChromosomeSequence, setChromosome3DExampleID, setChromosome3DLoading, setGeneName, geneName, geneSize, setChromosome3DExampleData, setGeneSize, formatNumber, cellLineList, setChromosome3DCellLineName, removeComparisonHeatmap, setSelectedSphereLists, isExampleMode, fetchExistChromos3DData, exampleDataSet, progressPolling, updateComparisonHeatmapCellLine, comparisonHeatmapUpdateTrigger, setChromosome3DComponents, setChromosome3DComponentIndex, comparisonHeatmapList, isBintuMode = false, bintuId = null, bintuStep = 30000,
     // Bintu control props
@@ -220,7 +221,7 @@ export const Heatmap = ({ comparisonHeatmapId, cellLineName, chromosomeName, chr
 
     const fetchComparisonChromosomeData = (compared_cell_line) => {
         setIndependentHeatmapLoading(true);
-        fetch("/api/getChromosData", {
+        fetchCached("/api/getChromosData", {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -257,7 +258,7 @@ export const Heatmap = ({ comparisonHeatmapId, cellLineName, chromosomeName, chr
                 setChromosome3DLoading(true);
             }
 
-            fetch("/api/getChromosome3DData", {
+            fetchCached("/api/getChromosome3DData", {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -1,6 +1,7 @@
 import React, { useRef, useState, useEffect } from 'react';
 import * as d3 from 'd3';
 import { Select, Switch, InputNumber, Slider, Tooltip } from "antd";
+import { fetchCached } from './utils/etagClient.js';
 
 export const MergedCellLinesHeatmap = ({ cellLineName, chromosomeName, totalChromosomeSequences, currentChromosomeSequence, independentHeatmapData, fqRawcMode, cellLineList, setFqRawcMode, colorScaleRange, setColorScaleRange, changeColorByInput, changeColorScale }) => {
     const containerRef = useRef(null);
@@ -37,7 +38,7 @@ export const MergedCellLinesHeatmap = ({ cellLineName, chromosomeName, totalChro
     }, []);
 
     useEffect(() => {
-        fetch('/api/getChromosMergedValidSequence', {
+        fetchCached('/api/getChromosMergedValidSequence', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -49,7 +50,7 @@ export const MergedCellLinesHeatmap = ({ cellLineName, chromosomeName, totalChro
                 setMergeCompareTotalSequences(data);
             });
         if (mergeCompareCellLine) {
-            fetch("/api/getChromosData", {
+            fetchCached("/api/getChromosData", {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { InputNumber, Slider } from 'antd';
 import { ExperimentOutlined, LaptopOutlined } from '@ant-design/icons';
 import * as d3 from 'd3';
+import { fetchCached } from './utils/etagClient.js';
 
 export const SimulatedFqHeatmap = ({ celllineName, chromosomeName, chromosomefqData, selectedChromosomeSequence }) => {
     const containerRef = useRef(null);
@@ -33,7 +34,7 @@ export const SimulatedFqHeatmap = ({ celllineName, chromosomeName, chromosomefqD
     };
 
     useEffect(() => {
-        fetch("/api/getChromosData", {
+        fetchCached("/api/getChromosData", {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -0,0 +1,76 @@
+/**
+ * fetch() for the cacheable POST endpoints, revalidating the last response with its ETag.
+ *
+ * Browsers never cache POST responses, so the backend's ETags would go unused: the body of every
+ * response with an ETag is kept here and the request is sent again with If-None-Match. A 304 Not
+ * Modified is answered from the kept body, which skips the download (and the backend's view).
+ */
+
+// Bodies kept at most, in characters, the least recently used are dropped first
+const MAX_STORED_CHARS = 64 * 1024 * 1024;
+
+const stored = new Map();
+let storedChars = 0;
+
+/**
+ * Keep the body of a response under its request key, dropping the oldest bodies over the limit
+ * @param {string} key - URL and request body
+ * @param {string} etag - ETag of the response
+ * @param {string} body - Response body
+ */
+function remember(key, etag, body) {
+    forget(key);
+    if (body.length > MAX_STORED_CHARS) {
+        return;
+    }
+    stored.set(key, { etag, body });
+    storedChars += body.length;
+    for (const [oldKey] of stored) {
+        if (storedChars <= MAX_STORED_CHARS) {
+            break;
+        }
+        forget(oldKey);
+    }
+}
+
+function forget(key) {
+    const entry = stored.get(key);
+    if (entry) {
+        storedChars -= entry.body.length;
+        stored.delete(key);
+    }
+}
+
+/**
+ * Drop-in replacement for fetch() that replays the kept body on 304 Not Modified
+ * @param {string} url - Request URL
+ * @param {Object} options - fetch() options
+ * @returns {Promise<Response>} The response, a 304 turned into a 200 with the kept body
+ */
+export async function fetchCached(url, options = {}) {
+    const key = `${url}\n${options.body || ''}`;
+    const entry = stored.get(key);
+    const headers = new Headers(options.headers || {});
+    if (entry) {
+        headers.set('If-None-Match', entry.etag);
+    }
+
+    const response = await fetch(url, { ...options, headers });
+    if (response.status === 304 && entry) {
+        // Most recently used again
+        stored.delete(key);
+        stored.set(key, entry);
+        return new Response(entry.body, {
+            status: 200,
+            headers: { 'Content-Type': 'application/json', 'ETag': entry.etag }
+        });
+    }
+
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        remember(key, etag, await response.clone().text());
+    } else {
+        forget(key);
+    }
+    return response;
+}